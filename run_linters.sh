@@ -18,23 +18,23 @@ fi
 # Check/fix formatting with black
 echo "Running black..."
 if [ "$FIX_MODE" = true ]; then
-    black src tests
+    black src tests tools
 else
-    black src tests --check
+    black src tests tools --check
 fi
 
 # Check/fix imports with isort
 echo "Running isort..."
 if [ "$FIX_MODE" = true ]; then
-    isort src tests
+    isort src tests tools
 else
-    isort src tests --check-only
+    isort src tests tools --check-only
 fi
 
 # Lint with flake8 (no auto-fix available)
 echo "Running flake8..."
 # Using configuration from .flake8
-flake8 src
+flake8 src tools
 flake8 tests --extend-ignore=F401,W291,F841 --config=.flake8
 
 # Type check with mypy (no auto-fix available)
@@ -22,7 +22,7 @@ docker build -t $IMAGE_NAME .
 # Run the tests in a Docker container with the specified test type(s)
 for TEST_TYPE in "${TEST_TYPES[@]}"; do
     echo "Running IC tests in Docker container for test type: $TEST_TYPE..."
-    docker run --rm $IMAGE_NAME $TEST_TYPE || {
+    docker run --rm -e TEST_WORKERS $IMAGE_NAME $TEST_TYPE || {
         echo "❌ Tests failed for $TEST_TYPE"
         exit 1
     }
@@ -0,0 +1,205 @@
+"""
+Archive canister holding the cold transaction history of a vault.
+
+The vault appends its oldest transactions here in id order, then deletes its own copy.
+Clients read archived transactions with get_transactions, following the ranges listed by
+the vault's get_archives or returned by its transaction queries.
+"""
+
+import json
+
+from kybra import (
+    Opt,
+    Principal,
+    Record,
+    StableBTreeMap,
+    Variant,
+    Vec,
+    ic,
+    init,
+    nat,
+    nat64,
+    post_upgrade,
+    query,
+    text,
+    update,
+    void,
+)
+
+
+# A transaction moved out of the vault, with the principals as stored by the vault
+# (a principal id, or "mint" / "burn" for the ledger's own accounts).
+class ArchivedTransactionRecord(Record):
+    id: nat
+    timestamp: nat64
+    kind: text
+    principal_from: text
+    principal_to: text
+    amount: nat
+    fee: nat
+
+
+# The vault the archive belongs to and the range of transaction ids it holds.
+class ArchiveStatusRecord(Record):
+    vault: Principal
+    transactions_count: nat
+    first_tx_id: Opt[nat]
+    last_tx_id: Opt[nat]
+    first_timestamp: Opt[nat64]
+    last_timestamp: Opt[nat64]
+
+
+# Outcome of appending transactions to the archive.
+class ArchiveAppendResult(Variant, total=False):
+    Ok: ArchiveStatusRecord
+    Err: text
+
+
+# A page of archived transactions, with the id to continue from if there are more.
+class ArchivedTransactionsPageRecord(Record):
+    transactions: Vec[ArchivedTransactionRecord]
+    next_tx_id: Opt[nat]
+
+
+# Archived transactions keyed by their position, in id order
+transactions_storage = StableBTreeMap[nat64, str](
+    memory_id=0, max_key_size=16, max_value_size=1000
+)
+# Settings and per-principal lists of positions:
+#     "vault"                         -> principal of the vault allowed to append
+#     "p|<principal>|count"           -> number of transactions of the principal
+#     "p|<principal>|#<n>"            -> position of its n-th transaction
+index_storage = StableBTreeMap[str, str](
+    memory_id=1, max_key_size=120, max_value_size=100
+)
+
+
+@init
+def init_(vault: Principal) -> void:
+    index_storage.insert("vault", vault.to_str())
+
+
+@post_upgrade
+def post_upgrade_(vault: Principal) -> void:
+    # The vault is set once, at install
+    pass
+
+
+def _get_int(key: str) -> int:
+    value = index_storage.get(key)
+    return int(value) if value else 0
+
+
+def _row(position: int) -> dict:
+    row = json.loads(transactions_storage.get(position))
+    # Transactions archived by vaults that did not record fees have none
+    row.setdefault("fee", 0)
+    return row
+
+
+def _first_position_from(count: int, tx_id_at, start_tx_id: int) -> int:
+    """Binary searches the first of `count` positions holding an id >= start_tx_id."""
+    low, high = 0, count
+    while low < high:
+        middle = (low + high) // 2
+        if tx_id_at(middle) < start_tx_id:
+            low = middle + 1
+        else:
+            high = middle
+    return low
+
+
+def _status() -> ArchiveStatusRecord:
+    count = transactions_storage.len()
+    first = _row(0) if count else None
+    last = _row(count - 1) if count else None
+    return ArchiveStatusRecord(
+        vault=Principal.from_str(index_storage.get("vault")),
+        transactions_count=count,
+        first_tx_id=first["id"] if first else None,
+        last_tx_id=last["id"] if last else None,
+        first_timestamp=first["timestamp"] if first else None,
+        last_timestamp=last["timestamp"] if last else None,
+    )
+
+
+@update
+def append_transactions(
+    transactions: Vec[ArchivedTransactionRecord],
+) -> ArchiveAppendResult:
+    """
+    Appends transactions of the vault, which must come in increasing id order.
+
+    Transactions with an id not above the last archived one are skipped, so the vault can
+    safely send a batch again when it did not get the reply.
+    """
+    if ic.caller().to_str() != index_storage.get("vault"):
+        return ArchiveAppendResult(
+            Err=f"Caller ({ic.caller().to_str()}) is not the archive's vault"
+        )
+
+    count = transactions_storage.len()
+    last_tx_id = _row(count - 1)["id"] if count else -1
+    for tx in transactions:
+        if tx["id"] <= last_tx_id:
+            continue
+
+        transactions_storage.insert(count, json.dumps(dict(tx)))
+        for principal_id in {tx["principal_from"], tx["principal_to"]}:
+            principal_count = _get_int(f"p|{principal_id}|count")
+            index_storage.insert(f"p|{principal_id}|#{principal_count}", str(count))
+            index_storage.insert(f"p|{principal_id}|count", str(principal_count + 1))
+        count += 1
+        last_tx_id = tx["id"]
+
+    return ArchiveAppendResult(Ok=_status())
+
+
+@query
+def status() -> ArchiveStatusRecord:
+    return _status()
+
+
+@query
+def get_transactions(
+    principal: Opt[Principal], start_tx_id: nat, end_tx_id: nat, limit: nat
+) -> ArchivedTransactionsPageRecord:
+    """
+    Get the archived transactions with an id within [start_tx_id, end_tx_id], in id order.
+
+    Args:
+        principal: Optional principal to restrict the transactions to
+        start_tx_id: First transaction id of the range
+        end_tx_id: Last transaction id of the range
+        limit: Maximum number of transactions returned
+
+    Returns:
+        A page of transactions, with the id to call again from if the range has more
+    """
+    if principal:
+        prefix = f"p|{principal.to_str()}|"
+        count = _get_int(f"{prefix}count")
+
+        def position_at(n):
+            return int(index_storage.get(f"{prefix}#{n}"))
+
+    else:
+        count = transactions_storage.len()
+
+        def position_at(n):
+            return n
+
+    n = _first_position_from(count, lambda n: _row(position_at(n))["id"], start_tx_id)
+    transactions = []
+    while n < count:
+        tx = _row(position_at(n))
+        if tx["id"] > end_tx_id:
+            break
+        if len(transactions) >= limit:
+            return ArchivedTransactionsPageRecord(
+                transactions=transactions, next_tx_id=tx["id"]
+            )
+        transactions.append(tx)
+        n += 1
+
+    return ArchivedTransactionsPageRecord(transactions=transactions, next_tx_id=None)
@@ -1,6 +1,7 @@
 import traceback
 from functools import wraps
 from pprint import pformat
+from types import GeneratorType
 
 from kybra import (
     Async,
@@ -10,9 +11,11 @@ from kybra import (
     StableBTreeMap,
     Tuple,
     Vec,
+    blob,
     ic,
     init,
     nat,
+    post_upgrade,
     query,
     update,
     void,
@@ -20,36 +23,392 @@ from kybra import (
 from kybra_simple_db import Database
 from kybra_simple_logging import get_logger
 
+from vault.accounting import apply_new_transaction, apply_transaction
+from vault.archives import (
+    archive_policy_set,
+    archives,
+    archives_overlapping,
+    current_archive,
+    is_archived,
+    record_archived_batch,
+    select_archive_batch,
+)
+from vault.balance_checkpoints import (
+    BALANCE_CHECKPOINTS_JOB_KIND,
+    balance_at,
+    balance_checkpoints_built,
+    clear_balance_checkpoints_chunk,
+    init_balance_checkpoints,
+    mark_balance_checkpoints_built,
+    record_new_transaction,
+    record_transaction,
+    replay_start,
+    start_balance_checkpoints_build,
+)
+from vault.balance_index import (
+    BALANCE_INDEX_JOB_KIND,
+    balance_index_built,
+    count_above,
+    index_balance,
+    init_balance_index,
+    mark_balance_index_built,
+    on_balance_change,
+    top_balances,
+)
 from vault.candid_types import (
     Account,
     AppDataRecord,
+    ArchiveAppendResult,
+    ArchiveCanister,
+    ArchiveRecord,
+    ArchivesRecord,
     BalanceRecord,
     CanisterRecord,
+    CategoryRecord,
+    CategoryRuleRecord,
+    CategoryTransactionsPageRecord,
+    ChangesPageRecord,
+    DepositAccountRecord,
+    EntityStorageRecord,
+    ExportChunkRecord,
     ICRCLedger,
+    ReconciliationRecord,
     Response,
     ResponseData,
     StatsRecord,
+    StorageRegionRecord,
+    StorageReportRecord,
+    SubscriptionRecord,
     TestModeRecord,
+    TimeIndexCursor,
+    TokenRecord,
     TransactionIdRecord,
     TransactionRecord,
+    TransactionsPageRecord,
     TransactionSummaryRecord,
     TransferArg,
+    TransferFromArgs,
     TransferResult,
+    WithdrawalsPageRecord,
+)
+from vault.categories import (
+    RESERVED_CHARACTERS,
+    add_to_category,
+    categorize_new_transaction,
+    category_totals,
+    category_transaction_ids,
+    clear_categories_chunk,
+    init_categories,
+    load_category_rules,
+    remove_from_category,
+    transaction_categories,
+)
+from vault.changes import (
+    changes_since,
+    first_seq,
+    init_change_log,
+    last_seq,
+    log_balance_change,
+    log_transaction_change,
+    log_transaction_deleted,
+)
+from vault.constants import (
+    ARCHIVE_BATCH_SIZE,
+    ARCHIVE_MAX_TRANSACTIONS,
+    BALANCE_AT_MAX_BUCKETS,
+    BALANCE_CHECKPOINT_BUILD_CHUNK_SIZE,
+    BALANCE_INDEX_BUILD_CHUNK_SIZE,
+    BALANCE_REBUILD_CHUNK_SIZE,
+    BALANCE_REBUILD_MAX_PROBES,
+    CANISTER_PRINCIPALS,
+    CATEGORY_NAME_MAX_LENGTH,
+    CATEGORY_PAGE_DEFAULT_RESULTS,
+    CATEGORY_PAGE_MAX_RESULTS,
+    CATEGORY_TAG_MAX_TRANSACTIONS,
+    CHANGE_FEED_MAX_RESULTS,
+    DEPOSIT_ACTIVE_WINDOW_NS,
+    DEPOSIT_MAX_ACTIVE_ACCOUNTS,
+    DEPOSIT_REOPEN_INTERVAL_NS,
+    DEPOSIT_SWEEP_MAX_PER_SYNC,
+    DEPOSIT_SYNC_MAX_FETCHES,
+    EXPORT_MAX_BYTES,
+    EXPORT_MAX_PROBES,
+    GET_BALANCES_MAX_PRINCIPALS,
+    MAX_ITERATION_COUNT,
+    MAX_RESULTS,
+    NOTIFICATION_MAX_SUBSCRIPTIONS,
+    NOTIFICATION_METHOD_MAX_LENGTH,
+    RECONCILIATION_INTERVAL_NS,
+    SNAPSHOT_ABORT_CHUNK_SIZE,
+    SNAPSHOT_IMPORT_MAX_ROWS,
+    STABLE_MEMORY_CAPACITY_BYTES,
+    STORAGE_COUNT_CHUNK_SIZE,
+    STORAGE_MIGRATION_CHUNK_SIZE,
+    SYNC_BACKOFF_BASE_NS,
+    SYNC_BACKOFF_MAX_NS,
+    SYNC_LEASE_DURATION_NS,
+    SYNC_MAX_RETRIES,
+    TEST_MODE_RESET_CHUNK_SIZE,
+    TEST_MODE_RESET_INLINE_CHUNKS,
+    TIME_INDEX_BUILD_CHUNK_SIZE,
+    TIME_INDEX_MAX_BUCKETS_PER_QUERY,
+    TOKEN_SYMBOL_MAX_LENGTH,
+    TOP_BALANCES_MAX,
+    WITHDRAWAL_MAX_PENDING_PER_PRINCIPAL,
+    WITHDRAWAL_PAGE_DEFAULT_RESULTS,
+    WITHDRAWAL_PAGE_MAX_RESULTS,
+    WITHDRAWAL_QUEUE_MAX_LENGTH,
+)
+from vault.deposits import (
+    active_deposit_count,
+    active_deposit_owners,
+    deactivate_deposit_account,
+    deposit_active_until,
+    deposit_subaccount,
+    init_deposits,
+    mark_deposit_activity,
 )
-from vault.constants import CANISTER_PRINCIPALS, MAX_ITERATION_COUNT, MAX_RESULTS
 from vault.entities import (
+    Archive,
     Balance,
     Canisters,
+    Category,
+    CategoryRule,
+    DepositAccount,
+    ShadowBalance,
+    Subscription,
+    Token,
+    TokenBalance,
+    TokenTransaction,
     VaultTransaction,
+    add_balance_listener,
+    add_transaction_listener,
     app_data,
+    entity_ids,
+    init_entity_storage,
+    job_runner_data,
+    snapshot_import_data,
     test_mode_data,
 )
-from vault.ic_util_calls import get_account_transactions, set_account_mock_transaction
+from vault.export import (
+    chain_hash,
+    chunk_sha256,
+    decode_rows,
+    export_balances_chunk,
+    export_transactions_chunk,
+)
+from vault.fees import cached_fee, expected_fee, set_fee
+from vault.ic_util_calls import (
+    get_account_transactions,
+    get_ledger_balance,
+    set_account_mock_transaction,
+)
+from vault.jobs import (
+    ACTIVE_JOB_STATUSES,
+    JOB_STATUS_COMPLETED,
+    JobKind,
+    create_job,
+    current_job,
+    get_job,
+    job_record,
+    next_ids,
+    queued_job,
+    register_job_kind,
+    run_job_chunk,
+    schedule_jobs,
+    stop_job,
+)
+from vault.notifications import (
+    clear_queue,
+    deliver_notifications,
+    init_notifications,
+    notification,
+    pending_count,
+    queue_notifications,
+    subscription_id,
+    subscriptions,
+)
+from vault.response_cache import (
+    cached_response,
+    invalidate_cached_responses,
+    register_cached_response,
+    schedule_refresh,
+)
+from vault.snapshot import (
+    SNAPSHOT_ABORT_JOB_KIND,
+    SNAPSHOT_IMPORT_ABORTING,
+    SNAPSHOT_IMPORT_COMPLETED,
+    SNAPSHOT_IMPORT_IN_PROGRESS,
+    SNAPSHOT_KIND_BALANCES,
+    SNAPSHOT_KIND_TRANSACTIONS,
+    import_balance_rows,
+    import_transaction_rows,
+    reset_snapshot_import,
+    snapshot_import_record,
+)
+from vault.storage import (
+    Partition,
+    PartitionedStorage,
+    int_id,
+    int_key,
+    prefixed_int_id,
+    prefixed_int_key,
+)
+from vault.storage_report import (
+    entity_reports,
+    growth_estimate,
+    record_sync_growth,
+    region_reports,
+    register_region,
+    stable_memory_bytes,
+)
+from vault.time_index import (
+    TIME_INDEX_JOB_KIND,
+    VAULT_SCOPE,
+    clear_time_index_chunk,
+    find_transaction_ids,
+    index_new_principals,
+    index_new_transaction,
+    index_transaction,
+    init_time_index,
+    last_transaction_id_at,
+    mark_time_index_built,
+    start_time_index_build,
+    time_index_built,
+)
+from vault.tokens import (
+    PRIMARY_TOKEN,
+    SYMBOL_RESERVED_CHARACTERS,
+    share_sync_budget,
+    sync_backlog,
+    token_balances,
+    token_exists,
+    token_indexer,
+    token_ledger,
+    token_symbols,
+    token_sync_state,
+    token_transaction_id,
+)
+from vault.withdrawals import (
+    WITHDRAWAL_STATUS_IN_FLIGHT,
+    WITHDRAWAL_STATUS_PENDING,
+    active_withdrawals,
+    create_withdrawal,
+    get_withdrawal,
+    init_withdrawals,
+    mark_withdrawal_cancelled,
+    record_withdrawal_failure,
+    record_withdrawal_sent,
+    requeue_in_flight_withdrawals,
+    schedule_withdrawals,
+    withdrawal_record,
+    withdrawals_page,
+)
 
 logger = get_logger(__name__)
 
+# Shared map for all entities without a memory region of their own
 storage = StableBTreeMap[str, str](memory_id=1, max_key_size=100, max_value_size=1000)
-Database.init(db_storage=storage)
+# Transactions keyed by their ledger id as a fixed-width big-endian blob, in id order
+transactions_storage = StableBTreeMap[blob, str](
+    memory_id=2, max_key_size=32, max_value_size=1000
+)
+# Balances and shadow balances keyed by principal id
+balances_storage = StableBTreeMap[str, str](
+    memory_id=3, max_key_size=100, max_value_size=1000
+)
+shadow_balances_storage = StableBTreeMap[str, str](
+    memory_id=4, max_key_size=100, max_value_size=1000
+)
+# Transactions and balances of the registered tokens other than the primary one
+token_transactions_storage = StableBTreeMap[blob, str](
+    memory_id=9, max_key_size=40, max_value_size=1000
+)
+token_balances_storage = StableBTreeMap[str, str](
+    memory_id=10, max_key_size=120, max_value_size=1000
+)
+# Number of entities of each type held by the shared map
+entity_counts_storage = StableBTreeMap[str, str](
+    memory_id=14, max_key_size=100, max_value_size=32
+)
+db_storage = PartitionedStorage(
+    storage,
+    {
+        "VaultTransaction": Partition(transactions_storage, int_key, int_id),
+        "Balance": Partition(balances_storage),
+        "ShadowBalance": Partition(shadow_balances_storage),
+        "TokenTransaction": Partition(
+            token_transactions_storage, prefixed_int_key, prefixed_int_id
+        ),
+        "TokenBalance": Partition(token_balances_storage),
+    },
+    entity_counts_storage,
+    on_write=invalidate_cached_responses,
+)
+Database.init(db_storage=db_storage)
+init_entity_storage(db_storage)
+
+# Time index: transaction ids grouped by timestamp bucket, for the vault and per principal
+time_index_storage = StableBTreeMap[str, str](
+    memory_id=5, max_key_size=100, max_value_size=32
+)
+init_time_index(time_index_storage)
+
+# Balance checkpoints: per-principal balance changes by transaction id interval
+balance_checkpoints_storage = StableBTreeMap[str, str](
+    memory_id=6, max_key_size=100, max_value_size=64
+)
+init_balance_checkpoints(balance_checkpoints_storage)
+
+# Balance index: balances grouped into buckets ordered by amount
+balance_index_storage = StableBTreeMap[str, str](
+    memory_id=7, max_key_size=120, max_value_size=160
+)
+init_balance_index(balance_index_storage)
+add_balance_listener(on_balance_change)
+
+# Category index: tagged transaction ids and running totals per category
+category_storage = StableBTreeMap[str, str](
+    memory_id=8, max_key_size=120, max_value_size=1000
+)
+init_categories(category_storage)
+
+
+# Deposit subaccounts with recent activity, the only ones synced
+deposit_activity_storage = StableBTreeMap[str, str](
+    memory_id=11, max_key_size=100, max_value_size=32
+)
+init_deposits(deposit_activity_storage)
+
+# Change feed: the last balance and transaction changes, by sequence number
+change_log_storage = StableBTreeMap[str, str](
+    memory_id=12, max_key_size=32, max_value_size=1000
+)
+init_change_log(change_log_storage)
+add_balance_listener(log_balance_change)
+add_transaction_listener(log_transaction_change)
+
+# Notifications queued for each subscription, until delivered
+notification_queue_storage = StableBTreeMap[str, str](
+    memory_id=13, max_key_size=160, max_value_size=1000
+)
+init_notifications(notification_queue_storage)
+
+# Stable maps listed by the storage report, partitions under the name of their entity type
+register_region("shared", 1, storage, 100, 1000)
+register_region("VaultTransaction", 2, transactions_storage, 32, 1000)
+register_region("Balance", 3, balances_storage, 100, 1000)
+register_region("ShadowBalance", 4, shadow_balances_storage, 100, 1000)
+register_region("time index", 5, time_index_storage, 100, 32)
+register_region("balance checkpoints", 6, balance_checkpoints_storage, 100, 64)
+register_region("balance index", 7, balance_index_storage, 120, 160)
+register_region("categories", 8, category_storage, 120, 1000)
+register_region("TokenTransaction", 9, token_transactions_storage, 40, 1000)
+register_region("TokenBalance", 10, token_balances_storage, 120, 1000)
+register_region("deposit activity", 11, deposit_activity_storage, 100, 32)
+register_region("change log", 12, change_log_storage, 32, 1000)
+register_region("notification queue", 13, notification_queue_storage, 160, 1000)
+register_region("entity counts", 14, entity_counts_storage, 100, 32)
 
 
 @init
@@ -62,6 +421,13 @@ def init_(
 ) -> void:
     logger.info("Initializing vault...")
 
+    # A fresh install has no entities left in the shared map from older versions
+    db_storage.mark_migrated()
+    db_storage.mark_counted()
+    mark_time_index_built()
+    mark_balance_checkpoints_built()
+    mark_balance_index_built()
+
     if canisters:
         for canister_name, principal_id in canisters:
 
@@ -75,27 +441,18 @@ def init_(
                     f"Canister record '{canister_name}' already exists with principal: {Canisters[canister_name].principal}"
                 )
 
-    if not Canisters["ckBTC ledger"]:
-        logger.info(
-            f"Creating canister record 'ckBTC ledger' with principal: {CANISTER_PRINCIPALS['ckBTC']['ledger']}"
-        )
-        Canisters(_id="ckBTC ledger", principal=CANISTER_PRINCIPALS["ckBTC"]["ledger"])
-    else:
-        logger.info(
-            f"Canister record 'ckBTC ledger' already exists with principal: {Canisters['ckBTC ledger'].principal}"
-        )
-
-    if not Canisters["ckBTC indexer"]:
-        logger.info(
-            f"Creating canister record 'ckBTC indexer' with principal: {CANISTER_PRINCIPALS['ckBTC']['indexer']}"
-        )
-        Canisters(
-            _id="ckBTC indexer", principal=CANISTER_PRINCIPALS["ckBTC"]["indexer"]
-        )
-    else:
-        logger.info(
-            f"Canister record 'ckBTC indexer' already exists with principal: {Canisters['ckBTC indexer'].principal}"
-        )
+    for symbol, principals in CANISTER_PRINCIPALS.items():
+        for role, principal_id in principals.items():
+            canister_name = f"{symbol} {role}"
+            if not Canisters[canister_name]:
+                logger.info(
+                    f"Creating canister record '{canister_name}' with principal: {principal_id}"
+                )
+                Canisters(_id=canister_name, principal=principal_id)
+            else:
+                logger.info(
+                    f"Canister record '{canister_name}' already exists with principal: {Canisters[canister_name].principal}"
+                )
 
     if not app_data().admin_principal:
         new_admin_principal = (
@@ -138,6 +495,51 @@ def init_(
     logger.info("Vault initialized.")
 
 
+@post_upgrade
+def post_upgrade_(
+    canisters: Opt[Vec[Tuple[str, Principal]]] = None,
+    admin_principal: Opt[Principal] = None,
+    max_results: Opt[nat] = None,
+    max_iteration_count: Opt[nat] = None,
+    test_mode_enabled: Opt[bool] = False,
+) -> void:
+    # Upgrades are called with the same Candid arguments as the install, so they are
+    # declared here too, but ignored: the configuration stored by init_ is kept, and is
+    # changed with set_canister and set_admin. Only timers and jobs are taken care of.
+    # Timers do not survive an upgrade, so re-arm the one driving queued jobs.
+    logger.info("Vault upgraded, resuming background jobs.")
+    schedule_jobs(force=True)
+
+    if not db_storage.is_migrated() and not queued_job("migrate_storage"):
+        logger.info("Queueing migration of entities to their own memory regions")
+        create_job("migrate_storage")
+
+    if not db_storage.shared_counts_complete() and not queued_job("count_storage"):
+        logger.info("Queueing count of the entities of the shared map")
+        create_job("count_storage")
+
+    # Send timers armed before the upgrade were dropped with it
+    requeue_in_flight_withdrawals()
+    schedule_withdrawals()
+
+    if not time_index_built() and not queued_job(TIME_INDEX_JOB_KIND):
+        # Transactions stored before the time index existed are indexed in the background
+        max_tx_id = _max_transaction_id()
+        logger.info(f"Queueing time index build up to transaction {max_tx_id}")
+        start_time_index_build(max_tx_id)
+        create_job(TIME_INDEX_JOB_KIND, cursor_end=max_tx_id)
+
+    if not balance_checkpoints_built() and not queued_job(BALANCE_CHECKPOINTS_JOB_KIND):
+        max_tx_id = _max_transaction_id()
+        logger.info(f"Queueing balance checkpoints build up to transaction {max_tx_id}")
+        start_balance_checkpoints_build(max_tx_id)
+        create_job(BALANCE_CHECKPOINTS_JOB_KIND, cursor_end=max_tx_id)
+
+    if not balance_index_built() and not queued_job(BALANCE_INDEX_JOB_KIND):
+        logger.info("Queueing balance index build")
+        create_job(BALANCE_INDEX_JOB_KIND)
+
+
 def admin_only(func):
     @wraps(func)
     def wrapper(*args, **kwargs):
@@ -171,8 +573,28 @@ def test_mode_only(func):
     return wrapper
 
 
+def _schedule_refresh_after(generator):
+    result = yield from generator
+    schedule_refresh()
+    return result
+
+
+def mutates_state(func):
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        # Async endpoints return a generator: refresh once its inter-canister calls are done
+        if isinstance(result, GeneratorType):
+            return _schedule_refresh_after(result)
+        schedule_refresh()
+        return result
+
+    return wrapper
+
+
 @update
 @admin_only
+@mutates_state
 def set_canister(canister_name: str, principal: Principal) -> Response:
     """
     Set or update the principal ID for a specific canister in the Canisters entity.
@@ -190,6 +612,11 @@ def set_canister(canister_name: str, principal: Principal) -> Response:
 
         logger.info(f"Setting canister '{canister_name}' to principal: {principal_id}")
 
+        # A new ledger or indexer may fix a failing sync, so don't keep backing off
+        symbol = canister_name.rsplit(" ", 1)[0]
+        if token_exists(symbol):
+            token_sync_state(symbol).sync_retry_after = 0
+
         # Check if the canister already exists
         existing_canister = Canisters[canister_name]
         if existing_canister:
@@ -223,55 +650,104 @@ def set_canister(canister_name: str, principal: Principal) -> Response:
         )
 
 
-@update
-@admin_only
-def transfer(to: Principal, amount: nat) -> Async[Response]:
+def _ledger_fee(symbol):
     """
-    Transfers a specified amount of tokens to a given principal.
+    Returns the fee of a token's ledger, calling icrc1_fee only when the cached fee has
+    expired. Returns None, leaving the ledger to apply its own fee, if the call fails.
+    """
+    ledger_id = token_ledger(symbol)
+    fee = cached_fee(symbol, ledger_id, ic.time())
+    if fee is not None:
+        return fee
+
+    result: CallResult[nat] = yield ICRCLedger(
+        Principal.from_str(ledger_id)
+    ).icrc1_fee()
+    if result.Err is not None:
+        logger.warning(f"Could not get the fee of the {symbol} ledger: {result.Err}")
+        return None
+    set_fee(symbol, ledger_id, result.Ok, ic.time())
+    return result.Ok
+
+
+def _call_retrying_bad_fee(symbol, ledger_call, fee):
+    """
+    Makes a transfer call to a token's ledger with an explicit fee. `ledger_call(fee)`
+    returns the call.
 
-    Args:
-        to: The principal ID of the recipient
-        amount: The amount of tokens to transfer
+    A fee cached before the ledger changed it is rejected with BadFee: the fee the ledger
+    expects is then cached and the call made once more.
 
     Returns:
-        Response object with success status, message, and transaction ID in the data field
+        Tuple of (result of the last call, fee it was made with)
     """
+    result = yield ledger_call(fee)
 
+    new_fee = expected_fee(result.Ok.get("Err")) if result.Ok is not None else None
+    if new_fee is not None and new_fee != fee:
+        logger.info(f"Fee of the {symbol} ledger changed to {new_fee}, retrying")
+        set_fee(symbol, token_ledger(symbol), new_fee, ic.time())
+        fee = new_fee
+        result = yield ledger_call(fee)
+    return result, fee
+
+
+def _call_with_ledger_fee(symbol, ledger_call):
+    """
+    Makes a transfer call to a token's ledger with the fee set explicitly, so the ledger
+    records it and the sync can account for it. See _call_retrying_bad_fee.
+    """
+    fee = yield _ledger_fee(symbol)
+    result, _ = yield _call_retrying_bad_fee(symbol, ledger_call, fee)
+    return result
+
+
+def _transfer(symbol, to, amount):
+    """Transfers `amount` of a token to `to` from the vault's ledger account."""
     try:
         if amount <= 0:
             return Response(
                 success=False, data=ResponseData(Error="Amount must be positive")
             )
 
-        logger.info(f"Transferring {amount} tokens to {to.to_str()}")
+        logger.info(f"Transferring {amount} {symbol} tokens to {to.to_str()}")
 
         if test_mode_data().test_mode_enabled:
             # Create a mock transaction record for testing
             tx_id = test_mode_data().tx_id
             test_mode_data().tx_id += 1
 
-            # Create mock transaction record
-            from kybra import ic
-
             timestamp = ic.time()
-            VaultTransaction(
-                _id=str(tx_id),
+            mock_tx_fields = dict(
                 principal_from=ic.id().to_str(),
                 principal_to=to.to_str(),
                 amount=amount,
                 timestamp=timestamp,
                 kind="mock_transfer",
             )
+            if symbol == PRIMARY_TOKEN:
+                mock_tx = VaultTransaction(_id=str(tx_id), **mock_tx_fields)
+            else:
+                mock_tx = TokenTransaction(
+                    _id=token_transaction_id(symbol, tx_id), **mock_tx_fields
+                )
 
             # Update balances for mock transaction
-            from_balance = Balance[ic.id().to_str()] or Balance(
+            balances = token_balances(symbol)
+            from_balance = balances[ic.id().to_str()] or balances(
                 _id=ic.id().to_str(), amount=0
             )
-            to_balance = Balance[to.to_str()] or Balance(_id=to.to_str(), amount=0)
+            to_balance = balances[to.to_str()] or balances(_id=to.to_str(), amount=0)
 
             from_balance.amount -= amount
             to_balance.amount += amount
 
+            if symbol == PRIMARY_TOKEN:
+                index_new_transaction(tx_id, timestamp, ic.id().to_str(), to.to_str())
+                categorize_new_transaction(
+                    ic.id().to_str(), mock_tx, None, load_category_rules()
+                )
+
             return Response(
                 success=True,
                 data=ResponseData(
@@ -279,19 +755,22 @@ def transfer(to: Principal, amount: nat) -> Async[Response]:
                 ),
             )
 
-        principal = Canisters["ckBTC ledger"].principal
-        ledger = ICRCLedger(Principal.from_str(principal))
+        ledger = ICRCLedger(Principal.from_str(token_ledger(symbol)))
 
-        args: TransferArg = TransferArg(
-            to=Account(owner=to, subaccount=None),
-            amount=amount,
-            fee=None,
-            memo=None,
-            from_subaccount=None,
-            created_at_time=None,
-        )
+        def transfer_call(fee):
+            args: TransferArg = TransferArg(
+                to=Account(owner=to, subaccount=None),
+                amount=amount,
+                fee=fee,
+                memo=None,
+                from_subaccount=None,
+                created_at_time=None,
+            )
+            return ledger.icrc1_transfer(args)
 
-        result: CallResult[TransferResult] = yield ledger.icrc1_transfer(args)
+        result: CallResult[TransferResult] = yield _call_with_ledger_fee(
+            symbol, transfer_call
+        )
 
         # Handle the result
         if result.Ok is not None:
@@ -322,601 +801,4075 @@ def transfer(to: Principal, amount: nat) -> Async[Response]:
         )
 
 
-def _sync_status(app_data_obj):
-    return (
-        "Synced"
-        if (
-            app_data_obj.scan_end_tx_id
-            == app_data_obj.scan_oldest_tx_id
-            == app_data_obj.scan_start_tx_id
+@update
+@admin_only
+@mutates_state
+def transfer(to: Principal, amount: nat) -> Async[Response]:
+    """
+    Transfers a specified amount of tokens to a given principal.
+
+    Args:
+        to: The principal ID of the recipient
+        amount: The amount of tokens to transfer
+
+    Returns:
+        Response object with success status, message, and transaction ID in the data field
+    """
+    return (yield _transfer(PRIMARY_TOKEN, to, amount))
+
+
+@update
+@admin_only
+@mutates_state
+def transfer_token(token: str, to: Principal, amount: nat) -> Async[Response]:
+    """
+    Transfers an amount of any token held by the vault to a given principal.
+
+    Args:
+        token: The symbol of the token, as listed by get_tokens
+        to: The principal ID of the recipient
+        amount: The amount of tokens to transfer
+
+    Returns:
+        Response object with success status, message, and transaction ID in the data field
+    """
+    if not token_exists(token):
+        return Response(
+            success=False, data=ResponseData(Error=f"Unknown token '{token}'")
         )
-        else "Syncing"
-    )
+    return (yield _transfer(token, to, amount))
 
 
 @update
-def update_transaction_history() -> Async[Response]:
+@mutates_state
+def deposit(amount: nat) -> Async[Response]:
     """
-    Updates the transaction history for the current principal by querying the ICRC indexer
-    and storing the transactions in the VaultTransaction database.
+    Deposits tokens from the caller's ledger account into the vault, using an ICRC-2
+    allowance.
+
+    The caller must first approve the vault for `amount` plus the ledger fee. The caller's
+    balance is credited as soon as the ledger returns the block index, without waiting
+    for the indexer. The transaction is stored under that index, so the sync recognises
+    it and does not credit it again.
+
+    Args:
+        amount: The amount of tokens to deposit
 
     Returns:
-        Response object with success status, message, and summary data
+        Response object with success status and the transaction ID in the data field
     """
     try:
+        if amount <= 0:
+            return Response(
+                success=False, data=ResponseData(Error="Amount must be positive")
+            )
+
+        caller = ic.caller().to_str()
         canister_id = ic.id().to_str()
-        logger.info(f"Updating transaction history for {canister_id}")
+        logger.info(f"Depositing {amount} tokens from {caller}")
 
         if test_mode_data().test_mode_enabled:
+            mock_tx = set_account_mock_transaction(caller, canister_id, amount)
+            _notify_subscribers()
             return Response(
                 success=True,
                 data=ResponseData(
-                    Message="Test mode enabled, skipping update_transaction_history"
+                    TransactionId=TransactionIdRecord(transaction_id=mock_tx["id"])
                 ),
             )
 
-        # Get the configured indexer canister ID
-        indexer_canister = Canisters["ckBTC indexer"]
-        indexer_canister_id = indexer_canister.principal
+        ledger = ICRCLedger(Principal.from_str(token_ledger(PRIMARY_TOKEN)))
 
-        batch_max_iteration_count = app_data().max_iteration_count
-        batch_max_results = app_data().max_results
-
-        scan_end_tx_id = app_data().scan_end_tx_id
-        scan_start_tx_id = app_data().scan_start_tx_id
-        scan_oldest_tx_id = app_data().scan_oldest_tx_id
-
-        batch_iteration_count = 0
-        new_txs_count = 0
-
-        # Implement cursor-based pagination to fetch all transactions
-        while batch_iteration_count < batch_max_iteration_count:
-            batch_iteration_count += 1
-            logger.debug(
-                f"batch_iteration_count: {batch_iteration_count}/{batch_max_iteration_count}"
+        def transfer_from_call(fee):
+            return ledger.icrc2_transfer_from(
+                TransferFromArgs(
+                    spender_subaccount=None,
+                    from_=Account(owner=ic.caller(), subaccount=None),
+                    to=Account(owner=ic.id(), subaccount=None),
+                    amount=amount,
+                    fee=fee,
+                    memo=None,
+                    created_at_time=None,
+                )
             )
 
-            start_tx_id = None
-            if (
-                scan_start_tx_id
-                and scan_oldest_tx_id
-                and scan_oldest_tx_id < scan_start_tx_id
-            ):
-                start_tx_id = scan_start_tx_id
+        fee = yield _ledger_fee(PRIMARY_TOKEN)
+        result, fee = yield _call_retrying_bad_fee(
+            PRIMARY_TOKEN, transfer_from_call, fee
+        )
 
-            logger.debug(
-                f"Fetching transactions with start_tx_id={start_tx_id}, max_results={batch_max_results}"
+        if result.Err is not None:
+            logger.error(f"Deposit failed: {result.Err}")
+            return Response(
+                success=False, data=ResponseData(Error=f"Call error: {result.Err}")
             )
-            response = yield get_account_transactions(
-                canister_id=indexer_canister_id,
-                owner_principal=canister_id,
-                start_tx_id=start_tx_id,
-                max_results=batch_max_results,
+        if result.Ok.get("Ok") is None:
+            error = result.Ok.get("Err")
+            return Response(
+                success=False, data=ResponseData(Error=f"Deposit error: {error}")
             )
 
-            if not scan_oldest_tx_id:
-                scan_oldest_tx_id = response.get("oldest_tx_id")
-                app_data().scan_oldest_tx_id = scan_oldest_tx_id
-                logger.debug(f"scan_oldest_tx_id: {scan_oldest_tx_id}")
-
-            response_txs = response.get("transactions")
+        tx_id = result.Ok["Ok"]
+        timestamp = ic.time()
+        # The sync may have stored the block while the ledger call was in flight
+        if _store_transaction(
+            canister_id,
+            tx_id,
+            "transfer",
+            caller,
+            canister_id,
+            amount,
+            timestamp,
+            None,
+            load_category_rules(),
+            fee or 0,
+        ):
+            logger.info(f"Credited deposit {tx_id} of {amount} tokens to {caller}")
+            _notify_subscribers(
+                [
+                    notification(
+                        PRIMARY_TOKEN,
+                        tx_id,
+                        timestamp,
+                        "transfer",
+                        caller,
+                        canister_id,
+                        amount,
+                    )
+                ]
+            )
+        return Response(
+            success=True,
+            data=ResponseData(TransactionId=TransactionIdRecord(transaction_id=tx_id)),
+        )
+    except Exception as e:
+        logger.error(f"Exception in deposit: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Exception in deposit: {str(e)}")
+        )
 
-            if not response_txs:
-                logger.debug("Empty batch - No older transactions will be found")
-                break
 
-            logger.debug(f"Received {len(response_txs)} transactions")
+def _store_withdrawal_transaction(withdrawal, block_id):
+    """
+    Stores a sent withdrawal under its ledger block, debiting the recipient's balance
+    right away. When the sync later fetches the same block, it finds the stored
+    transaction and does not debit it again. The withdrawal's timestamp is kept; a fee
+    that was not known when sending is corrected by the sync.
+    """
+    canister_id = ic.id().to_str()
+    timestamp = ic.time()
+    fee = max(withdrawal.fee, 0)
+    if withdrawal.token == PRIMARY_TOKEN:
+        is_new = _store_transaction(
+            canister_id,
+            block_id,
+            "transfer",
+            canister_id,
+            withdrawal.principal,
+            withdrawal.amount,
+            timestamp,
+            None,
+            load_category_rules(),
+            fee,
+        )
+    else:
+        is_new = _store_token_transaction(
+            withdrawal.token,
+            canister_id,
+            block_id,
+            "transfer",
+            canister_id,
+            withdrawal.principal,
+            withdrawal.amount,
+            timestamp,
+            fee,
+        )
 
-            response_txs.sort(
-                key=lambda x: x["id"], reverse=True
-            )  # sort by id descending
+    if is_new:
+        _notify_subscribers(
+            [
+                notification(
+                    withdrawal.token,
+                    block_id,
+                    timestamp,
+                    "transfer",
+                    canister_id,
+                    withdrawal.principal,
+                    withdrawal.amount,
+                )
+            ]
+        )
 
-            (
-                processed_batch_oldest_tx_id,
-                processed_batch_newest_tx_id,
-                processed_tx_ids,
-                inserted_new_txs_ids,
-            ) = _process_batch_txs(canister_id, response_txs)
-            logger.debug(f"Processed {len(processed_tx_ids)} transactions in batch")
-            logger.debug(
-                f"Processed batch oldest tx id: {processed_batch_oldest_tx_id}"
-            )
-            logger.debug(
-                f"Processed batch newest tx id: {processed_batch_newest_tx_id}"
-            )
-            if not len(processed_tx_ids):
-                logger.debug("No transactions processed in batch")
-                break
 
-            new_txs_count += len(inserted_new_txs_ids)
+def _send_withdrawal(withdrawal_id):
+    """
+    Makes the ledger transfer of an in-flight withdrawal and records its outcome.
 
-            if not scan_end_tx_id or scan_end_tx_id < processed_batch_newest_tx_id:
-                scan_end_tx_id = processed_batch_newest_tx_id
-                app_data().scan_end_tx_id = processed_batch_newest_tx_id
-            if (
-                not scan_start_tx_id
-                or scan_start_tx_id > processed_batch_oldest_tx_id
-                or not start_tx_id
-            ):
-                scan_start_tx_id = processed_batch_oldest_tx_id
-                app_data().scan_start_tx_id = processed_batch_oldest_tx_id
+    The first attempt fixes the fee and created_at_time of the transfer and the retries
+    reuse them, so if an earlier attempt did reach the ledger, the retry is rejected as
+    a Duplicate of its block instead of paying twice.
+    """
+    withdrawal = get_withdrawal(withdrawal_id)
+    if not withdrawal or withdrawal.status != WITHDRAWAL_STATUS_IN_FLIGHT:
+        return
 
-            if processed_batch_oldest_tx_id <= scan_oldest_tx_id:
-                logger.info(
-                    f"Transaction history is now in sync. Latest tx id: {scan_end_tx_id}"
+    symbol = withdrawal.token
+    to = Principal.from_str(withdrawal.principal)
+    try:
+        if test_mode_data().test_mode_enabled:
+            # The mock transfer records the transaction and updates the balances itself
+            response = yield _transfer(symbol, to, withdrawal.amount)
+            if response["success"]:
+                record_withdrawal_sent(
+                    withdrawal, response["data"]["TransactionId"]["transaction_id"]
+                )
+            else:
+                record_withdrawal_failure(withdrawal, response["data"]["Error"])
+            return
+
+        if not withdrawal.created_at_time:
+            fee = yield _ledger_fee(symbol)
+            withdrawal.fee = -1 if fee is None else fee
+            withdrawal.created_at_time = ic.time()
+
+        ledger = ICRCLedger(Principal.from_str(token_ledger(symbol)))
+
+        def transfer_call(fee):
+            return ledger.icrc1_transfer(
+                TransferArg(
+                    to=Account(owner=to, subaccount=None),
+                    amount=withdrawal.amount,
+                    fee=fee,
+                    memo=None,
+                    from_subaccount=None,
+                    created_at_time=withdrawal.created_at_time,
                 )
-
-                scan_end_tx_id = scan_end_tx_id
-                scan_start_tx_id = scan_end_tx_id
-                scan_oldest_tx_id = scan_end_tx_id
-                app_data().scan_end_tx_id = scan_end_tx_id
-                app_data().scan_start_tx_id = scan_end_tx_id
-                app_data().scan_oldest_tx_id = scan_end_tx_id
-                break
-
-    except Exception as e:
-        logger.error(f"Error processing transactions: {e}\n {traceback.format_exc()}")
-        return Response(
-            success=False,
-            data=ResponseData(Error=f"Error processing transactions: {str(e)}"),
-        )
-
-    summary_msg = f"Processed a total of {new_txs_count} new transactions"
-    logger.info(summary_msg)
-    return Response(
-        success=True,
-        data=ResponseData(
-            TransactionSummary=TransactionSummaryRecord(
-                new_txs_count=new_txs_count,
-                scan_end_tx_id=scan_end_tx_id,
-                sync_status=_sync_status(app_data()),
             )
-        ),
-    )
 
+        result, fee = yield _call_retrying_bad_fee(
+            symbol, transfer_call, withdrawal.fee if withdrawal.fee >= 0 else None
+        )
+        if fee is not None and fee != withdrawal.fee:
+            withdrawal.fee = fee
 
-def _process_batch_txs(canister_id, txs):
+        if result.Err is not None:
+            record_withdrawal_failure(withdrawal, f"Call error: {result.Err}")
+            return
 
-    processed_batch_oldest_tx_id = None
-    processed_batch_newest_tx_id = None
-    processed_tx_ids = []
-    inserted_new_txs_ids = []
+        if result.Ok.get("Ok") is not None:
+            block_id = int(result.Ok["Ok"])
+        else:
+            error = result.Ok.get("Err") or {}
+            if error.get("Duplicate") is None:
+                # Once the first attempt is too old to be deduplicated, a retry could
+                # pay a second time
+                record_withdrawal_failure(
+                    withdrawal,
+                    f"Transfer error: {error}",
+                    retry="TooOld" not in error and "BadBurn" not in error,
+                )
+                return
+            block_id = int(error["Duplicate"]["duplicate_of"])
 
-    logger.debug(f"Processing batch of {len(txs)} transactions")
+        record_withdrawal_sent(withdrawal, block_id)
+        _store_withdrawal_transaction(withdrawal, block_id)
+    except Exception as e:
+        logger.error(
+            f"Error sending withdrawal {withdrawal_id}: {e}\n{traceback.format_exc()}"
+        )
+        record_withdrawal_failure(withdrawal, f"Exception in withdrawal: {str(e)}")
 
-    for tx in txs:
-        try:
-            tx_id = int(tx["id"])
-            logger.debug(f"Processing transaction {tx_id}: {pformat(tx)}")
 
-            transaction = tx["transaction"]
-            timestamp = (
-                int(transaction["timestamp"]) if "timestamp" in transaction else 0
-            )
-            kind = transaction["kind"] if "kind" in transaction else "unknown"
+def _withdrawal_sender(withdrawal_id):
+    """Returns the timer callback sending one withdrawal, then draining the queue."""
 
-            # Initialize default values
-            principal_from = "unknown"
-            principal_to = "unknown"
-            amount = 0
+    def send() -> Async[void]:
+        yield _send_withdrawal(withdrawal_id)
+        schedule_withdrawals()
+        schedule_refresh()
 
-            # Handle different transaction types
-            if kind == "mint":
-                # For mint transactions, the recipient is this principal
-                principal_to = canister_id
-                principal_from = "mint"
+    return send
 
-                if transaction.get("mint"):
-                    amount = int(transaction["mint"].get("amount", 0))
 
-                logger.debug(
-                    f"Processing mint transaction {tx_id} to {principal_to} with amount {amount}"
-                )
+init_withdrawals(_withdrawal_sender)
 
-            elif kind == "burn":
-                # For burn transactions, the sender is this principal
-                principal_from = canister_id
-                principal_to = "burn"
 
-                if transaction.get("burn"):
-                    amount = int(transaction["burn"].get("amount", 0))
+@update
+@mutates_state
+def request_withdrawal(amount: nat, to: Opt[Principal], token: Opt[str]) -> Response:
+    """
+    Queue a payout from the vault. A timer sends the queued withdrawals, a few at a time,
+    and retries failed ones with exponential backoff.
 
-                logger.debug(
-                    f"Processing burn transaction {tx_id} from {principal_from} with amount {amount}"
-                )
+    Anyone can withdraw from their own balance, up to the amount not already queued. The
+    admin can also queue payouts to any principal, as with transfer.
 
-            elif "transfer" in transaction and transaction["transfer"]:
-                # Handle transfer transactions
-                transfer = transaction["transfer"]
+    Args:
+        amount: The amount of tokens to pay out
+        to: The recipient (null for the caller)
+        token: The symbol of the token, as listed by get_tokens (null for the primary one)
 
-                # Get principals for from and to accounts
-                principal_from = (
-                    str(transfer["from_"]["owner"])
-                    if "from_" in transfer and "owner" in transfer["from_"]
-                    else "unknown"
+    Returns:
+        Response object with success status and the queued withdrawal
+    """
+    try:
+        symbol = token or PRIMARY_TOKEN
+        if not token_exists(symbol):
+            return Response(
+                success=False, data=ResponseData(Error=f"Unknown token '{symbol}'")
+            )
+        if amount <= 0:
+            return Response(
+                success=False, data=ResponseData(Error="Amount must be positive")
+            )
+
+        caller = ic.caller().to_str()
+        recipient = to.to_str() if to else caller
+        is_admin = caller == app_data().admin_principal
+        if recipient != caller and not is_admin:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="Only the admin can queue withdrawals to another principal"
+                ),
+            )
+
+        active = active_withdrawals()
+        if len(active) >= WITHDRAWAL_QUEUE_MAX_LENGTH:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="The withdrawal queue is full, try again later"
+                ),
+            )
+
+        if not is_admin:
+            queued = [w for w in active if w.principal == recipient]
+            if len(queued) >= WITHDRAWAL_MAX_PENDING_PER_PRINCIPAL:
+                return Response(
+                    success=False,
+                    data=ResponseData(
+                        Error=f"At most {WITHDRAWAL_MAX_PENDING_PER_PRINCIPAL} withdrawals can be queued per principal"
+                    ),
                 )
-                principal_to = (
-                    str(transfer["to"]["owner"])
-                    if "to" in transfer and "owner" in transfer["to"]
-                    else "unknown"
+            balance = token_balances(symbol)[recipient]
+            available = (balance.amount if balance else 0) - sum(
+                w.amount for w in queued if w.token == symbol
+            )
+            if amount > available:
+                return Response(
+                    success=False,
+                    data=ResponseData(
+                        Error=f"Insufficient balance: {max(available, 0)} available to withdraw"
+                    ),
                 )
 
-                if transaction.get("transfer"):
-                    amount = int(transaction["transfer"].get("amount", 0))
+        withdrawal = create_withdrawal(symbol, recipient, amount, caller)
+        schedule_withdrawals()
+        return Response(
+            success=True,
+            data=ResponseData(Withdrawal=withdrawal_record(withdrawal)),
+        )
+    except Exception as e:
+        logger.error(f"Error queueing withdrawal: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error queueing withdrawal: {str(e)}"),
+        )
 
-                logger.debug(
-                    f"Processing transfer transaction {tx_id} from {principal_from} to {principal_to} with amount {amount}"
+
+@update
+@mutates_state
+def cancel_withdrawal(withdrawal_id: nat) -> Response:
+    """
+    Cancel a withdrawal that has not been sent yet. Allowed to the principal that queued
+    it, its recipient and the admin.
+
+    Args:
+        withdrawal_id: The id of the withdrawal
+
+    Returns:
+        Response object with success status and the cancelled withdrawal
+    """
+    try:
+        withdrawal = get_withdrawal(withdrawal_id)
+        if not withdrawal:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Withdrawal {withdrawal_id} not found"),
+            )
+
+        caller = ic.caller().to_str()
+        if caller not in (
+            withdrawal.requested_by,
+            withdrawal.principal,
+            app_data().admin_principal,
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Caller ({caller}) cannot cancel withdrawal {withdrawal_id}"
+                ),
+            )
+        if withdrawal.status != WITHDRAWAL_STATUS_PENDING:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Withdrawal {withdrawal_id} is {withdrawal.status}"
+                ),
+            )
+
+        mark_withdrawal_cancelled(withdrawal)
+        return Response(
+            success=True,
+            data=ResponseData(Withdrawal=withdrawal_record(withdrawal)),
+        )
+    except Exception as e:
+        logger.error(
+            f"Error cancelling withdrawal {withdrawal_id}: {e}\n{traceback.format_exc()}"
+        )
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error cancelling withdrawal: {str(e)}"),
+        )
+
+
+@query
+def get_withdrawals(
+    principal: Opt[Principal], cursor: Opt[nat], limit: Opt[nat]
+) -> Response:
+    """
+    Get the queued and past withdrawals, newest first, with their status, attempts and
+    ledger block ids.
+
+    Args:
+        principal: Only list the withdrawals to this recipient (null for all)
+        cursor: The next_cursor of the previous page (null for the first page)
+        limit: Maximum number of withdrawals returned (capped at WITHDRAWAL_PAGE_MAX_RESULTS)
+
+    Returns:
+        Response object with success status and a page of withdrawals
+    """
+    try:
+        page_limit = min(
+            limit or WITHDRAWAL_PAGE_DEFAULT_RESULTS, WITHDRAWAL_PAGE_MAX_RESULTS
+        )
+        withdrawals, next_cursor = withdrawals_page(
+            principal.to_str() if principal else None, cursor, page_limit
+        )
+        return Response(
+            success=True,
+            data=ResponseData(
+                WithdrawalsPage=WithdrawalsPageRecord(
+                    withdrawals=[withdrawal_record(w) for w in withdrawals],
+                    next_cursor=next_cursor,
                 )
-            else:
-                # Skip unknown transaction types
-                logger.debug(
-                    f"Skipping unknown transaction type: {kind} for tx {tx_id}"
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting withdrawals: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting withdrawals: {str(e)}"),
+        )
+
+
+def _token_record(symbol):
+    state = token_sync_state(symbol)
+    vault_balance = token_balances(symbol)[ic.id().to_str()]
+    return TokenRecord(
+        symbol=symbol,
+        ledger=Principal.from_str(token_ledger(symbol)),
+        indexer=Principal.from_str(token_indexer(symbol)),
+        scan_end_tx_id=state.scan_end_tx_id,
+        scan_start_tx_id=state.scan_start_tx_id,
+        scan_oldest_tx_id=state.scan_oldest_tx_id,
+        sync_status=_sync_status(state),
+        sync_backlog=sync_backlog(state),
+        sync_last_error=state.sync_last_error or None,
+        sync_retry_after=state.sync_retry_after,
+        vault_balance=vault_balance.amount if vault_balance else 0,
+    )
+
+
+@update
+@admin_only
+@mutates_state
+def register_token(symbol: str, ledger: Principal, indexer: Principal) -> Response:
+    """
+    Register another ICRC-1 token, synced by update_transaction_history alongside the
+    primary one.
+
+    Its transactions and balances are kept apart from the primary token's. The ledger
+    and indexer are stored as the canisters "<symbol> ledger" and "<symbol> indexer",
+    which set_canister can change later.
+
+    Args:
+        symbol: The token symbol, used to refer to it (e.g. "ckETH")
+        ledger: The principal ID of the token's ledger canister
+        indexer: The principal ID of the token's indexer canister
+
+    Returns:
+        Response object with success status and the new token
+    """
+    try:
+        if (
+            not symbol
+            or len(symbol) > TOKEN_SYMBOL_MAX_LENGTH
+            or any(char in symbol for char in SYMBOL_RESERVED_CHARACTERS)
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Token symbols must have 1 to {TOKEN_SYMBOL_MAX_LENGTH} characters, "
+                    f"none of them {', '.join(repr(char) for char in SYMBOL_RESERVED_CHARACTERS)}"
+                ),
+            )
+        if token_exists(symbol):
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Token '{symbol}' already exists"),
+            )
+
+        for canister_name, principal in (
+            (f"{symbol} ledger", ledger),
+            (f"{symbol} indexer", indexer),
+        ):
+            canister = Canisters[canister_name] or Canisters(_id=canister_name)
+            canister.principal = principal.to_str()
+        Token(_id=symbol)
+
+        logger.info(f"Registered token '{symbol}'")
+        return Response(success=True, data=ResponseData(Tokens=[_token_record(symbol)]))
+    except Exception as e:
+        logger.error(f"Error registering token: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error registering token: {str(e)}"),
+        )
+
+
+@query
+def get_tokens() -> Response:
+    """
+    Get the tokens held by the vault, primary one first, with the progress of their sync.
+
+    Returns:
+        Response object with success status and the tokens
+    """
+    try:
+        return Response(
+            success=True,
+            data=ResponseData(
+                Tokens=[_token_record(symbol) for symbol in token_symbols()]
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting tokens: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting tokens: {str(e)}"),
+        )
+
+
+@query
+def get_token_balance(token: str, principal: Principal) -> Response:
+    """
+    Get the balance of a principal in any token held by the vault.
+
+    Args:
+        token: The symbol of the token, as listed by get_tokens
+        principal: The principal ID to check balance for
+
+    Returns:
+        Response object with success status and balance data
+    """
+    try:
+        if not token_exists(token):
+            return Response(
+                success=False, data=ResponseData(Error=f"Unknown token '{token}'")
+            )
+
+        balance = token_balances(token)[principal.to_str()]
+        return Response(
+            success=True,
+            data=ResponseData(
+                Balance=BalanceRecord(
+                    principal_id=principal, amount=balance.amount if balance else 0
                 )
-                continue
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting token balance: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting token balance: {str(e)}"),
+        )
 
-            logger.debug(f"Processing transaction {tx_id}")
 
-            # Create or update the VaultTransaction
-            existing_tx = VaultTransaction[tx_id]
-            if existing_tx:
-                if (
-                    existing_tx.principal_from != principal_from
-                    or existing_tx.principal_to != principal_to
-                    or existing_tx.amount != amount
-                    or existing_tx.timestamp != timestamp
-                    or existing_tx.kind != kind
-                ):
-                    existing_tx.principal_from = principal_from
-                    existing_tx.principal_to = principal_to
-                    existing_tx.amount = amount
-                    existing_tx.timestamp = timestamp
-                    existing_tx.kind = kind
+def _deposit_account_record(owner):
+    deposit_account = DepositAccount[owner]
+    return DepositAccountRecord(
+        owner=Principal.from_str(owner),
+        account=Account(owner=ic.id(), subaccount=deposit_subaccount(owner)),
+        sync_status=_sync_status(deposit_account),
+        scan_end_tx_id=deposit_account.scan_end_tx_id,
+        last_deposit_at=deposit_account.last_deposit_at,
+    )
 
-            else:
-                # Create new transaction
-                VaultTransaction(
-                    _id=tx_id,
-                    principal_from=principal_from,
-                    principal_to=principal_to,
-                    amount=amount,
-                    timestamp=timestamp,
-                    kind=kind,
+
+@update
+@mutates_state
+def open_deposit_account() -> Response:
+    """
+    Open the caller's deposit subaccount of the vault's primary token.
+
+    Deposits sent to it are credited to the caller, whoever sends them. The subaccount is
+    derived from the caller's principal, so it never changes. It is synced for
+    DEPOSIT_ACTIVE_WINDOW_NS after each call and after each deposit found; call this
+    again after depositing to an idle subaccount.
+
+    The anonymous principal cannot open one. At most DEPOSIT_MAX_ACTIVE_ACCOUNTS
+    subaccounts are synced at the same time, and calls less than
+    DEPOSIT_REOPEN_INTERVAL_NS apart do not extend the activity window.
+
+    Returns:
+        Response object with success status and the deposit account
+    """
+    try:
+        owner = ic.caller().to_str()
+        if owner == Principal.anonymous().to_str():
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="The anonymous principal cannot open a deposit account"
+                ),
+            )
+
+        now = ic.time()
+        active_until = deposit_active_until(owner)
+        if active_until is None:
+            if active_deposit_count() >= DEPOSIT_MAX_ACTIVE_ACCOUNTS:
+                return Response(
+                    success=False,
+                    data=ResponseData(
+                        Error="Too many deposit accounts are active, try again later"
+                    ),
                 )
+        elif active_until - DEPOSIT_ACTIVE_WINDOW_NS + DEPOSIT_REOPEN_INTERVAL_NS > now:
+            # Opened or credited moments ago: the account is already being synced
+            return Response(
+                success=True,
+                data=ResponseData(DepositAccount=_deposit_account_record(owner)),
+            )
 
-                # Update balances based on transaction type
-                if kind == "mint":
-                    # For mint, only update the recipient's balance
-                    balance_to = Balance[principal_to] or Balance(
-                        _id=principal_to, amount=0
-                    )
-                    balance_to.amount = balance_to.amount + amount
-                    logger.debug(
-                        f"Updated balance for {principal_to} to {balance_to.amount}"
-                    )
-                elif kind == "burn":
-                    # For burn, only update the sender's balance
-                    balance_from = Balance[principal_from] or Balance(
-                        _id=principal_from, amount=0
-                    )
-                    balance_from.amount = balance_from.amount - amount
-                    logger.debug(
-                        f"Updated balance for {principal_from} to {balance_from.amount}"
-                    )
-                elif kind == "transfer":
-                    """
-                    user deposits in the vault => balance of user increases
-                    vault transfers to user => balance of user decreases
-                    """
-
-                    if canister_id == principal_to:
-                        balance_from = Balance[principal_from] or Balance(
-                            _id=principal_from, amount=0
-                        )
-                        balance_from.amount = balance_from.amount + amount
-                        logger.debug(
-                            f"Updated balance for {principal_from} to {balance_from.amount}"
-                        )
-
-                        vault_balance = Balance[canister_id]
-                        vault_balance.amount = vault_balance.amount + amount
-
-                    if canister_id == principal_from:
-                        balance_to = Balance[principal_to] or Balance(
-                            _id=principal_to, amount=0
-                        )
-                        balance_to.amount = balance_to.amount - amount
-                        logger.debug(
-                            f"Updated balance for {principal_to} to {balance_to.amount}"
-                        )
-
-                        vault_balance = Balance[canister_id]
-                        vault_balance.amount = vault_balance.amount - amount
+        if not DepositAccount[owner]:
+            logger.info(f"Opening deposit subaccount of {owner}")
+            DepositAccount(_id=owner)
+        mark_deposit_activity(owner, now)
+        return Response(
+            success=True,
+            data=ResponseData(DepositAccount=_deposit_account_record(owner)),
+        )
+    except Exception as e:
+        logger.error(f"Error opening deposit account: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error opening deposit account: {str(e)}"),
+        )
 
-                inserted_new_txs_ids.append(tx_id)
 
-            if not processed_batch_oldest_tx_id or processed_batch_oldest_tx_id > tx_id:
-                processed_batch_oldest_tx_id = tx_id
-            if not processed_batch_newest_tx_id or processed_batch_newest_tx_id < tx_id:
-                processed_batch_newest_tx_id = tx_id
-            processed_tx_ids.append(tx_id)
+@query
+def get_deposit_account(principal: Principal) -> Response:
+    """
+    Get the deposit subaccount opened by a principal, with the progress of its sync.
 
-        except Exception as e:
-            logger.error(
-                f"Error processing transaction {tx_id}: {e}\n {traceback.format_exc()}"
+    Returns:
+        Response object with success status and the deposit account
+    """
+    try:
+        owner = principal.to_str()
+        if not DepositAccount[owner]:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"No deposit account opened by {owner}"),
+            )
+        return Response(
+            success=True,
+            data=ResponseData(DepositAccount=_deposit_account_record(owner)),
+        )
+    except Exception as e:
+        logger.error(f"Error getting deposit account: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting deposit account: {str(e)}"),
+        )
+
+
+def _sync_status(app_data_obj):
+    return (
+        "Synced"
+        if (
+            app_data_obj.scan_end_tx_id
+            == app_data_obj.scan_oldest_tx_id
+            == app_data_obj.scan_start_tx_id
+        )
+        else "Syncing"
+    )
+
+
+def _fetch_error_message(fetch_result):
+    if "Rejected" in fetch_result:
+        return f"Indexer call rejected: {fetch_result['Rejected']}"
+    return f"Indexer error: {fetch_result.get('IndexerError')}"
+
+
+def _sync_state(symbol, deposit_owner=None):
+    """
+    Returns the entity holding the scan cursors and backoff state of an account synced
+    from an indexer: a token's default account, or a deposit subaccount.
+    """
+    return DepositAccount[deposit_owner] if deposit_owner else token_sync_state(symbol)
+
+
+def _sync_label(symbol, deposit_owner=None):
+    return f"{symbol} deposits of {deposit_owner}" if deposit_owner else symbol
+
+
+def _record_sync_failure(symbol, error, deposit_owner=None):
+    """Store the error and push back the next sync attempt of an account with exponential backoff."""
+    state = _sync_state(symbol, deposit_owner)
+    failures = state.sync_consecutive_failures + 1
+    delay = min(SYNC_BACKOFF_BASE_NS * 2 ** min(failures - 1, 32), SYNC_BACKOFF_MAX_NS)
+    now = ic.time()
+
+    state.sync_consecutive_failures = failures
+    state.sync_last_error = error
+    state.sync_last_error_timestamp = now
+    state.sync_retry_after = now + delay
+    logger.warning(
+        f"Sync of {_sync_label(symbol, deposit_owner)} failed {failures} time(s) in a row, "
+        f"next attempt allowed in {delay} ns: {error}"
+    )
+
+
+def _record_sync_success(symbol, deposit_owner=None):
+    """Clear the error and backoff state left by earlier failed syncs of an account."""
+    state = _sync_state(symbol, deposit_owner)
+    if state.sync_consecutive_failures or state.sync_retry_after:
+        state.sync_consecutive_failures = 0
+        state.sync_retry_after = 0
+    if state.sync_last_error:
+        state.sync_last_error = ""
+
+
+def _sync_backing_off(symbol, deposit_owner=None):
+    retry_after = _sync_state(symbol, deposit_owner).sync_retry_after
+    return bool(retry_after and ic.time() < retry_after)
+
+
+def _sync_lease_active(app_data_obj):
+    return bool(
+        app_data_obj.sync_lease_owner and ic.time() < app_data_obj.sync_lease_expires_at
+    )
+
+
+def _acquire_sync_lease():
+    """
+    Take the sync lease unless another sync holds an unexpired one.
+
+    Returns:
+        The lease token identifying this sync, or None if a sync is already in progress
+    """
+    app_data_obj = app_data()
+    if _sync_lease_active(app_data_obj):
+        return None
+
+    lease_counter = app_data_obj.sync_lease_counter + 1
+    lease_token = f"{ic.caller().to_str()}#{lease_counter}"
+    app_data_obj.sync_lease_counter = lease_counter
+    app_data_obj.sync_lease_owner = lease_token
+    app_data_obj.sync_lease_expires_at = ic.time() + SYNC_LEASE_DURATION_NS
+    app_data_obj.sync_lease_new_txs_count = 0
+    logger.debug(f"Acquired sync lease {lease_token}")
+    return lease_token
+
+
+def _renew_sync_lease(lease_token, new_txs_count):
+    """Extend the lease after a batch. Returns False if the lease was lost meanwhile."""
+    app_data_obj = app_data()
+    if app_data_obj.sync_lease_owner != lease_token:
+        return False
+    app_data_obj.sync_lease_expires_at = ic.time() + SYNC_LEASE_DURATION_NS
+    app_data_obj.sync_lease_new_txs_count = new_txs_count
+    return True
+
+
+def _release_sync_lease(lease_token):
+    app_data_obj = app_data()
+    if app_data_obj.sync_lease_owner == lease_token:
+        app_data_obj.sync_lease_owner = ""
+        app_data_obj.sync_lease_expires_at = 0
+        logger.debug(f"Released sync lease {lease_token}")
+
+
+def _sync_in_progress_response():
+    app_data_obj = app_data()
+    logger.info(f"Sync already in progress (lease {app_data_obj.sync_lease_owner})")
+    return Response(
+        success=True,
+        data=ResponseData(
+            TransactionSummary=TransactionSummaryRecord(
+                new_txs_count=app_data_obj.sync_lease_new_txs_count,
+                scan_end_tx_id=app_data_obj.scan_end_tx_id,
+                sync_status="InProgress",
+            )
+        ),
+    )
+
+
+def _reconciliation_record(app_data_obj):
+    if not app_data_obj.reconciliation_timestamp:
+        return None
+
+    indexer_balance = app_data_obj.reconciliation_indexer_balance
+    vault_drift = app_data_obj.reconciliation_vault_balance - indexer_balance
+    ledger_drift = app_data_obj.reconciliation_ledger_balance - indexer_balance
+    return ReconciliationRecord(
+        timestamp=app_data_obj.reconciliation_timestamp,
+        sync_tx_id=app_data_obj.reconciliation_sync_tx_id,
+        ledger_balance=app_data_obj.reconciliation_ledger_balance,
+        indexer_balance=indexer_balance,
+        vault_balance=app_data_obj.reconciliation_vault_balance,
+        vault_drift=vault_drift,
+        ledger_drift=ledger_drift,
+        drift_detected=vault_drift != 0,
+        error=app_data_obj.reconciliation_error or None,
+    )
+
+
+def _reconcile(indexer_balance, indexer_newest_tx_id):
+    """
+    Compares the vault's balance with the balance reported by the indexer and the ledger.
+
+    The comparison is only meaningful at a sync point: the indexer balance must come from a
+    page whose newest transaction is the newest one the vault has processed. The ledger
+    balance is queried afterwards, so a non-zero ledger drift may just be indexer lag.
+
+    Returns:
+        None if the reconciliation was recorded, otherwise the reason it was not
+    """
+    app_data_obj = app_data()
+    sync_tx_id = app_data_obj.scan_end_tx_id
+    if _sync_status(app_data_obj) != "Synced" or (indexer_newest_tx_id or 0) != (
+        sync_tx_id or 0
+    ):
+        return "The vault is not in sync with the indexer"
+
+    canister_id = ic.id().to_str()
+    vault_balance_obj = Balance[canister_id]
+    # The indexer balance is the default account's: deposit subaccounts not swept yet
+    # hold the rest of the vault's tokens
+    vault_balance = (
+        vault_balance_obj.amount if vault_balance_obj else 0
+    ) - app_data_obj.deposit_subaccounts_balance
+
+    ledger_result = yield get_ledger_balance(token_ledger(PRIMARY_TOKEN), canister_id)
+
+    app_data_obj = app_data()
+    app_data_obj.reconciliation_timestamp = ic.time()
+    if "Ok" not in ledger_result:
+        app_data_obj.reconciliation_error = ledger_result["Err"]
+        logger.warning(f"Reconciliation failed: {ledger_result['Err']}")
+        return f"Error querying the ledger balance: {ledger_result['Err']}"
+
+    app_data_obj.reconciliation_sync_tx_id = sync_tx_id
+    app_data_obj.reconciliation_ledger_balance = ledger_result["Ok"]
+    app_data_obj.reconciliation_indexer_balance = indexer_balance
+    app_data_obj.reconciliation_vault_balance = vault_balance
+    app_data_obj.reconciliation_error = ""
+
+    if vault_balance != indexer_balance:
+        logger.warning(
+            f"Balance drift at tx {sync_tx_id}: vault {vault_balance}, "
+            f"indexer {indexer_balance}, ledger {ledger_result['Ok']}"
+        )
+    return None
+
+
+def _sync_token(
+    symbol, canister_id, lease_token, max_iterations, new_txs_count, deposit_owner=None
+):
+    """
+    Fetches the transactions of one token from its indexer, using up to `max_iterations`
+    indexer fetches, and stores the new ones. With `deposit_owner`, the deposit
+    subaccount of that principal is synced instead of the vault's default account.
+
+    Returns:
+        Tuple of (number of fetches used, new transactions count including `new_txs_count`,
+        error or None, (indexer balance, newest transaction id) of the newest page fetched
+        or None, whether the sync lease is still held)
+    """
+    indexer_canister_id = token_indexer(symbol)
+    subaccount = deposit_subaccount(deposit_owner) if deposit_owner else None
+    label = _sync_label(symbol, deposit_owner)
+    batch_max_results = app_data().max_results
+
+    state = _sync_state(symbol, deposit_owner)
+    scan_end_tx_id = state.scan_end_tx_id
+    scan_start_tx_id = state.scan_start_tx_id
+    scan_oldest_tx_id = state.scan_oldest_tx_id
+
+    batch_iteration_count = 0
+    fetch_failures = 0
+    sync_error = None
+    # Indexer balance and newest transaction id of the newest page fetched
+    indexer_snapshot = None
+
+    # Implement cursor-based pagination to fetch all transactions
+    while batch_iteration_count < max_iterations:
+        batch_iteration_count += 1
+        logger.debug(
+            f"{label} batch_iteration_count: {batch_iteration_count}/{max_iterations}"
+        )
+
+        start_tx_id = None
+        if (
+            scan_start_tx_id
+            and scan_oldest_tx_id
+            and scan_oldest_tx_id < scan_start_tx_id
+        ):
+            start_tx_id = scan_start_tx_id
+
+        logger.debug(
+            f"Fetching {label} transactions with start_tx_id={start_tx_id}, max_results={batch_max_results}"
+        )
+        fetch_result = yield get_account_transactions(
+            canister_id=indexer_canister_id,
+            owner_principal=canister_id,
+            subaccount=subaccount,
+            start_tx_id=start_tx_id,
+            max_results=batch_max_results,
+        )
+
+        if not _renew_sync_lease(lease_token, new_txs_count):
+            return batch_iteration_count, new_txs_count, sync_error, None, False
+
+        if "Ok" not in fetch_result:
+            # A failed fetch is not an empty page: retry within the budget
+            sync_error = _fetch_error_message(fetch_result)
+            fetch_failures += 1
+            logger.warning(
+                f"Failed to fetch {label} transactions (attempt {fetch_failures}): {sync_error}"
+            )
+            if fetch_failures > SYNC_MAX_RETRIES:
+                break
+            continue
+
+        sync_error = None
+        response = fetch_result["Ok"]
+
+        if not scan_oldest_tx_id:
+            scan_oldest_tx_id = response.get("oldest_tx_id")
+            _sync_state(symbol, deposit_owner).scan_oldest_tx_id = scan_oldest_tx_id
+            logger.debug(f"scan_oldest_tx_id: {scan_oldest_tx_id}")
+
+        response_txs = response.get("transactions")
+
+        if start_tx_id is None:
+            indexer_snapshot = (
+                response.get("balance", 0),
+                max((tx["id"] for tx in response_txs), default=None),
+            )
+
+        if not response_txs:
+            logger.debug("Empty batch - No older transactions will be found")
+            break
+
+        logger.debug(f"Received {len(response_txs)} transactions")
+
+        response_txs.sort(key=lambda x: x["id"], reverse=True)  # sort by id descending
+
+        (
+            processed_batch_oldest_tx_id,
+            processed_batch_newest_tx_id,
+            processed_tx_ids,
+            inserted_new_txs_ids,
+        ) = _process_batch_txs(canister_id, response_txs, symbol, deposit_owner)
+        logger.debug(f"Processed {len(processed_tx_ids)} transactions in batch")
+        logger.debug(f"Processed batch oldest tx id: {processed_batch_oldest_tx_id}")
+        logger.debug(f"Processed batch newest tx id: {processed_batch_newest_tx_id}")
+        if not len(processed_tx_ids):
+            logger.debug("No transactions processed in batch")
+            break
+
+        new_txs_count += len(inserted_new_txs_ids)
+
+        if not scan_end_tx_id or scan_end_tx_id < processed_batch_newest_tx_id:
+            scan_end_tx_id = processed_batch_newest_tx_id
+            _sync_state(symbol, deposit_owner).scan_end_tx_id = (
+                processed_batch_newest_tx_id
+            )
+        if (
+            not scan_start_tx_id
+            or scan_start_tx_id > processed_batch_oldest_tx_id
+            or not start_tx_id
+        ):
+            scan_start_tx_id = processed_batch_oldest_tx_id
+            _sync_state(symbol, deposit_owner).scan_start_tx_id = (
+                processed_batch_oldest_tx_id
+            )
+
+        if processed_batch_oldest_tx_id <= scan_oldest_tx_id:
+            logger.info(
+                f"{label} transaction history is now in sync. Latest tx id: {scan_end_tx_id}"
+            )
+
+            scan_start_tx_id = scan_end_tx_id
+            scan_oldest_tx_id = scan_end_tx_id
+            state = _sync_state(symbol, deposit_owner)
+            state.scan_end_tx_id = scan_end_tx_id
+            state.scan_start_tx_id = scan_end_tx_id
+            state.scan_oldest_tx_id = scan_end_tx_id
+            break
+
+    return batch_iteration_count, new_txs_count, sync_error, indexer_snapshot, True
+
+
+def _sync_accounts(accounts, budget, start, canister_id, lease_token, new_txs_count):
+    """
+    Syncs several accounts, given as (token symbol, deposit owner or None), sharing
+    `budget` indexer fetches between them with share_sync_budget. Fetches an account does
+    not need are left to the accounts synced after it.
+
+    Returns:
+        Tuple of (new transactions count including `new_txs_count`, errors, indexer
+        snapshot of the primary token's default account or None, whether the sync lease
+        is still held)
+    """
+    shares = share_sync_budget(
+        budget,
+        [(account, sync_backlog(_sync_state(*account))) for account in accounts],
+        start,
+    )
+
+    sync_errors = []
+    indexer_snapshot = None
+    spare_iterations = 0
+    for symbol, deposit_owner in accounts[start:] + accounts[:start]:
+        max_iterations = shares[(symbol, deposit_owner)] + spare_iterations
+        if not max_iterations:
+            continue
+
+        (
+            iterations,
+            new_txs_count,
+            sync_error,
+            account_indexer_snapshot,
+            lease_held,
+        ) = yield _sync_token(
+            symbol,
+            canister_id,
+            lease_token,
+            max_iterations,
+            new_txs_count,
+            deposit_owner,
+        )
+        if not lease_held:
+            return new_txs_count, sync_errors, indexer_snapshot, False
+
+        spare_iterations = max_iterations - iterations
+        if sync_error:
+            _record_sync_failure(symbol, sync_error, deposit_owner)
+            sync_errors.append(f"{_sync_label(symbol, deposit_owner)}: {sync_error}")
+        else:
+            _record_sync_success(symbol, deposit_owner)
+        if symbol == PRIMARY_TOKEN and not deposit_owner:
+            indexer_snapshot = account_indexer_snapshot
+
+    return new_txs_count, sync_errors, indexer_snapshot, True
+
+
+def _active_deposit_accounts():
+    """
+    Lists the deposit subaccounts to sync: those opened or credited recently, plus those
+    still walking back their history or waiting to be swept. Idle ones are dropped from
+    the activity map.
+    """
+    now = ic.time()
+    accounts = []
+    for owner, active_until in active_deposit_owners():
+        deposit_account = DepositAccount[owner]
+        if not deposit_account or (
+            active_until < now
+            and _sync_status(deposit_account) == "Synced"
+            and not deposit_account.sweep_pending
+        ):
+            deactivate_deposit_account(owner)
+        elif not _sync_backing_off(PRIMARY_TOKEN, owner):
+            accounts.append((PRIMARY_TOKEN, owner))
+    return accounts
+
+
+def _sweep_deposit_account(canister_id, owner):
+    """
+    Moves the tokens of a deposit subaccount to the vault's default account, which pays
+    out transfers and withdrawals. The whole ledger balance of the subaccount is sent,
+    less the fee, so the subaccount ends up empty.
+
+    Balances are not changed here: the sweep is stored by a later sync like any other
+    transaction, and only its fee is debited from the vault.
+    """
+    deposit_account = DepositAccount[owner]
+    subaccount = deposit_subaccount(owner)
+    ledger_id = token_ledger(PRIMARY_TOKEN)
+
+    balance_result = yield get_ledger_balance(ledger_id, canister_id, subaccount)
+    if "Ok" not in balance_result:
+        logger.warning(
+            f"Could not get the balance of the deposit subaccount of {owner}: {balance_result['Err']}"
+        )
+        return
+    balance = balance_result["Ok"]
+
+    fee = yield _ledger_fee(PRIMARY_TOKEN)
+    if fee is None:
+        return
+    if balance <= fee:
+        logger.debug(f"Nothing to sweep from the deposit subaccount of {owner}")
+        deposit_account.sweep_pending = False
+        return
+
+    ledger = ICRCLedger(Principal.from_str(ledger_id))
+
+    def transfer_call(fee):
+        return ledger.icrc1_transfer(
+            TransferArg(
+                to=Account(owner=ic.id(), subaccount=None),
+                amount=balance - fee,
+                fee=fee,
+                memo=None,
+                from_subaccount=subaccount,
+                created_at_time=None,
+            )
+        )
+
+    result, fee = yield _call_retrying_bad_fee(PRIMARY_TOKEN, transfer_call, fee)
+    if result.Err is not None:
+        logger.warning(
+            f"Sweep of the deposit subaccount of {owner} failed: {result.Err}"
+        )
+        return
+    if result.Ok.get("Ok") is None:
+        logger.warning(
+            f"Sweep of the deposit subaccount of {owner} failed: {result.Ok.get('Err')}"
+        )
+        return
+
+    logger.info(
+        f"Swept {balance - fee} tokens from the deposit subaccount of {owner} in block {result.Ok['Ok']}"
+    )
+    deposit_account.sweep_pending = False
+
+
+def _sweep_deposit_accounts(canister_id):
+    """
+    Sweeps up to DEPOSIT_SWEEP_MAX_PER_SYNC deposit subaccounts that received deposits.
+    Failed sweeps are retried by the next sync call.
+    """
+    owners = [
+        owner
+        for owner, _ in active_deposit_owners()
+        if DepositAccount[owner] and DepositAccount[owner].sweep_pending
+    ]
+    for owner in owners[:DEPOSIT_SWEEP_MAX_PER_SYNC]:
+        try:
+            yield _sweep_deposit_account(canister_id, owner)
+        except Exception as e:
+            logger.error(
+                f"Error sweeping the deposit subaccount of {owner}: {e}\n{traceback.format_exc()}"
+            )
+
+
+@update
+@mutates_state
+def update_transaction_history() -> Async[Response]:
+    """
+    Updates the transaction history for the current principal by querying the ICRC indexer
+    of each token and storing the transactions in the VaultTransaction database (or as
+    TokenTransaction for tokens other than the primary one).
+
+    The max_iteration_count indexer fetches of the call are shared between tokens: each
+    gets one fetch in turn, and the rest are split by how far behind each token is, so a
+    token with a long history cannot starve the others. A token whose indexer keeps
+    failing backs off on its own while the others keep syncing.
+
+    Only one sync runs at a time: while another call holds the sync lease, this returns
+    immediately with sync_status "InProgress" and the progress of the running sync.
+
+    Returns:
+        Response object with success status, message, and summary data
+    """
+    lease_token = None
+    new_txs_count = 0
+    try:
+        canister_id = ic.id().to_str()
+        logger.info(f"Updating transaction history for {canister_id}")
+
+        if test_mode_data().test_mode_enabled:
+            return Response(
+                success=True,
+                data=ResponseData(
+                    Message="Test mode enabled, skipping update_transaction_history"
+                ),
+            )
+
+        if snapshot_import_data().status in (
+            SNAPSHOT_IMPORT_IN_PROGRESS,
+            SNAPSHOT_IMPORT_ABORTING,
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="A snapshot import is in progress, sync resumes once it is finished"
+                ),
+            )
+
+        symbols = [token for token in token_symbols() if not _sync_backing_off(token)]
+        if not symbols:
+            state = token_sync_state(PRIMARY_TOKEN)
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Sync is backing off after {state.sync_consecutive_failures} consecutive failures "
+                    f"until {state.sync_retry_after}. Last error: {state.sync_last_error}"
+                ),
+            )
+
+        lease_token = _acquire_sync_lease()
+        if not lease_token:
+            return _sync_in_progress_response()
+
+        rotation = app_data().sync_token_rotation
+        app_data().sync_token_rotation = rotation + 1
+        (
+            new_txs_count,
+            sync_errors,
+            indexer_snapshot,
+            lease_held,
+        ) = yield _sync_accounts(
+            [(token, None) for token in symbols],
+            app_data().max_iteration_count,
+            rotation % len(symbols),
+            canister_id,
+            lease_token,
+            new_txs_count,
+        )
+
+        deposit_accounts = _active_deposit_accounts() if lease_held else []
+        if deposit_accounts:
+            rotation = app_data().deposit_sync_rotation
+            app_data().deposit_sync_rotation = rotation + 1
+            (
+                new_txs_count,
+                deposit_sync_errors,
+                _,
+                lease_held,
+            ) = yield _sync_accounts(
+                deposit_accounts,
+                DEPOSIT_SYNC_MAX_FETCHES,
+                rotation % len(deposit_accounts),
+                canister_id,
+                lease_token,
+                new_txs_count,
+            )
+            sync_errors += deposit_sync_errors
+
+        if lease_held:
+            yield _sweep_deposit_accounts(canister_id)
+
+        if not lease_held:
+            logger.warning(f"Sync lease {lease_token} lost, stopping sync")
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Sync lease expired after processing {new_txs_count} new transactions"
+                ),
+            )
+
+        if sync_errors:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Error fetching transactions after processing {new_txs_count} new transactions: "
+                    + "; ".join(sync_errors)
+                ),
+            )
+
+        if (
+            indexer_snapshot
+            and ic.time()
+            >= app_data().reconciliation_timestamp + RECONCILIATION_INTERVAL_NS
+        ):
+            try:
+                skipped_reason = yield _reconcile(*indexer_snapshot)
+                if skipped_reason:
+                    logger.debug(f"Reconciliation skipped: {skipped_reason}")
+            except Exception as e:
+                # A failed reconciliation must not fail the sync itself
+                logger.error(f"Error reconciling balances: {e}")
+
+    except Exception as e:
+        logger.error(f"Error processing transactions: {e}\n {traceback.format_exc()}")
+        _record_sync_failure(PRIMARY_TOKEN, f"Error processing transactions: {str(e)}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error processing transactions: {str(e)}"),
+        )
+    finally:
+        if lease_token:
+            # Transactions stored before an error count towards the growth rate too
+            record_sync_growth(new_txs_count, ic.time())
+            _release_sync_lease(lease_token)
+
+    summary_msg = f"Processed a total of {new_txs_count} new transactions"
+    logger.info(summary_msg)
+    return Response(
+        success=True,
+        data=ResponseData(
+            TransactionSummary=TransactionSummaryRecord(
+                new_txs_count=new_txs_count,
+                scan_end_tx_id=app_data().scan_end_tx_id,
+                sync_status=(
+                    "Synced"
+                    if all(
+                        _sync_status(token_sync_state(token)) == "Synced"
+                        for token in token_symbols()
+                    )
+                    else "Syncing"
+                ),
+            )
+        ),
+    )
+
+
+@update
+@admin_only
+@mutates_state
+def reconcile_balances() -> Async[Response]:
+    """
+    Reconcile the vault's balance against the ledger and the indexer right away.
+
+    The newest page of the indexer provides its balance; the reconciliation is only
+    recorded if the vault has already processed the newest transaction of that page.
+    Otherwise the vault should be synced first with update_transaction_history.
+
+    Returns:
+        Response object with success status and the recorded reconciliation
+    """
+    lease_token = None
+    try:
+        if test_mode_data().test_mode_enabled:
+            return Response(
+                success=False,
+                data=ResponseData(Error="Reconciliation is not available in test mode"),
+            )
+
+        lease_token = _acquire_sync_lease()
+        if not lease_token:
+            return Response(
+                success=False,
+                data=ResponseData(Error="A sync is in progress, try again later"),
+            )
+
+        canister_id = ic.id().to_str()
+        fetch_result = yield get_account_transactions(
+            canister_id=token_indexer(PRIMARY_TOKEN),
+            owner_principal=canister_id,
+            start_tx_id=None,
+            max_results=1,
+        )
+        if "Ok" not in fetch_result:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Error fetching the indexer balance: {_fetch_error_message(fetch_result)}"
+                ),
+            )
+
+        response = fetch_result["Ok"]
+        response_txs = response.get("transactions") or []
+        skipped_reason = yield _reconcile(
+            response.get("balance", 0),
+            max((tx["id"] for tx in response_txs), default=None),
+        )
+        if skipped_reason:
+            return Response(success=False, data=ResponseData(Error=skipped_reason))
+
+        return Response(
+            success=True,
+            data=ResponseData(Reconciliation=_reconciliation_record(app_data())),
+        )
+    except Exception as e:
+        logger.error(f"Error reconciling balances: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error reconciling balances: {str(e)}"),
+        )
+    finally:
+        if lease_token:
+            _release_sync_lease(lease_token)
+
+
+def _memo_hex(operation):
+    """Returns the memo of a ledger operation as a hex string, if it has one."""
+    memo = operation.get("memo") if operation else None
+    return bytes(memo).hex() if memo else None
+
+
+def _correct_transaction(
+    canister_id, tx, kind, principal_from, principal_to, amount, fee
+):
+    """
+    Updates a stored transaction with the details the ledger reports for it, moving its
+    effects on the balances, the balance checkpoints and the category totals, and
+    indexing it under its new principals.
+
+    The timestamp it was stored with is kept: deposit and the withdrawal queue store
+    their transactions at the time of the ledger call, within seconds of the block's
+    own, and an entry of the time index cannot be moved to another bucket.
+    """
+    logger.warning(f"Correcting stored transaction {tx._id} with the ledger's details")
+    tx_id = int(tx._id)
+    old_principals = {tx.principal_from, tx.principal_to}
+    old_details = (tx.kind, tx.principal_from, tx.principal_to, tx.amount, tx.fee)
+    apply_new_transaction(canister_id, tx_id, *old_details, reverse=True)
+    record_new_transaction(canister_id, tx_id, *old_details, reverse=True)
+    categories = transaction_categories(tx_id)
+    for category in categories:
+        remove_from_category(canister_id, tx, category)
+
+    # Each assignment saves the transaction and logs it to the change feed
+    tx.kind = kind
+    tx.principal_from = principal_from
+    tx.principal_to = principal_to
+    tx.amount = amount
+    tx.fee = fee
+
+    apply_new_transaction(
+        canister_id, tx_id, kind, principal_from, principal_to, amount, fee
+    )
+    record_new_transaction(
+        canister_id, tx_id, kind, principal_from, principal_to, amount, fee
+    )
+    for category in categories:
+        add_to_category(canister_id, tx, category)
+    index_new_principals(
+        tx_id, tx.timestamp, {principal_from, principal_to} - old_principals
+    )
+
+
+def _store_transaction(
+    canister_id,
+    tx_id,
+    kind,
+    principal_from,
+    principal_to,
+    amount,
+    timestamp,
+    memo,
+    category_rules,
+    fee=0,
+):
+    """Stores a transaction of the primary token. Returns True if it is a new one."""
+    if is_archived(tx_id):
+        logger.debug(f"Transaction {tx_id} is already archived")
+        return False
+
+    # Create or update the VaultTransaction
+    existing_tx = VaultTransaction[tx_id]
+    if existing_tx:
+        if (
+            existing_tx.principal_from != principal_from
+            or existing_tx.principal_to != principal_to
+            or existing_tx.amount != amount
+            or existing_tx.kind != kind
+            or existing_tx.fee != fee
+        ):
+            _correct_transaction(
+                canister_id,
+                existing_tx,
+                kind,
+                principal_from,
+                principal_to,
+                amount,
+                fee,
+            )
+        return False
+
+    # Create new transaction
+    new_tx = VaultTransaction(
+        _id=tx_id,
+        principal_from=principal_from,
+        principal_to=principal_to,
+        amount=amount,
+        fee=fee,
+        timestamp=timestamp,
+        kind=kind,
+    )
+
+    # Update balances based on transaction type
+    apply_new_transaction(
+        canister_id, tx_id, kind, principal_from, principal_to, amount, fee
+    )
+    index_new_transaction(tx_id, timestamp, principal_from, principal_to)
+    record_new_transaction(
+        canister_id, tx_id, kind, principal_from, principal_to, amount, fee
+    )
+    categorize_new_transaction(canister_id, new_tx, memo, category_rules)
+    return True
+
+
+def _store_token_transaction(
+    symbol,
+    canister_id,
+    tx_id,
+    kind,
+    principal_from,
+    principal_to,
+    amount,
+    timestamp,
+    fee=0,
+):
+    """
+    Stores a transaction of a registered token and applies it to the token's balances.
+
+    The history indexes (time index, balance checkpoints and index, categories) only
+    cover the primary token.
+
+    A stored transaction the ledger reports other details for, such as a withdrawal
+    stored before its fee was known, is corrected and its effects moved. Its timestamp
+    is kept, as for the primary token.
+
+    Returns:
+        True if the transaction is a new one
+    """
+    existing_tx = TokenTransaction[token_transaction_id(symbol, tx_id)]
+    if existing_tx:
+        old_details = (
+            existing_tx.kind,
+            existing_tx.principal_from,
+            existing_tx.principal_to,
+            existing_tx.amount,
+        )
+        if old_details != (kind, principal_from, principal_to, amount) or (
+            existing_tx.fee != fee
+        ):
+            logger.warning(
+                f"Correcting stored {symbol} transaction {tx_id} with the ledger's details"
+            )
+            balances = token_balances(symbol)
+            apply_transaction(
+                canister_id,
+                *old_details,
+                balances,
+                existing_tx.fee,
+                reverse=True,
+            )
+            existing_tx.kind = kind
+            existing_tx.principal_from = principal_from
+            existing_tx.principal_to = principal_to
+            existing_tx.amount = amount
+            existing_tx.fee = fee
+            apply_transaction(
+                canister_id,
+                kind,
+                principal_from,
+                principal_to,
+                amount,
+                balances,
+                fee,
+            )
+        return False
+
+    TokenTransaction(
+        _id=token_transaction_id(symbol, tx_id),
+        principal_from=principal_from,
+        principal_to=principal_to,
+        amount=amount,
+        fee=fee,
+        timestamp=timestamp,
+        kind=kind,
+    )
+    apply_transaction(
+        canister_id,
+        kind,
+        principal_from,
+        principal_to,
+        amount,
+        token_balances(symbol),
+        fee,
+    )
+    return True
+
+
+def _notify_subscribers(new_notifications=()):
+    """
+    Queues new transactions for the subscriptions they match, then runs a delivery round
+    (which also retries earlier batches). Errors are logged and never fail the caller.
+    """
+    try:
+        queue_notifications(list(new_notifications))
+        deliver_notifications(ic.time())
+    except Exception as e:
+        logger.error(f"Error notifying subscribers: {e}\n{traceback.format_exc()}")
+
+
+def _track_deposit_subaccounts(
+    canister_id, kind, principal_from, principal_to, amount, fee, deposit_owner
+):
+    """
+    Keeps the tokens held by the deposit subaccounts up to date with a new transaction:
+    a deposit credited to `deposit_owner` is added and marks its subaccount to be swept,
+    a sweep to the default account is subtracted with its fee.
+    """
+    app_data_obj = app_data()
+    if deposit_owner:
+        app_data_obj.deposit_subaccounts_balance = (
+            app_data_obj.deposit_subaccounts_balance + amount
+        )
+        deposit_account = DepositAccount[deposit_owner]
+        deposit_account.last_deposit_at = ic.time()
+        if not deposit_account.sweep_pending:
+            deposit_account.sweep_pending = True
+        mark_deposit_activity(deposit_owner, ic.time())
+    elif kind == "transfer" and canister_id == principal_from == principal_to:
+        app_data_obj.deposit_subaccounts_balance = (
+            app_data_obj.deposit_subaccounts_balance - amount - fee
+        )
+
+
+def _process_batch_txs(canister_id, txs, symbol=PRIMARY_TOKEN, deposit_owner=None):
+
+    category_rules = load_category_rules() if symbol == PRIMARY_TOKEN else []
+    processed_batch_oldest_tx_id = None
+    processed_batch_newest_tx_id = None
+    processed_tx_ids = []
+    inserted_new_txs_ids = []
+    new_notifications = []
+
+    logger.debug(f"Processing batch of {len(txs)} transactions")
+
+    for tx in txs:
+        try:
+            tx_id = int(tx["id"])
+            logger.debug(f"Processing transaction {tx_id}: {pformat(tx)}")
+
+            transaction = tx["transaction"]
+            timestamp = (
+                int(transaction["timestamp"]) if "timestamp" in transaction else 0
+            )
+            kind = transaction["kind"] if "kind" in transaction else "unknown"
+
+            # Initialize default values
+            principal_from = "unknown"
+            principal_to = "unknown"
+            amount = 0
+            fee = 0
+            memo = None
+            to_deposit_subaccount = False
+
+            # Handle different transaction types
+            if kind == "mint":
+                # For mint transactions, the recipient is this principal
+                principal_to = canister_id
+                principal_from = "mint"
+
+                if transaction.get("mint"):
+                    amount = int(transaction["mint"].get("amount", 0))
+                    memo = _memo_hex(transaction["mint"])
+
+                logger.debug(
+                    f"Processing mint transaction {tx_id} to {principal_to} with amount {amount}"
+                )
+
+            elif kind == "burn":
+                # For burn transactions, the sender is this principal
+                principal_from = canister_id
+                principal_to = "burn"
+
+                if transaction.get("burn"):
+                    amount = int(transaction["burn"].get("amount", 0))
+                    memo = _memo_hex(transaction["burn"])
+
+                logger.debug(
+                    f"Processing burn transaction {tx_id} from {principal_from} with amount {amount}"
+                )
+
+            elif "transfer" in transaction and transaction["transfer"]:
+                # Handle transfer transactions
+                transfer = transaction["transfer"]
+
+                # Get principals for from and to accounts
+                principal_from = (
+                    str(transfer["from_"]["owner"])
+                    if "from_" in transfer and "owner" in transfer["from_"]
+                    else "unknown"
+                )
+                principal_to = (
+                    str(transfer["to"]["owner"])
+                    if "to" in transfer and "owner" in transfer["to"]
+                    else "unknown"
+                )
+
+                if transaction.get("transfer"):
+                    amount = int(transaction["transfer"].get("amount", 0))
+                    fee = int(transaction["transfer"].get("fee") or 0)
+                    memo = _memo_hex(transaction["transfer"])
+
+                if (
+                    deposit_owner
+                    and principal_to == canister_id
+                    and list(transfer["to"].get("subaccount") or [])
+                    == deposit_subaccount(deposit_owner)
+                ):
+                    # Deposits to a deposit subaccount are credited to its owner,
+                    # whoever sent them
+                    principal_from = deposit_owner
+                    to_deposit_subaccount = True
+
+                logger.debug(
+                    f"Processing transfer transaction {tx_id} from {principal_from} to {principal_to} with amount {amount}"
+                )
+            else:
+                # Skip unknown transaction types
+                logger.debug(
+                    f"Skipping unknown transaction type: {kind} for tx {tx_id}"
+                )
+                continue
+
+            logger.debug(f"Processing transaction {tx_id}")
+
+            if symbol == PRIMARY_TOKEN:
+                is_new = _store_transaction(
+                    canister_id,
+                    tx_id,
+                    kind,
+                    principal_from,
+                    principal_to,
+                    amount,
+                    timestamp,
+                    memo,
+                    category_rules,
+                    fee,
+                )
+            else:
+                is_new = _store_token_transaction(
+                    symbol,
+                    canister_id,
+                    tx_id,
+                    kind,
+                    principal_from,
+                    principal_to,
+                    amount,
+                    timestamp,
+                    fee,
+                )
+            if is_new and symbol == PRIMARY_TOKEN:
+                _track_deposit_subaccounts(
+                    canister_id,
+                    kind,
+                    principal_from,
+                    principal_to,
+                    amount,
+                    fee,
+                    deposit_owner if to_deposit_subaccount else None,
+                )
+            if is_new:
+                inserted_new_txs_ids.append(tx_id)
+                new_notifications.append(
+                    notification(
+                        symbol,
+                        tx_id,
+                        timestamp,
+                        kind,
+                        principal_from,
+                        principal_to,
+                        amount,
+                    )
+                )
+
+            if not processed_batch_oldest_tx_id or processed_batch_oldest_tx_id > tx_id:
+                processed_batch_oldest_tx_id = tx_id
+            if not processed_batch_newest_tx_id or processed_batch_newest_tx_id < tx_id:
+                processed_batch_newest_tx_id = tx_id
+            processed_tx_ids.append(tx_id)
+
+        except Exception as e:
+            logger.error(
+                f"Error processing transaction {tx_id}: {e}\n {traceback.format_exc()}"
+            )
+
+    logger.debug(
+        f"Processed {len(processed_tx_ids)} transactions, from id {processed_batch_oldest_tx_id} to id {processed_batch_newest_tx_id}"
+    )
+    _notify_subscribers(new_notifications)
+    return (
+        processed_batch_oldest_tx_id,
+        processed_batch_newest_tx_id,
+        processed_tx_ids,
+        inserted_new_txs_ids,
+    )
+
+
+@query
+def get_balance(principal: Principal) -> Response:
+    """
+    Get the balance for a specific principal.
+
+    Args:
+        principal: The principal ID to check balance for
+
+    Returns:
+        Response object with success status, message, and balance data
+    """
+    try:
+        principal_id: str = principal.to_str()
+
+        logger.info(f"Getting balance for principal: {principal_id}")
+
+        # Look up the balance in the database
+        balance = Balance[principal_id]
+
+        # If no balance record exists, default to 0 (don't create a record)
+        balance_amount = balance.amount if balance else 0
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                Balance=BalanceRecord(
+                    principal_id=Principal.from_str(principal_id), amount=balance_amount
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(
+            f"Error getting balance for principal {principal_id}: {e}\n{traceback.format_exc()}"
+        )
+        return Response(
+            success=False, data=ResponseData(Error=f"Error getting balance: {str(e)}")
+        )
+
+
+@query
+def get_balances(principals: Vec[Principal]) -> Response:
+    """
+    Get the balances of several principals in a single call.
+
+    Args:
+        principals: The principals to check balances for (at most GET_BALANCES_MAX_PRINCIPALS)
+
+    Returns:
+        Response object with success status and the balances, in the order of `principals`
+        (principals without a balance record get a zero balance)
+    """
+    try:
+        if len(principals) > GET_BALANCES_MAX_PRINCIPALS:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"At most {GET_BALANCES_MAX_PRINCIPALS} principals can be queried at once"
+                ),
+            )
+
+        principal_ids = [principal.to_str() for principal in principals]
+        logger.info(f"Getting balances for {len(principal_ids)} principals")
+
+        # Look up each distinct principal once, in key order
+        amounts = {}
+        for principal_id in sorted(set(principal_ids)):
+            balance = Balance[principal_id]
+            amounts[principal_id] = balance.amount if balance else 0
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                Balances=[
+                    BalanceRecord(principal_id=principal, amount=amounts[principal_id])
+                    for principal, principal_id in zip(principals, principal_ids)
+                ]
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting balances: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Error getting balances: {str(e)}")
+        )
+
+
+def _balance_index_pending_response():
+    return Response(
+        success=False,
+        data=ResponseData(
+            Error="The balance index is being built, check job_status and try again later"
+        ),
+    )
+
+
+@query
+def get_top_balances(n: nat, ascending: Opt[bool]) -> Response:
+    """
+    Get the largest balances, or the smallest ones, from the amount-ordered balance index.
+
+    Args:
+        n: Number of balances to return (at most TOP_BALANCES_MAX)
+        ascending: Return the smallest balances first instead of the largest
+
+    Returns:
+        Response object with success status and the balances, in amount order
+    """
+    try:
+        if not balance_index_built():
+            return _balance_index_pending_response()
+        if n > TOP_BALANCES_MAX:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"At most {TOP_BALANCES_MAX} balances can be returned at once"
+                ),
+            )
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                Balances=[
+                    BalanceRecord(
+                        principal_id=Principal.from_str(principal_id), amount=amount
+                    )
+                    for principal_id, amount in top_balances(n, bool(ascending))
+                ]
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting top balances: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting top balances: {str(e)}"),
+        )
+
+
+@query
+def count_balances_above(threshold: int) -> Response:
+    """
+    Count the balances with an amount strictly greater than a threshold.
+
+    Args:
+        threshold: The amount to compare balances with
+
+    Returns:
+        Response object with success status and the number of balances
+    """
+    try:
+        if not balance_index_built():
+            return _balance_index_pending_response()
+
+        return Response(
+            success=True,
+            data=ResponseData(Count=count_above(threshold)),
+        )
+    except Exception as e:
+        logger.error(f"Error counting balances: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error counting balances: {str(e)}"),
+        )
+
+
+def _transaction_record(tx, principal_id):
+    """Builds the record of a transaction, with its amount signed from `principal_id`'s side."""
+    amount = int(tx.amount)
+    if tx.principal_from == principal_id:
+        amount = -amount  # Negative for sender (outgoing)
+    # Positive for recipient (incoming) - no change needed
+
+    return TransactionRecord(
+        id=int(tx._id),
+        amount=amount,
+        timestamp=int(tx.timestamp),
+        principal_from=Principal.from_str(tx.principal_from),
+        principal_to=Principal.from_str(tx.principal_to),
+        kind=tx.kind,
+    )
+
+
+@query
+def get_balance_at(
+    principal: Principal, tx_id: Opt[nat], timestamp: Opt[nat]
+) -> Response:
+    """
+    Get the balance of a principal at a point in its history.
+
+    The balance is computed from the stored transactions only: it starts from the nearest
+    balance checkpoint and replays the few transactions that follow it. It is not
+    available where those transactions are archived.
+
+    Args:
+        principal: The principal ID to get the balance for
+        tx_id: The balance is the one right after this ledger transaction id
+        timestamp: Alternatively, the balance is the one at this time (in nanoseconds)
+
+    Returns:
+        Response object with success status and the balance at that point
+    """
+    try:
+        principal_id = principal.to_str()
+
+        if (tx_id is None) == (timestamp is None):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="Exactly one of tx_id and timestamp must be provided"
+                ),
+            )
+
+        at_tx_id = tx_id
+        if timestamp is not None:
+
+            def load_timestamp(indexed_tx_id):
+                tx = VaultTransaction[str(indexed_tx_id)]
+                return tx.timestamp if tx else None
+
+            at_tx_id = last_transaction_id_at(
+                timestamp, BALANCE_AT_MAX_BUCKETS, load_timestamp
+            )
+            if at_tx_id is None:
+                return Response(
+                    success=False,
+                    data=ResponseData(
+                        Error=f"No transaction found in the {BALANCE_AT_MAX_BUCKETS} hours before timestamp {timestamp}, "
+                        "query by tx_id instead"
+                    ),
+                )
+
+        archive_end_tx_id = app_data().archive_end_tx_id
+        if replay_start(at_tx_id) < archive_end_tx_id:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Transactions below id {archive_end_tx_id} are archived, "
+                    f"the balance at transaction {at_tx_id} cannot be computed"
+                ),
+            )
+
+        amount = balance_at(ic.id().to_str(), principal_id, at_tx_id)
+        return Response(
+            success=True,
+            data=ResponseData(
+                Balance=BalanceRecord(principal_id=principal, amount=amount)
+            ),
+        )
+    except Exception as e:
+        logger.error(
+            f"Error getting historical balance for principal {principal.to_str()}: {e}\n{traceback.format_exc()}"
+        )
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting historical balance: {str(e)}"),
+        )
+
+
+@query
+def get_transactions(principal: Principal) -> Response:
+    """
+    Get all transactions associated with a specific principal.
+
+    Only the transactions kept in the vault are returned; older ones are read from the
+    archives listed by get_archives.
+
+    Args:
+        principal: The principal ID to get transactions for
+
+    Returns:
+        Response object with success status, message, and transactions data
+    """
+
+    try:
+        principal_id: str = principal.to_str()
+
+        logger.info(f"Getting transactions for principal: {principal_id}")
+
+        # Collect all transactions where this principal is involved
+        txs = []
+
+        for tx_id in entity_ids(VaultTransaction):
+            tx = VaultTransaction[tx_id]
+            logger.debug(f"Reading stored data for transaction {tx.to_dict()}")
+
+            # Skip transactions not related to this principal
+            if tx.principal_from != principal_id and tx.principal_to != principal_id:
+                continue
+
+            try:
+                tx_record = _transaction_record(tx, principal_id)
+                txs.append(tx_record)
+                logger.debug(f"Added transaction record: {tx_record}")
+            except Exception as e:
+                logger.error(f"Error creating transaction record: {e}")
+                # Continue with the next transaction
+
+        logger.info(f"Collected {len(txs)} transactions for principal {principal_id}")
+
+        # Sort transactions by timestamp (newest first)
+        if txs:
+            try:
+                txs.sort(key=lambda tx: tx["id"], reverse=True)
+                logger.debug("Successfully sorted transactions")
+            except Exception as e:
+                logger.error(f"Error sorting transactions: {e}")
+                # Continue without sorting if there's an error
+
+        return Response(
+            success=True,
+            data=ResponseData(Transactions=txs),
+        )
+    except Exception as e:
+        logger.error(
+            f"Error getting transactions for principal {principal_id}: {e}\n {traceback.format_exc()}"
+        )
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting transactions: {str(e)}"),
+        )
+
+
+@query
+def get_transactions_by_time(
+    principal: Opt[Principal],
+    start_ns: nat,
+    end_ns: nat,
+    cursor: Opt[TimeIndexCursor],
+    limit: Opt[nat],
+) -> Response:
+    """
+    Get a page of the transactions with a timestamp within [start_ns, end_ns].
+
+    Transactions are read from the time index, in ascending order of their hourly bucket
+    (and in sync order within a bucket), instead of scanning every stored transaction.
+    Transactions moved to an archive are not returned; the archives holding some of the
+    range are listed in every page instead.
+
+    Args:
+        principal: Optional principal ID to restrict the transactions to; amounts are
+            signed from its side, or from the vault's side if not provided
+        start_ns: Start of the time range in nanoseconds (inclusive)
+        end_ns: End of the time range in nanoseconds (inclusive)
+        cursor: The next_cursor of the previous page, or null for the first page
+        limit: Maximum number of transactions returned (at most max_results)
+
+    Returns:
+        Response object with success status and a page of transactions with the cursor of
+        the next page, which is null once the whole range has been returned, and the
+        archives to query for the archived part of the range
+    """
+    try:
+        if end_ns < start_ns:
+            return Response(
+                success=False,
+                data=ResponseData(Error="end_ns must not be lower than start_ns"),
+            )
+
+        max_results = app_data().max_results
+        page_limit = min(limit, max_results) if limit else max_results
+        principal_id = principal.to_str() if principal else ic.id().to_str()
+        scope = principal.to_str() if principal else VAULT_SCOPE
+
+        tx_ids, next_cursor = find_transaction_ids(
+            scope,
+            start_ns,
+            end_ns,
+            (cursor["bucket"], cursor["position"]) if cursor else None,
+            page_limit,
+            TIME_INDEX_MAX_BUCKETS_PER_QUERY,
+        )
+
+        txs = []
+        for tx_id in tx_ids:
+            tx = VaultTransaction[str(tx_id)]
+            # Index entries are only appended, so skip those no longer matching
+            # their transaction (e.g. deleted by a test mode reset)
+            if not tx or not start_ns <= tx.timestamp <= end_ns:
+                continue
+            if principal and principal_id not in (tx.principal_from, tx.principal_to):
+                continue
+
+            try:
+                txs.append(_transaction_record(tx, principal_id))
+            except Exception as e:
+                logger.error(f"Error creating transaction record: {e}")
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                TransactionsPage=TransactionsPageRecord(
+                    transactions=txs,
+                    next_cursor=(
+                        TimeIndexCursor(bucket=next_cursor[0], position=next_cursor[1])
+                        if next_cursor
+                        else None
+                    ),
+                    archived=[
+                        _archive_record(archive)
+                        for archive in archives_overlapping(start_ns, end_ns)
+                    ],
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(
+            f"Error getting transactions by time: {e}\n{traceback.format_exc()}"
+        )
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting transactions by time: {str(e)}"),
+        )
+
+
+@query
+def export_transactions(cursor: Opt[nat], max_bytes: Opt[nat]) -> Response:
+    """
+    Export the stored transactions in id order, as chunks of CBOR-encoded rows.
+
+    Each row is a CBOR array [version, id, timestamp, kind, principal_from,
+    principal_to, amount, fee]; a chunk is a concatenation of rows. Calling again with
+    next_cursor until it is null returns the whole history.
+
+    Args:
+        cursor: First transaction id to export (null to start from the beginning)
+        max_bytes: Maximum size of the chunk (defaults to and is capped at EXPORT_MAX_BYTES)
+
+    Returns:
+        Response object with success status and the chunk with the cursor of the next one
+    """
+    try:
+        chunk_max_bytes = (
+            min(max_bytes, EXPORT_MAX_BYTES) if max_bytes else EXPORT_MAX_BYTES
+        )
+
+        data, row_count, next_cursor = export_transactions_chunk(
+            lambda tx_id: VaultTransaction[str(tx_id)],
+            cursor or 0,
+            _max_transaction_id(),
+            chunk_max_bytes,
+            EXPORT_MAX_PROBES,
+        )
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                ExportChunk=ExportChunkRecord(
+                    data=data, row_count=row_count, next_cursor=next_cursor
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error exporting transactions: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error exporting transactions: {str(e)}"),
+        )
+
+
+@query
+def export_balances(cursor: Opt[nat], max_bytes: Opt[nat]) -> Response:
+    """
+    Export the balances, as chunks of CBOR-encoded rows [version, principal_id, amount].
+
+    Args:
+        cursor: Position of the first balance to export, in principal order (null to start)
+        max_bytes: Maximum size of the chunk (defaults to and is capped at EXPORT_MAX_BYTES)
+
+    Returns:
+        Response object with success status and the chunk with the cursor of the next one
+    """
+    try:
+        chunk_max_bytes = (
+            min(max_bytes, EXPORT_MAX_BYTES) if max_bytes else EXPORT_MAX_BYTES
+        )
+
+        data, row_count, next_cursor = export_balances_chunk(
+            cached_response("balance_ids"),
+            lambda principal_id: Balance[principal_id],
+            cursor or 0,
+            chunk_max_bytes,
+        )
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                ExportChunk=ExportChunkRecord(
+                    data=data, row_count=row_count, next_cursor=next_cursor
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error exporting balances: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error exporting balances: {str(e)}"),
+        )
+
+
+def _status_balances_and_canisters():
+    """Builds the balance and canister records listed by status()."""
+    balances = []
+    for balance_id in entity_ids(Balance):
+        balance = Balance[balance_id]
+        balances.append(
+            BalanceRecord(
+                principal_id=Principal.from_str(balance._id),
+                amount=balance.amount,
+            )
+        )
+
+    canisters = []
+    for canister in Canisters.instances():
+        canisters.append(
+            CanisterRecord(
+                id=canister._id,
+                principal=Principal.from_str(canister.principal),
+            )
+        )
+
+    return balances, canisters
+
+
+register_cached_response("status", _status_balances_and_canisters)
+register_cached_response("balance_ids", lambda: sorted(entity_ids(Balance)))
+
+
+@query
+def status() -> Response:
+    """
+    Get statistics about the vault's state including balances and canister references.
+
+    Returns:
+        Response object with success status, message, and stats data
+    """
+
+    try:
+        # Get app_data with proper typing
+        app_data_obj = app_data()
+        sync_status = _sync_status(app_data_obj)
+        sync_tx_id = app_data_obj.scan_oldest_tx_id
+
+        app_data_record = AppDataRecord(
+            admin_principal=Principal.from_str(app_data_obj.admin_principal),
+            max_results=app_data_obj.max_results,
+            max_iteration_count=app_data_obj.max_iteration_count,
+            scan_end_tx_id=app_data_obj.scan_end_tx_id,
+            scan_start_tx_id=app_data_obj.scan_start_tx_id,
+            scan_oldest_tx_id=app_data_obj.scan_oldest_tx_id,
+            sync_status=sync_status,
+            sync_tx_id=sync_tx_id,
+            sync_last_error=app_data_obj.sync_last_error or None,
+            sync_last_error_timestamp=app_data_obj.sync_last_error_timestamp,
+            sync_consecutive_failures=app_data_obj.sync_consecutive_failures,
+            sync_retry_after=app_data_obj.sync_retry_after,
+            sync_lease_owner=(
+                app_data_obj.sync_lease_owner
+                if _sync_lease_active(app_data_obj)
+                else None
+            ),
+            sync_lease_expires_at=app_data_obj.sync_lease_expires_at,
+        )
+
+        # Balances and canisters only change with the state version, unlike the sync status
+        balances, canisters = cached_response("status")
+
+        # Create stats record
+        stats = StatsRecord(
+            app_data=app_data_record,
+            balances=balances,
+            canisters=canisters,
+            reconciliation=_reconciliation_record(app_data_obj),
+        )
+
+        # Return response with stats
+        return Response(
+            success=True,
+            data=ResponseData(Stats=stats),
+        )
+
+    except Exception as e:
+        logger.error(
+            f"Error retrieving vault statistics: {e}\n{traceback.format_exc()}"
+        )
+        return Response(
+            success=False,
+            data=ResponseData(
+                Error=f"Error retrieving vault statistics: {traceback.format_exc()}"
+            ),
+        )
+
+
+@query
+def test_mode_status() -> Response:
+    """
+    Get data about the vault's test mode state.
+
+    Returns:
+        Response object with success status, message, and test mode data
+    """
+
+    try:
+        # Get app_data with proper typing
+        test_mode_data_obj = test_mode_data()
+
+        test_mode_record = TestModeRecord(
+            test_mode_enabled=test_mode_data_obj.test_mode_enabled,
+            tx_id=test_mode_data_obj.tx_id,
+        )
+
+        # Return response with stats
+        return Response(
+            success=True,
+            data=ResponseData(TestMode=test_mode_record),
+        )
+
+    except Exception as e:
+        logger.error(f"Error retrieving test mode data: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(
+                Error=f"Error retrieving test mode data: {traceback.format_exc()}"
+            ),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def set_admin(new_admin: Principal) -> Response:
+    """
+    Set a new admin principal for the vault.
+
+    This function can only be called by the current admin.
+
+    Args:
+        new_admin: The principal ID of the new admin
+
+    Returns:
+        Response object with success status and message
+    """
+    try:
+        current_admin = app_data().admin_principal
+        new_admin_id = new_admin.to_str()
+
+        logger.info(f"Changing admin principal from {current_admin} to {new_admin_id}")
+
+        # Update the admin_principal in app_data
+        app_data().admin_principal = new_admin_id
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                Message=f"Admin principal updated successfully to {new_admin_id}"
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error setting admin principal: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error setting admin principal: {str(e)}"),
+        )
+
+
+def _max_transaction_id():
+    """Returns the highest id a stored transaction can currently have."""
+    app_data_obj = app_data()
+    # The cursors cover transactions stored before max_stored_tx_id was kept
+    return max(
+        app_data_obj.max_stored_tx_id,
+        app_data_obj.scan_end_tx_id,
+        test_mode_data().tx_id - 1,
+    )
+
+
+def _raise_max_stored_tx_id(tx):
+    """
+    Transaction listener keeping max_stored_tx_id up to date. Deposits, withdrawals and
+    deposit subaccount syncs store transactions under ledger ids that can be above the
+    default account's sync cursor.
+    """
+    tx_id = int(tx._id)
+    app_data_obj = app_data()
+    if tx_id > app_data_obj.max_stored_tx_id:
+        app_data_obj.max_stored_tx_id = tx_id
+
+
+add_transaction_listener(_raise_max_stored_tx_id)
+
+
+def _swap_in_rebuilt_balances_chunk(job):
+    """
+    Replaces the next chunk of balances, in principal order, with their rebuilt amount.
+
+    Returns:
+        True once every balance has been replaced
+    """
+
+    def list_principal_ids():
+        return set(entity_ids(ShadowBalance)) | set(entity_ids(Balance))
+
+    principal_ids, done = next_ids(job, list_principal_ids, BALANCE_REBUILD_CHUNK_SIZE)
+    for principal_id in principal_ids:
+        # Principals without any replayed transaction end up with a zero balance
+        shadow = ShadowBalance[principal_id]
+        amount = shadow.amount if shadow else 0
+        balance = Balance[principal_id] or Balance(_id=principal_id, amount=0)
+        if balance.amount != amount:
+            logger.info(
+                f"Rebuilt balance for {principal_id}: {balance.amount} -> {amount}"
+            )
+            balance.amount = amount
+        if shadow:
+            shadow.delete()
+        job.cursor_key = principal_id
+    return done
+
+
+def _clear_shadow_balances_chunk(job):
+    """Deletes the next chunk of shadow balances. Returns True once none is left."""
+    shadow_ids, done = next_ids(
+        job, lambda: entity_ids(ShadowBalance), BALANCE_REBUILD_CHUNK_SIZE
+    )
+    for shadow_id in shadow_ids:
+        shadow = ShadowBalance[shadow_id]
+        if shadow:
+            shadow.delete()
+        job.cursor_key = shadow_id
+    return done
+
+
+def _start_rebuild_balances(job):
+    # Leftovers of a previous rebuild that did not complete are dropped first
+    job.phase = "clear"
+    job.cursor_key = ""
+    job.cursor = -1
+
+
+def _walk_transactions_chunk(job, max_tx_id, max_count, handle_tx):
+    """
+    Passes the stored transactions following the job's cursor, in id order, to `handle_tx`.
+
+    Ledger ids are sparse, so ids are probed one by one, at most
+    BALANCE_REBUILD_MAX_PROBES per call. The job's cursor is advanced past the last id probed.
+
+    Returns:
+        The number of transactions handled
+    """
+    tx_id = job.cursor
+    probes = 0
+    handled_count = 0
+
+    while (
+        tx_id < max_tx_id
+        and probes < BALANCE_REBUILD_MAX_PROBES
+        and handled_count < max_count
+    ):
+        tx_id += 1
+        probes += 1
+        tx = VaultTransaction[str(tx_id)]
+        if tx:
+            handle_tx(tx)
+            handled_count += 1
+
+    job.cursor = tx_id
+    return handled_count
+
+
+def _rebuild_balances_chunk(job):
+    """
+    Runs the next chunk of the rebuild: it clears leftover shadow balances, replays the
+    transactions into the shadow balances, swaps them in, then drops the shadow balances
+    of principals created by transactions synced during the swap.
+    """
+    if job.phase == "clear":
+        if _clear_shadow_balances_chunk(job):
+            job.phase = "replay"
+            job.cursor_key = ""
+        return False
+
+    if job.phase == "replay":
+        canister_id = ic.id().to_str()
+        max_tx_id = _max_transaction_id()
+
+        def replay(tx):
+            apply_transaction(
+                canister_id,
+                tx.kind,
+                tx.principal_from,
+                tx.principal_to,
+                tx.amount,
+                ShadowBalance,
+                tx.fee,
+            )
+
+        replayed_count = _walk_transactions_chunk(
+            job, max_tx_id, BALANCE_REBUILD_CHUNK_SIZE, replay
+        )
+        tx_id = job.cursor
+        job.cursor_end = max_tx_id
+        job.processed_count = job.processed_count + replayed_count
+        logger.debug(
+            f"Balance rebuild replayed {replayed_count} transactions up to id {tx_id}/{max_tx_id}"
+        )
+
+        if tx_id >= max_tx_id:
+            job.phase = "swap"
+        return False
+
+    if job.phase == "swap":
+        if _swap_in_rebuilt_balances_chunk(job):
+            job.phase = "cleanup"
+            job.cursor_key = ""
+        return False
+
+    # Principals created during the swap, after it listed the balances, may have been
+    # given a shadow balance; their balance already holds all of their transactions
+    return _clear_shadow_balances_chunk(job)
+
+
+def _cancel_rebuild_balances(job):
+    # The shadow table is dropped when the next rebuild starts
+    logger.info(f"Balance rebuild cancelled at tx id {job.cursor}")
+
+
+register_job_kind(
+    "rebuild_balances",
+    JobKind(
+        run_chunk=_rebuild_balances_chunk,
+        start=_start_rebuild_balances,
+        cancel=_cancel_rebuild_balances,
+    ),
+)
+
+
+def _start_build_time_index(job):
+    job.phase = "index"
+    job.cursor = -1
+
+
+def _build_time_index_chunk(job):
+    """Indexes the next chunk of transactions stored before the time index existed."""
+
+    def index(tx):
+        index_transaction(int(tx._id), tx.timestamp, tx.principal_from, tx.principal_to)
+
+    indexed_count = _walk_transactions_chunk(
+        job, job.cursor_end, TIME_INDEX_BUILD_CHUNK_SIZE, index
+    )
+    job.processed_count = job.processed_count + indexed_count
+
+    if job.cursor < job.cursor_end:
+        return False
+
+    mark_time_index_built()
+    return True
+
+
+register_job_kind(
+    TIME_INDEX_JOB_KIND,
+    JobKind(run_chunk=_build_time_index_chunk, start=_start_build_time_index),
+)
+
+
+def _start_build_balance_checkpoints(job):
+    job.phase = "record"
+    job.cursor = -1
+
+
+def _build_balance_checkpoints_chunk(job):
+    """Records the next chunk of transactions stored before the checkpoints existed."""
+    canister_id = ic.id().to_str()
+
+    def record(tx):
+        record_transaction(
+            canister_id,
+            int(tx._id),
+            tx.kind,
+            tx.principal_from,
+            tx.principal_to,
+            tx.amount,
+            tx.fee,
+        )
+
+    recorded_count = _walk_transactions_chunk(
+        job, job.cursor_end, BALANCE_CHECKPOINT_BUILD_CHUNK_SIZE, record
+    )
+    job.processed_count = job.processed_count + recorded_count
+
+    if job.cursor < job.cursor_end:
+        return False
+
+    mark_balance_checkpoints_built()
+    return True
+
+
+register_job_kind(
+    BALANCE_CHECKPOINTS_JOB_KIND,
+    JobKind(
+        run_chunk=_build_balance_checkpoints_chunk,
+        start=_start_build_balance_checkpoints,
+    ),
+)
+
+
+def _build_balance_index_chunk(job):
+    """Indexes the next chunk of balances stored before the index existed, in principal order."""
+    balance_ids, done = next_ids(
+        job, lambda: entity_ids(Balance), BALANCE_INDEX_BUILD_CHUNK_SIZE
+    )
+    for balance_id in balance_ids:
+        balance = Balance[balance_id]
+        # Changes to balances up to the cursor are indexed as they happen from now on
+        job.cursor_key = balance_id
+        if balance:
+            index_balance(balance_id, balance.amount)
+            job.processed_count = job.processed_count + 1
+
+    if not done:
+        return False
+
+    mark_balance_index_built()
+    return True
+
+
+register_job_kind(BALANCE_INDEX_JOB_KIND, JobKind(run_chunk=_build_balance_index_chunk))
+
+
+def _start_test_mode_reset(job):
+    job.phase = "transactions"
+    job.cursor = -1
+
+
+def _test_mode_reset_chunk(job):
+    """
+    Deletes mock transactions, clears the indexes built from them, then zeroes balances of
+    every token, a bounded chunk at a time.
+    """
+    if job.phase == "transactions":
+        tx_id = job.cursor
+        probes = 0
+        while tx_id < job.cursor_end and probes < TEST_MODE_RESET_CHUNK_SIZE:
+            tx_id += 1
+            probes += 1
+            tx = VaultTransaction[str(tx_id)]
+            if tx and tx.kind == "mock_transfer":
+                tx.delete()
+                log_transaction_deleted(tx_id)
+                job.processed_count = job.processed_count + 1
+        job.cursor = tx_id
+
+        if tx_id >= job.cursor_end:
+            job.phase = "time_index"
+            # Transactions other than mock ones are kept: once the time index and the
+            # balance checkpoints are cleared, they are indexed and recorded again
+            _queue_index_builds(job.cursor_end)
+        return False
+
+    if job.phase == "time_index":
+        if clear_time_index_chunk(TEST_MODE_RESET_CHUNK_SIZE):
+            job.phase = "balance_checkpoints"
+        return False
+
+    if job.phase == "balance_checkpoints":
+        if clear_balance_checkpoints_chunk(TEST_MODE_RESET_CHUNK_SIZE):
+            job.phase = "categories"
+        return False
+
+    if job.phase == "categories":
+        if clear_categories_chunk(TEST_MODE_RESET_CHUNK_SIZE):
+            job.phase = "token_transactions"
+        return False
+
+    if job.phase == "token_transactions":
+        if _reset_entities_chunk(job, TokenTransaction, _delete_mock_transaction):
+            job.phase = "token_balances"
+            job.cursor_key = ""
+        return False
+
+    if job.phase == "token_balances":
+        if _reset_entities_chunk(job, TokenBalance, _zero_balance):
+            job.phase = "balances"
+            job.cursor_key = ""
+        return False
+
+    return _reset_entities_chunk(job, Balance, _zero_balance)
+
+
+def _reset_entities_chunk(job, entity_cls, reset):
+    """Calls reset(entity) on the next chunk of entities of a type. Returns True once done."""
+    # Ids are strings, so walk them in sorted order from the last one reset
+    chunk_ids, done = next_ids(
+        job, lambda: entity_ids(entity_cls), TEST_MODE_RESET_CHUNK_SIZE
+    )
+    for entity_id in chunk_ids:
+        entity = entity_cls[entity_id]
+        if entity:
+            reset(entity)
+            job.processed_count = job.processed_count + 1
+        job.cursor_key = entity_id
+    return done
+
+
+def _delete_mock_transaction(tx):
+    if tx.kind == "mock_transfer":
+        tx.delete()
+
+
+def _zero_balance(balance):
+    if balance.amount != 0:
+        balance.amount = 0
+
+
+register_job_kind(
+    "test_mode_reset",
+    JobKind(run_chunk=_test_mode_reset_chunk, start=_start_test_mode_reset),
+)
+
+
+def _migrate_storage_chunk(job):
+    """Moves the next chunk of entities from the shared map to their own memory region."""
+    moved_count, done = db_storage.migrate_chunk(STORAGE_MIGRATION_CHUNK_SIZE)
+    job.processed_count = job.processed_count + moved_count
+    return done
+
+
+register_job_kind("migrate_storage", JobKind(run_chunk=_migrate_storage_chunk))
+
+
+def _count_storage_chunk(job):
+    """Counts the next chunk of entities of the shared map."""
+    counted_count, done = db_storage.count_chunk(STORAGE_COUNT_CHUNK_SIZE)
+    job.processed_count = job.processed_count + counted_count
+    return done
+
+
+register_job_kind("count_storage", JobKind(run_chunk=_count_storage_chunk))
+
+
+def _start_abort_snapshot_import(job):
+    job.phase = "transactions"
+    job.cursor = -1
+
+
+def _abort_snapshot_import_chunk(job):
+    """Deletes the next chunk of imported transactions, then of balances, and finally
+    returns the snapshot import to Idle."""
+    if job.phase == "transactions":
+
+        def delete(tx):
+            tx.delete()
+            log_transaction_deleted(int(tx._id))
+
+        deleted_count = _walk_transactions_chunk(
+            job, job.cursor_end, SNAPSHOT_ABORT_CHUNK_SIZE, delete
+        )
+        job.processed_count = job.processed_count + deleted_count
+
+        if job.cursor >= job.cursor_end:
+            job.phase = "balances"
+            job.cursor_key = ""
+        return False
+
+    # The vault had no transactions when the import started, so every balance is imported
+    balance_ids, done = next_ids(
+        job, lambda: entity_ids(Balance), SNAPSHOT_ABORT_CHUNK_SIZE
+    )
+    for balance_id in balance_ids:
+        balance = Balance[balance_id]
+        if balance:
+            balance.delete()
+            job.processed_count = job.processed_count + 1
+        job.cursor_key = balance_id
+
+    if not done:
+        return False
+
+    reset_snapshot_import(snapshot_import_data())
+    logger.info("Snapshot import aborted")
+    return True
+
+
+register_job_kind(
+    SNAPSHOT_ABORT_JOB_KIND,
+    JobKind(run_chunk=_abort_snapshot_import_chunk, start=_start_abort_snapshot_import),
+)
+
+
+@update
+@admin_only
+@mutates_state
+def rebuild_balances() -> Response:
+    """
+    Queue a job rebuilding all balances by replaying the stored transactions in id order.
+
+    The replay runs in bounded chunks into a shadow balance table. Once every transaction
+    has been replayed, the shadow balances replace the balances, a chunk at a time.
+
+    Returns:
+        Response object with success status and the queued job
+    """
+    try:
+        queued_rebuild = queued_job("rebuild_balances")
+        if queued_rebuild:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"A balance rebuild is already queued as job {queued_rebuild._id}"
+                ),
+            )
+
+        if app_data().archive_end_tx_id:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="Balances cannot be rebuilt once transactions are archived"
+                ),
+            )
+
+        job = create_job("rebuild_balances")
+        return Response(success=True, data=ResponseData(Job=job_record(job)))
+    except Exception as e:
+        logger.error(f"Error starting balance rebuild: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error starting balance rebuild: {str(e)}"),
+        )
+
+
+@query
+def job_status(job_id: Opt[nat] = None) -> Response:
+    """
+    Get the state and progress of a background job.
+
+    Args:
+        job_id: The id of the job, or None for the most recently created job
+
+    Returns:
+        Response object with success status and the job data
+    """
+    try:
+        job = get_job(job_id if job_id is not None else job_runner_data().last_job_id)
+        if not job:
+            return Response(
+                success=False, data=ResponseData(Error=f"Job {job_id} not found")
+            )
+
+        return Response(success=True, data=ResponseData(Job=job_record(job)))
+    except Exception as e:
+        logger.error(f"Error retrieving job status: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error retrieving job status: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def cancel_job(job_id: nat) -> Response:
+    """
+    Cancel a pending or running background job.
+
+    Args:
+        job_id: The id of the job to cancel
+
+    Returns:
+        Response object with success status and the cancelled job
+    """
+    try:
+        job = get_job(job_id)
+        if not job:
+            return Response(
+                success=False, data=ResponseData(Error=f"Job {job_id} not found")
+            )
+        if job.status not in ACTIVE_JOB_STATUSES:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Job {job_id} is already {job.status}"),
+            )
+
+        stop_job(job)
+        return Response(success=True, data=ResponseData(Job=job_record(job)))
+    except Exception as e:
+        logger.error(f"Error cancelling job {job_id}: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error cancelling job: {str(e)}"),
+        )
+
+
+def _category_record(name):
+    transactions_count, amount_in, amount_out = category_totals(name)
+    return CategoryRecord(
+        name=name,
+        transactions_count=transactions_count,
+        amount_in=amount_in,
+        amount_out=amount_out,
+    )
+
+
+def _category_rule_record(rule):
+    return CategoryRuleRecord(
+        id=int(rule._id),
+        category=rule.category,
+        counterparty=(
+            Principal.from_str(rule.counterparty) if rule.counterparty else None
+        ),
+        memo=bytes.fromhex(rule.memo) if rule.memo else None,
+        kind=rule.kind or None,
+    )
+
+
+def _category_rules_response():
+    return Response(
+        success=True,
+        data=ResponseData(
+            CategoryRules=[
+                _category_rule_record(CategoryRule[rule_id])
+                for rule_id in entity_ids(CategoryRule)
+            ]
+        ),
+    )
+
+
+def _update_tags(tx_ids, category, update_tag):
+    """Applies add_to_category or remove_from_category to stored transactions."""
+    if len(tx_ids) > CATEGORY_TAG_MAX_TRANSACTIONS:
+        return Response(
+            success=False,
+            data=ResponseData(
+                Error=f"At most {CATEGORY_TAG_MAX_TRANSACTIONS} transactions can be tagged at once"
+            ),
+        )
+    if not Category[category]:
+        return Response(
+            success=False, data=ResponseData(Error=f"Unknown category '{category}'")
+        )
+
+    transactions = [VaultTransaction[str(tx_id)] for tx_id in tx_ids]
+    missing_tx_ids = [tx_id for tx_id, tx in zip(tx_ids, transactions) if not tx]
+    if missing_tx_ids:
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Unknown transactions: {missing_tx_ids}"),
+        )
+
+    canister_id = ic.id().to_str()
+    for tx in transactions:
+        update_tag(canister_id, tx, category)
+
+    return Response(
+        success=True, data=ResponseData(Categories=[_category_record(category)])
+    )
+
+
+@update
+@admin_only
+@mutates_state
+def create_category(name: str) -> Response:
+    """
+    Create a category that transactions can be tagged with.
+
+    Args:
+        name: The category name, also used to refer to it
+
+    Returns:
+        Response object with success status and the new category
+    """
+    try:
+        if (
+            not name
+            or len(name) > CATEGORY_NAME_MAX_LENGTH
+            or any(char in name for char in RESERVED_CHARACTERS)
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Category names must have 1 to {CATEGORY_NAME_MAX_LENGTH} characters, "
+                    f"none of them {' '.join(RESERVED_CHARACTERS)}"
+                ),
+            )
+        if Category[name]:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Category '{name}' already exists"),
+            )
+
+        Category(_id=name, name=name)
+        logger.info(f"Created category '{name}'")
+        return Response(
+            success=True, data=ResponseData(Categories=[_category_record(name)])
+        )
+    except Exception as e:
+        logger.error(f"Error creating category: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error creating category: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def tag_transaction(tx_id: nat, category: str) -> Response:
+    """
+    Tag a stored transaction with a category.
+
+    Returns:
+        Response object with success status and the updated category totals
+    """
+    try:
+        return _update_tags([tx_id], category, add_to_category)
+    except Exception as e:
+        logger.error(f"Error tagging transaction: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error tagging transaction: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def tag_transactions(tx_ids: Vec[nat], category: str) -> Response:
+    """
+    Tag several stored transactions with a category. Nothing is tagged if any is unknown.
+
+    Returns:
+        Response object with success status and the updated category totals
+    """
+    try:
+        return _update_tags(tx_ids, category, add_to_category)
+    except Exception as e:
+        logger.error(f"Error tagging transactions: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error tagging transactions: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def untag_transaction(tx_id: nat, category: str) -> Response:
+    """
+    Remove a category from a transaction.
+
+    Returns:
+        Response object with success status and the updated category totals
+    """
+    try:
+        return _update_tags([tx_id], category, remove_from_category)
+    except Exception as e:
+        logger.error(f"Error untagging transaction: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error untagging transaction: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def add_category_rule(
+    category: str,
+    counterparty: Opt[Principal],
+    memo: Opt[blob],
+    kind: Opt[str],
+) -> Response:
+    """
+    Add a rule tagging the transactions synced from now on with a category.
+
+    A transaction matches if it matches every criterion set: it is sent or received by
+    `counterparty`, its memo is `memo`, and its kind is `kind`.
+
+    Returns:
+        Response object with success status and all the rules
+    """
+    try:
+        if not Category[category]:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Unknown category '{category}'"),
+            )
+        if counterparty is None and memo is None and kind is None:
+            return Response(
+                success=False,
+                data=ResponseData(Error="A rule needs at least one criterion"),
+            )
+
+        CategoryRule(
+            category=category,
+            counterparty=counterparty.to_str() if counterparty else "",
+            memo=bytes(memo).hex() if memo is not None else "",
+            kind=kind or "",
+        )
+        logger.info(f"Added rule for category '{category}'")
+        return _category_rules_response()
+    except Exception as e:
+        logger.error(f"Error adding category rule: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error adding category rule: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def remove_category_rule(rule_id: nat) -> Response:
+    """
+    Remove a category rule. Transactions it tagged keep their category.
+
+    Returns:
+        Response object with success status and the remaining rules
+    """
+    try:
+        rule = CategoryRule[str(rule_id)]
+        if not rule:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Unknown category rule {rule_id}"),
+            )
+        rule.delete()
+        return _category_rules_response()
+    except Exception as e:
+        logger.error(f"Error removing category rule: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error removing category rule: {str(e)}"),
+        )
+
+
+@query
+def get_category_rules() -> Response:
+    """Get the rules tagging synced transactions with categories."""
+    try:
+        return _category_rules_response()
+    except Exception as e:
+        logger.error(f"Error getting category rules: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting category rules: {str(e)}"),
+        )
+
+
+@query
+def get_categories() -> Response:
+    """
+    Get every category with the running totals of its transactions.
+
+    Returns:
+        Response object with success status and the categories
+    """
+    try:
+        return Response(
+            success=True,
+            data=ResponseData(
+                Categories=[_category_record(name) for name in entity_ids(Category)]
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting categories: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting categories: {str(e)}"),
+        )
+
+
+@query
+def get_category_transactions(
+    category: str, cursor: Opt[nat], limit: Opt[nat]
+) -> Response:
+    """
+    Get the transactions of a category, in the order they were tagged.
+
+    Args:
+        category: The category name
+        cursor: The next_cursor of the previous page (null for the first page)
+        limit: Maximum number of transactions returned (capped at CATEGORY_PAGE_MAX_RESULTS)
+
+    Returns:
+        Response object with success status and a page of transactions, with amounts
+        signed from the vault's side, and the ids of the archived transactions of the page
+    """
+    try:
+        if not Category[category]:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Unknown category '{category}'"),
+            )
+
+        page_limit = min(
+            limit or CATEGORY_PAGE_DEFAULT_RESULTS, CATEGORY_PAGE_MAX_RESULTS
+        )
+        tx_ids, next_cursor = category_transaction_ids(
+            category, cursor or 0, page_limit
+        )
+
+        canister_id = ic.id().to_str()
+        transactions = []
+        archived_tx_ids = []
+        for tx_id in tx_ids:
+            if is_archived(tx_id):
+                archived_tx_ids.append(tx_id)
+                continue
+            tx = VaultTransaction[str(tx_id)]
+            if tx:
+                transactions.append(_transaction_record(tx, canister_id))
+
+        return Response(
+            success=True,
+            data=ResponseData(
+                CategoryTransactionsPage=CategoryTransactionsPageRecord(
+                    transactions=transactions,
+                    next_cursor=next_cursor,
+                    archived_tx_ids=archived_tx_ids,
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(
+            f"Error getting category transactions: {e}\n{traceback.format_exc()}"
+        )
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error getting category transactions: {str(e)}"),
+        )
+
+
+def _archive_record(archive):
+    return ArchiveRecord(
+        archive=Principal.from_str(archive.principal),
+        transactions_count=archive.transactions_count,
+        first_tx_id=archive.first_tx_id if archive.first_tx_id >= 0 else None,
+        last_tx_id=archive.last_tx_id if archive.last_tx_id >= 0 else None,
+        min_timestamp=archive.min_timestamp,
+        max_timestamp=archive.max_timestamp,
+    )
+
+
+def _archives_response():
+    state = app_data()
+    return Response(
+        success=True,
+        data=ResponseData(
+            Archives=ArchivesRecord(
+                archives=[_archive_record(archive) for archive in archives()],
+                archive_end_tx_id=state.archive_end_tx_id,
+                archive_max_age_ns=state.archive_max_age_ns,
+                archive_below_tx_id=state.archive_below_tx_id,
+            )
+        ),
+    )
+
+
+@update
+@admin_only
+@mutates_state
+def add_archive(archive: Principal) -> Response:
+    """
+    Add an archive canister, which receives the transactions archived from now on.
+
+    The archive canister (src/archive) must be installed with this vault as its vault.
+    Another archive is only needed once the current one holds ARCHIVE_MAX_TRANSACTIONS.
+
+    Args:
+        archive: The principal ID of the archive canister
+
+    Returns:
+        Response object with success status and the archives
+    """
+    try:
+        archive_id = archive.to_str()
+        if any(existing.principal == archive_id for existing in archives()):
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Archive {archive_id} was already added"),
+            )
+
+        logger.info(f"Adding archive {archive_id}")
+        Archive(_id=str(len(entity_ids(Archive))), principal=archive_id)
+        return _archives_response()
+    except Exception as e:
+        logger.error(f"Error adding archive: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Error adding archive: {str(e)}")
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def set_archive_policy(max_age_ns: Opt[nat], below_tx_id: Opt[nat]) -> Response:
+    """
+    Set which transactions archive_transactions moves out of the vault.
+
+    Args:
+        max_age_ns: Transactions older than this (in nanoseconds) are archived, or null
+        below_tx_id: Transactions with an id below this are archived, or null
+
+    Returns:
+        Response object with success status and the archives
+    """
+    try:
+        state = app_data()
+        state.archive_max_age_ns = max_age_ns or 0
+        state.archive_below_tx_id = below_tx_id or 0
+        return _archives_response()
+    except Exception as e:
+        logger.error(f"Error setting archive policy: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error setting archive policy: {str(e)}"),
+        )
+
+
+@update
+@admin_only
+@mutates_state
+def archive_transactions() -> Async[Response]:
+    """
+    Move the next transactions matching the archiving policy to the current archive.
+
+    Up to ARCHIVE_BATCH_SIZE transactions are moved per call, oldest first, so the call
+    is repeated until it returns a count of 0. The vault deletes its copy of the
+    transactions only once the archive has stored them. Balances, the time index,
+    balance checkpoints and categories keep covering the archived transactions.
+
+    Returns:
+        Response object with success status and the number of transactions archived
+    """
+    try:
+        if not archive_policy_set():
+            return Response(
+                success=False,
+                data=ResponseData(Error="No archiving policy, call set_archive_policy"),
+            )
+        if _sync_status(app_data()) != "Synced":
+            # Transactions older than the sync cursors may still be stored
+            return Response(
+                success=False,
+                data=ResponseData(Error="Transaction history is still syncing"),
+            )
+
+        archive = current_archive()
+        if not archive:
+            return Response(
+                success=False,
+                data=ResponseData(Error="No archive canister, call add_archive"),
+            )
+        capacity = ARCHIVE_MAX_TRANSACTIONS - archive.transactions_count
+        if capacity <= 0:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Archive {archive.principal} is full, call add_archive"
+                ),
+            )
+
+        archive_id = archive._id
+        batch, end_tx_id = select_archive_batch(
+            _max_transaction_id(), ic.time(), min(ARCHIVE_BATCH_SIZE, capacity)
+        )
+        archive_status = {"transactions_count": archive.transactions_count}
+
+        if batch:
+            archive_canister = ArchiveCanister(Principal.from_str(archive.principal))
+            result: CallResult[ArchiveAppendResult] = (
+                yield archive_canister.append_transactions(batch)
+            )
+            if result.Err is not None:
+                logger.error(f"Archiving failed: {result.Err}")
+                return Response(
+                    success=False, data=ResponseData(Error=f"Call error: {result.Err}")
+                )
+            if result.Ok.get("Ok") is None:
+                return Response(
+                    success=False,
+                    data=ResponseData(Error=f"Archive error: {result.Ok.get('Err')}"),
+                )
+
+            archive_status = result.Ok["Ok"]
+            last_tx_id = archive_status.get("last_tx_id")
+            if last_tx_id is None or last_tx_id < batch[-1]["id"]:
+                return Response(
+                    success=False,
+                    data=ResponseData(
+                        Error=f"Archive did not store the batch, its last id is {last_tx_id}"
+                    ),
+                )
+
+        record_archived_batch(archive_id, batch, archive_status, end_tx_id)
+        return Response(success=True, data=ResponseData(Count=len(batch)))
+    except Exception as e:
+        logger.error(f"Error archiving transactions: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error archiving transactions: {str(e)}"),
+        )
+
+
+@query
+def get_archives() -> Response:
+    """
+    Get the archive canisters with the range of transactions each holds, and the
+    archiving policy.
+
+    Archived transactions are read with the archive's get_transactions query.
+
+    Returns:
+        Response object with success status and the archives
+    """
+    try:
+        return _archives_response()
+    except Exception as e:
+        logger.error(f"Error getting archives: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Error getting archives: {str(e)}")
+        )
+
+
+@query
+def get_changes_since(seq: nat, limit: Opt[nat]) -> Response:
+    """
+    Get the balance and transaction changes following a sequence number, so that an
+    off-chain mirror only pulls what changed since its last call.
+
+    A mirror starts from a full load, taken after reading last_seq with
+    get_changes_since(0, opt 0), then calls again with the seq of the last change it
+    applied. Changes are idempotent upserts (or deletions), so changes made during the
+    full load can safely be applied again. Only the primary token is covered.
+
+    Args:
+        seq: Sequence number of the last change applied by the caller (0 for none)
+        limit: Maximum number of changes returned (capped at CHANGE_FEED_MAX_RESULTS)
+
+    Returns:
+        Response object with success status and a page of changes; resync_required is
+        set when the changes following `seq` are no longer kept
+    """
+    try:
+        page_limit = min(
+            CHANGE_FEED_MAX_RESULTS if limit is None else limit,
+            CHANGE_FEED_MAX_RESULTS,
+        )
+        changes, resync_required = changes_since(seq, page_limit)
+        return Response(
+            success=True,
+            data=ResponseData(
+                ChangesPage=ChangesPageRecord(
+                    changes=changes,
+                    last_seq=last_seq(),
+                    first_seq=first_seq(),
+                    resync_required=resync_required,
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error getting changes: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Error getting changes: {str(e)}")
+        )
+
+
+def _subscription_record(subscription):
+    return SubscriptionRecord(
+        subscriber=Principal.from_str(subscription.subscriber),
+        method=subscription.method,
+        principal=(
+            Principal.from_str(subscription.principal)
+            if subscription.principal
+            else None
+        ),
+        min_amount=subscription.min_amount,
+        kind=subscription.kind or None,
+        since=subscription.since,
+        active=subscription.active,
+        pending=pending_count(subscription),
+        matched_count=subscription.matched_count,
+        delivered_count=subscription.delivered_count,
+        dropped_count=subscription.dropped_count,
+        consecutive_failures=subscription.consecutive_failures,
+        retry_after=subscription.retry_after,
+        last_error=subscription.last_error or None,
+    )
+
+
+@update
+@mutates_state
+def subscribe(
+    method: str, principal: Opt[Principal], min_amount: Opt[nat], kind: Opt[str]
+) -> Response:
+    """
+    Subscribe the calling canister to notifications of new transactions, so that it does
+    not have to poll the vault.
+
+    After each sync batch, deposit or mock transaction, the new transactions matching the
+    filter are sent to the caller's `method`, an update method taking a
+    NotificationBatchRecord, as one-way calls of at most NOTIFICATION_BATCH_SIZE
+    transactions. Only transactions made after the subscription are sent. Calling again
+    with the same method replaces the filter, and resumes a suspended subscription.
+
+    Args:
+        method: The caller's method receiving the notifications
+        principal: Only notify transactions from or to this principal
+        min_amount: Only notify transactions of at least this amount
+        kind: Only notify transactions of this kind (e.g. "transfer")
+
+    Returns:
+        Response object with success status and the subscription
+    """
+    try:
+        if not method or len(method) > NOTIFICATION_METHOD_MAX_LENGTH:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Method name must be 1 to {NOTIFICATION_METHOD_MAX_LENGTH} characters"
+                ),
             )
 
-    logger.debug(
-        f"Processed {len(processed_tx_ids)} transactions, from id {processed_batch_oldest_tx_id} to id {processed_batch_newest_tx_id}"
-    )
-    return (
-        processed_batch_oldest_tx_id,
-        processed_batch_newest_tx_id,
-        processed_tx_ids,
-        inserted_new_txs_ids,
-    )
+        subscriber = ic.caller().to_str()
+        sub_id = subscription_id(subscriber, method)
+        subscription = Subscription[sub_id]
+        if not subscription:
+            if len(entity_ids(Subscription)) >= NOTIFICATION_MAX_SUBSCRIPTIONS:
+                return Response(
+                    success=False,
+                    data=ResponseData(
+                        Error=f"At most {NOTIFICATION_MAX_SUBSCRIPTIONS} subscriptions can be registered"
+                    ),
+                )
+            logger.info(f"Subscribing {subscriber} to notifications with {method}")
+            subscription = Subscription(
+                _id=sub_id, subscriber=subscriber, method=method, since=ic.time()
+            )
+        elif not subscription.active:
+            logger.info(f"Resuming subscription {sub_id}")
+            subscription.active = True
+            subscription.consecutive_failures = 0
+            subscription.retry_after = 0
+            subscription.since = ic.time()
+
+        subscription.principal = principal.to_str() if principal else ""
+        subscription.min_amount = min_amount or 0
+        subscription.kind = kind or ""
+        return Response(
+            success=True,
+            data=ResponseData(Subscription=_subscription_record(subscription)),
+        )
+    except Exception as e:
+        logger.error(f"Error subscribing: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Error subscribing: {str(e)}")
+        )
 
 
-@query
-def get_balance(principal: Principal) -> Response:
+@update
+@mutates_state
+def unsubscribe(method: str, subscriber: Opt[Principal]) -> Response:
     """
-    Get the balance for a specific principal.
+    Remove a subscription, dropping its queued notifications.
 
     Args:
-        principal: The principal ID to check balance for
+        method: The method of the subscription
+        subscriber: The subscribed canister (defaults to the caller; only the admin can
+            remove the subscriptions of others)
 
     Returns:
-        Response object with success status, message, and balance data
+        Response object with success status and a message
     """
     try:
-        principal_id: str = principal.to_str()
+        caller = ic.caller().to_str()
+        subscriber_id = subscriber.to_str() if subscriber else caller
+        if subscriber_id != caller and caller != app_data().admin_principal:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Caller ({caller}) can only remove its own subscriptions"
+                ),
+            )
 
-        logger.info(f"Getting balance for principal: {principal_id}")
+        sub_id = subscription_id(subscriber_id, method)
+        subscription = Subscription[sub_id]
+        if not subscription:
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"No subscription {sub_id}"),
+            )
 
-        # Look up the balance in the database
-        balance = Balance[principal_id]
+        logger.info(f"Removing subscription {sub_id}")
+        clear_queue(subscription)
+        subscription.delete()
+        return Response(
+            success=True,
+            data=ResponseData(Message=f"Subscription {sub_id} removed"),
+        )
+    except Exception as e:
+        logger.error(f"Error unsubscribing: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False, data=ResponseData(Error=f"Error unsubscribing: {str(e)}")
+        )
 
-        # If no balance record exists, default to 0 (don't create a record)
-        balance_amount = balance.amount if balance else 0
 
+@query
+def get_subscriptions() -> Response:
+    """
+    Get the subscriptions to transaction notifications, with their delivery state.
+
+    Returns:
+        Response object with success status and the subscriptions
+    """
+    try:
         return Response(
             success=True,
             data=ResponseData(
-                Balance=BalanceRecord(
-                    principal_id=Principal.from_str(principal_id), amount=balance_amount
-                )
+                Subscriptions=[
+                    _subscription_record(subscription)
+                    for subscription in subscriptions()
+                ]
             ),
         )
     except Exception as e:
-        logger.error(
-            f"Error getting balance for principal {principal_id}: {e}\n{traceback.format_exc()}"
-        )
+        logger.error(f"Error getting subscriptions: {e}\n{traceback.format_exc()}")
         return Response(
-            success=False, data=ResponseData(Error=f"Error getting balance: {str(e)}")
+            success=False,
+            data=ResponseData(Error=f"Error getting subscriptions: {str(e)}"),
         )
 
 
 @query
-def get_transactions(principal: Principal) -> Response:
+@admin_only
+def storage_report() -> Response:
     """
-    Get all transactions associated with a specific principal.
+    Report the stable memory used by the vault: pages allocated, rows and approximate
+    bytes of every stable map and of every entity type, and how fast storage grows
+    according to recent syncs.
 
-    Args:
-        principal: The principal ID to get transactions for
+    Row counts come from the maps' lengths and from counts kept up to date on every
+    write, so the report does not scan any map. Sizes are approximate: every entry of a
+    stable map takes the map's maximum key and value sizes.
 
     Returns:
-        Response object with success status, message, and transactions data
+        Response object with success status and the storage report
     """
-
     try:
-        principal_id: str = principal.to_str()
+        regions = region_reports()
+        growth = growth_estimate(
+            ic.time(),
+            transactions_storage.len(),
+            sum(region["approx_bytes"] for region in regions),
+        )
+        return Response(
+            success=True,
+            data=ResponseData(
+                StorageReport=StorageReportRecord(
+                    stable_memory_pages=ic.stable64_size(),
+                    stable_memory_bytes=stable_memory_bytes(),
+                    stable_memory_capacity_bytes=STABLE_MEMORY_CAPACITY_BYTES,
+                    regions=[StorageRegionRecord(**region) for region in regions],
+                    entities=[
+                        EntityStorageRecord(**entity)
+                        for entity in entity_reports(db_storage, 1)
+                    ],
+                    entity_counts_complete=db_storage.shared_counts_complete(),
+                    transactions_per_day=growth["transactions_per_day"],
+                    bytes_per_day=growth["bytes_per_day"],
+                    days_until_full=growth["days_until_full"],
+                )
+            ),
+        )
+    except Exception as e:
+        logger.error(f"Error building storage report: {e}\n{traceback.format_exc()}")
+        return Response(
+            success=False,
+            data=ResponseData(Error=f"Error building storage report: {str(e)}"),
+        )
 
-        logger.info(f"Getting transactions for principal: {principal_id}")
 
-        # Collect all transactions where this principal is involved
-        txs = []
+def _queue_index_builds(max_tx_id):
+    """Queues the builds of the time index and balance checkpoints up to `max_tx_id`."""
+    if not queued_job(TIME_INDEX_JOB_KIND):
+        start_time_index_build(max_tx_id)
+        create_job(TIME_INDEX_JOB_KIND, cursor_end=max_tx_id)
+    if not queued_job(BALANCE_CHECKPOINTS_JOB_KIND):
+        start_balance_checkpoints_build(max_tx_id)
+        create_job(BALANCE_CHECKPOINTS_JOB_KIND, cursor_end=max_tx_id)
 
-        for tx in VaultTransaction.instances():
-            logger.debug(f"Reading stored data for transaction {tx.to_dict()}")
 
-            # Skip transactions not related to this principal
-            if tx.principal_from != principal_id and tx.principal_to != principal_id:
-                continue
+@update
+@admin_only
+@mutates_state
+def import_snapshot_start(source_vault: Principal) -> Response:
+    """
+    Start seeding this vault with a snapshot exported from another vault.
 
-            amount = int(tx.amount)
-            if tx.principal_from == principal_id:
-                amount = -amount  # Negative for sender (outgoing)
-            # Positive for recipient (incoming) - no change needed
+    The vault must not have synced any transaction yet, unless it is resuming an
+    interrupted import. Syncing is refused until import_snapshot_finish succeeds.
 
-            try:
-                tx_record = TransactionRecord(
-                    id=int(tx._id),
-                    amount=amount,
-                    timestamp=int(tx.timestamp),
-                    principal_from=Principal.from_str(tx.principal_from),
-                    principal_to=Principal.from_str(tx.principal_to),
-                    kind=tx.kind,
-                )
-                txs.append(tx_record)
-                logger.debug(f"Added transaction record: {tx_record}")
-            except Exception as e:
-                logger.error(f"Error creating transaction record: {e}")
-                # Continue with the next transaction
+    Args:
+        source_vault: The principal of the exporting vault; its balance and the
+            transactions to or from it are attributed to this vault
 
-        logger.info(f"Collected {len(txs)} transactions for principal {principal_id}")
+    Returns:
+        Response object with success status and the import progress
+    """
+    try:
+        snapshot = snapshot_import_data()
+        if snapshot.status == SNAPSHOT_IMPORT_ABORTING:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="The previous snapshot import is being aborted, try again later"
+                ),
+            )
+        if snapshot.status != SNAPSHOT_IMPORT_IN_PROGRESS and (
+            app_data().scan_end_tx_id or db_storage.partition_len("VaultTransaction")
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error="A snapshot can only be imported into a vault without transactions"
+                ),
+            )
+        if _sync_lease_active(app_data()):
+            return Response(
+                success=False,
+                data=ResponseData(Error="A sync is in progress, try again later"),
+            )
 
-        # Sort transactions by timestamp (newest first)
-        if txs:
-            try:
-                txs.sort(key=lambda tx: tx["id"], reverse=True)
-                logger.debug("Successfully sorted transactions")
-            except Exception as e:
-                logger.error(f"Error sorting transactions: {e}")
-                # Continue without sorting if there's an error
+        snapshot.status = SNAPSHOT_IMPORT_IN_PROGRESS
+        snapshot.source_vault = source_vault.to_str()
+        snapshot.transactions_count = 0
+        snapshot.balances_count = 0
+        snapshot.transactions_hash = ""
+        snapshot.balances_hash = ""
+        snapshot.started_at = ic.time()
+        snapshot.finished_at = 0
+        logger.info(f"Started snapshot import from vault {snapshot.source_vault}")
 
         return Response(
             success=True,
-            data=ResponseData(Transactions=txs),
+            data=ResponseData(SnapshotImport=snapshot_import_record(snapshot)),
         )
     except Exception as e:
-        logger.error(
-            f"Error getting transactions for principal {principal_id}: {e}\n {traceback.format_exc()}"
-        )
+        logger.error(f"Error starting snapshot import: {e}\n{traceback.format_exc()}")
         return Response(
             success=False,
-            data=ResponseData(Error=f"Error getting transactions: {str(e)}"),
+            data=ResponseData(Error=f"Error starting snapshot import: {str(e)}"),
         )
 
 
-@query
-def status() -> Response:
+@update
+@admin_only
+@mutates_state
+def import_snapshot_chunk(kind: str, data: blob, sha256: str) -> Response:
     """
-    Get statistics about the vault's state including balances and canister references.
+    Import one chunk of a snapshot, as returned by export_transactions or export_balances.
+
+    Chunks of each kind must be imported in export order: the hash of each kind is
+    chained over its chunks and checked by import_snapshot_finish.
+
+    Args:
+        kind: "transactions" or "balances"
+        data: The chunk, a CBOR sequence of exported rows
+        sha256: The hex SHA-256 of the chunk, checked before anything is imported
 
     Returns:
-        Response object with success status, message, and stats data
+        Response object with success status and the import progress
     """
-
     try:
-        # Get app_data with proper typing
-        app_data_obj = app_data()
-        sync_status = _sync_status(app_data_obj)
-        sync_tx_id = app_data_obj.scan_oldest_tx_id
-
-        app_data_record = AppDataRecord(
-            admin_principal=Principal.from_str(app_data_obj.admin_principal),
-            max_results=app_data_obj.max_results,
-            max_iteration_count=app_data_obj.max_iteration_count,
-            scan_end_tx_id=app_data_obj.scan_end_tx_id,
-            scan_start_tx_id=app_data_obj.scan_start_tx_id,
-            scan_oldest_tx_id=app_data_obj.scan_oldest_tx_id,
-            sync_status=sync_status,
-            sync_tx_id=sync_tx_id,
-        )
-
-        # Get balances with proper typing
-        balances = []
-        for balance in Balance.instances():
-            balances.append(
-                BalanceRecord(
-                    principal_id=Principal.from_str(balance._id),
-                    amount=balance.amount,
-                )
+        snapshot = snapshot_import_data()
+        if snapshot.status != SNAPSHOT_IMPORT_IN_PROGRESS:
+            return Response(
+                success=False,
+                data=ResponseData(Error="No snapshot import in progress"),
+            )
+        if kind not in (SNAPSHOT_KIND_TRANSACTIONS, SNAPSHOT_KIND_BALANCES):
+            return Response(
+                success=False,
+                data=ResponseData(Error=f"Unknown snapshot kind '{kind}'"),
+            )
+        if chunk_sha256(data) != sha256:
+            return Response(
+                success=False,
+                data=ResponseData(Error="Chunk hash mismatch, chunk not imported"),
             )
 
-        # Get canisters with proper typing
-        canisters = []
-        for canister in Canisters.instances():
-            canisters.append(
-                CanisterRecord(
-                    id=canister._id,
-                    principal=Principal.from_str(canister.principal),
-                )
+        rows = list(decode_rows(data))
+        if len(rows) > SNAPSHOT_IMPORT_MAX_ROWS:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Chunk has {len(rows)} rows, at most {SNAPSHOT_IMPORT_MAX_ROWS} are accepted"
+                ),
             )
 
-        # Create stats record
-        stats = StatsRecord(
-            app_data=app_data_record,
-            balances=balances,
-            canisters=canisters,
-        )
+        canister_id = ic.id().to_str()
+        if kind == SNAPSHOT_KIND_TRANSACTIONS:
+            last_tx_id = import_transaction_rows(
+                rows, snapshot.source_vault, canister_id
+            )
+            snapshot.last_tx_id = max(snapshot.last_tx_id, last_tx_id)
+            snapshot.transactions_count = snapshot.transactions_count + len(rows)
+            snapshot.transactions_hash = chain_hash(snapshot.transactions_hash, data)
+        else:
+            import_balance_rows(rows, snapshot.source_vault, canister_id)
+            snapshot.balances_count = snapshot.balances_count + len(rows)
+            snapshot.balances_hash = chain_hash(snapshot.balances_hash, data)
 
-        # Return response with stats
         return Response(
             success=True,
-            data=ResponseData(Stats=stats),
+            data=ResponseData(SnapshotImport=snapshot_import_record(snapshot)),
         )
-
     except Exception as e:
-        logger.error(
-            f"Error retrieving vault statistics: {e}\n{traceback.format_exc()}"
-        )
+        logger.error(f"Error importing snapshot chunk: {e}\n{traceback.format_exc()}")
         return Response(
             success=False,
-            data=ResponseData(
-                Error=f"Error retrieving vault statistics: {traceback.format_exc()}"
-            ),
+            data=ResponseData(Error=f"Error importing snapshot chunk: {str(e)}"),
         )
 
 
-@query
-def test_mode_status() -> Response:
+@update
+@admin_only
+@mutates_state
+def import_snapshot_finish(
+    transactions_hash: str,
+    balances_hash: str,
+    scan_end_tx_id: nat,
+    scan_start_tx_id: nat,
+    scan_oldest_tx_id: nat,
+) -> Response:
     """
-    Get data about the vault's test mode state.
+    Verify the imported snapshot and resume syncing from the exporting vault's cursors.
+
+    Args:
+        transactions_hash: Expected hash chain of the transaction chunks
+        balances_hash: Expected hash chain of the balance chunks
+        scan_end_tx_id: The exporting vault's scan_end_tx_id
+        scan_start_tx_id: The exporting vault's scan_start_tx_id
+        scan_oldest_tx_id: The exporting vault's scan_oldest_tx_id
 
     Returns:
-        Response object with success status, message, and test mode data
+        Response object with success status and the import progress
     """
-
     try:
-        # Get app_data with proper typing
-        test_mode_data_obj = test_mode_data()
+        snapshot = snapshot_import_data()
+        if snapshot.status != SNAPSHOT_IMPORT_IN_PROGRESS:
+            return Response(
+                success=False,
+                data=ResponseData(Error="No snapshot import in progress"),
+            )
+        if (
+            snapshot.transactions_hash != transactions_hash
+            or snapshot.balances_hash != balances_hash
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"Snapshot hash mismatch: imported transactions {snapshot.transactions_hash}, "
+                    f"balances {snapshot.balances_hash}"
+                ),
+            )
 
-        test_mode_record = TestModeRecord(
-            test_mode_enabled=test_mode_data_obj.test_mode_enabled,
-            tx_id=test_mode_data_obj.tx_id,
+        app_data_obj = app_data()
+        app_data_obj.scan_end_tx_id = scan_end_tx_id
+        app_data_obj.scan_start_tx_id = scan_start_tx_id
+        app_data_obj.scan_oldest_tx_id = scan_oldest_tx_id
+        if snapshot.last_tx_id >= test_mode_data().tx_id:
+            # Mock transactions created afterwards must not reuse imported ids
+            test_mode_data().tx_id = snapshot.last_tx_id + 1
+
+        # Imported transactions are indexed in the background
+        _queue_index_builds(_max_transaction_id())
+
+        snapshot.status = SNAPSHOT_IMPORT_COMPLETED
+        snapshot.finished_at = ic.time()
+        logger.info(
+            f"Snapshot import completed: {snapshot.transactions_count} transactions, "
+            f"{snapshot.balances_count} balances"
         )
 
-        # Return response with stats
         return Response(
             success=True,
-            data=ResponseData(TestMode=test_mode_record),
+            data=ResponseData(SnapshotImport=snapshot_import_record(snapshot)),
         )
-
     except Exception as e:
-        logger.error(f"Error retrieving test mode data: {e}\n{traceback.format_exc()}")
+        logger.error(f"Error finishing snapshot import: {e}\n{traceback.format_exc()}")
         return Response(
             success=False,
-            data=ResponseData(
-                Error=f"Error retrieving test mode data: {traceback.format_exc()}"
-            ),
+            data=ResponseData(Error=f"Error finishing snapshot import: {str(e)}"),
         )
 
 
 @update
 @admin_only
-def set_admin(new_admin: Principal) -> Response:
+@mutates_state
+def import_snapshot_abort() -> Response:
     """
-    Set a new admin principal for the vault.
-
-    This function can only be called by the current admin.
+    Abort an unfinished snapshot import, e.g. after import_snapshot_finish reported a
+    hash mismatch.
 
-    Args:
-        new_admin: The principal ID of the new admin
+    Queues a job deleting the imported transactions and balances in chunks, then returning
+    the import to Idle. Syncing and new imports are refused until the job is done.
 
     Returns:
-        Response object with success status and message
+        Response object with success status and the queued job
     """
     try:
-        current_admin = app_data().admin_principal
-        new_admin_id = new_admin.to_str()
-
-        logger.info(f"Changing admin principal from {current_admin} to {new_admin_id}")
-
-        # Update the admin_principal in app_data
-        app_data().admin_principal = new_admin_id
+        snapshot = snapshot_import_data()
+        if snapshot.status not in (
+            SNAPSHOT_IMPORT_IN_PROGRESS,
+            SNAPSHOT_IMPORT_ABORTING,
+        ):
+            return Response(
+                success=False,
+                data=ResponseData(Error="No snapshot import in progress"),
+            )
+        queued_abort = queued_job(SNAPSHOT_ABORT_JOB_KIND)
+        if queued_abort:
+            return Response(
+                success=False,
+                data=ResponseData(
+                    Error=f"The snapshot import is already being aborted by job {queued_abort._id}"
+                ),
+            )
 
-        return Response(
-            success=True,
-            data=ResponseData(
-                Message=f"Admin principal updated successfully to {new_admin_id}"
-            ),
-        )
+        snapshot.status = SNAPSHOT_IMPORT_ABORTING
+        job = create_job(SNAPSHOT_ABORT_JOB_KIND, cursor_end=snapshot.last_tx_id)
+        logger.info(f"Aborting snapshot import from vault {snapshot.source_vault}")
+        return Response(success=True, data=ResponseData(Job=job_record(job)))
     except Exception as e:
-        logger.error(f"Error setting admin principal: {e}\n{traceback.format_exc()}")
+        logger.error(f"Error aborting snapshot import: {e}\n{traceback.format_exc()}")
         return Response(
             success=False,
-            data=ResponseData(Error=f"Error setting admin principal: {str(e)}"),
+            data=ResponseData(Error=f"Error aborting snapshot import: {str(e)}"),
         )
 
 
 @update
 @test_mode_only
+@mutates_state
 def test_mode_set_mock_transaction(
     principal_from: Principal,
     principal_to: Principal,
     amount: nat,
     kind: str = "mock_transfer",
     timestamp: Opt[nat] = None,
+    fee: Opt[nat] = None,
 ) -> Response:
     try:
         logger.info(
@@ -924,8 +4877,14 @@ def test_mode_set_mock_transaction(
         )
 
         set_account_mock_transaction(
-            principal_from.to_str(), principal_to.to_str(), amount, kind, timestamp
+            principal_from.to_str(),
+            principal_to.to_str(),
+            amount,
+            kind,
+            timestamp,
+            fee or 0,
         )
+        _notify_subscribers()
         return Response(
             success=True,
             data=ResponseData(Message="Mock transaction set successfully"),
@@ -940,6 +4899,7 @@ def test_mode_set_mock_transaction(
 
 @update
 @test_mode_only
+@mutates_state
 def test_mode_set_balance(principal: Principal, amount: nat) -> Response:
     """
     Set a specific balance for a principal in test mode.
@@ -973,6 +4933,7 @@ def test_mode_set_balance(principal: Principal, amount: nat) -> Response:
 
 @update
 @test_mode_only
+@mutates_state
 def test_mode_reset() -> Response:
     """
     Reset test mode state (clear transactions and balances).
@@ -984,21 +4945,30 @@ def test_mode_reset() -> Response:
 
         logger.info("Resetting test mode state")
 
+        max_tx_id = _max_transaction_id()
+
         # Reset transaction ID
         test_mode_data().tx_id = 0
 
-        # Clear all transactions
-        for tx in VaultTransaction.instances():
-            if tx.kind == "mock_transfer":
-                tx.delete()
+        # Clearing transactions and balances runs as a job. Unless other jobs are
+        # queued, its first chunks run right away, which is enough for small states.
+        job = create_job("test_mode_reset", cursor_end=max_tx_id)
+        if current_job() == job:
+            for _ in range(TEST_MODE_RESET_INLINE_CHUNKS):
+                if job.status in ACTIVE_JOB_STATUSES:
+                    run_job_chunk(job)
 
-        # Reset all balances to 0
-        for balance in Balance.instances():
-            balance.amount = 0
+        if job.status == JOB_STATUS_COMPLETED:
+            return Response(
+                success=True,
+                data=ResponseData(Message="Test mode state reset successfully"),
+            )
 
         return Response(
             success=True,
-            data=ResponseData(Message="Test mode state reset successfully"),
+            data=ResponseData(
+                Message=f"Test mode state reset continues in background job {job._id}"
+            ),
         )
     except Exception as e:
         logger.error(f"Error resetting test mode: {e}\n{traceback.format_exc()}")
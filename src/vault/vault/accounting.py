@@ -0,0 +1,149 @@
+from typing import List, Tuple
+
+from kybra_simple_logging import get_logger
+
+from vault.entities import Balance, ShadowBalance
+from vault.jobs import running_job
+
+logger = get_logger(__name__)
+
+
+def transaction_effects(
+    canister_id: str,
+    kind: str,
+    principal_from: str,
+    principal_to: str,
+    amount: int,
+    fee: int = 0,
+) -> List[Tuple[str, int]]:
+    """
+    Lists the balance changes caused by a transaction.
+
+    user deposits in the vault => balance of user increases
+    vault transfers to user => balance of user decreases
+    vault pays a ledger fee => balance of the vault decreases by the fee as well
+    vault sweeps a deposit subaccount to its default account => only the fee is spent
+
+    Args:
+        canister_id: The principal ID of the vault canister
+        kind: The type of transaction ("mint", "burn", "transfer")
+        principal_from: The principal ID of the sender
+        principal_to: The principal ID of the recipient
+        amount: The amount of tokens transferred
+        fee: The ledger fee paid by the sender
+
+    Returns:
+        List of (principal ID, signed amount added to its balance)
+    """
+    effects = []
+
+    if kind == "mint":
+        # For mint, only update the recipient's balance
+        effects.append((principal_to, amount))
+
+    elif kind == "burn":
+        # For burn, only update the sender's balance
+        effects.append((principal_from, -amount))
+
+    elif kind == "transfer":
+        if canister_id == principal_from == principal_to:
+            # Between two accounts of the vault, the tokens stay in the vault
+            effects.append((canister_id, -fee))
+            return effects
+
+        if canister_id == principal_to:
+            # User depositing into vault
+            effects.append((principal_from, amount))
+            effects.append((canister_id, amount))
+
+        if canister_id == principal_from:
+            # Vault transferring to user, paying the fee from its own balance
+            effects.append((principal_to, -amount))
+            effects.append((canister_id, -amount - fee))
+
+    return effects
+
+
+def _apply_effects(effects: List[Tuple[str, int]], balance_cls) -> None:
+    for principal_id, delta in effects:
+        balance = balance_cls[principal_id] or balance_cls(_id=principal_id, amount=0)
+        balance.amount = balance.amount + delta
+        logger.debug(f"Updated balance for {principal_id} to {balance.amount}")
+
+
+def apply_transaction(
+    canister_id: str,
+    kind: str,
+    principal_from: str,
+    principal_to: str,
+    amount: int,
+    balance_cls=Balance,
+    fee: int = 0,
+    reverse: bool = False,
+) -> None:
+    """
+    Applies the effect of a transaction to the balances stored in `balance_cls`, or
+    with `reverse`, takes it back.
+
+    Args:
+        canister_id: The principal ID of the vault canister
+        kind: The type of transaction ("mint", "burn", "transfer")
+        principal_from: The principal ID of the sender
+        principal_to: The principal ID of the recipient
+        amount: The amount of tokens transferred
+        balance_cls: The balance entity to update (Balance, or ShadowBalance during a rebuild)
+        fee: The ledger fee paid by the sender
+        reverse: Whether to take back a transaction applied before
+    """
+    _apply_effects(
+        [
+            (principal_id, -delta if reverse else delta)
+            for principal_id, delta in transaction_effects(
+                canister_id, kind, principal_from, principal_to, amount, fee
+            )
+        ],
+        balance_cls,
+    )
+
+
+def apply_new_transaction(
+    canister_id: str,
+    tx_id: int,
+    kind: str,
+    principal_from: str,
+    principal_to: str,
+    amount: int,
+    fee: int = 0,
+    reverse: bool = False,
+) -> None:
+    """
+    Applies a newly stored transaction to the balances. With `reverse`, takes back a
+    transaction applied before, so that a corrected version of it can be applied.
+
+    If a balance rebuild is running, the transaction is also applied to the shadow
+    balances that will still be swapped in, so it is not lost: while replaying, when
+    the replay is already past `tx_id`; while swapping, for the principals following
+    the last one swapped in.
+    """
+    effects = [
+        (principal_id, -delta if reverse else delta)
+        for principal_id, delta in transaction_effects(
+            canister_id, kind, principal_from, principal_to, amount, fee
+        )
+    ]
+    _apply_effects(effects, Balance)
+
+    rebuild = running_job("rebuild_balances")
+    if not rebuild:
+        return
+    if rebuild.phase == "replay" and int(tx_id) <= rebuild.cursor:
+        _apply_effects(effects, ShadowBalance)
+    elif rebuild.phase == "swap":
+        _apply_effects(
+            [
+                (principal_id, delta)
+                for principal_id, delta in effects
+                if principal_id > rebuild.cursor_key
+            ],
+            ShadowBalance,
+        )
@@ -0,0 +1,135 @@
+from typing import List, Optional, Tuple
+
+from kybra_simple_logging import get_logger
+
+from vault.candid_types import StoredTransactionRecord
+from vault.constants import ARCHIVE_MAX_PROBES
+from vault.entities import Archive, VaultTransaction, app_data, entity_ids
+
+logger = get_logger(__name__)
+
+
+def archives() -> List[Archive]:
+    """Lists the archives in the order they were filled."""
+    return [Archive[archive_id] for archive_id in sorted(entity_ids(Archive), key=int)]
+
+
+def current_archive() -> Optional[Archive]:
+    """Returns the archive receiving the transactions archived next."""
+    ordered = archives()
+    return ordered[-1] if ordered else None
+
+
+def is_archived(tx_id: int) -> bool:
+    return int(tx_id) < app_data().archive_end_tx_id
+
+
+def archives_overlapping(start_ns: int, end_ns: int) -> List[Archive]:
+    """Lists the archives holding transactions with a timestamp within [start_ns, end_ns]."""
+    return [
+        archive
+        for archive in archives()
+        if archive.transactions_count
+        and archive.min_timestamp <= end_ns
+        and archive.max_timestamp >= start_ns
+    ]
+
+
+def archive_policy_set() -> bool:
+    state = app_data()
+    return bool(state.archive_max_age_ns or state.archive_below_tx_id)
+
+
+def select_archive_batch(
+    max_tx_id: int, now: int, max_count: int
+) -> Tuple[List[StoredTransactionRecord], int]:
+    """
+    Collects the oldest stored transactions that the archiving policy moves out.
+
+    Ledger ids are sparse, so ids are probed one by one from archive_end_tx_id, at most
+    ARCHIVE_MAX_PROBES per call. The walk stops at the first transaction the policy
+    keeps, so only a prefix of the history is ever archived.
+
+    Args:
+        max_tx_id: The highest id a stored transaction can currently have
+        now: The current time (in nanoseconds)
+        max_count: Maximum number of transactions collected
+
+    Returns:
+        Tuple of (transactions to archive, in id order, id the walk stopped at); every
+        stored transaction with an id below the latter is in the batch or archived
+    """
+    state = app_data()
+    below_tx_id = state.archive_below_tx_id or max_tx_id + 1
+    oldest_kept_timestamp = now - state.archive_max_age_ns
+    tx_id = state.archive_end_tx_id
+    probes = 0
+    batch = []
+
+    while (
+        tx_id <= max_tx_id
+        and tx_id < below_tx_id
+        and probes < ARCHIVE_MAX_PROBES
+        and len(batch) < max_count
+    ):
+        tx = VaultTransaction[str(tx_id)]
+        if tx:
+            if state.archive_max_age_ns and tx.timestamp > oldest_kept_timestamp:
+                break
+            batch.append(
+                StoredTransactionRecord(
+                    id=tx_id,
+                    timestamp=tx.timestamp,
+                    kind=tx.kind,
+                    principal_from=tx.principal_from,
+                    principal_to=tx.principal_to,
+                    amount=tx.amount,
+                    fee=tx.fee,
+                )
+            )
+        tx_id += 1
+        probes += 1
+
+    return batch, tx_id
+
+
+def record_archived_batch(
+    archive_id: str, batch: List[StoredTransactionRecord], archive_status, end_tx_id
+) -> None:
+    """
+    Records a batch accepted by an archive, then deletes the vault's copy.
+
+    Args:
+        archive_id: The id of the Archive entity the batch was sent to
+        batch: The transactions sent, as returned by select_archive_batch
+        archive_status: The ArchiveStatusRecord returned by the archive
+        end_tx_id: The id the walk of select_archive_batch stopped at
+    """
+    archive = Archive[archive_id]
+    had_transactions = archive.first_tx_id >= 0
+    archive.transactions_count = archive_status["transactions_count"]
+    if archive_status.get("first_tx_id") is not None:
+        archive.first_tx_id = archive_status["first_tx_id"]
+        archive.last_tx_id = archive_status["last_tx_id"]
+
+    if batch:
+        timestamps = [tx["timestamp"] for tx in batch]
+        archive.min_timestamp = (
+            min(archive.min_timestamp, *timestamps)
+            if had_transactions
+            else min(timestamps)
+        )
+        archive.max_timestamp = max(archive.max_timestamp, *timestamps)
+
+    for tx in batch:
+        stored_tx = VaultTransaction[str(tx["id"])]
+        if stored_tx:
+            stored_tx.delete()
+
+    state = app_data()
+    if end_tx_id > state.archive_end_tx_id:
+        state.archive_end_tx_id = end_tx_id
+    logger.info(
+        f"Archived {len(batch)} transactions to {archive.principal}, "
+        f"transactions below id {state.archive_end_tx_id} are archived"
+    )
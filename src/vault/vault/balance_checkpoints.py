@@ -0,0 +1,173 @@
+from kybra_simple_logging import get_logger
+
+from vault.accounting import transaction_effects
+from vault.constants import BALANCE_CHECKPOINT_INTERVAL, BALANCE_CHECKPOINT_LEVELS
+from vault.entities import VaultTransaction
+from vault.jobs import running_job
+
+logger = get_logger(__name__)
+
+# Keys recording whether transactions stored before the checkpoints existed are recorded
+BUILT_KEY = "_built"
+BUILD_END_KEY = "_build_end"
+
+BALANCE_CHECKPOINTS_JOB_KIND = "build_balance_checkpoints"
+
+_checkpoint_map = None
+
+
+def init_balance_checkpoints(stable_map) -> None:
+    """
+    Sets the stable map holding the balance checkpoints.
+
+    Transaction ids are grouped into intervals of BALANCE_CHECKPOINT_INTERVAL ids. For each
+    principal, the balance changes of every interval are kept in a sparse Fenwick tree:
+
+        "<principal>|<node>" -> sum of the balance changes of the intervals covered by node
+
+    The balance at the start of any interval is then the sum of at most
+    BALANCE_CHECKPOINT_LEVELS nodes. Transactions may be recorded in any order, which
+    matters because the sync stores pages from the newest transaction backwards.
+    """
+    global _checkpoint_map
+    _checkpoint_map = stable_map
+
+
+def _node_key(principal_id: str, node: int) -> str:
+    return f"{principal_id}|{node}"
+
+
+def _interval_of(tx_id: int) -> int:
+    interval = tx_id // BALANCE_CHECKPOINT_INTERVAL
+    if interval >= 1 << BALANCE_CHECKPOINT_LEVELS:
+        raise ValueError(f"Transaction id {tx_id} is beyond the checkpointed range")
+    return interval
+
+
+def _add(principal_id: str, interval: int, delta: int) -> None:
+    node = interval + 1
+    while node <= 1 << BALANCE_CHECKPOINT_LEVELS:
+        key = _node_key(principal_id, node)
+        current = _checkpoint_map.get(key)
+        _checkpoint_map.insert(key, str((int(current) if current else 0) + delta))
+        node += node & -node
+
+
+def _balance_before_interval(principal_id: str, interval: int) -> int:
+    balance = 0
+    node = interval
+    while node > 0:
+        value = _checkpoint_map.get(_node_key(principal_id, node))
+        if value:
+            balance += int(value)
+        node -= node & -node
+    return balance
+
+
+def record_transaction(
+    canister_id: str,
+    tx_id: int,
+    kind: str,
+    principal_from: str,
+    principal_to: str,
+    amount: int,
+    fee: int = 0,
+    reverse: bool = False,
+) -> None:
+    """
+    Adds the balance changes of a transaction to the checkpoints of its principals, or
+    with `reverse`, takes them back.
+    """
+    interval = _interval_of(int(tx_id))
+    for principal_id, delta in transaction_effects(
+        canister_id, kind, principal_from, principal_to, amount, fee
+    ):
+        _add(principal_id, interval, -delta if reverse else delta)
+
+
+def record_new_transaction(
+    canister_id: str,
+    tx_id: int,
+    kind: str,
+    principal_from: str,
+    principal_to: str,
+    amount: int,
+    fee: int = 0,
+    reverse: bool = False,
+) -> None:
+    """
+    Records a newly stored transaction, unless the checkpoint build still has to reach it.
+    With `reverse`, takes back a transaction recorded before.
+
+    While the checkpoints of an existing history are being built, transactions up to the
+    build's end are recorded by the build itself, so they are not counted twice.
+    """
+    if not balance_checkpoints_built():
+        build = running_job(BALANCE_CHECKPOINTS_JOB_KIND)
+        build_cursor = build.cursor if build else -1
+        if build_cursor < int(tx_id) <= balance_checkpoints_build_end():
+            return
+
+    record_transaction(
+        canister_id, tx_id, kind, principal_from, principal_to, amount, fee, reverse
+    )
+
+
+def replay_start(tx_id: int) -> int:
+    """Returns the first transaction id replayed by balance_at for `tx_id`."""
+    return _interval_of(tx_id) * BALANCE_CHECKPOINT_INTERVAL
+
+
+def balance_at(canister_id: str, principal_id: str, tx_id: int) -> int:
+    """
+    Computes the balance of a principal right after transaction `tx_id`.
+
+    Starts from the checkpointed balance at the beginning of the interval holding `tx_id`,
+    then replays the stored transactions of that interval up to `tx_id`.
+    """
+    interval = _interval_of(tx_id)
+    balance = _balance_before_interval(principal_id, interval)
+
+    for replayed_tx_id in range(replay_start(tx_id), tx_id + 1):
+        tx = VaultTransaction[str(replayed_tx_id)]
+        if not tx:
+            continue
+        for affected_principal_id, delta in transaction_effects(
+            canister_id,
+            tx.kind,
+            tx.principal_from,
+            tx.principal_to,
+            tx.amount,
+            tx.fee,
+        ):
+            if affected_principal_id == principal_id:
+                balance += delta
+
+    return balance
+
+
+def balance_checkpoints_built() -> bool:
+    return _checkpoint_map.get(BUILT_KEY) == "1"
+
+
+def balance_checkpoints_build_end() -> int:
+    end = _checkpoint_map.get(BUILD_END_KEY)
+    return int(end) if end else -1
+
+
+def mark_balance_checkpoints_built() -> None:
+    _checkpoint_map.insert(BUILT_KEY, "1")
+
+
+def start_balance_checkpoints_build(end_tx_id: int) -> None:
+    """Records that transactions up to `end_tx_id` are left to the checkpoint build."""
+    _checkpoint_map.insert(BUILD_END_KEY, str(end_tx_id))
+    _checkpoint_map.remove(BUILT_KEY)
+
+
+def clear_balance_checkpoints_chunk(max_keys: int) -> bool:
+    """Removes up to `max_keys` checkpoint nodes. Returns True once none are left."""
+    keys = [key for key in _checkpoint_map.keys() if not key.startswith("_")]
+    for key in keys[:max_keys]:
+        _checkpoint_map.remove(key)
+    return len(keys) <= max_keys
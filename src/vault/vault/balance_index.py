@@ -0,0 +1,229 @@
+from typing import List, Optional, Tuple
+
+from kybra_simple_logging import get_logger
+
+from vault.constants import BALANCE_INDEX_MAX_BITS
+from vault.jobs import running_job
+
+logger = get_logger(__name__)
+
+# Key recording whether the balances stored before the index existed are indexed
+BUILT_KEY = "_built"
+
+BALANCE_INDEX_JOB_KIND = "build_balance_index"
+
+# Amounts below this have a bucket of their own; larger ones share a bucket with the
+# amounts having the same bit length and the same top _MANTISSA_BITS bits
+_EXACT_LIMIT = 32
+_MANTISSA_BITS = 5
+_POSITIVE_BUCKETS = _EXACT_LIMIT + (BALANCE_INDEX_MAX_BITS - _MANTISSA_BITS) * (
+    _EXACT_LIMIT // 2
+)
+# Buckets of negative amounts mirror those of positive ones, numbered from 1
+_SIZE = 2 * _POSITIVE_BUCKETS - 1
+_LEVELS = _SIZE.bit_length()
+
+_index_map = None
+
+
+def init_balance_index(stable_map) -> None:
+    """
+    Sets the stable map holding the amount-ordered balance index.
+
+    Balances are grouped into buckets ordered by amount, using only point lookups:
+
+        "n|<node>"               -> number of balances in the buckets covered by a
+                                    Fenwick tree node, to find buckets by rank
+        "c|<bucket>"             -> number of balances in the bucket
+        "e|<bucket>|<position>"  -> "<principal>|<amount>"
+        "p|<principal>"          -> "<bucket>|<position>|<amount>"
+
+    Small amounts have exact buckets and larger ones buckets of about 1/16 of their
+    magnitude, so only the boundary buckets of a query need sorting.
+    """
+    global _index_map
+    _index_map = stable_map
+
+
+def _magnitude_bucket(amount: int) -> int:
+    if amount < _EXACT_LIMIT:
+        return amount
+    length = amount.bit_length()
+    if length > BALANCE_INDEX_MAX_BITS:
+        return _POSITIVE_BUCKETS - 1
+    mantissa = amount >> (length - _MANTISSA_BITS)
+    return (
+        _EXACT_LIMIT
+        + (length - _MANTISSA_BITS - 1) * (_EXACT_LIMIT // 2)
+        + mantissa
+        - _EXACT_LIMIT // 2
+    )
+
+
+def bucket_of(amount: int) -> int:
+    """Returns the bucket of an amount, from 1 (most negative) to _SIZE (largest)."""
+    signed = _magnitude_bucket(amount) if amount >= 0 else -_magnitude_bucket(-amount)
+    return signed + _POSITIVE_BUCKETS
+
+
+def _is_exact(bucket: int) -> bool:
+    return abs(bucket - _POSITIVE_BUCKETS) < _EXACT_LIMIT
+
+
+def _get_int(key: str) -> int:
+    value = _index_map.get(key)
+    return int(value) if value else 0
+
+
+def _fenwick_add(bucket: int, delta: int) -> None:
+    node = bucket
+    while node <= _SIZE:
+        key = f"n|{node}"
+        _index_map.insert(key, str(_get_int(key) + delta))
+        node += node & -node
+
+
+def _count_up_to(bucket: int) -> int:
+    """Number of balances in the buckets up to `bucket` (inclusive)."""
+    count = 0
+    node = bucket
+    while node > 0:
+        count += _get_int(f"n|{node}")
+        node -= node & -node
+    return count
+
+
+def _bucket_at_rank(rank: int) -> Tuple[int, int]:
+    """Returns (bucket, number of balances in the buckets before it) for a 0-based rank."""
+    node = 0
+    before = 0
+    for level in reversed(range(_LEVELS)):
+        next_node = node + (1 << level)
+        if next_node <= _SIZE:
+            count = _get_int(f"n|{next_node}")
+            if before + count <= rank:
+                node = next_node
+                before += count
+    return node + 1, before
+
+
+def _remove(principal_id: str, location: str) -> None:
+    bucket, position = (int(part) for part in location.split("|")[:2])
+    last_position = _get_int(f"c|{bucket}") - 1
+
+    if position != last_position:
+        # Move the last entry of the bucket into the freed position
+        moved = _index_map.get(f"e|{bucket}|{last_position}")
+        moved_principal_id, moved_amount = moved.split("|")
+        _index_map.insert(f"e|{bucket}|{position}", moved)
+        _index_map.insert(
+            f"p|{moved_principal_id}", f"{bucket}|{position}|{moved_amount}"
+        )
+
+    _index_map.remove(f"e|{bucket}|{last_position}")
+    _index_map.insert(f"c|{bucket}", str(last_position))
+    _index_map.remove(f"p|{principal_id}")
+    _fenwick_add(bucket, -1)
+
+
+def _append(principal_id: str, amount: int) -> None:
+    bucket = bucket_of(amount)
+    position = _get_int(f"c|{bucket}")
+    _index_map.insert(f"e|{bucket}|{position}", f"{principal_id}|{amount}")
+    _index_map.insert(f"c|{bucket}", str(position + 1))
+    _index_map.insert(f"p|{principal_id}", f"{bucket}|{position}|{amount}")
+    _fenwick_add(bucket, 1)
+
+
+def index_balance(principal_id: str, amount: Optional[int]) -> None:
+    """Records the current amount of a balance, or its deletion when `amount` is None."""
+    location = _index_map.get(f"p|{principal_id}")
+    if location is not None:
+        bucket, position, indexed_amount = (int(part) for part in location.split("|"))
+        if amount == indexed_amount:
+            return
+        if amount is not None and bucket_of(amount) == bucket:
+            _index_map.insert(f"e|{bucket}|{position}", f"{principal_id}|{amount}")
+            _index_map.insert(f"p|{principal_id}", f"{bucket}|{position}|{amount}")
+            return
+        _remove(principal_id, location)
+
+    if amount is not None:
+        _append(principal_id, amount)
+
+
+def on_balance_change(principal_id: str, amount: Optional[int]) -> None:
+    """
+    Keeps the index up to date with a saved or deleted balance.
+
+    While the index of existing balances is being built, balances the build has not
+    reached yet are left to it.
+    """
+    if not balance_index_built():
+        build = running_job(BALANCE_INDEX_JOB_KIND)
+        if not build or principal_id > (build.cursor_key or ""):
+            return
+
+    index_balance(principal_id, amount)
+
+
+def _bucket_entries(bucket: int, descending: bool) -> List[Tuple[str, int]]:
+    entries = []
+    for position in range(_get_int(f"c|{bucket}")):
+        principal_id, amount = _index_map.get(f"e|{bucket}|{position}").split("|")
+        entries.append((principal_id, int(amount)))
+    entries.sort(key=lambda entry: (entry[1], entry[0]), reverse=descending)
+    return entries
+
+
+def top_balances(n: int, ascending: bool = False) -> List[Tuple[str, int]]:
+    """
+    Lists the `n` largest balances (or smallest, if `ascending`) as (principal, amount).
+
+    Only the buckets holding the result are read. Ties are ordered by principal, except
+    within exact buckets, where the first entries found are returned as they are.
+    """
+    total = _count_up_to(_SIZE)
+    balances: List[Tuple[str, int]] = []
+    rank = 0 if ascending else total - 1
+
+    while len(balances) < n and 0 <= rank < total:
+        bucket, before = _bucket_at_rank(rank)
+        count = _get_int(f"c|{bucket}")
+        missing = n - len(balances)
+
+        if _is_exact(bucket):
+            entries = []
+            for position in range(min(count, missing)):
+                principal_id, amount = _index_map.get(f"e|{bucket}|{position}").split(
+                    "|"
+                )
+                entries.append((principal_id, int(amount)))
+        else:
+            entries = _bucket_entries(bucket, descending=not ascending)
+
+        balances.extend(entries[:missing])
+        rank = before + count if ascending else before - 1
+
+    return balances
+
+
+def count_above(threshold: int) -> int:
+    """Counts the balances with an amount strictly greater than `threshold`."""
+    bucket = bucket_of(threshold)
+    count = _count_up_to(_SIZE) - _count_up_to(bucket)
+    if not _is_exact(bucket):
+        count += sum(
+            1
+            for _, amount in _bucket_entries(bucket, descending=False)
+            if amount > threshold
+        )
+    return count
+
+
+def balance_index_built() -> bool:
+    return _index_map.get(BUILT_KEY) == "1"
+
+
+def mark_balance_index_built() -> None:
+    _index_map.insert(BUILT_KEY, "1")
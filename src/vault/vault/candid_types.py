@@ -50,6 +50,12 @@ class AppDataRecord(Record):
     scan_oldest_tx_id: nat
     sync_status: text
     sync_tx_id: nat
+    sync_last_error: Opt[text]
+    sync_last_error_timestamp: nat
+    sync_consecutive_failures: nat
+    sync_retry_after: nat
+    sync_lease_owner: Opt[text]
+    sync_lease_expires_at: nat
 
 
 class TestModeRecord(Record):
@@ -57,11 +63,27 @@ class TestModeRecord(Record):
     tx_id: nat
 
 
+# Outcome of the last reconciliation of the vault's balance against the ledger and indexer.
+# Drifts are signed: vault_drift = vault_balance - indexer_balance and
+# ledger_drift = ledger_balance - indexer_balance.
+class ReconciliationRecord(Record):
+    timestamp: nat
+    sync_tx_id: nat
+    ledger_balance: nat
+    indexer_balance: nat
+    vault_balance: int
+    vault_drift: int
+    ledger_drift: int
+    drift_detected: bool
+    error: Opt[text]
+
+
 # Statistics and state information for the application.
 class StatsRecord(Record):
     app_data: AppDataRecord
     balances: Vec[BalanceRecord]
     canisters: Vec[CanisterRecord]
+    reconciliation: Opt[ReconciliationRecord]
 
 
 # Simple record containing a transaction ID.
@@ -76,6 +98,112 @@ class TransactionSummaryRecord(Record):
     scan_end_tx_id: nat
 
 
+# State and progress of a background job.
+class JobRecord(Record):
+    id: nat
+    kind: text
+    status: text
+    phase: text
+    cursor: int
+    cursor_end: nat
+    processed_count: nat
+    created_at: nat
+    started_at: nat
+    updated_at: nat
+    finished_at: nat
+    error: Opt[text]
+
+
+# Position in the time index where a paginated time-range query continues.
+class TimeIndexCursor(Record):
+    bucket: nat
+    position: nat
+
+
+# An archive canister and the range of transactions moved to it.
+class ArchiveRecord(Record):
+    archive: Principal
+    transactions_count: nat
+    first_tx_id: Opt[nat]
+    last_tx_id: Opt[nat]
+    min_timestamp: nat
+    max_timestamp: nat
+
+
+# The archives of the vault with the archiving policy.
+class ArchivesRecord(Record):
+    archives: Vec[ArchiveRecord]
+    archive_end_tx_id: nat
+    archive_max_age_ns: nat
+    archive_below_tx_id: nat
+
+
+# A page of transactions, with the cursor of the next page if there is one, and the
+# archives holding transactions of the queried range that were moved out of the vault.
+class TransactionsPageRecord(Record):
+    transactions: Vec[TransactionRecord]
+    next_cursor: Opt[TimeIndexCursor]
+    archived: Vec[ArchiveRecord]
+
+
+# A page of the transactions of a category, with the cursor of the next page if there is
+# one. Transactions of the page moved to an archive are listed by id only.
+class CategoryTransactionsPageRecord(Record):
+    transactions: Vec[TransactionRecord]
+    next_cursor: Opt[nat]
+    archived_tx_ids: Vec[nat]
+
+
+# A category with the running totals of its transactions, from the vault's side.
+class CategoryRecord(Record):
+    name: text
+    transactions_count: nat
+    amount_in: nat
+    amount_out: nat
+
+
+# A rule tagging synced transactions with a category; unset criteria match anything.
+class CategoryRuleRecord(Record):
+    id: nat
+    category: text
+    counterparty: Opt[Principal]
+    memo: Opt[blob]
+    kind: Opt[text]
+
+
+# A token held by the vault, with its canisters, sync cursors and the vault's balance.
+class TokenRecord(Record):
+    symbol: text
+    ledger: Principal
+    indexer: Principal
+    scan_end_tx_id: nat
+    scan_start_tx_id: nat
+    scan_oldest_tx_id: nat
+    sync_status: text
+    sync_backlog: Opt[nat]
+    sync_last_error: Opt[text]
+    sync_retry_after: nat
+    vault_balance: int
+
+
+# A chunk of exported transactions: a CBOR sequence of rows in id order.
+class ExportChunkRecord(Record):
+    data: blob
+    row_count: nat
+    next_cursor: Opt[nat]
+
+
+# Progress of a snapshot import, with the hash chains of the chunks imported so far.
+class SnapshotImportRecord(Record):
+    status: text
+    transactions_count: nat
+    balances_count: nat
+    transactions_hash: text
+    balances_hash: text
+    started_at: nat
+    finished_at: nat
+
+
 # Container for a list of transaction records.
 class TransactionsListRecord(Record):
     transactions: Vec[TransactionRecord]
@@ -106,6 +234,17 @@ class TransferArg(Record):
     amount: nat
 
 
+# Arguments for ICRC-2 transfer_from operations.
+class TransferFromArgs(Record):
+    spender_subaccount: Opt[blob]
+    from_: Account
+    to: Account
+    amount: nat
+    fee: Opt[nat]
+    memo: Opt[blob]
+    created_at_time: Opt[nat64]
+
+
 # Transaction Types
 
 
@@ -194,6 +333,16 @@ class GenericErrorRecord(Record):
     message: str
 
 
+# Error when the allowance given to the spender does not cover the transfer.
+class InsufficientAllowanceRecord(Record):
+    allowance: nat
+
+
+# Error when the transfer was created after the ledger's current time.
+class CreatedInFutureRecord(Record):
+    ledger_time: nat64
+
+
 # ICRC-1 standard transfer error variants.
 class TransferError(Variant, total=False):
     BadFee: BadFeeRecord
@@ -212,6 +361,185 @@ class TransferResult(Variant, total=False):
     Err: TransferError
 
 
+# A stored transaction, with the principals as stored by the vault (a principal id, or
+# "mint" / "burn" for the ledger's own accounts).
+class StoredTransactionRecord(Record):
+    id: nat
+    timestamp: nat64
+    kind: text
+    principal_from: text
+    principal_to: text
+    amount: nat
+    fee: nat
+
+
+# The new amount of a balance.
+class BalanceChangeRecord(Record):
+    principal_id: text
+    amount: int
+
+
+# A change of the vault's state, as listed by the change feed.
+class ChangeData(Variant, total=False):
+    Balance: BalanceChangeRecord
+    BalanceDeleted: text
+    Transaction: StoredTransactionRecord
+    TransactionDeleted: nat
+
+
+# An entry of the change feed.
+class ChangeRecord(Record):
+    seq: nat
+    timestamp: nat64
+    change: ChangeData
+
+
+# A page of the change feed. When resync_required is set, changes following the
+# requested sequence number are no longer kept: the mirror must reload the whole state,
+# then follow the feed from last_seq as returned before reloading.
+class ChangesPageRecord(Record):
+    changes: Vec[ChangeRecord]
+    last_seq: nat
+    first_seq: nat
+    resync_required: bool
+
+
+# The range of transaction ids held by an archive canister.
+class ArchiveStatusRecord(Record):
+    vault: Principal
+    transactions_count: nat
+    first_tx_id: Opt[nat]
+    last_tx_id: Opt[nat]
+    first_timestamp: Opt[nat64]
+    last_timestamp: Opt[nat64]
+
+
+# Outcome of appending transactions to an archive canister.
+class ArchiveAppendResult(Variant, total=False):
+    Ok: ArchiveStatusRecord
+    Err: text
+
+
+# ICRC-2 transfer_from error variants.
+class TransferFromError(Variant, total=False):
+    BadFee: BadFeeRecord
+    BadBurn: BadBurnRecord
+    InsufficientFunds: InsufficientFundsRecord
+    InsufficientAllowance: InsufficientAllowanceRecord
+    TooOld: null
+    CreatedInFuture: CreatedInFutureRecord
+    Duplicate: DuplicateRecord
+    TemporarilyUnavailable: null
+    GenericError: GenericErrorRecord
+
+
+# ICRC-2 transfer_from result - either a success with the block index or an error.
+class TransferFromResult(Variant, total=False):
+    Ok: nat
+    Err: TransferFromError
+
+
+# The deposit subaccount of a principal, with the progress of its sync.
+class DepositAccountRecord(Record):
+    owner: Principal
+    account: Account
+    sync_status: text
+    scan_end_tx_id: nat
+    last_deposit_at: nat
+
+
+# A transaction pushed to a subscriber, with the token it belongs to.
+class NotificationRecord(Record):
+    token: text
+    id: nat
+    timestamp: nat64
+    kind: text
+    principal_from: text
+    principal_to: text
+    amount: nat
+
+
+# The argument of a subscriber's callback method. batch_seq grows by one with every batch
+# sent to the subscription; missed counts the notifications dropped since the previous
+# batch because the subscriber did not keep up.
+class NotificationBatchRecord(Record):
+    batch_seq: nat
+    missed: nat
+    notifications: Vec[NotificationRecord]
+
+
+# A subscription to transaction notifications, with its filter and delivery state.
+class SubscriptionRecord(Record):
+    subscriber: Principal
+    method: text
+    principal: Opt[Principal]
+    min_amount: nat
+    kind: Opt[text]
+    since: nat64
+    active: bool
+    pending: nat
+    matched_count: nat
+    delivered_count: nat
+    dropped_count: nat
+    consecutive_failures: nat
+    retry_after: nat64
+    last_error: Opt[text]
+
+
+# A stable map with its number of rows and approximate size in bytes.
+class StorageRegionRecord(Record):
+    name: text
+    memory_id: nat
+    rows: nat
+    approx_bytes: nat
+
+
+# The stored entities of one type, with the memory region holding them.
+class EntityStorageRecord(Record):
+    entity: text
+    memory_id: nat
+    rows: nat
+    approx_bytes: nat
+
+
+# Stable memory used by the vault, per region and per entity type, with the growth
+# estimated from recent syncs. days_until_full is null while nothing grows.
+class StorageReportRecord(Record):
+    stable_memory_pages: nat
+    stable_memory_bytes: nat
+    stable_memory_capacity_bytes: nat
+    regions: Vec[StorageRegionRecord]
+    entities: Vec[EntityStorageRecord]
+    entity_counts_complete: bool
+    transactions_per_day: nat
+    bytes_per_day: nat
+    days_until_full: Opt[nat]
+
+
+# A payout queued for the withdrawal timer. block_id is the ledger block of the transfer
+# once sent; fee is the fee set on the transfer (null for the ledger's default).
+class WithdrawalRecord(Record):
+    id: nat
+    token: text
+    principal: Principal
+    amount: nat
+    requested_by: Principal
+    status: text
+    attempts: nat
+    retry_after: nat64
+    block_id: Opt[nat]
+    fee: Opt[nat]
+    error: Opt[text]
+    created_at: nat64
+    finished_at: nat64
+
+
+# A page of withdrawals, newest first, with the cursor of the next page if there is one.
+class WithdrawalsPageRecord(Record):
+    withdrawals: Vec[WithdrawalRecord]
+    next_cursor: Opt[nat]
+
+
 # Response Types
 
 
@@ -220,11 +548,30 @@ class ResponseData(Variant, total=False):
     TransactionId: TransactionIdRecord
     TransactionSummary: TransactionSummaryRecord
     Balance: BalanceRecord
+    Balances: Vec[BalanceRecord]
+    Count: nat
+    CategoryTransactionsPage: CategoryTransactionsPageRecord
+    Categories: Vec[CategoryRecord]
+    CategoryRules: Vec[CategoryRuleRecord]
+    Tokens: Vec[TokenRecord]
+    DepositAccount: DepositAccountRecord
+    Archives: ArchivesRecord
+    ChangesPage: ChangesPageRecord
+    Subscription: SubscriptionRecord
+    Subscriptions: Vec[SubscriptionRecord]
+    StorageReport: StorageReportRecord
+    Withdrawal: WithdrawalRecord
+    WithdrawalsPage: WithdrawalsPageRecord
     Transactions: Vec[TransactionRecord]
     Stats: StatsRecord
     Error: str
     Message: str
     TestMode: TestModeRecord
+    Job: JobRecord
+    TransactionsPage: TransactionsPageRecord
+    Reconciliation: ReconciliationRecord
+    ExportChunk: ExportChunkRecord
+    SnapshotImport: SnapshotImportRecord
 
 
 # Standard API response with success flag and data payload.
@@ -256,6 +603,21 @@ class GetTransactionsResult(Variant):
     Err: str
 
 
+# Outcome of fetching a page of account transactions from the indexer.
+# Ok holds the page (which may be genuinely empty), Rejected holds the reason the
+# inter-canister call itself failed and IndexerError holds the Err returned by the indexer.
+class AccountTransactionsResult(Variant, total=False):
+    Ok: GetAccountTransactionsResponse
+    Rejected: str
+    IndexerError: str
+
+
+# Outcome of querying the ledger for an account balance.
+class LedgerBalanceResult(Variant, total=False):
+    Ok: nat
+    Err: str
+
+
 # Service Definitions
 
 
@@ -270,6 +632,17 @@ class ICRCLedger(Service):
     @service_update
     def icrc1_transfer(self, args: TransferArg) -> TransferResult: ...
 
+    @service_update
+    def icrc2_transfer_from(self, args: TransferFromArgs) -> TransferFromResult: ...
+
+
+# Interface for the archive canisters holding the cold transaction history.
+class ArchiveCanister(Service):
+    @service_update
+    def append_transactions(
+        self, transactions: Vec[StoredTransactionRecord]
+    ) -> ArchiveAppendResult: ...
+
 
 # Interface for the ICRC transaction indexer service.
 class ICRCIndexer(Service):
@@ -0,0 +1,180 @@
+from typing import List, Optional, Tuple
+
+from kybra_simple_logging import get_logger
+
+from vault.entities import CategoryRule, entity_ids
+
+logger = get_logger(__name__)
+
+# Characters reserved by the keys of the category index and of the entity storage
+RESERVED_CHARACTERS = ("|", ",", "@")
+
+_category_map = None
+
+
+def init_categories(stable_map) -> None:
+    """
+    Sets the stable map holding the category index.
+
+    For each category, the tagged transaction ids and running totals are kept so that
+    category queries never walk the transactions:
+
+        "c|<category>|count"            -> number of tagged transactions
+        "c|<category>|in"               -> sum of the amounts received by the vault
+        "c|<category>|out"              -> sum of the amounts sent by the vault
+        "c|<category>|#<position>"      -> transaction id
+        "c|<category>|@<transaction>"   -> position of the transaction
+        "t|<transaction>"               -> comma-separated categories of the transaction
+    """
+    global _category_map
+    _category_map = stable_map
+
+
+def _key(category: str, suffix: str) -> str:
+    return f"c|{category}|{suffix}"
+
+
+def _get_int(key: str) -> int:
+    value = _category_map.get(key)
+    return int(value) if value else 0
+
+
+def _add_int(key: str, delta: int) -> None:
+    _category_map.insert(key, str(_get_int(key) + delta))
+
+
+def _vault_flows(canister_id: str, tx) -> Tuple[int, int]:
+    """Returns the (in, out) amounts of a transaction from the vault's side."""
+    amount = int(tx.amount)
+    amount_in = amount if tx.principal_to == canister_id else 0
+    amount_out = amount if tx.principal_from == canister_id else 0
+    return amount_in, amount_out
+
+
+def transaction_categories(tx_id: int) -> List[str]:
+    categories = _category_map.get(f"t|{tx_id}")
+    return categories.split(",") if categories else []
+
+
+def add_to_category(canister_id: str, tx, category: str) -> bool:
+    """Adds a stored transaction to a category. Returns False if it was already in it."""
+    tx_id = int(tx._id)
+    if _category_map.get(_key(category, f"@{tx_id}")) is not None:
+        return False
+
+    position = _get_int(_key(category, "count"))
+    _category_map.insert(_key(category, f"#{position}"), str(tx_id))
+    _category_map.insert(_key(category, f"@{tx_id}"), str(position))
+    _category_map.insert(_key(category, "count"), str(position + 1))
+
+    amount_in, amount_out = _vault_flows(canister_id, tx)
+    _add_int(_key(category, "in"), amount_in)
+    _add_int(_key(category, "out"), amount_out)
+
+    _category_map.insert(
+        f"t|{tx_id}", ",".join(transaction_categories(tx_id) + [category])
+    )
+    return True
+
+
+def remove_from_category(canister_id: str, tx, category: str) -> bool:
+    """Removes a transaction from a category. Returns False if it was not in it."""
+    tx_id = int(tx._id)
+    position = _category_map.get(_key(category, f"@{tx_id}"))
+    if position is None:
+        return False
+
+    # Move the last transaction of the category into the freed position
+    last_position = _get_int(_key(category, "count")) - 1
+    if int(position) != last_position:
+        moved_tx_id = _category_map.get(_key(category, f"#{last_position}"))
+        _category_map.insert(_key(category, f"#{position}"), moved_tx_id)
+        _category_map.insert(_key(category, f"@{moved_tx_id}"), position)
+    _category_map.remove(_key(category, f"#{last_position}"))
+    _category_map.remove(_key(category, f"@{tx_id}"))
+    _category_map.insert(_key(category, "count"), str(last_position))
+
+    amount_in, amount_out = _vault_flows(canister_id, tx)
+    _add_int(_key(category, "in"), -amount_in)
+    _add_int(_key(category, "out"), -amount_out)
+
+    remaining = [c for c in transaction_categories(tx_id) if c != category]
+    if remaining:
+        _category_map.insert(f"t|{tx_id}", ",".join(remaining))
+    else:
+        _category_map.remove(f"t|{tx_id}")
+    return True
+
+
+def category_totals(category: str) -> Tuple[int, int, int]:
+    """Returns (number of transactions, amount in, amount out) of a category."""
+    return (
+        _get_int(_key(category, "count")),
+        _get_int(_key(category, "in")),
+        _get_int(_key(category, "out")),
+    )
+
+
+def category_transaction_ids(
+    category: str, cursor: int, limit: int
+) -> Tuple[List[int], Optional[int]]:
+    """
+    Lists the transactions of a category in tagging order, from position `cursor`.
+
+    Untagging moves the last transaction of the category into the freed position.
+
+    Returns:
+        Tuple of (transaction ids, cursor of the next page or None if there is none)
+    """
+    count = _get_int(_key(category, "count"))
+    end = min(cursor + limit, count)
+    tx_ids = [
+        int(_category_map.get(_key(category, f"#{position}")))
+        for position in range(cursor, end)
+    ]
+    return tx_ids, end if end < count else None
+
+
+def load_category_rules() -> List[CategoryRule]:
+    return [CategoryRule[rule_id] for rule_id in entity_ids(CategoryRule)]
+
+
+def rule_matches(rule: CategoryRule, tx, memo: Optional[str]) -> bool:
+    """Checks a transaction against every criterion set on a rule."""
+    if rule.counterparty and rule.counterparty not in (
+        tx.principal_from,
+        tx.principal_to,
+    ):
+        return False
+    if rule.memo and rule.memo != memo:
+        return False
+    if rule.kind and rule.kind != tx.kind:
+        return False
+    return True
+
+
+def categorize_new_transaction(
+    canister_id: str, tx, memo: Optional[str], rules: List[CategoryRule]
+) -> None:
+    """
+    Tags a newly stored transaction with the categories of the rules it matches.
+
+    Args:
+        canister_id: The principal ID of the vault canister
+        tx: The stored VaultTransaction
+        memo: The transaction memo as a hex string, if it has one
+        rules: The rules to apply, as returned by load_category_rules
+    """
+    for rule in rules:
+        if rule_matches(rule, tx, memo) and add_to_category(
+            canister_id, tx, rule.category
+        ):
+            logger.debug(f"Tagged transaction {tx._id} with category {rule.category}")
+
+
+def clear_categories_chunk(max_keys: int) -> bool:
+    """Removes up to `max_keys` index entries. Returns True once the index is empty."""
+    keys = list(_category_map.keys())
+    for key in keys[:max_keys]:
+        _category_map.remove(key)
+    return len(keys) <= max_keys
@@ -0,0 +1,103 @@
+import json
+from typing import List, Optional, Tuple
+
+from kybra import ic
+from kybra_simple_logging import get_logger
+
+from vault.constants import CHANGE_LOG_MAX_ENTRIES
+
+logger = get_logger(__name__)
+
+_change_map = None
+
+
+def init_change_log(stable_map) -> None:
+    """
+    Sets the stable map holding the change feed.
+
+    Every change of a balance or transaction is appended with the next sequence number,
+    and only the last CHANGE_LOG_MAX_ENTRIES changes are kept:
+
+        "last"      -> sequence number of the last change (0 before any change)
+        "first"     -> sequence number of the oldest change kept
+        "#<seq>"    -> {"seq", "timestamp", "change"} as JSON
+    """
+    global _change_map
+    _change_map = stable_map
+
+
+def _get_int(key: str, default: int) -> int:
+    value = _change_map.get(key)
+    return int(value) if value else default
+
+
+def last_seq() -> int:
+    return _get_int("last", 0)
+
+
+def first_seq() -> int:
+    return _get_int("first", 1)
+
+
+def log_change(change: dict) -> None:
+    """Appends a change (a ChangeData variant), dropping the oldest one if the log is full."""
+    seq = last_seq() + 1
+    _change_map.insert(
+        f"#{seq}", json.dumps({"seq": seq, "timestamp": ic.time(), "change": change})
+    )
+    _change_map.insert("last", str(seq))
+
+    first = first_seq()
+    if seq - first >= CHANGE_LOG_MAX_ENTRIES:
+        _change_map.remove(f"#{first}")
+        _change_map.insert("first", str(first + 1))
+
+
+def log_balance_change(principal_id: str, amount: Optional[int]) -> None:
+    """Balance listener logging the new amount of a balance, or its deletion."""
+    if amount is None:
+        log_change({"BalanceDeleted": principal_id})
+    else:
+        log_change({"Balance": {"principal_id": principal_id, "amount": amount}})
+
+
+def log_transaction_change(tx) -> None:
+    """Transaction listener logging a stored or updated transaction."""
+    log_change(
+        {
+            "Transaction": {
+                "id": int(tx._id),
+                "timestamp": tx.timestamp,
+                "kind": tx.kind,
+                "principal_from": tx.principal_from,
+                "principal_to": tx.principal_to,
+                "amount": tx.amount,
+                "fee": tx.fee,
+            }
+        }
+    )
+
+
+def log_transaction_deleted(tx_id: int) -> None:
+    log_change({"TransactionDeleted": int(tx_id)})
+
+
+def changes_since(seq: int, limit: int) -> Tuple[List[dict], bool]:
+    """
+    Lists up to `limit` changes following sequence number `seq`, in order.
+
+    Returns:
+        Tuple of (changes, whether the mirror must reload the whole state, in which case
+        no changes are returned): changes following `seq` were dropped, or `seq` is
+        ahead of the log (e.g. the vault was reinstalled)
+    """
+    if seq + 1 < first_seq() or seq > last_seq():
+        return [], True
+
+    end = min(seq + limit, last_seq())
+    changes = [json.loads(_change_map.get(f"#{n}")) for n in range(seq + 1, end + 1)]
+    for change in changes:
+        # Transactions logged before fees were recorded have none
+        if "Transaction" in change["change"]:
+            change["change"]["Transaction"].setdefault("fee", 0)
+    return changes, False
@@ -3,6 +3,7 @@
 # Dictionary of canister principal IDs implementing Chain-Key tokens in the IC
 # Each token has a corresponding ledger canister for token operations
 # and an indexer canister for transaction history and queries
+# The first token is the vault's primary token; others are added with register_token
 CANISTER_PRINCIPALS = {
     "ckBTC": {
         "ledger": "mxzaz-hqaaa-aaaar-qaada-cai",
@@ -17,3 +18,198 @@ MAX_RESULTS = 20
 # Maximum number of iterations for operations that process data in batches
 # Prevents infinite loops and excessive resource consumption
 MAX_ITERATION_COUNT = 5
+
+# Maximum number of failed indexer fetches retried within a single sync call
+# Each retry also consumes one iteration of the max_iteration_count budget
+SYNC_MAX_RETRIES = 2
+
+# Base and maximum delay (in nanoseconds) of the exponential backoff applied
+# between sync calls after consecutive indexer failures
+SYNC_BACKOFF_BASE_NS = 1_000_000_000
+SYNC_BACKOFF_MAX_NS = 300_000_000_000
+
+# Duration (in nanoseconds) of the lease held by a running sync
+# The lease is renewed after every batch, so it only expires if a sync call dies mid-way
+SYNC_LEASE_DURATION_NS = 120_000_000_000
+
+# Maximum number of stored transactions replayed per message by the balance rebuild
+BALANCE_REBUILD_CHUNK_SIZE = 500
+
+# Maximum number of transaction ids looked up per message by the balance rebuild
+# Ledger ids are sparse, so most lookups may hit ids that are not vault transactions
+BALANCE_REBUILD_MAX_PROBES = 5000
+
+# Maximum number of transaction ids or balances handled per message by the test mode reset
+TEST_MODE_RESET_CHUNK_SIZE = 2000
+
+# Number of test mode reset chunks run directly within the test_mode_reset call
+TEST_MODE_RESET_INLINE_CHUNKS = 7
+
+# Maximum number of entities moved per message from the shared stable map to their own
+# memory region, when upgrading from a version storing all entities in one map
+STORAGE_MIGRATION_CHUNK_SIZE = 500
+
+# Maximum number of entities of the shared stable map counted per message, when
+# upgrading from a version that did not keep their counts
+STORAGE_COUNT_CHUNK_SIZE = 5000
+
+# Width (in nanoseconds) of the time index buckets grouping transactions by timestamp
+TIME_INDEX_BUCKET_NS = 3_600_000_000_000
+
+# Maximum number of time index buckets visited by a single time-range query
+# A query over a sparse range returns a cursor to continue from once this is reached
+TIME_INDEX_MAX_BUCKETS_PER_QUERY = 2000
+
+# Maximum number of stored transactions indexed per message when building the time index
+TIME_INDEX_BUILD_CHUNK_SIZE = 500
+
+# Number of consecutive ledger transaction ids covered by one balance checkpoint interval
+# get_balance_at replays at most this many transaction ids after the nearest checkpoint
+BALANCE_CHECKPOINT_INTERVAL = 1000
+
+# Number of levels of the per-principal checkpoint trees, which cover
+# 2**BALANCE_CHECKPOINT_LEVELS intervals (about 4 * 10**12 transaction ids)
+BALANCE_CHECKPOINT_LEVELS = 32
+
+# Maximum number of stored transactions recorded per message when building the checkpoints
+BALANCE_CHECKPOINT_BUILD_CHUNK_SIZE = 200
+
+# Maximum number of time index buckets searched backwards from a timestamp by get_balance_at
+BALANCE_AT_MAX_BUCKETS = 10_000
+
+# Minimum delay (in nanoseconds) between two automatic reconciliations of the vault's
+# balance against the ledger, run at the end of a sync that reached the newest transaction
+RECONCILIATION_INTERVAL_NS = 3_600_000_000_000
+
+# Default and maximum size (in bytes) of a chunk returned by export_transactions
+# Kept well below the 2 MiB limit of a canister reply
+EXPORT_MAX_BYTES = 1_000_000
+
+# Maximum number of transaction ids looked up by a single export_transactions call
+EXPORT_MAX_PROBES = 20_000
+
+# Maximum number of rows accepted in a single snapshot import chunk
+SNAPSHOT_IMPORT_MAX_ROWS = 5000
+
+# Maximum number of transaction ids or balances handled per message when aborting a
+# snapshot import
+SNAPSHOT_ABORT_CHUNK_SIZE = 2000
+
+# Maximum number of principals accepted by a single get_balances call
+GET_BALANCES_MAX_PRINCIPALS = 1000
+
+# Bit length of the largest amount with buckets of its own in the balance index; larger
+# amounts share the top bucket
+BALANCE_INDEX_MAX_BITS = 128
+
+# Number of balances indexed per chunk of the balance index build
+BALANCE_INDEX_BUILD_CHUNK_SIZE = 500
+
+# Maximum number of balances returned by a single get_top_balances call
+TOP_BALANCES_MAX = 1000
+
+# Maximum length of a category name
+CATEGORY_NAME_MAX_LENGTH = 64
+
+# Maximum number of transactions tagged by a single tag_transactions call
+CATEGORY_TAG_MAX_TRANSACTIONS = 1000
+
+# Default and maximum number of transactions returned per get_category_transactions page
+CATEGORY_PAGE_DEFAULT_RESULTS = 100
+CATEGORY_PAGE_MAX_RESULTS = 500
+
+# Maximum length of the symbol of a registered token
+TOKEN_SYMBOL_MAX_LENGTH = 16
+
+# Time (in nanoseconds) a deposit subaccount keeps being synced after it was opened or
+# received a deposit
+DEPOSIT_ACTIVE_WINDOW_NS = 86_400_000_000_000
+
+# Maximum number of deposit subaccounts being synced at the same time: further ones can
+# only be opened once some have gone idle
+DEPOSIT_MAX_ACTIVE_ACCOUNTS = 500
+
+# Minimum time (in nanoseconds) between two open_deposit_account calls of the same
+# principal extending its activity window; calls in between leave it unchanged
+DEPOSIT_REOPEN_INTERVAL_NS = 600_000_000_000
+
+# Maximum number of indexer fetches per sync call shared by the active deposit subaccounts
+DEPOSIT_SYNC_MAX_FETCHES = 10
+
+# Maximum number of deposit subaccounts swept into the vault's default account per sync call
+DEPOSIT_SWEEP_MAX_PER_SYNC = 10
+
+# Maximum number of transactions moved to the archive by a single archive_transactions call
+ARCHIVE_BATCH_SIZE = 1000
+
+# Maximum number of transaction ids looked up by a single archive_transactions call
+ARCHIVE_MAX_PROBES = 5000
+
+# Number of transactions an archive canister holds before a new one must be added
+ARCHIVE_MAX_TRANSACTIONS = 5_000_000
+
+# Number of entries kept by the change feed; older ones are dropped, and mirrors that
+# have not read them must reload the whole state
+CHANGE_LOG_MAX_ENTRIES = 100_000
+
+# Maximum number of changes returned by a single get_changes_since call
+CHANGE_FEED_MAX_RESULTS = 1000
+
+# Maximum number of subscriptions to transaction notifications
+NOTIFICATION_MAX_SUBSCRIPTIONS = 100
+
+# Maximum length of the callback method of a subscription
+NOTIFICATION_METHOD_MAX_LENGTH = 64
+
+# Number of notifications queued per subscription; the oldest ones are dropped when the
+# subscriber does not keep up
+NOTIFICATION_QUEUE_MAX_LENGTH = 10_000
+
+# Maximum number of transactions sent in a single notification
+NOTIFICATION_BATCH_SIZE = 100
+
+# Maximum number of notifications sent per delivery round, shared by the subscriptions
+NOTIFICATION_MAX_CALLS = 20
+
+# Number of consecutive failed deliveries after which a subscription is suspended
+NOTIFICATION_MAX_FAILURES = 10
+
+# Delay (in nanoseconds) before retrying a failed delivery, doubled after each failure
+NOTIFICATION_RETRY_BASE_NS = 10_000_000_000
+NOTIFICATION_RETRY_MAX_NS = 3_600_000_000_000
+
+# Size of a stable memory page
+WASM_PAGE_SIZE = 65_536
+
+# Stable memory the vault's maps can use: the limit of the memory manager sharing stable
+# memory between them (32768 buckets of 8 MiB), below the Internet Computer's own limit
+STABLE_MEMORY_CAPACITY_BYTES = 256 * 1024**3
+
+# Duration (in nanoseconds) over which the transactions stored by syncs are counted to
+# estimate the storage growth
+GROWTH_WINDOW_NS = 86_400_000_000_000
+
+# Duration (in nanoseconds) a token's ledger fee is cached before being fetched again;
+# a transfer rejected with BadFee updates it right away
+LEDGER_FEE_TTL_NS = 3_600_000_000_000
+
+# Maximum number of pending and in-flight withdrawals, and per recipient
+WITHDRAWAL_QUEUE_MAX_LENGTH = 1000
+WITHDRAWAL_MAX_PENDING_PER_PRINCIPAL = 10
+
+# Maximum number of withdrawals waiting for the ledger at the same time
+WITHDRAWAL_MAX_IN_FLIGHT = 5
+
+# Number of attempts after which a withdrawal fails; all of them fit in the ledger's
+# 24-hour deduplication window
+WITHDRAWAL_MAX_ATTEMPTS = 8
+
+# Delay (in nanoseconds) before retrying a failed withdrawal, doubled after each failure
+WITHDRAWAL_RETRY_BASE_NS = 10_000_000_000
+WITHDRAWAL_RETRY_MAX_NS = 3_600_000_000_000
+
+# Number of withdrawals returned by get_withdrawals by default and at most, and number of
+# withdrawals it looks at when filtering by principal
+WITHDRAWAL_PAGE_DEFAULT_RESULTS = 50
+WITHDRAWAL_PAGE_MAX_RESULTS = 500
+WITHDRAWAL_PAGE_MAX_SCAN = 2000
@@ -0,0 +1,57 @@
+from typing import List, Optional, Tuple
+
+from kybra import Principal
+from kybra_simple_logging import get_logger
+
+from vault.constants import DEPOSIT_ACTIVE_WINDOW_NS
+
+logger = get_logger(__name__)
+
+_activity_map = None
+
+
+def init_deposits(stable_map) -> None:
+    """
+    Sets the stable map holding the deposit subaccounts with recent activity.
+
+        "<owner principal>" -> end of the activity window (ns)
+
+    Only these subaccounts are synced; a subaccount leaves the map once its window has
+    passed and it is in sync, and comes back when its owner opens it again.
+    """
+    global _activity_map
+    _activity_map = stable_map
+
+
+def deposit_subaccount(principal_id: str) -> List[int]:
+    """
+    Returns the deposit subaccount of a principal: the length of the principal's bytes,
+    then the bytes, zero-padded to 32 bytes.
+    """
+    principal_bytes = Principal.from_str(principal_id).bytes
+    return list((bytes([len(principal_bytes)]) + principal_bytes).ljust(32, b"\x00"))
+
+
+def mark_deposit_activity(owner: str, now: int) -> None:
+    """Makes a deposit subaccount eligible for syncing for DEPOSIT_ACTIVE_WINDOW_NS."""
+    _activity_map.insert(owner, str(now + DEPOSIT_ACTIVE_WINDOW_NS))
+
+
+def deposit_active_until(owner: str) -> Optional[int]:
+    """Returns the end of the activity window of a deposit subaccount, None if idle."""
+    active_until = _activity_map.get(owner)
+    return int(active_until) if active_until is not None else None
+
+
+def active_deposit_count() -> int:
+    return _activity_map.len()
+
+
+def active_deposit_owners() -> List[Tuple[str, int]]:
+    """Lists the owners of the deposit subaccounts to sync, with their activity window end."""
+    return [(owner, int(active_until)) for owner, active_until in _activity_map.items()]
+
+
+def deactivate_deposit_account(owner: str) -> None:
+    logger.debug(f"Deposit subaccount of {owner} is idle, no longer syncing it")
+    _activity_map.remove(owner)
@@ -1,3 +1,5 @@
+from typing import Callable, List, Optional
+
 from kybra_simple_db import (
     Boolean,
     Entity,
@@ -20,6 +22,49 @@ class ApplicationData(Entity, TimestampedMixin):
     scan_start_tx_id = Integer(default=0)
     scan_oldest_tx_id = Integer(default=0)
 
+    sync_last_error = String()
+    sync_last_error_timestamp = Integer(default=0)
+    sync_consecutive_failures = Integer(default=0)
+    sync_retry_after = Integer(default=0)
+    # Positions of the token and of the deposit subaccount synced first by the next sync
+    # call, so that each gets a turn
+    sync_token_rotation = Integer(default=0)
+    deposit_sync_rotation = Integer(default=0)
+
+    sync_lease_owner = String()
+    sync_lease_expires_at = Integer(default=0)
+    sync_lease_counter = Integer(default=0)
+    sync_lease_new_txs_count = Integer(default=0)
+
+    reconciliation_timestamp = Integer(default=0)
+    reconciliation_sync_tx_id = Integer(default=0)
+    reconciliation_ledger_balance = Integer(default=0)
+    reconciliation_indexer_balance = Integer(default=0)
+    reconciliation_vault_balance = Integer(default=0)
+    reconciliation_error = String()
+    # Tokens held by the deposit subaccounts according to the stored transactions:
+    # deposits to them, less the sweeps to the default account and their fees
+    deposit_subaccounts_balance = Integer(default=0)
+    # Highest id of a transaction ever stored, by a sync, deposit, a withdrawal, test
+    # mode or a snapshot import, so that walks over the stored ids reach every one
+    max_stored_tx_id = Integer(default=-1)
+
+    # Transactions older than archive_max_age_ns, or with an id below
+    # archive_below_tx_id, are moved to the archives (0 disables either criterion).
+    # Every transaction with an id below archive_end_tx_id has been archived.
+    archive_max_age_ns = Integer(default=0)
+    archive_below_tx_id = Integer(default=0)
+    archive_end_tx_id = Integer(default=0)
+
+    # Position of the subscription notified first by the next delivery round
+    notification_rotation = Integer(default=0)
+
+    # Transactions stored by syncs since growth_window_start, and the rate (transactions
+    # per day) of the last window that spanned GROWTH_WINDOW_NS
+    growth_window_start = Integer(default=0)
+    growth_window_txs = Integer(default=0)
+    growth_txs_per_day = Integer(default=0)
+
 
 class TestModeData(Entity, TimestampedMixin):
     """Stores test mode configuration and state."""
@@ -34,6 +79,77 @@ class Canisters(Entity, TimestampedMixin):
     principal = String()
 
 
+class Token(Entity, TimestampedMixin):
+    """
+    An ICRC-1 token held by the vault besides the primary one, keyed by its symbol.
+
+    Its ledger and indexer are the canisters "<symbol> ledger" and "<symbol> indexer".
+    """
+
+    scan_end_tx_id = Integer(default=0)
+    scan_start_tx_id = Integer(default=0)
+    scan_oldest_tx_id = Integer(default=0)
+
+    sync_last_error = String()
+    sync_last_error_timestamp = Integer(default=0)
+    sync_consecutive_failures = Integer(default=0)
+    sync_retry_after = Integer(default=0)
+
+
+class DepositAccount(Entity, TimestampedMixin):
+    """
+    The deposit subaccount of the vault opened by a principal, keyed by that principal.
+
+    Deposits to it are credited to its owner, whoever sent them. It is synced with its
+    own cursors, like a token's default account.
+    """
+
+    scan_end_tx_id = Integer(default=0)
+    scan_start_tx_id = Integer(default=0)
+    scan_oldest_tx_id = Integer(default=0)
+
+    sync_last_error = String()
+    sync_last_error_timestamp = Integer(default=0)
+    sync_consecutive_failures = Integer(default=0)
+    sync_retry_after = Integer(default=0)
+
+    last_deposit_at = Integer(default=0)
+    # Set when a deposit is found, until the subaccount is swept to the default account
+    sweep_pending = Boolean(default=False)
+
+
+class Subscription(Entity, TimestampedMixin):
+    """
+    A canister notified of new transactions, keyed by "<subscriber>|<method>".
+
+    Transactions matching its filter are queued at positions queue_start (the oldest not
+    delivered yet) to queue_end, and sent in batches to the subscriber's method.
+    """
+
+    subscriber = String()
+    method = String()
+    # Filter: a principal the transaction is from or to, a minimum amount and a kind
+    # (empty strings match any); only transactions made after `since` are queued
+    principal = String()
+    min_amount = Integer(default=0)
+    kind = String()
+    since = Integer(default=0)
+
+    active = Boolean(default=True)
+    queue_start = Integer(default=0)
+    queue_end = Integer(default=0)
+    batch_seq = Integer(default=0)
+    # Notifications dropped from the full queue since the last batch sent
+    missed = Integer(default=0)
+
+    matched_count = Integer(default=0)
+    delivered_count = Integer(default=0)
+    dropped_count = Integer(default=0)
+    consecutive_failures = Integer(default=0)
+    retry_after = Integer(default=0)
+    last_error = String()
+
+
 def app_data():
     """Retrieves the singleton ApplicationData instance, creating it if it doesn't exist."""
     return ApplicationData["main"] or ApplicationData(_id="main")
@@ -50,16 +166,76 @@ class Category(Entity, TimestampedMixin):
     name = String()
 
 
+class CategoryRule(Entity, TimestampedMixin):
+    """Tags synced transactions matching all of its set criteria with a category."""
+
+    category = String()
+    counterparty = String()
+    memo = String()
+    kind = String()
+
+
+# Called as listener(transaction) after every save of a VaultTransaction
+_transaction_listeners: List[Callable[["VaultTransaction"], None]] = []
+
+
+def add_transaction_listener(listener: Callable[["VaultTransaction"], None]) -> None:
+    _transaction_listeners.append(listener)
+
+
 class VaultTransaction(Entity, TimestampedMixin):
     """Records details of an ICRC-1 transaction relevant to the vault's operations."""
 
     principal_from = String()
     principal_to = String()
     amount = Integer(min_value=0)
+    # Ledger fee paid by the sender, as reported by the indexer (0 if not reported)
+    fee = Integer(min_value=0, default=0)
     timestamp = Integer(min_value=0)
     kind = String()
     categories = ManyToMany("Category", "transactions")
 
+    def _save(self):
+        entity = super()._save()
+        if not self._do_not_save:
+            for listener in _transaction_listeners:
+                listener(self)
+        return entity
+
+
+class Archive(Entity, TimestampedMixin):
+    """
+    An archive canister holding transactions moved out of the vault, keyed by its
+    position. Archives are filled one after the other, so they hold consecutive ranges.
+    """
+
+    principal = String()
+    transactions_count = Integer(default=0)
+    first_tx_id = Integer(default=-1)
+    last_tx_id = Integer(default=-1)
+    min_timestamp = Integer(default=0)
+    max_timestamp = Integer(default=0)
+
+
+class TokenTransaction(Entity, TimestampedMixin):
+    """A transaction of a registered token, keyed by "<symbol>|<ledger transaction id>"."""
+
+    principal_from = String()
+    principal_to = String()
+    amount = Integer(min_value=0)
+    fee = Integer(min_value=0, default=0)
+    timestamp = Integer(min_value=0)
+    kind = String()
+
+
+# Called as listener(principal_id, amount) after every save of a Balance, and with an
+# amount of None after its deletion
+_balance_listeners: List[Callable[[str, Optional[int]], None]] = []
+
+
+def add_balance_listener(listener: Callable[[str, Optional[int]], None]) -> None:
+    _balance_listeners.append(listener)
+
 
 class Balance(Entity, TimestampedMixin):
     """Represents a balance amount, potentially associated with a 'Canister' entity."""
@@ -67,6 +243,131 @@ class Balance(Entity, TimestampedMixin):
     amount = Integer(default=0)
     canister = OneToMany("Canister", "balances")
 
+    def _save(self):
+        entity = super()._save()
+        if not self._do_not_save:
+            for listener in _balance_listeners:
+                listener(self._id, self.amount)
+        return entity
+
+    def delete(self) -> None:
+        super().delete()
+        for listener in _balance_listeners:
+            listener(self._id, None)
+
+
+class ShadowBalance(Entity, TimestampedMixin):
+    """Balance recomputed by a running rebuild, swapped into 'Balance' when the rebuild completes."""
+
+    amount = Integer(default=0)
+
+
+class TokenBalance(Entity, TimestampedMixin):
+    """A balance of a registered token, keyed by "<symbol>|<principal>"."""
+
+    amount = Integer(default=0)
+
+
+class Job(Entity, TimestampedMixin):
+    """A long-running maintenance task processed in bounded chunks by the job runner."""
+
+    kind = String()
+    status = String(default="Pending")
+    phase = String()
+    cursor = Integer(default=-1)
+    cursor_key = String()
+    cursor_end = Integer(default=0)
+    processed_count = Integer(default=0)
+    created_at = Integer(default=0)
+    started_at = Integer(default=0)
+    updated_at = Integer(default=0)
+    finished_at = Integer(default=0)
+    requested_by = String()
+    error = String()
+
+
+class JobRunner(Entity, TimestampedMixin):
+    """Stores the position of the job queue; jobs run one at a time in id order."""
+
+    current_job_id = Integer(default=0)
+    last_job_id = Integer(default=0)
+    timer_scheduled = Boolean(default=False)
+
+
+def job_runner_data():
+    """Retrieves the singleton JobRunner instance, creating it if it doesn't exist."""
+    return JobRunner["main"] or JobRunner(_id="main")
+
+
+class SnapshotImport(Entity, TimestampedMixin):
+    """Stores the progress of a snapshot import seeding this vault from another one."""
+
+    status = String(default="Idle")
+    source_vault = String()
+    transactions_count = Integer(default=0)
+    balances_count = Integer(default=0)
+    transactions_hash = String(default="")
+    balances_hash = String(default="")
+    last_tx_id = Integer(default=-1)
+    started_at = Integer(default=0)
+    finished_at = Integer(default=0)
+
+
+def snapshot_import_data():
+    """Retrieves the singleton SnapshotImport instance, creating it if it doesn't exist."""
+    return SnapshotImport["main"] or SnapshotImport(_id="main")
+
+
+class Withdrawal(Entity, TimestampedMixin):
+    """A payout queued for the withdrawal timer, keyed by a sequential id."""
+
+    token = String()
+    # Recipient of the payout, whose balance it is debited from
+    principal = String()
+    amount = Integer(min_value=0)
+    requested_by = String()
+    status = String(default="Pending")
+    attempts = Integer(default=0)
+    retry_after = Integer(default=0)
+    # Fee (-1 for the ledger's default) and created_at_time of the first attempt, reused
+    # by the retries so that the ledger deduplicates a transfer already made
+    fee = Integer(default=-1)
+    created_at_time = Integer(default=0)
+    block_id = Integer(default=-1)
+    error = String()
+    created_at = Integer(default=0)
+    finished_at = Integer(default=0)
+
+
+class WithdrawalQueue(Entity, TimestampedMixin):
+    """Stores the position of the withdrawal queue; withdrawals are sent in id order."""
+
+    head_id = Integer(default=1)
+    last_id = Integer(default=0)
+
+
+def withdrawal_queue_data():
+    """Retrieves the singleton WithdrawalQueue instance, creating it if it doesn't exist."""
+    return WithdrawalQueue["main"] or WithdrawalQueue(_id="main")
+
+
+# The PartitionedStorage the database was initialized with, listing the ids of a type
+_entity_storage = None
+
+
+def init_entity_storage(storage) -> None:
+    global _entity_storage
+    _entity_storage = storage
+
+
+def entity_ids(entity_cls):
+    """
+    Lists the ids of all stored entities of a type, without loading them.
+
+    Entity types with their own memory region are listed without a full scan.
+    """
+    return _entity_storage.ids_for_type(entity_cls.__name__)
+
 
 def stats():
     """Gathers and returns various statistics from the vault's entities."""
@@ -0,0 +1,159 @@
+import hashlib
+from io import BytesIO
+from typing import Callable, Iterator, List, Optional, Tuple
+
+from cbor2 import CBORDecoder, dumps
+
+# Versions of the row layouts below, stored as the first item of every exported row
+TRANSACTION_ROW_VERSION = 2
+BALANCE_ROW_VERSION = 1
+
+
+def encode_transaction_row(tx) -> bytes:
+    """
+    Encodes a VaultTransaction as a CBOR array:
+
+        [version, id, timestamp, kind, principal_from, principal_to, amount, fee]
+
+    Exported chunks are concatenations of such rows (a CBOR sequence), so chunks can be
+    appended to a file as they arrive and read back one row at a time.
+    """
+    return dumps(
+        [
+            TRANSACTION_ROW_VERSION,
+            int(tx._id),
+            tx.timestamp,
+            tx.kind,
+            tx.principal_from,
+            tx.principal_to,
+            tx.amount,
+            tx.fee,
+        ]
+    )
+
+
+def export_transactions_chunk(
+    load_tx: Callable[[int], object],
+    cursor: int,
+    max_tx_id: int,
+    max_bytes: int,
+    max_probes: int,
+) -> Tuple[bytes, int, Optional[int]]:
+    """
+    Encodes the stored transactions from id `cursor` onwards, in id order.
+
+    Args:
+        load_tx: Returns the stored transaction with the given id, or None
+        cursor: First transaction id to export
+        max_tx_id: Highest transaction id that can be stored
+        max_bytes: Maximum size of the chunk; a single row larger than this is still
+            exported on its own, so the export always progresses
+        max_probes: Maximum number of ids looked up, since ledger ids are sparse
+
+    Returns:
+        Tuple of (chunk, number of rows, next cursor or None once max_tx_id is passed)
+    """
+    rows: List[bytes] = []
+    size = 0
+    tx_id = cursor
+    probes = 0
+
+    while tx_id <= max_tx_id and probes < max_probes:
+        tx = load_tx(tx_id)
+        probes += 1
+        if tx:
+            row = encode_transaction_row(tx)
+            if rows and size + len(row) > max_bytes:
+                break
+            rows.append(row)
+            size += len(row)
+        tx_id += 1
+
+    next_cursor = tx_id if tx_id <= max_tx_id else None
+    return b"".join(rows), len(rows), next_cursor
+
+
+def encode_balance_row(balance) -> bytes:
+    """Encodes a Balance as a CBOR array: [version, principal_id, amount]."""
+    return dumps([BALANCE_ROW_VERSION, balance._id, balance.amount])
+
+
+def export_balances_chunk(
+    balance_ids: List[str],
+    load_balance: Callable[[str], object],
+    cursor: int,
+    max_bytes: int,
+) -> Tuple[bytes, int, Optional[int]]:
+    """
+    Encodes the balances from position `cursor` of `balance_ids` onwards.
+
+    Returns:
+        Tuple of (chunk, number of rows, next cursor or None once all balances are exported)
+    """
+    rows: List[bytes] = []
+    size = 0
+    position = cursor
+
+    while position < len(balance_ids):
+        balance = load_balance(balance_ids[position])
+        if balance:
+            row = encode_balance_row(balance)
+            if rows and size + len(row) > max_bytes:
+                break
+            rows.append(row)
+            size += len(row)
+        position += 1
+
+    next_cursor = position if position < len(balance_ids) else None
+    return b"".join(rows), len(rows), next_cursor
+
+
+def decode_rows(chunk: bytes) -> Iterator[list]:
+    """Iterates over the rows of an exported chunk."""
+    stream = BytesIO(chunk)
+    decoder = CBORDecoder(stream)
+    while stream.tell() < len(chunk):
+        yield decoder.decode()
+
+
+def decode_transaction_row(row: list) -> dict:
+    """Decodes a transaction row; version 1 rows, exported without the fee, have none."""
+    version = row[0]
+    if version == 1:
+        row = row + [0]
+    elif version != TRANSACTION_ROW_VERSION:
+        raise ValueError(f"Unsupported transaction row version {version}")
+    _, tx_id, timestamp, kind, principal_from, principal_to, amount, fee = row
+    return {
+        "id": tx_id,
+        "timestamp": timestamp,
+        "kind": kind,
+        "principal_from": principal_from,
+        "principal_to": principal_to,
+        "amount": amount,
+        "fee": fee,
+    }
+
+
+def decode_balance_row(row: list) -> Tuple[str, int]:
+    version, principal_id, amount = row
+    if version != BALANCE_ROW_VERSION:
+        raise ValueError(f"Unsupported balance row version {version}")
+    return principal_id, amount
+
+
+def chunk_sha256(chunk: bytes) -> str:
+    return hashlib.sha256(chunk).hexdigest()
+
+
+def chain_hash(previous_hash: str, chunk: bytes) -> str:
+    """
+    Extends the hash of a sequence of chunks with one more chunk.
+
+    The hash of a snapshot is the chain over its chunks in order, starting from "". It
+    can be computed one chunk at a time, so a canister can verify an import spanning
+    many messages.
+    """
+    return hashlib.sha256(
+        (previous_hash + chunk_sha256(chunk)).encode("utf-8")
+    ).hexdigest()
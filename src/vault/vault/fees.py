@@ -0,0 +1,29 @@
+from typing import Dict, Optional, Tuple
+
+from vault.constants import LEDGER_FEE_TTL_NS
+
+# Heap state: lost on upgrade, after which each fee is fetched again on first use.
+# Symbol -> (ledger principal, fee, time it was fetched)
+_fees: Dict[str, Tuple[str, int, int]] = {}
+
+
+def cached_fee(symbol: str, ledger: str, now: int) -> Optional[int]:
+    """
+    Returns the cached fee of a token's ledger, or None if it has to be fetched: never
+    fetched, older than LEDGER_FEE_TTL_NS, or fetched from another ledger.
+    """
+    cached = _fees.get(symbol)
+    if not cached or cached[0] != ledger or now - cached[2] >= LEDGER_FEE_TTL_NS:
+        return None
+    return cached[1]
+
+
+def set_fee(symbol: str, ledger: str, fee: int, now: int) -> None:
+    _fees[symbol] = (ledger, int(fee), now)
+
+
+def expected_fee(transfer_error: Optional[dict]) -> Optional[int]:
+    """Returns the fee a ledger asked for when it rejected a transfer with BadFee."""
+    if transfer_error and transfer_error.get("BadFee") is not None:
+        return int(transfer_error["BadFee"]["expected_fee"])
+    return None
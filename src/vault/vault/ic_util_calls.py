@@ -10,9 +10,12 @@ from kybra_simple_logging import get_logger
 
 from vault.candid_types import (
     Account,
+    AccountTransactionsResult,
     GetAccountTransactionsRequest,
     GetAccountTransactionsResponse,
     ICRCIndexer,
+    ICRCLedger,
+    LedgerBalanceResult,
 )
 
 logger = get_logger(__name__)
@@ -24,6 +27,7 @@ def set_account_mock_transaction(
     amount: int,
     kind: str = "transfer",
     timestamp: Optional[int] = None,
+    fee: int = 0,
 ) -> dict:
     """
     Creates a mock transaction for testing purposes.
@@ -34,13 +38,20 @@ def set_account_mock_transaction(
         amount: The amount of tokens to transfer
         kind: The type of transaction ("transfer", "mint", "burn")
         timestamp: Optional timestamp (uses current time if not provided)
+        fee: The ledger fee paid by the sender
 
     Returns:
         Dictionary containing the mock transaction data
     """
     from kybra import ic
 
-    from vault.entities import Balance, VaultTransaction, test_mode_data
+    from vault.accounting import apply_new_transaction
+    from vault.balance_checkpoints import record_new_transaction
+    from vault.categories import categorize_new_transaction, load_category_rules
+    from vault.entities import VaultTransaction, test_mode_data
+    from vault.notifications import notification, queue_notifications
+    from vault.time_index import index_new_transaction
+    from vault.tokens import PRIMARY_TOKEN
 
     try:
         # Get current test mode data and increment transaction ID
@@ -57,73 +68,40 @@ def set_account_mock_transaction(
         )
 
         # Create the mock VaultTransaction
-        VaultTransaction(
+        vault_tx = VaultTransaction(
             _id=tx_id,
             principal_from=principal_from,
             principal_to=principal_to,
             amount=amount,
+            fee=fee,
             timestamp=timestamp,
             kind=kind,
         )
 
         # Update balances based on transaction type
-        if kind == "mint":
-            # For mint, only update the recipient's balance
-            balance_to = Balance[principal_to] or Balance(_id=principal_to, amount=0)
-            balance_to.amount = balance_to.amount + amount
-            logger.debug(f"Updated balance for {principal_to} to {balance_to.amount}")
-
-        elif kind == "burn":
-            # For burn, only update the sender's balance
-            balance_from = Balance[principal_from] or Balance(
-                _id=principal_from, amount=0
-            )
-            balance_from.amount = balance_from.amount - amount
-            logger.debug(
-                f"Updated balance for {principal_from} to {balance_from.amount}"
-            )
-
-        elif kind == "transfer":
-            # For transfer, update both balances
-            canister_id = ic.id().to_str()
-
-            if canister_id == principal_to:
-                # User depositing into vault
-                balance_from = Balance[principal_from] or Balance(
-                    _id=principal_from, amount=0
-                )
-                balance_from.amount = balance_from.amount + amount
-
-                vault_balance = Balance[canister_id] or Balance(
-                    _id=canister_id, amount=0
-                )
-                vault_balance.amount = vault_balance.amount + amount
-
-                logger.debug(
-                    f"Deposit: Updated balance for {principal_from} to {balance_from.amount}"
-                )
-                logger.debug(
-                    f"Deposit: Updated vault balance to {vault_balance.amount}"
-                )
-
-            elif canister_id == principal_from:
-                # Vault transferring to user
-                balance_to = Balance[principal_to] or Balance(
-                    _id=principal_to, amount=0
-                )
-                balance_to.amount = balance_to.amount - amount
-
-                vault_balance = Balance[canister_id] or Balance(
-                    _id=canister_id, amount=0
-                )
-                vault_balance.amount = vault_balance.amount - amount
-
-                logger.debug(
-                    f"Withdrawal: Updated balance for {principal_to} to {balance_to.amount}"
-                )
-                logger.debug(
-                    f"Withdrawal: Updated vault balance to {vault_balance.amount}"
+        apply_new_transaction(
+            ic.id().to_str(), tx_id, kind, principal_from, principal_to, amount, fee
+        )
+        index_new_transaction(tx_id, timestamp, principal_from, principal_to)
+        record_new_transaction(
+            ic.id().to_str(), tx_id, kind, principal_from, principal_to, amount, fee
+        )
+        categorize_new_transaction(
+            ic.id().to_str(), vault_tx, None, load_category_rules()
+        )
+        queue_notifications(
+            [
+                notification(
+                    PRIMARY_TOKEN,
+                    tx_id,
+                    timestamp,
+                    kind,
+                    principal_from,
+                    principal_to,
+                    amount,
                 )
+            ]
+        )
 
         # Return mock transaction data in the same format as real transactions
         mock_transaction = {
@@ -154,7 +132,7 @@ def set_account_mock_transaction(
                 "from_": {"owner": principal_from, "subaccount": None},
                 "to": {"owner": principal_to, "subaccount": None},
                 "amount": amount,
-                "fee": None,
+                "fee": [fee] if fee else None,
                 "memo": None,
                 "created_at_time": timestamp,
             }
@@ -173,7 +151,7 @@ def get_account_transactions(
     max_results: nat,
     subaccount: Optional[List[int]] = None,
     start_tx_id: Optional[nat] = 0,
-) -> Async[GetAccountTransactionsResponse]:
+) -> Async[AccountTransactionsResult]:
     """
     Query the indexer canister for account transactions.
 
@@ -185,7 +163,9 @@ def get_account_transactions(
         start_tx_id: Transaction ID to start retrieving from (for pagination)
 
     Returns:
-        A GetAccountTransactionsResponse object containing balance and transactions
+        An AccountTransactionsResult variant: Ok with the GetAccountTransactionsResponse
+        (possibly with no transactions), Rejected if the call did not reach the indexer
+        or IndexerError if the indexer answered with an error
     """
     try:
         indexer = ICRCIndexer(Principal.from_str(canister_id))
@@ -198,26 +178,60 @@ def get_account_transactions(
                 max_results=max_results,
             )
         )
+    except Exception as e:
+        logger.error(f"Exception in get_account_transactions: {str(e)}")
+        return AccountTransactionsResult(Rejected=f"Exception calling indexer: {e}")
+
+    if result.Err is not None:
+        logger.warning(f"Call to indexer {canister_id} rejected: {result.Err}")
+        return AccountTransactionsResult(Rejected=str(result.Err))
+
+    if isinstance(result.Ok, dict) and result.Ok.get("Err") is not None:
+        logger.warning(f"Error from indexer: {result.Ok['Err']}")
+        return AccountTransactionsResult(IndexerError=str(result.Ok["Err"]))
+
+    if not isinstance(result.Ok, dict) or result.Ok.get("Ok") is None:
+        logger.warning(f"Unexpected response from indexer: {result.Ok}")
+        return AccountTransactionsResult(
+            IndexerError=f"Unexpected response from indexer: {result.Ok}"
+        )
+
+    data = result.Ok["Ok"]
+    return AccountTransactionsResult(
+        Ok=GetAccountTransactionsResponse(
+            balance=data.get("balance", 0),
+            transactions=data.get("transactions", []),
+            oldest_tx_id=data.get("oldest_tx_id"),
+        )
+    )
 
-        if (
-            hasattr(result, "Ok")
-            and result.Ok is not None
-            and isinstance(result.Ok, dict)
-            and "Ok" in result.Ok
-        ):
-            data = result.Ok["Ok"]
-            return GetAccountTransactionsResponse(
-                balance=data.get("balance", 0),
-                transactions=data.get("transactions", []),
-                oldest_tx_id=data.get("oldest_tx_id"),
-            )
 
-        # Log errors but don't break the flow
-        if hasattr(result, "Err") and result.Err is not None:
-            logger.debug(f"Error from indexer: {result.Err}")
+def get_ledger_balance(
+    canister_id: str, owner_principal: str, subaccount: Optional[List[int]] = None
+) -> Async[LedgerBalanceResult]:
+    """
+    Query the ledger canister for the balance of an account.
+
+    Args:
+        canister_id: The principal ID of the ledger canister
+        owner_principal: The principal ID of the account owner
+        subaccount: Optional subaccount (as a list of bytes)
 
+    Returns:
+        A LedgerBalanceResult variant: Ok with the balance, or Err with the reason the
+        call failed
+    """
+    try:
+        ledger = ICRCLedger(Principal.from_str(canister_id))
+        result = yield ledger.icrc1_balance_of(
+            Account(owner=Principal.from_str(owner_principal), subaccount=subaccount)
+        )
     except Exception as e:
-        logger.error(f"Exception in get_account_transactions: {str(e)}")
+        logger.error(f"Exception in get_ledger_balance: {str(e)}")
+        return LedgerBalanceResult(Err=f"Exception calling ledger: {e}")
+
+    if result.Err is not None:
+        logger.warning(f"Call to ledger {canister_id} rejected: {result.Err}")
+        return LedgerBalanceResult(Err=str(result.Err))
 
-    # Default response for all error cases
-    return GetAccountTransactionsResponse(balance=0, transactions=[], oldest_tx_id=None)
+    return LedgerBalanceResult(Ok=result.Ok)
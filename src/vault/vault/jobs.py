@@ -0,0 +1,254 @@
+import traceback
+from typing import Callable, Dict, List, Optional, Tuple
+
+from kybra import ic, void
+from kybra_simple_logging import get_logger
+
+from vault.candid_types import JobRecord
+from vault.entities import Job, job_runner_data
+from vault.response_cache import schedule_refresh
+
+logger = get_logger(__name__)
+
+JOB_STATUS_PENDING = "Pending"
+JOB_STATUS_RUNNING = "Running"
+JOB_STATUS_COMPLETED = "Completed"
+JOB_STATUS_FAILED = "Failed"
+JOB_STATUS_CANCELLED = "Cancelled"
+
+ACTIVE_JOB_STATUSES = (JOB_STATUS_PENDING, JOB_STATUS_RUNNING)
+
+
+class JobKind:
+    """
+    Describes how to run one kind of job.
+
+    Args:
+        run_chunk: Processes one bounded chunk of work, persisting its progress in the
+            job's cursor fields, and returns True once the job is finished
+        start: Optional setup run once, right before the first chunk
+        cancel: Optional cleanup run when the job is cancelled
+    """
+
+    def __init__(
+        self,
+        run_chunk: Callable[[Job], bool],
+        start: Optional[Callable[[Job], None]] = None,
+        cancel: Optional[Callable[[Job], None]] = None,
+    ):
+        self.run_chunk = run_chunk
+        self.start = start
+        self.cancel = cancel
+
+
+_job_kinds: Dict[str, JobKind] = {}
+
+# Heap state: ids listed once per job phase, sorted in reverse so the next ones are at the
+# end. Lost on upgrade, after which the ids following the job's cursor_key are listed again.
+_id_lists: Dict[Tuple[str, str], List[str]] = {}
+
+
+def register_job_kind(kind: str, job_kind: JobKind) -> None:
+    """Makes a kind of job available to create_job."""
+    _job_kinds[kind] = job_kind
+
+
+def create_job(kind: str, cursor_end: int = 0) -> Job:
+    """
+    Queues a new job. Jobs run one at a time, in creation order.
+
+    Args:
+        kind: A kind previously registered with register_job_kind
+        cursor_end: Optional end of the job's cursor range, if known upfront
+
+    Returns:
+        The new Job entity
+    """
+    if kind not in _job_kinds:
+        raise ValueError(f"Unknown job kind '{kind}'")
+
+    runner = job_runner_data()
+    job_id = runner.last_job_id + 1
+    runner.last_job_id = job_id
+
+    job = Job(
+        _id=str(job_id),
+        kind=kind,
+        status=JOB_STATUS_PENDING,
+        cursor_end=cursor_end,
+        created_at=ic.time(),
+        requested_by=ic.caller().to_str(),
+    )
+    logger.info(f"Created job {job_id} of kind '{kind}'")
+
+    schedule_jobs()
+    return job
+
+
+def get_job(job_id: int) -> Optional[Job]:
+    return Job[str(job_id)]
+
+
+def current_job() -> Optional[Job]:
+    """Returns the job at the head of the queue, skipping finished ones."""
+    runner = job_runner_data()
+    while runner.current_job_id <= runner.last_job_id:
+        job = Job[str(runner.current_job_id)]
+        if job and job.status in ACTIVE_JOB_STATUSES:
+            return job
+        if runner.current_job_id == runner.last_job_id:
+            return None
+        runner.current_job_id = runner.current_job_id + 1
+    return None
+
+
+def queued_job(kind: str) -> Optional[Job]:
+    """Returns the first pending or running job of the given kind, if any."""
+    runner = job_runner_data()
+    for job_id in range(runner.current_job_id, runner.last_job_id + 1):
+        job = Job[str(job_id)]
+        if job and job.kind == kind and job.status in ACTIVE_JOB_STATUSES:
+            return job
+    return None
+
+
+def running_job(kind: str) -> Optional[Job]:
+    """Returns the job of the given kind if it is currently running."""
+    job = current_job()
+    if job and job.kind == kind and job.status == JOB_STATUS_RUNNING:
+        return job
+    return None
+
+
+def next_ids(
+    job: Job, list_ids: Callable[[], List[str]], limit: int
+) -> Tuple[List[str], bool]:
+    """
+    Returns up to `limit` ids following the job's cursor_key, in sorted order, and
+    whether they are the last ones.
+
+    `list_ids` lists every id to walk. Stable maps can only list all their keys at once,
+    so it is called once per job phase rather than once per chunk, then once more when
+    that list is used up, to find the ids added after the cursor meanwhile. The caller
+    advances cursor_key past each id it handles.
+    """
+    list_key = (job._id, job.phase or "")
+    ids = _id_lists.get(list_key)
+    listed_now = ids is None
+    if listed_now:
+        ids = sorted(
+            (
+                entity_id
+                for entity_id in list_ids()
+                if not job.cursor_key or entity_id > job.cursor_key
+            ),
+            reverse=True,
+        )
+        _id_lists[list_key] = ids
+
+    while ids and job.cursor_key and ids[-1] <= job.cursor_key:
+        ids.pop()
+    chunk = ids[-limit:][::-1]
+    if len(ids) > limit:
+        return chunk, False
+
+    del _id_lists[list_key]
+    return chunk, listed_now
+
+
+def _forget_id_lists(job: Job) -> None:
+    for list_key in [key for key in _id_lists if key[0] == job._id]:
+        del _id_lists[list_key]
+
+
+def run_job_chunk(job: Job) -> None:
+    """Runs one chunk of a job, starting it first if needed, and records the outcome."""
+    job_kind = _job_kinds.get(job.kind)
+
+    try:
+        if job_kind is None:
+            raise ValueError(f"Unknown job kind '{job.kind}'")
+
+        if job.status == JOB_STATUS_PENDING:
+            logger.info(f"Starting job {job._id} of kind '{job.kind}'")
+            job.status = JOB_STATUS_RUNNING
+            job.started_at = ic.time()
+            if job_kind.start:
+                job_kind.start(job)
+
+        done = job_kind.run_chunk(job)
+        job.updated_at = ic.time()
+
+        if done:
+            _forget_id_lists(job)
+            job.status = JOB_STATUS_COMPLETED
+            job.finished_at = ic.time()
+            logger.info(
+                f"Job {job._id} of kind '{job.kind}' completed after processing {job.processed_count} items"
+            )
+    except Exception as e:
+        logger.error(f"Error running job {job._id}: {e}\n{traceback.format_exc()}")
+        _forget_id_lists(job)
+        job.status = JOB_STATUS_FAILED
+        job.error = str(e)
+        job.finished_at = ic.time()
+
+
+def stop_job(job: Job) -> None:
+    """Stops a pending or running job. Its chunks already processed are kept."""
+    job_kind = _job_kinds.get(job.kind)
+    if job_kind and job_kind.cancel and job.status == JOB_STATUS_RUNNING:
+        job_kind.cancel(job)
+    _forget_id_lists(job)
+    job.status = JOB_STATUS_CANCELLED
+    job.finished_at = ic.time()
+    logger.info(f"Cancelled job {job._id} of kind '{job.kind}'")
+
+
+def _run_jobs() -> void:
+    """Timer callback running one chunk of the job at the head of the queue."""
+    runner = job_runner_data()
+    runner.timer_scheduled = False
+
+    job = current_job()
+    if not job:
+        return
+
+    run_job_chunk(job)
+    schedule_jobs()
+    schedule_refresh()
+
+
+def schedule_jobs(force: bool = False) -> None:
+    """
+    Arms the timer that runs the next chunk, if there is queued work.
+
+    Args:
+        force: Arm the timer even if one is recorded as scheduled, e.g. after an
+            upgrade dropped all timers
+    """
+    runner = job_runner_data()
+    if runner.timer_scheduled and not force:
+        return
+    if not current_job():
+        return
+
+    ic.set_timer(0, _run_jobs)
+    runner.timer_scheduled = True
+
+
+def job_record(job: Job) -> JobRecord:
+    return JobRecord(
+        id=int(job._id),
+        kind=job.kind,
+        status=job.status,
+        phase=job.phase or "",
+        cursor=job.cursor,
+        cursor_end=max(job.cursor_end, 0),
+        processed_count=job.processed_count,
+        created_at=job.created_at,
+        started_at=job.started_at,
+        updated_at=job.updated_at,
+        finished_at=job.finished_at,
+        error=job.error or None,
+    )
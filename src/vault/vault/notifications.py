@@ -0,0 +1,239 @@
+import json
+from typing import List
+
+from kybra import Principal, ic
+from kybra_simple_logging import get_logger
+
+from vault.constants import (
+    NOTIFICATION_BATCH_SIZE,
+    NOTIFICATION_MAX_CALLS,
+    NOTIFICATION_MAX_FAILURES,
+    NOTIFICATION_QUEUE_MAX_LENGTH,
+    NOTIFICATION_RETRY_BASE_NS,
+    NOTIFICATION_RETRY_MAX_NS,
+)
+from vault.entities import Subscription, app_data, entity_ids
+
+logger = get_logger(__name__)
+
+_queue_map = None
+
+
+def init_notifications(stable_map) -> None:
+    """
+    Sets the stable map holding the notifications queued for each subscription:
+
+        "<subscription id>|#<position>" -> NotificationRecord as JSON
+    """
+    global _queue_map
+    _queue_map = stable_map
+
+
+def subscription_id(subscriber: str, method: str) -> str:
+    return f"{subscriber}|{method}"
+
+
+def subscriptions() -> List[Subscription]:
+    return [Subscription[sub_id] for sub_id in sorted(entity_ids(Subscription))]
+
+
+def pending_count(subscription: Subscription) -> int:
+    return subscription.queue_end - subscription.queue_start
+
+
+def clear_queue(subscription: Subscription) -> None:
+    """Drops every notification queued for a subscription."""
+    for position in range(subscription.queue_start, subscription.queue_end):
+        _queue_map.remove(f"{subscription._id}|#{position}")
+    subscription.dropped_count += pending_count(subscription)
+    subscription.queue_start = subscription.queue_end
+
+
+def notification(
+    token: str,
+    tx_id: int,
+    timestamp: int,
+    kind: str,
+    principal_from: str,
+    principal_to: str,
+    amount: int,
+) -> dict:
+    """Builds the NotificationRecord of a new transaction."""
+    return {
+        "token": token,
+        "id": int(tx_id),
+        "timestamp": timestamp,
+        "kind": kind,
+        "principal_from": principal_from,
+        "principal_to": principal_to,
+        "amount": amount,
+    }
+
+
+def matches(subscription: Subscription, item: dict) -> bool:
+    return (
+        item["timestamp"] >= subscription.since
+        and item["amount"] >= subscription.min_amount
+        and (not subscription.kind or item["kind"] == subscription.kind)
+        and (
+            not subscription.principal
+            or subscription.principal in (item["principal_from"], item["principal_to"])
+        )
+    )
+
+
+def queue_notifications(notifications: List[dict]) -> None:
+    """
+    Queues new transactions (as NotificationRecord dicts) for the active subscriptions
+    whose filter they match. When a queue is full, its oldest notifications are dropped
+    and counted as missed in the next batch.
+    """
+    if not notifications:
+        return
+
+    for subscription in subscriptions():
+        if not subscription.active:
+            continue
+        matching = [n for n in notifications if matches(subscription, n)]
+        if not matching:
+            continue
+
+        queue_start = subscription.queue_start
+        queue_end = subscription.queue_end
+        for item in matching:
+            _queue_map.insert(f"{subscription._id}|#{queue_end}", json.dumps(item))
+            queue_end += 1
+        dropped = max(0, queue_end - queue_start - NOTIFICATION_QUEUE_MAX_LENGTH)
+        for position in range(queue_start, queue_start + dropped):
+            _queue_map.remove(f"{subscription._id}|#{position}")
+
+        subscription.queue_end = queue_end
+        subscription.matched_count += len(matching)
+        if dropped:
+            logger.warning(
+                f"Notification queue of {subscription._id} is full, dropped {dropped} notifications"
+            )
+            subscription.queue_start = queue_start + dropped
+            subscription.missed += dropped
+            subscription.dropped_count += dropped
+
+
+def _candid_text(value: str) -> str:
+    return '"' + value.replace("\\", "\\\\").replace('"', '\\"') + '"'
+
+
+def encode_notification_batch(
+    batch_seq: int, missed: int, notifications: List[dict]
+) -> str:
+    """Writes a NotificationBatchRecord argument in Candid text, for ic.candid_encode."""
+    records = "; ".join(
+        "record { "
+        f"token = {_candid_text(n['token'])}; "
+        f"id = {n['id']} : nat; "
+        f"timestamp = {n['timestamp']} : nat64; "
+        f"kind = {_candid_text(n['kind'])}; "
+        f"principal_from = {_candid_text(n['principal_from'])}; "
+        f"principal_to = {_candid_text(n['principal_to'])}; "
+        f"amount = {n['amount']} : nat }}"
+        for n in notifications
+    )
+    return (
+        f"(record {{ batch_seq = {batch_seq} : nat; missed = {missed} : nat; "
+        f"notifications = vec {{ {records} }} }})"
+    )
+
+
+def _record_delivery_failure(subscription: Subscription, error: str, now: int) -> None:
+    failures = subscription.consecutive_failures + 1
+    delay = min(
+        NOTIFICATION_RETRY_BASE_NS * 2 ** min(failures - 1, 32),
+        NOTIFICATION_RETRY_MAX_NS,
+    )
+    subscription.consecutive_failures = failures
+    subscription.last_error = error
+    subscription.retry_after = now + delay
+    logger.warning(
+        f"Notification to {subscription._id} failed {failures} time(s) in a row: {error}"
+    )
+
+    if failures >= NOTIFICATION_MAX_FAILURES:
+        logger.warning(f"Suspending subscription {subscription._id}")
+        subscription.active = False
+        clear_queue(subscription)
+
+
+def _deliver_batch(subscription: Subscription, now: int) -> None:
+    """Sends the oldest queued notifications of a subscription as one one-way call."""
+    end = min(
+        subscription.queue_end, subscription.queue_start + NOTIFICATION_BATCH_SIZE
+    )
+    positions = range(subscription.queue_start, end)
+    notifications = [
+        json.loads(_queue_map.get(f"{subscription._id}|#{position}"))
+        for position in positions
+    ]
+
+    try:
+        result = ic.notify_raw(
+            Principal.from_str(subscription.subscriber),
+            subscription.method,
+            ic.candid_encode(
+                encode_notification_batch(
+                    subscription.batch_seq + 1, subscription.missed, notifications
+                )
+            ),
+            0,
+        )
+        error = None if "Ok" in result else f"Notify rejected: {result.get('Err')}"
+    except Exception as e:
+        error = f"Notify failed: {e}"
+
+    if error:
+        _record_delivery_failure(subscription, error, now)
+        return
+
+    for position in positions:
+        _queue_map.remove(f"{subscription._id}|#{position}")
+    subscription.queue_start = end
+    subscription.batch_seq += 1
+    subscription.delivered_count += len(notifications)
+    if subscription.missed:
+        subscription.missed = 0
+    if subscription.consecutive_failures or subscription.retry_after:
+        subscription.consecutive_failures = 0
+        subscription.retry_after = 0
+
+
+def deliver_notifications(now: int) -> int:
+    """
+    Runs a delivery round: each subscription with queued notifications gets at most one
+    batch, up to NOTIFICATION_MAX_CALLS batches, starting from a different subscription
+    every round so that all get a turn.
+
+    Notifications are one-way calls, so only a failure to send the call is seen (e.g. a
+    full output queue towards the subscriber). Failed batches are retried in a later
+    round with exponential backoff; after NOTIFICATION_MAX_FAILURES failures in a row the
+    subscription is suspended and its queue dropped.
+
+    Returns:
+        Number of batches sent or attempted
+    """
+    ready = [
+        subscription
+        for subscription in subscriptions()
+        if subscription.active
+        and pending_count(subscription)
+        and subscription.retry_after <= now
+    ]
+    if not ready:
+        return 0
+
+    state = app_data()
+    rotation = state.notification_rotation
+    state.notification_rotation = rotation + 1
+    start = rotation % len(ready)
+    ordered = ready[start:] + ready[:start]
+
+    for subscription in ordered[:NOTIFICATION_MAX_CALLS]:
+        _deliver_batch(subscription, now)
+    return min(len(ordered), NOTIFICATION_MAX_CALLS)
@@ -0,0 +1,76 @@
+import traceback
+from typing import Any, Callable, Dict, Tuple
+
+from kybra import ic, void
+from kybra_simple_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Heap state: lost on upgrade, after which every response is rebuilt on first use
+_state_version = 0
+_builders: Dict[str, Callable[[], Any]] = {}
+_cache: Dict[str, Tuple[int, Any]] = {}
+_refresh_needed = False
+_refresh_scheduled = False
+
+
+def register_cached_response(key: str, build: Callable[[], Any]) -> None:
+    """
+    Makes an expensive part of a query response cacheable.
+
+    Query calls cannot persist anything, so the cache is filled by a timer armed
+    after the state changes. Queries arriving in between rebuild the response
+    themselves.
+    """
+    _builders[key] = build
+
+
+def cached_response(key: str) -> Any:
+    """Returns the response built for the current state version, building it if needed."""
+    cached = _cache.get(key)
+    if cached and cached[0] == _state_version:
+        return cached[1]
+
+    value = _builders[key]()
+    # Only kept when called from an update or a timer
+    _cache[key] = (_state_version, value)
+    return value
+
+
+def state_version() -> int:
+    return _state_version
+
+
+def invalidate_cached_responses() -> None:
+    """
+    Invalidates every cached response. Called by the storage on each write, so that no
+    change is missed, whichever endpoint or timer makes it.
+    """
+    global _state_version, _refresh_needed
+    _state_version += 1
+    _refresh_needed = True
+
+
+def schedule_refresh() -> None:
+    """
+    Arms the timer rebuilding the cached responses if the state changed since they were
+    built. Called at the end of update calls and timer callbacks; queries cannot arm timers.
+    """
+    global _refresh_scheduled
+    if _refresh_needed and not _refresh_scheduled and _builders:
+        ic.set_timer(0, _refresh_cached_responses)
+        _refresh_scheduled = True
+
+
+def _refresh_cached_responses() -> void:
+    """Timer callback rebuilding the cached responses invalidated since the last run."""
+    global _refresh_needed, _refresh_scheduled
+    _refresh_needed = False
+    _refresh_scheduled = False
+    for key in _builders:
+        try:
+            cached_response(key)
+        except Exception as e:
+            logger.error(
+                f"Error refreshing cached response '{key}': {e}\n{traceback.format_exc()}"
+            )
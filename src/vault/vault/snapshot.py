@@ -0,0 +1,86 @@
+from kybra import ic
+from kybra_simple_logging import get_logger
+
+from vault.candid_types import SnapshotImportRecord
+from vault.entities import Balance, VaultTransaction
+from vault.export import decode_balance_row, decode_transaction_row
+
+logger = get_logger(__name__)
+
+SNAPSHOT_IMPORT_IDLE = "Idle"
+SNAPSHOT_IMPORT_IN_PROGRESS = "InProgress"
+SNAPSHOT_IMPORT_COMPLETED = "Completed"
+SNAPSHOT_IMPORT_ABORTING = "Aborting"
+
+SNAPSHOT_KIND_TRANSACTIONS = "transactions"
+SNAPSHOT_KIND_BALANCES = "balances"
+
+SNAPSHOT_ABORT_JOB_KIND = "abort_snapshot_import"
+
+
+def _remap(principal_id: str, source_vault_id: str, canister_id: str) -> str:
+    # The exporting vault's own account becomes this vault's account
+    return canister_id if principal_id == source_vault_id else principal_id
+
+
+def import_transaction_rows(rows, source_vault_id: str, canister_id: str) -> int:
+    """
+    Stores exported transaction rows as they are, without touching the balances.
+
+    Rows already stored (e.g. when an interrupted import is resumed) are left unchanged.
+
+    Returns:
+        The highest transaction id among the rows, or -1 if there are none
+    """
+    last_tx_id = -1
+    for row in rows:
+        tx = decode_transaction_row(row)
+        tx_id = int(tx["id"])
+        last_tx_id = max(last_tx_id, tx_id)
+
+        if VaultTransaction[str(tx_id)]:
+            continue
+
+        VaultTransaction(
+            _id=str(tx_id),
+            principal_from=_remap(tx["principal_from"], source_vault_id, canister_id),
+            principal_to=_remap(tx["principal_to"], source_vault_id, canister_id),
+            amount=tx["amount"],
+            fee=tx["fee"],
+            timestamp=tx["timestamp"],
+            kind=tx["kind"],
+        )
+    return last_tx_id
+
+
+def import_balance_rows(rows, source_vault_id: str, canister_id: str) -> None:
+    """Sets balances to their exported amounts."""
+    for row in rows:
+        principal_id, amount = decode_balance_row(row)
+        principal_id = _remap(principal_id, source_vault_id, canister_id)
+        balance = Balance[principal_id] or Balance(_id=principal_id, amount=0)
+        if balance.amount != amount:
+            balance.amount = amount
+
+
+def reset_snapshot_import(snapshot) -> None:
+    """Returns an aborted import to Idle, so that a new one can be started."""
+    snapshot.status = SNAPSHOT_IMPORT_IDLE
+    snapshot.transactions_count = 0
+    snapshot.balances_count = 0
+    snapshot.transactions_hash = ""
+    snapshot.balances_hash = ""
+    snapshot.last_tx_id = -1
+    snapshot.finished_at = ic.time()
+
+
+def snapshot_import_record(snapshot) -> SnapshotImportRecord:
+    return SnapshotImportRecord(
+        status=snapshot.status,
+        transactions_count=snapshot.transactions_count,
+        balances_count=snapshot.balances_count,
+        transactions_hash=snapshot.transactions_hash,
+        balances_hash=snapshot.balances_hash,
+        started_at=snapshot.started_at,
+        finished_at=snapshot.finished_at,
+    )
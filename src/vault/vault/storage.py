@@ -0,0 +1,318 @@
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+from kybra_simple_db import Storage
+from kybra_simple_logging import get_logger
+
+logger = get_logger(__name__)
+
+# Key of the shared map recording that no entity of a partitioned type is left in it
+MIGRATED_KEY = "_partitioned_storage_migrated"
+
+# Key of the counts map recording that the counts cover every entity of the shared map
+COUNTED_KEY = "_counted"
+
+SEPARATOR = "@"
+
+
+def int_key(entity_id: str) -> bytes:
+    """Encodes an integer id as a fixed-width big-endian key, so keys sort numerically."""
+    return int(entity_id).to_bytes(8, "big")
+
+
+def int_id(key: bytes) -> str:
+    return str(int.from_bytes(key, "big"))
+
+
+def prefixed_int_key(entity_id: str) -> bytes:
+    """Encodes a "<prefix>|<integer>" id so keys sort by prefix, then numerically."""
+    prefix, _, number = entity_id.rpartition("|")
+    return prefix.encode("utf-8") + b"|" + int_key(number)
+
+
+def prefixed_int_id(key: bytes) -> str:
+    return f"{key[:-9].decode('utf-8')}|{int_id(key[-8:])}"
+
+
+def str_key(entity_id: str) -> str:
+    return entity_id
+
+
+def str_id(key: str) -> str:
+    return key
+
+
+class Partition:
+    """
+    A stable map holding the entities of a single type, keyed by their native id.
+
+    Args:
+        stable_map: The StableBTreeMap with its own memory id
+        encode_key: Converts an entity id (str) into the map's key
+        decode_key: Converts a map key back into the entity id (str)
+    """
+
+    def __init__(
+        self,
+        stable_map,
+        encode_key: Callable[[str], object] = str_key,
+        decode_key: Callable[[object], str] = str_id,
+    ):
+        self.stable_map = stable_map
+        self.encode_key = encode_key
+        self.decode_key = decode_key
+
+
+class PartitionedStorage(Storage):
+    """
+    Storage for kybra_simple_db that keeps some entity types in their own stable maps.
+
+    Keys are "<type>@<id>" as used by the database. Entities of a partitioned type are
+    stored in that type's map, so scanning one type no longer walks past all others,
+    while every other key stays in the shared map.
+
+    Entities written by earlier versions into the shared map are still found there
+    until `migrate_chunk` has moved them to their partition.
+
+    With a `counts_map`, the number of entities of each type held by the shared map is
+    kept up to date on every insert and removal, so it can be reported without a scan
+    (partitions are counted by their own map's length).
+
+    `on_write`, if given, is called after every insert and removal.
+    """
+
+    def __init__(
+        self,
+        shared_map,
+        partitions: Dict[str, Partition],
+        counts_map=None,
+        on_write: Optional[Callable[[], None]] = None,
+    ):
+        self._shared_map = shared_map
+        self._partitions = partitions
+        self._counts_map = counts_map
+        self._on_write = on_write
+        self._migrated: Optional[bool] = None
+        # Heap state: keys of each partitioned type left in the shared map, listed once
+        # per canister version while the migration is unfinished. Writes never add any.
+        self._unmigrated: Optional[Dict[str, List[str]]] = None
+        # Heap state: keys of the shared map left to count, listed by the first
+        # count_chunk of each canister version
+        self._uncounted: Optional[List[str]] = None
+
+    def _route(self, key: str):
+        type_name, _, entity_id = key.partition(SEPARATOR)
+        partition = self._partitions.get(type_name)
+        if partition is None:
+            return None, None
+        try:
+            return partition, partition.encode_key(entity_id)
+        except ValueError:
+            # Ids the partition cannot encode (e.g. non-numeric) stay in the shared map
+            return None, None
+
+    def is_migrated(self) -> bool:
+        if self._migrated is None:
+            self._migrated = self._shared_map.get(MIGRATED_KEY) == "1"
+        return self._migrated
+
+    def mark_migrated(self) -> None:
+        self._shared_map.insert(MIGRATED_KEY, "1")
+        self._migrated = True
+        self._unmigrated = None
+
+    def _unmigrated_keys(self) -> Dict[str, List[str]]:
+        """
+        Lists the keys of partitioned types still in the shared map, by type.
+
+        Stable maps can only list all their keys at once, so this is done once, then
+        the lists shrink as keys are migrated. Keys found in them may have been removed
+        since, and are checked before use.
+        """
+        if self._unmigrated is None:
+            self._unmigrated = {type_name: [] for type_name in self._partitions}
+            for key in self._shared_map.keys():
+                if self._route(key)[0] is not None:
+                    self._unmigrated[key.partition(SEPARATOR)[0]].append(key)
+        return self._unmigrated
+
+    def _count(self, key: str, delta: int) -> None:
+        type_name, separator, _ = key.partition(SEPARATOR)
+        if self._counts_map is None or not separator:
+            return
+        count = int(self._counts_map.get(type_name) or 0) + delta
+        self._counts_map.insert(type_name, str(count))
+
+    def _shared_insert(self, key: str, value: str) -> None:
+        if self._shared_map.insert(key, value) is None:
+            self._count(key, 1)
+
+    def _shared_remove(self, key: str) -> None:
+        if self._shared_map.remove(key) is not None:
+            self._count(key, -1)
+
+    def insert(self, key: str, value: str) -> None:
+        partition, partition_key = self._route(key)
+        if partition is None:
+            self._shared_insert(key, value)
+        else:
+            partition.stable_map.insert(partition_key, value)
+            if not self.is_migrated() and self._shared_map.contains_key(key):
+                self._shared_remove(key)
+        if self._on_write:
+            self._on_write()
+
+    def get(self, key: str) -> Optional[str]:
+        partition, partition_key = self._route(key)
+        if partition is None:
+            return self._shared_map.get(key)
+
+        value = partition.stable_map.get(partition_key)
+        if value is None and not self.is_migrated():
+            value = self._shared_map.get(key)
+        return value
+
+    def remove(self, key: str) -> None:
+        partition, partition_key = self._route(key)
+        if partition is not None:
+            partition.stable_map.remove(partition_key)
+        if partition is None or not self.is_migrated():
+            self._shared_remove(key)
+        if self._on_write:
+            self._on_write()
+
+    def __contains__(self, key: str) -> bool:
+        return self.get(key) is not None
+
+    def items(self) -> Iterator[Tuple[str, str]]:
+        for key in self.keys():
+            yield key, self.get(key)
+
+    def keys(self) -> Iterator[str]:
+        for key in self._shared_map.keys():
+            if not self.is_migrated() and self._route(key)[0] is not None:
+                # Not migrated yet; the partitions below may also hold a newer copy
+                partition, partition_key = self._route(key)
+                if partition.stable_map.contains_key(partition_key):
+                    continue
+            yield key
+        for type_name in self._partitions:
+            for entity_id in self._partition_ids(type_name):
+                yield f"{type_name}{SEPARATOR}{entity_id}"
+
+    def _partition_ids(self, type_name: str) -> List[str]:
+        partition = self._partitions[type_name]
+        return [partition.decode_key(key) for key in partition.stable_map.keys()]
+
+    def ids_for_type(self, type_name: str) -> List[str]:
+        """
+        Lists the ids of all entities of a type.
+
+        For partitioned types only that type's map is read, in key order (numeric order
+        for integer keys), instead of scanning every key of the database.
+        """
+        if type_name not in self._partitions:
+            return [
+                key.partition(SEPARATOR)[2]
+                for key in self._shared_map.keys()
+                if key.partition(SEPARATOR)[0] == type_name
+            ]
+
+        ids = self._partition_ids(type_name)
+        if not self.is_migrated():
+            known_ids = set(ids)
+            for key in self._unmigrated_keys()[type_name]:
+                entity_id = key.partition(SEPARATOR)[2]
+                if entity_id not in known_ids and self._shared_map.contains_key(key):
+                    ids.append(entity_id)
+        return ids
+
+    def partition_len(self, type_name: str) -> int:
+        return self._partitions[type_name].stable_map.len()
+
+    def partition_types(self) -> List[str]:
+        return list(self._partitions)
+
+    def shared_counts_complete(self) -> bool:
+        return self._counts_map.get(COUNTED_KEY) == "1"
+
+    def mark_counted(self) -> None:
+        self._counts_map.insert(COUNTED_KEY, "1")
+        self._uncounted = None
+
+    def count_chunk(self, max_keys: int) -> Tuple[int, bool]:
+        """
+        Counts up to `max_keys` entities of the shared map, for maps written before the
+        counts were maintained.
+
+        The first chunk of each canister version resets the counts and lists the keys.
+        Writes keep adjusting the counts meanwhile, so every listed key is counted, even
+        one removed since: its removal was already subtracted.
+
+        Returns:
+            Tuple of (number of entities counted, whether the counts are complete)
+        """
+        if self.shared_counts_complete():
+            return 0, True
+
+        if self._uncounted is None:
+            for type_name in list(self._counts_map.keys()):
+                self._counts_map.remove(type_name)
+            self._uncounted = [
+                key for key in self._shared_map.keys() if SEPARATOR in key
+            ]
+
+        keys = [
+            self._uncounted.pop() for _ in range(min(max_keys, len(self._uncounted)))
+        ]
+        counts: Dict[str, int] = {}
+        for key in keys:
+            type_name = key.partition(SEPARATOR)[0]
+            counts[type_name] = counts.get(type_name, 0) + 1
+        for type_name, count in counts.items():
+            count += int(self._counts_map.get(type_name) or 0)
+            self._counts_map.insert(type_name, str(count))
+
+        if self._uncounted:
+            return len(keys), False
+        self.mark_counted()
+        logger.info("Counted the entities of the shared map")
+        return len(keys), True
+
+    def shared_counts(self) -> Dict[str, int]:
+        """Returns the number of entities of each type held by the shared map."""
+        return {
+            type_name: int(count)
+            for type_name, count in self._counts_map.items()
+            if type_name != COUNTED_KEY and int(count)
+        }
+
+    def migrate_chunk(self, max_keys: int) -> Tuple[int, bool]:
+        """
+        Moves up to `max_keys` entities of partitioned types out of the shared map.
+
+        Returns:
+            Tuple of (number of entities moved, whether the migration is complete)
+        """
+        if self.is_migrated():
+            return 0, True
+
+        moved = 0
+        for keys in self._unmigrated_keys().values():
+            while keys:
+                if moved >= max_keys:
+                    return moved, False
+
+                key = keys.pop()
+                value = self._shared_map.get(key)
+                if value is None:
+                    # Removed since the keys were listed
+                    continue
+                partition, partition_key = self._route(key)
+                if not partition.stable_map.contains_key(partition_key):
+                    partition.stable_map.insert(partition_key, value)
+                self._shared_remove(key)
+                moved += 1
+
+        logger.info("All partitioned entities moved out of the shared stable map")
+        self.mark_migrated()
+        return moved, True
@@ -0,0 +1,134 @@
+from typing import Dict, List, Optional
+
+from kybra import ic
+
+from vault.constants import (
+    GROWTH_WINDOW_NS,
+    STABLE_MEMORY_CAPACITY_BYTES,
+    WASM_PAGE_SIZE,
+)
+from vault.entities import app_data
+
+DAY_NS = 86_400_000_000_000
+
+# (name, memory id, stable map, max key size, max value size) of every stable map
+_regions: List[tuple] = []
+
+
+def register_region(
+    name: str, memory_id: int, stable_map, max_key_size: int, max_value_size: int
+) -> None:
+    """
+    Lists a stable map in the storage report.
+
+    Entries of a StableBTreeMap are allocated with the map's maximum key and value sizes,
+    so rows times their sum approximates the stable memory the map uses.
+    """
+    _regions.append((name, memory_id, stable_map, max_key_size, max_value_size))
+
+
+def region_reports() -> List[dict]:
+    return [
+        {
+            "name": name,
+            "memory_id": memory_id,
+            "rows": stable_map.len(),
+            "approx_bytes": stable_map.len() * (max_key_size + max_value_size),
+        }
+        for name, memory_id, stable_map, max_key_size, max_value_size in _regions
+    ]
+
+
+def entity_reports(db_storage, shared_memory_id: int) -> List[dict]:
+    """
+    Lists the rows and approximate size of each entity type, from the lengths of the
+    partitions and the counts kept by the shared map.
+
+    Args:
+        db_storage: The PartitionedStorage of the database
+        shared_memory_id: The memory id of its shared map
+    """
+    entry_sizes = {memory_id: key + value for _, memory_id, _, key, value in _regions}
+    partition_memory_ids = {
+        name: memory_id
+        for name, memory_id, *_ in _regions
+        if name in db_storage.partition_types()
+    }
+
+    # Entities of partitioned types written by earlier versions may still be in the
+    # shared map until migrated
+    rows: Dict[str, int] = db_storage.shared_counts()
+    for type_name in db_storage.partition_types():
+        rows[type_name] = rows.get(type_name, 0) + db_storage.partition_len(type_name)
+
+    reports = []
+    for type_name, count in sorted(rows.items()):
+        memory_id = partition_memory_ids.get(type_name, shared_memory_id)
+        reports.append(
+            {
+                "entity": type_name,
+                "memory_id": memory_id,
+                "rows": count,
+                "approx_bytes": count * entry_sizes[memory_id],
+            }
+        )
+    return reports
+
+
+def record_sync_growth(new_txs_count: int, now: int) -> None:
+    """
+    Adds the transactions stored by a sync to the growth window. Once the window spans
+    GROWTH_WINDOW_NS, its rate becomes the growth estimate and a new window starts.
+    """
+    state = app_data()
+    if not state.growth_window_start:
+        state.growth_window_start = now
+    if new_txs_count:
+        state.growth_window_txs += new_txs_count
+
+    elapsed = now - state.growth_window_start
+    if elapsed >= GROWTH_WINDOW_NS:
+        state.growth_txs_per_day = state.growth_window_txs * DAY_NS // elapsed
+        state.growth_window_start = now
+        state.growth_window_txs = 0
+
+
+def transactions_per_day(now: int) -> int:
+    """
+    Estimates how many transactions syncs store per day: the rate of the last full
+    window, or of the current one until a window has completed.
+    """
+    state = app_data()
+    if state.growth_txs_per_day or not state.growth_window_start:
+        return state.growth_txs_per_day
+    elapsed = now - state.growth_window_start
+    return state.growth_window_txs * DAY_NS // elapsed if elapsed > 0 else 0
+
+
+def stable_memory_bytes() -> int:
+    return ic.stable64_size() * WASM_PAGE_SIZE
+
+
+def growth_estimate(
+    now: int, transactions_count: int, total_bytes: int
+) -> Dict[str, Optional[int]]:
+    """
+    Estimates the stable memory growth from the sync rate, assuming every stored
+    transaction costs the current average of all regions per transaction (indexes and
+    balances included).
+
+    Returns:
+        Dictionary with transactions_per_day, bytes_per_day and days_until_full (None
+        when nothing grows)
+    """
+    txs_per_day = transactions_per_day(now)
+    bytes_per_transaction = (
+        total_bytes // transactions_count if transactions_count else 0
+    )
+    bytes_per_day = txs_per_day * bytes_per_transaction
+    free_bytes = max(0, STABLE_MEMORY_CAPACITY_BYTES - stable_memory_bytes())
+    return {
+        "transactions_per_day": txs_per_day,
+        "bytes_per_day": bytes_per_day,
+        "days_until_full": free_bytes // bytes_per_day if bytes_per_day else None,
+    }
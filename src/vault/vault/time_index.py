@@ -0,0 +1,215 @@
+from typing import List, Optional, Tuple
+
+from kybra_simple_logging import get_logger
+
+from vault.constants import TIME_INDEX_BUCKET_NS
+from vault.jobs import running_job
+
+logger = get_logger(__name__)
+
+# Scope of the index entries covering every transaction of the vault
+VAULT_SCOPE = "*"
+
+# Keys recording whether transactions stored before the index existed are indexed
+BUILT_KEY = "_built"
+BUILD_END_KEY = "_build_end"
+
+TIME_INDEX_JOB_KIND = "build_time_index"
+
+_index_map = None
+
+
+def init_time_index(stable_map) -> None:
+    """
+    Sets the stable map holding the time index.
+
+    The index groups transaction ids into buckets of TIME_INDEX_BUCKET_NS, per scope
+    (the whole vault, or one principal), using only point lookups:
+
+        "<scope>|<bucket>"             -> number of entries in the bucket
+        "<scope>|<bucket>|<position>"  -> transaction id
+    """
+    global _index_map
+    _index_map = stable_map
+
+
+def bucket_of(timestamp: int) -> int:
+    return timestamp // TIME_INDEX_BUCKET_NS
+
+
+def _count_key(scope: str, bucket: int) -> str:
+    return f"{scope}|{bucket}"
+
+
+def _entry_key(scope: str, bucket: int, position: int) -> str:
+    return f"{scope}|{bucket}|{position}"
+
+
+def _bucket_count(scope: str, bucket: int) -> int:
+    count = _index_map.get(_count_key(scope, bucket))
+    return int(count) if count else 0
+
+
+def _append(scope: str, bucket: int, tx_id: int) -> None:
+    position = _bucket_count(scope, bucket)
+    _index_map.insert(_entry_key(scope, bucket, position), str(tx_id))
+    _index_map.insert(_count_key(scope, bucket), str(position + 1))
+
+
+def index_transaction(
+    tx_id: int, timestamp: int, principal_from: str, principal_to: str
+) -> None:
+    """Adds a transaction to the vault-wide index and to those of its principals."""
+    bucket = bucket_of(timestamp)
+    _append(VAULT_SCOPE, bucket, tx_id)
+    for principal_id in {principal_from, principal_to}:
+        _append(principal_id, bucket, tx_id)
+
+
+def index_new_transaction(
+    tx_id: int, timestamp: int, principal_from: str, principal_to: str
+) -> None:
+    """
+    Indexes a newly stored transaction, unless the index build still has to reach it.
+
+    While the index of an existing history is being built, transactions up to the
+    build's end are indexed by the build itself, so they are not listed twice.
+    """
+    if _left_to_build(tx_id):
+        return
+
+    index_transaction(tx_id, timestamp, principal_from, principal_to)
+
+
+def index_new_principals(tx_id: int, timestamp: int, principal_ids) -> None:
+    """
+    Adds an indexed transaction to the indexes of principals it was not stored with.
+    Its entries under its former principals are left, as lookups check the principals.
+    """
+    if _left_to_build(tx_id):
+        return
+
+    bucket = bucket_of(timestamp)
+    for principal_id in principal_ids:
+        _append(principal_id, bucket, tx_id)
+
+
+def _left_to_build(tx_id: int) -> bool:
+    """Returns True if the running index build has yet to index the transaction."""
+    if time_index_built():
+        return False
+    build = running_job(TIME_INDEX_JOB_KIND)
+    build_cursor = build.cursor if build else -1
+    return build_cursor < int(tx_id) <= time_index_build_end()
+
+
+def find_transaction_ids(
+    scope: str,
+    start_ns: int,
+    end_ns: int,
+    cursor: Optional[Tuple[int, int]],
+    limit: int,
+    max_buckets: int,
+) -> Tuple[List[int], Optional[Tuple[int, int]]]:
+    """
+    Lists the ids of the transactions indexed in the buckets overlapping [start_ns, end_ns].
+
+    Buckets are visited in ascending time order; within a bucket ids are listed in the
+    order they were indexed. The caller filters out transactions outside the exact range.
+
+    Args:
+        scope: VAULT_SCOPE or a principal id
+        start_ns: Start of the time range (inclusive)
+        end_ns: End of the time range (inclusive)
+        cursor: (bucket, position) to continue from, as returned by a previous call
+        limit: Maximum number of ids returned
+        max_buckets: Maximum number of buckets visited, bounding the cost of sparse ranges
+
+    Returns:
+        Tuple of (transaction ids, cursor of the next page or None if the range is done)
+    """
+    bucket, position = cursor if cursor else (bucket_of(start_ns), 0)
+    last_bucket = bucket_of(end_ns)
+    tx_ids = []
+    visited_buckets = 0
+
+    while bucket <= last_bucket:
+        if visited_buckets >= max_buckets:
+            return tx_ids, (bucket, position)
+        visited_buckets += 1
+
+        count = _bucket_count(scope, bucket)
+        while position < count:
+            if len(tx_ids) >= limit:
+                return tx_ids, (bucket, position)
+            tx_id = _index_map.get(_entry_key(scope, bucket, position))
+            if tx_id is not None:
+                tx_ids.append(int(tx_id))
+            position += 1
+
+        bucket += 1
+        position = 0
+
+    return tx_ids, None
+
+
+def last_transaction_id_at(
+    timestamp: int, max_buckets: int, load_timestamp
+) -> Optional[int]:
+    """
+    Finds the highest id of the transactions indexed with a timestamp up to `timestamp`.
+
+    Searches the vault-wide buckets backwards, starting with the bucket of `timestamp`.
+
+    Args:
+        timestamp: The timestamp in nanoseconds
+        max_buckets: Maximum number of buckets searched
+        load_timestamp: Returns the timestamp of a stored transaction id, or None if the
+            transaction is no longer stored
+
+    Returns:
+        The transaction id, or None if no transaction was found within `max_buckets`
+    """
+    bucket = bucket_of(timestamp)
+    for _ in range(max_buckets):
+        if bucket < 0:
+            break
+        found_tx_id = None
+        for position in range(_bucket_count(VAULT_SCOPE, bucket)):
+            tx_id = _index_map.get(_entry_key(VAULT_SCOPE, bucket, position))
+            if tx_id is None or (found_tx_id is not None and int(tx_id) <= found_tx_id):
+                continue
+            tx_timestamp = load_timestamp(int(tx_id))
+            if tx_timestamp is not None and tx_timestamp <= timestamp:
+                found_tx_id = int(tx_id)
+        if found_tx_id is not None:
+            return found_tx_id
+        bucket -= 1
+    return None
+
+
+def time_index_built() -> bool:
+    return _index_map.get(BUILT_KEY) == "1"
+
+
+def time_index_build_end() -> int:
+    end = _index_map.get(BUILD_END_KEY)
+    return int(end) if end else -1
+
+
+def mark_time_index_built() -> None:
+    _index_map.insert(BUILT_KEY, "1")
+
+
+def start_time_index_build(end_tx_id: int) -> None:
+    """Records that transactions up to `end_tx_id` are left to the index build."""
+    _index_map.insert(BUILD_END_KEY, str(end_tx_id))
+    _index_map.remove(BUILT_KEY)
+
+
+def clear_time_index_chunk(max_keys: int) -> bool:
+    """Removes up to `max_keys` index entries. Returns True once the index is empty."""
+    keys = [key for key in _index_map.keys() if not key.startswith("_")]
+    for key in keys[:max_keys]:
+        _index_map.remove(key)
+    return len(keys) <= max_keys
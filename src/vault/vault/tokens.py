@@ -0,0 +1,132 @@
+from typing import Dict, List, Optional, Tuple
+
+from vault.constants import CANISTER_PRINCIPALS
+from vault.entities import (
+    Balance,
+    Canisters,
+    Token,
+    TokenBalance,
+    app_data,
+    entity_ids,
+)
+
+# The token whose transactions and balances are the VaultTransaction and Balance tables,
+# and whose sync state is kept in ApplicationData
+PRIMARY_TOKEN = next(iter(CANISTER_PRINCIPALS))
+
+# Characters reserved by the keys of token transactions and balances, and by the names
+# of the token's canisters
+SYMBOL_RESERVED_CHARACTERS = ("|", "@", " ")
+
+
+def token_symbols() -> List[str]:
+    """Lists the primary token followed by the registered tokens."""
+    return [PRIMARY_TOKEN] + sorted(entity_ids(Token))
+
+
+def token_exists(symbol: str) -> bool:
+    return symbol == PRIMARY_TOKEN or bool(Token[symbol])
+
+
+def token_ledger(symbol: str) -> str:
+    return Canisters[f"{symbol} ledger"].principal
+
+
+def token_indexer(symbol: str) -> str:
+    return Canisters[f"{symbol} indexer"].principal
+
+
+def token_sync_state(symbol: str):
+    """
+    Returns the entity holding the scan cursors and backoff state of a token.
+
+    Both ApplicationData (for the primary token) and Token have the same fields.
+    """
+    return app_data() if symbol == PRIMARY_TOKEN else Token[symbol]
+
+
+def token_transaction_id(symbol: str, tx_id: int) -> str:
+    return f"{symbol}|{tx_id}"
+
+
+class TokenBalances:
+    """
+    The balances of a registered token, keyed by principal like the Balance entity.
+
+    Can be passed as the balance_cls of vault.accounting.apply_transaction.
+    """
+
+    def __init__(self, symbol: str):
+        self.symbol = symbol
+
+    def __getitem__(self, principal_id: str) -> Optional[TokenBalance]:
+        return TokenBalance[f"{self.symbol}|{principal_id}"]
+
+    def __call__(self, _id: str, amount: int = 0) -> TokenBalance:
+        return TokenBalance(_id=f"{self.symbol}|{_id}", amount=amount)
+
+
+def token_balances(symbol: str):
+    """Returns the balance namespace of a token: Balance, or the token's TokenBalances."""
+    return Balance if symbol == PRIMARY_TOKEN else TokenBalances(symbol)
+
+
+def sync_backlog(state) -> Optional[int]:
+    """
+    Estimates how far a token's sync is from the oldest transaction left to fetch.
+
+    The estimate is the gap in ledger ids still to walk back, so it only compares tokens
+    roughly. Returns None for a token that has never been synced.
+    """
+    if not state.scan_oldest_tx_id:
+        return None
+    return max(0, state.scan_start_tx_id - state.scan_oldest_tx_id)
+
+
+def share_sync_budget(
+    budget: int, backlogs: List[Tuple[str, Optional[int]]], start: int = 0
+) -> Dict[str, int]:
+    """
+    Splits the indexer fetches of a sync call between accounts (tokens or deposit
+    subaccounts).
+
+    Every account gets one fetch, taking turns from position `start` when there are more
+    accounts than fetches, so that new transactions are noticed on all of them. The rest
+    of the budget is shared in proportion to the backlogs, so an account with a long
+    history to walk back gets more fetches without starving the others. An account never
+    synced is weighted like the largest known backlog.
+
+    Args:
+        budget: Number of indexer fetches of the call
+        backlogs: List of (account, backlog as returned by sync_backlog)
+        start: Position of the first account to get a fetch
+
+    Returns:
+        Dictionary of account to number of fetches
+    """
+    order = [backlogs[(start + i) % len(backlogs)] for i in range(len(backlogs))]
+    shares = {account: 0 for account, _ in order}
+    for account, _ in order[:budget]:
+        shares[account] = 1
+
+    remaining = budget - min(budget, len(order))
+    largest_backlog = max((backlog or 0 for _, backlog in order), default=0) or 1
+    weights = [
+        (account, largest_backlog if backlog is None else backlog)
+        for account, backlog in order
+        if backlog != 0
+    ]
+    total = sum(weight for _, weight in weights)
+    if not remaining or not total:
+        return shares
+
+    # Largest remainder method, with integers as backlogs can be large
+    remainders = []
+    for account, weight in weights:
+        share, remainder = divmod(remaining * weight, total)
+        shares[account] += share
+        remainders.append((remainder, account))
+    left = remaining - sum(remaining * weight // total for _, weight in weights)
+    for _, account in sorted(remainders, key=lambda item: -item[0])[:left]:
+        shares[account] += 1
+    return shares
@@ -0,0 +1,246 @@
+import traceback
+from typing import Callable, List, Optional, Tuple
+
+from kybra import Principal, ic, void
+from kybra_simple_logging import get_logger
+
+from vault.candid_types import WithdrawalRecord
+from vault.constants import (
+    WITHDRAWAL_MAX_ATTEMPTS,
+    WITHDRAWAL_MAX_IN_FLIGHT,
+    WITHDRAWAL_PAGE_MAX_SCAN,
+    WITHDRAWAL_RETRY_BASE_NS,
+    WITHDRAWAL_RETRY_MAX_NS,
+)
+from vault.entities import Withdrawal, withdrawal_queue_data
+
+logger = get_logger(__name__)
+
+WITHDRAWAL_STATUS_PENDING = "Pending"
+WITHDRAWAL_STATUS_IN_FLIGHT = "InFlight"
+WITHDRAWAL_STATUS_COMPLETED = "Completed"
+WITHDRAWAL_STATUS_FAILED = "Failed"
+WITHDRAWAL_STATUS_CANCELLED = "Cancelled"
+
+ACTIVE_WITHDRAWAL_STATUSES = (WITHDRAWAL_STATUS_PENDING, WITHDRAWAL_STATUS_IN_FLIGHT)
+
+# Heap state: timers do not survive an upgrade, so neither does the drain timer
+_drain_timer = None
+_drain_at = 0
+_sender: Optional[Callable[[str], Callable[[], void]]] = None
+
+
+def init_withdrawals(sender: Callable[[str], Callable[[], void]]) -> None:
+    """
+    Sets the function returning the timer callback that sends one in-flight withdrawal,
+    given its id. The callback records the outcome, then calls schedule_withdrawals.
+    """
+    global _sender
+    _sender = sender
+
+
+def create_withdrawal(
+    token: str, principal: str, amount: int, requested_by: str
+) -> Withdrawal:
+    queue = withdrawal_queue_data()
+    withdrawal_id = queue.last_id + 1
+    queue.last_id = withdrawal_id
+
+    withdrawal = Withdrawal(
+        _id=str(withdrawal_id),
+        token=token,
+        principal=principal,
+        amount=amount,
+        requested_by=requested_by,
+        created_at=ic.time(),
+    )
+    logger.info(
+        f"Queued withdrawal {withdrawal_id} of {amount} {token} tokens to {principal}"
+    )
+    return withdrawal
+
+
+def get_withdrawal(withdrawal_id: int) -> Optional[Withdrawal]:
+    return Withdrawal[str(withdrawal_id)]
+
+
+def active_withdrawals() -> List[Withdrawal]:
+    """Lists the pending and in-flight withdrawals, in id order."""
+    queue = withdrawal_queue_data()
+    withdrawals = []
+    for withdrawal_id in range(queue.head_id, queue.last_id + 1):
+        withdrawal = Withdrawal[str(withdrawal_id)]
+        if withdrawal and withdrawal.status in ACTIVE_WITHDRAWAL_STATUSES:
+            withdrawals.append(withdrawal)
+    return withdrawals
+
+
+def _advance_head() -> None:
+    """Moves the head of the queue past the withdrawals that are finished."""
+    queue = withdrawal_queue_data()
+    head_id = queue.head_id
+    while head_id <= queue.last_id:
+        withdrawal = Withdrawal[str(head_id)]
+        if withdrawal and withdrawal.status in ACTIVE_WITHDRAWAL_STATUSES:
+            break
+        head_id += 1
+    if head_id != queue.head_id:
+        queue.head_id = head_id
+
+
+def mark_withdrawal_cancelled(withdrawal: Withdrawal) -> None:
+    withdrawal.status = WITHDRAWAL_STATUS_CANCELLED
+    withdrawal.finished_at = ic.time()
+    logger.info(f"Cancelled withdrawal {withdrawal._id}")
+
+
+def record_withdrawal_sent(withdrawal: Withdrawal, block_id: int) -> None:
+    withdrawal.status = WITHDRAWAL_STATUS_COMPLETED
+    withdrawal.block_id = block_id
+    withdrawal.error = ""
+    withdrawal.finished_at = ic.time()
+    logger.info(f"Withdrawal {withdrawal._id} sent in ledger block {block_id}")
+
+
+def record_withdrawal_failure(
+    withdrawal: Withdrawal, error: str, retry: bool = True
+) -> None:
+    """
+    Records a failed attempt. The withdrawal is retried with exponential backoff, until
+    WITHDRAWAL_MAX_ATTEMPTS attempts have failed or `retry` is False.
+    """
+    withdrawal.error = error
+    if retry and withdrawal.attempts < WITHDRAWAL_MAX_ATTEMPTS:
+        delay = min(
+            WITHDRAWAL_RETRY_BASE_NS * 2 ** (withdrawal.attempts - 1),
+            WITHDRAWAL_RETRY_MAX_NS,
+        )
+        withdrawal.status = WITHDRAWAL_STATUS_PENDING
+        withdrawal.retry_after = ic.time() + delay
+        logger.warning(
+            f"Withdrawal {withdrawal._id} failed {withdrawal.attempts} time(s): {error}"
+        )
+        return
+
+    withdrawal.status = WITHDRAWAL_STATUS_FAILED
+    withdrawal.finished_at = ic.time()
+    logger.error(
+        f"Withdrawal {withdrawal._id} failed after {withdrawal.attempts} attempt(s): {error}"
+    )
+
+
+def requeue_in_flight_withdrawals() -> None:
+    """
+    Puts back in the queue the withdrawals whose send timer was dropped by an upgrade.
+    Sending them again is safe: the retry reuses the fee and created_at_time of the
+    first attempt, so the ledger rejects a transfer it already made as a Duplicate.
+    """
+    for withdrawal in active_withdrawals():
+        if withdrawal.status == WITHDRAWAL_STATUS_IN_FLIGHT:
+            withdrawal.status = WITHDRAWAL_STATUS_PENDING
+
+
+def _drain_withdrawals() -> void:
+    """
+    Timer callback starting the sends of the withdrawals that are due, so that at most
+    WITHDRAWAL_MAX_IN_FLIGHT wait for the ledger at the same time. Each send runs in its
+    own timer, so a slow ledger call does not hold up the others.
+    """
+    global _drain_timer
+    _drain_timer = None
+
+    try:
+        _advance_head()
+        now = ic.time()
+        active = active_withdrawals()
+        slots = WITHDRAWAL_MAX_IN_FLIGHT - sum(
+            1 for w in active if w.status == WITHDRAWAL_STATUS_IN_FLIGHT
+        )
+        due = [
+            w
+            for w in active
+            if w.status == WITHDRAWAL_STATUS_PENDING and w.retry_after <= now
+        ]
+        for withdrawal in due[: max(slots, 0)]:
+            withdrawal.status = WITHDRAWAL_STATUS_IN_FLIGHT
+            withdrawal.attempts += 1
+            ic.set_timer(0, _sender(withdrawal._id))
+    except Exception as e:
+        logger.error(f"Error draining withdrawals: {e}\n{traceback.format_exc()}")
+
+    schedule_withdrawals()
+
+
+def schedule_withdrawals() -> None:
+    """
+    Arms the drain timer for when the next pending withdrawal is due, unless every
+    in-flight slot is taken: the send that frees one schedules the drain again.
+    """
+    global _drain_timer, _drain_at
+
+    active = active_withdrawals()
+    in_flight = sum(1 for w in active if w.status == WITHDRAWAL_STATUS_IN_FLIGHT)
+    retry_times = [
+        w.retry_after for w in active if w.status == WITHDRAWAL_STATUS_PENDING
+    ]
+    if not retry_times or in_flight >= WITHDRAWAL_MAX_IN_FLIGHT:
+        return
+
+    now = ic.time()
+    due_at = max(now, min(retry_times))
+    if _drain_timer is not None:
+        if _drain_at <= due_at:
+            return
+        ic.clear_timer(_drain_timer)
+
+    delay_seconds = -(-(due_at - now) // 1_000_000_000)
+    _drain_timer = ic.set_timer(delay_seconds, _drain_withdrawals)
+    _drain_at = now + delay_seconds * 1_000_000_000
+
+
+def withdrawals_page(
+    principal: Optional[str], cursor: Optional[int], limit: int
+) -> Tuple[List[Withdrawal], Optional[int]]:
+    """
+    Lists withdrawals, newest first, starting from id `cursor` (the newest if None).
+
+    When filtering by recipient, at most WITHDRAWAL_PAGE_MAX_SCAN withdrawals are looked
+    at, so a page can come back short with a next cursor.
+
+    Returns:
+        Tuple of (withdrawals, id to continue from, or None after the oldest)
+    """
+    last_id = withdrawal_queue_data().last_id
+    withdrawal_id = last_id if cursor is None else min(cursor, last_id)
+    withdrawals = []
+    scanned = 0
+    while (
+        withdrawal_id >= 1
+        and len(withdrawals) < limit
+        and scanned < WITHDRAWAL_PAGE_MAX_SCAN
+    ):
+        withdrawal = Withdrawal[str(withdrawal_id)]
+        if withdrawal and (principal is None or withdrawal.principal == principal):
+            withdrawals.append(withdrawal)
+        withdrawal_id -= 1
+        scanned += 1
+
+    return withdrawals, withdrawal_id if withdrawal_id >= 1 else None
+
+
+def withdrawal_record(withdrawal: Withdrawal) -> WithdrawalRecord:
+    return WithdrawalRecord(
+        id=int(withdrawal._id),
+        token=withdrawal.token,
+        principal=Principal.from_str(withdrawal.principal),
+        amount=withdrawal.amount,
+        requested_by=Principal.from_str(withdrawal.requested_by),
+        status=withdrawal.status,
+        attempts=withdrawal.attempts,
+        retry_after=withdrawal.retry_after,
+        block_id=withdrawal.block_id if withdrawal.block_id >= 0 else None,
+        fee=withdrawal.fee if withdrawal.fee >= 0 else None,
+        error=withdrawal.error or None,
+        created_at=withdrawal.created_at,
+        finished_at=withdrawal.finished_at,
+    )
@@ -7,14 +7,24 @@ from kybra import (
     CallResult,
     Principal,
     Record,
+    Vec,
     ic,
+    nat,
+    query,
     update,
+    void,
 )
 from vault_candid_types import (
+    NotificationBatchRecord,
+    NotificationRecord,
     Response,
     Vault,
 )
 
+# Vault subscribed to, and the transactions it pushed (kept on the heap for the example)
+subscribed_vault = {}
+received_notifications = []
+
 
 # Define test results container
 class VaultTestResults(Record):
@@ -105,3 +115,45 @@ def run_vault_tests(vault_canister_id: Principal) -> Async[VaultTestResults]:
         balance_response=balance_response,
         transactions_response=transactions_response,
     )
+
+
+@update
+def subscribe_to_vault(
+    vault_canister_id: Principal, min_amount: nat
+) -> Async[Response]:
+    """Subscribe to the vault's notifications of transactions of at least `min_amount`.
+
+    The vault then calls on_vault_notification after each sync batch with the new
+    matching transactions, so no polling loop is needed.
+    """
+    vault = Vault(vault_canister_id)
+    result: CallResult[Response] = yield vault.subscribe(
+        "on_vault_notification", None, min_amount, None
+    )
+    if result.Err is not None:
+        raise Exception(f"Error from vault: {result.Err}")
+
+    subscribed_vault["principal"] = vault_canister_id.to_str()
+    return result.Ok
+
+
+@update
+def on_vault_notification(batch: NotificationBatchRecord) -> void:
+    """Receives the transactions pushed by the vault."""
+    if ic.caller().to_str() != subscribed_vault.get("principal"):
+        return
+
+    if batch["missed"]:
+        # Notifications were dropped: catch up with get_transactions
+        ic.print(f"Missed {batch['missed']} notifications")
+    for notification in batch["notifications"]:
+        ic.print(
+            f"Transaction {notification['id']}: {notification['amount']} {notification['token']} "
+            f"from {notification['principal_from']} to {notification['principal_to']}"
+        )
+    received_notifications.extend(batch["notifications"])
+
+
+@query
+def get_received_notifications() -> Vec[NotificationRecord]:
+    return received_notifications
@@ -1,5 +1,6 @@
 from kybra import (
     Async,
+    Opt,
     Principal,
     Record,
     Service,
@@ -56,12 +57,46 @@ class TransactionSummaryRecord(Record):
     scan_end_tx_id: nat
 
 
+class NotificationRecord(Record):
+    token: text
+    id: nat
+    timestamp: nat64
+    kind: text
+    principal_from: text
+    principal_to: text
+    amount: nat
+
+
+class NotificationBatchRecord(Record):
+    batch_seq: nat
+    missed: nat
+    notifications: Vec[NotificationRecord]
+
+
+class SubscriptionRecord(Record):
+    subscriber: Principal
+    method: text
+    principal: Opt[Principal]
+    min_amount: nat
+    kind: Opt[text]
+    since: nat64
+    active: bool
+    pending: nat
+    matched_count: nat
+    delivered_count: nat
+    dropped_count: nat
+    consecutive_failures: nat
+    retry_after: nat64
+    last_error: Opt[text]
+
+
 class ResponseData(Variant, total=False):
     TransactionId: TransactionIdRecord
     TransactionSummary: TransactionSummaryRecord
     Balance: BalanceRecord
     Transactions: Vec[TransactionRecord]
     Stats: StatsRecord
+    Subscription: SubscriptionRecord
     Error: text
     Message: text
 
@@ -84,3 +119,12 @@ class Vault(Service):
 
     @service_update
     def transfer(self, principal: Principal, amount: nat) -> Async[Response]: ...
+
+    @service_update
+    def subscribe(
+        self,
+        method: text,
+        principal: Opt[Principal],
+        min_amount: Opt[nat],
+        kind: Opt[text],
+    ) -> Response: ...
@@ -10,11 +10,13 @@ import sys
 import subprocess
 import shutil
 import json
+import time
 
 # Add the parent directory to the Python path to make imports work
 sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 # isort: on
 
+from tests.test_cases.transfer_tests import transfer_to_vault
 from tests.utils.colors import print_error, print_ok
 from tests.utils.command import (
     deploy_ckbtc_indexer,
@@ -131,6 +133,47 @@ def run_external_canister_tests():
     return True
 
 
+def run_notification_tests():
+    """Test that the vault pushes new transactions to a subscribed canister."""
+    print("\n=== Running notification tests ===")
+
+    vault_canister_id = run_command("dfx canister id vault")
+    subscribe_result = run_command(
+        f"dfx canister call external subscribe_to_vault '(principal \"{vault_canister_id}\", 1000)' --output json"
+    )
+    if not subscribe_result or not json.loads(subscribe_result).get("success"):
+        print_error(f"Failed to subscribe the external canister: {subscribe_result}")
+        return False
+    print_ok("External canister subscribed to the vault")
+
+    # Only the second transfer reaches the subscription's minimum amount
+    for amount in (500, 5000):
+        _, success = transfer_to_vault(amount)
+        if not success:
+            return False
+
+    for _ in range(10):
+        time.sleep(2)
+        update_transaction_history()
+        received = json.loads(
+            run_command(
+                "dfx canister call external get_received_notifications --output json"
+            )
+        )
+        if received:
+            break
+
+    amounts = [int(str(n["amount"]).replace("_", "")) for n in received]
+    if amounts != [5000]:
+        print_error(
+            f"Expected a notification of the 5000 transfer only, got {received}"
+        )
+        return False
+
+    print_ok("Vault notified the subscribed canister of the matching transfer")
+    return True
+
+
 def main():
     """Run the external canister integration tests."""
     try:
@@ -163,6 +206,11 @@ def main():
         #     print_error("External canister tests failed")
         #     return 1
 
+        # 5. Check that the vault pushes new transactions to the external canister
+        if not run_notification_tests():
+            print_error("Notification tests failed")
+            return 1
+
         print("\n=== All External Canister Tests Completed Successfully ===")
         return 0
 
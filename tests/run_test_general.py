@@ -3,7 +3,6 @@
 Main test runner for the vault canister tests.
 """
 
-
 # isort: off
 import traceback
 import os
@@ -16,11 +15,14 @@ sys.path.insert(0, os.path.abspath(os.path.dirname(os.path.dirname(__file__))))
 
 from tests.test_cases.deployment_tests import (
     test_deploy_vault_without_params,
+    test_reconcile_balances,
     test_set_admin,
     test_set_canisters,
+    test_sync_error_reported_in_status,
     test_upgrade,
 )
 from tests.test_cases.transaction_tests import (
+    test_deposit_then_sync,
     test_get_transactions_nonexistent_user,
     test_transaction_ordering,
     test_transaction_validity,
@@ -28,6 +30,7 @@ from tests.test_cases.transaction_tests import (
 from tests.test_cases.transfer_tests import (
     test_exceed_balance_transfer,
     test_negative_amount_transfer,
+    test_withdraw_subaccount_deposit,
     test_zero_amount_transfer,
     transfer_from_vault,
     transfer_to_vault,
@@ -57,6 +60,7 @@ def main():
         # Deploy the vault canister
         results["Deploy Vault Without Params"] = test_deploy_vault_without_params()
         results["Set canisters"] = test_set_canisters()
+        results["Sync Error Reported In Status"] = test_sync_error_reported_in_status()
 
         # Transfer tokens to the vault
         results["Transfer To Vault"] = transfer_to_vault(1000)
@@ -83,6 +87,9 @@ def main():
         # Check transaction ordering and validity
         results["Transaction Ordering"] = test_transaction_ordering()
         results["Transaction Validity"] = test_transaction_validity()
+        results["Deposit Then Sync"] = test_deposit_then_sync()
+        results["Withdraw Subaccount Deposit"] = test_withdraw_subaccount_deposit()
+        results["Reconcile Balances"] = test_reconcile_balances()
 
         # Test set canisters and ensure only the admin can do so
         if not test_set_canisters():
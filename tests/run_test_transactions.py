@@ -13,6 +13,7 @@ It deploys all necessary canisters (ckBTC ledger, indexer, vault) and sets up
 test identities before running the transaction sequence.
 """
 
+import os
 import sys
 import traceback
 
@@ -32,6 +33,8 @@ from tests.utils.command import (
 INITIAL_TRANSFER_AMOUNT = 101  # Starting amount for transfers
 MAX_RESULTS = 2  # Max results parameter for vault deployment
 MAX_ITERATION_COUNT = 2  # Max iteration count parameter for vault deployment
+# Worker threads for the transaction sequence (1 runs every step sequentially)
+WORKERS = int(os.environ.get("TEST_WORKERS", "1"))
 
 # Initial balances for test identities
 IDENTITY_BALANCES = {
@@ -120,6 +123,7 @@ def main():
             identities=identities,
             start_amount=INITIAL_TRANSFER_AMOUNT,
             initial_balances=IDENTITY_BALANCES.copy(),
+            workers=WORKERS,
         )
 
         results["Transaction Sequence"] = success
@@ -346,3 +346,99 @@ def test_set_admin():
         # Clean up - ensure we remove test identity even if test fails
         run_command("dfx identity remove new_admin || true")
         return False
+
+
+def test_sync_error_reported_in_status():
+    """Test that a failing indexer is reported as an error instead of an empty sync."""
+    print("\nTesting sync error propagation...")
+
+    ledger_id = get_canister_id("ckbtc_ledger")
+    indexer_id = get_canister_id("ckbtc_indexer")
+
+    try:
+        # The ledger does not implement get_account_transactions, so every fetch fails
+        set_cmd = f"""dfx canister call vault set_canister '(\"ckBTC indexer\", principal \"{ledger_id}\")' --output json"""
+        if not run_command_expects_response_obj(set_cmd):
+            return False
+
+        update_result = run_command(
+            "dfx canister call vault update_transaction_history --output json"
+        )
+        if not update_result or json.loads(update_result).get("success", False):
+            print_error(
+                f"Expected sync against a broken indexer to fail: {update_result}"
+            )
+            return False
+
+        status_result = run_command_expects_response_obj(
+            "dfx canister call vault status --output json"
+        )
+        if not status_result:
+            return False
+
+        app_data = status_result["data"]["Stats"]["app_data"]
+        if not app_data.get("sync_last_error"):
+            print_error(f"Expected sync_last_error in status: {app_data}")
+            return False
+        if int(app_data.get("sync_consecutive_failures", "0").replace("_", "")) < 1:
+            print_error(f"Expected sync_consecutive_failures >= 1: {app_data}")
+            return False
+
+        print_ok(f"Sync error reported in status: {app_data['sync_last_error']}")
+    finally:
+        # Restoring the indexer also clears the backoff window
+        set_cmd = f"""dfx canister call vault set_canister '(\"ckBTC indexer\", principal \"{indexer_id}\")' --output json"""
+        run_command_expects_response_obj(set_cmd)
+
+    if not update_transaction_history():
+        return False
+
+    status_result = run_command_expects_response_obj(
+        "dfx canister call vault status --output json"
+    )
+    if not status_result:
+        return False
+    app_data = status_result["data"]["Stats"]["app_data"]
+    if app_data.get("sync_last_error"):
+        print_error(f"Expected the sync error to be cleared: {app_data}")
+        return False
+
+    print_ok("Sync error cleared after a successful sync")
+    return True
+
+
+def test_reconcile_balances():
+    """Test that the vault's balance is reconciled against the ledger and the indexer."""
+    print("\nTesting balance reconciliation...")
+
+    if not update_transaction_history():
+        return False
+
+    reconcile_result = run_command_expects_response_obj(
+        "dfx canister call vault reconcile_balances --output json"
+    )
+    if not reconcile_result:
+        print_error("Failed to reconcile balances")
+        return False
+
+    reconciliation = reconcile_result["data"]["Reconciliation"]
+    vault_balance = int(reconciliation["vault_balance"].replace("_", ""))
+    indexer_balance = int(reconciliation["indexer_balance"].replace("_", ""))
+    vault_drift = int(reconciliation["vault_drift"].replace("_", ""))
+    if vault_drift != vault_balance - indexer_balance:
+        print_error(f"Inconsistent vault drift: {reconciliation}")
+        return False
+    # The fees of the vault's transfers are debited from its balance
+    if vault_drift != 0:
+        print_error(f"Expected no vault drift: {reconciliation}")
+        return False
+
+    status_result = run_command_expects_response_obj(
+        "dfx canister call vault status --output json"
+    )
+    if not status_result or not status_result["data"]["Stats"]["reconciliation"]:
+        print_error(f"Expected the reconciliation in status: {status_result}")
+        return False
+
+    print_ok(f"Balances reconciled: {reconciliation}")
+    return True
@@ -3,16 +3,24 @@
 Tests for the vault canister's test mode functionality.
 """
 
+import base64
+import hashlib
 import json
 import os
 import sys
+import tempfile
+import time
 import traceback
 
+import cbor2
+
 from tests.utils.colors import print_error, print_ok
 from tests.utils.command import (
+    get_canister_id,
     get_current_principal,
     run_command,
     run_command_expects_response_obj,
+    wait_for_job,
 )
 
 # Add the parent directory to the Python path to make imports work
@@ -692,6 +700,1230 @@ def test_reset_clears_mock_transactions():
         return False
 
 
+def test_reset_keeps_transaction_index():
+    """Test that test_mode_reset leaves the transactions it keeps in the time index."""
+    try:
+        print("Testing reset keeps the time index of kept transactions...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        timestamp = 1_700_000_000_000_000_000
+
+        # Only the mock_transfer is deleted by the reset
+        for amount, kind in ((100, "transfer"), (200, "mock_transfer")):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"{kind}\\", opt {timestamp})" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        if not run_command_expects_response_obj(
+            "dfx canister call vault test_mode_reset --output json"
+        ):
+            print_error("Failed to reset test mode")
+            return False
+
+        # The index builds queued by the reset are the last jobs to run
+        last_job = run_command_expects_response_obj(
+            "dfx canister call vault job_status '(null)' --output json"
+        )
+        if not last_job:
+            print_error("Failed to get the last job")
+            return False
+        status = wait_for_job(last_job["data"]["Job"]["id"])
+        if status != "Completed":
+            print_error(f"Expected the index builds to complete, got status {status}")
+            return False
+
+        query_cmd = f'dfx canister call vault get_transactions_by_time "(opt principal \\"{current_principal}\\", {timestamp}, {timestamp}, null, null)" --output json'
+        result = run_command_expects_response_obj(query_cmd)
+        if not result:
+            print_error("Failed to get transactions by time")
+            return False
+        amounts = [
+            int(tx["amount"])
+            for tx in result["data"]["TransactionsPage"]["transactions"]
+        ]
+        if amounts != [-100]:
+            print_error(f"Expected only the kept transfer of 100, got {amounts}")
+            return False
+
+        print_ok("✓ test_mode_reset keeps the time index of kept transactions")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing reset keeps the time index: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
+def deploy_test_mode_vault():
+    """Deploy a fresh vault with test mode enabled and the current principal as admin."""
+    run_command("dfx canister delete vault --yes || true")
+
+    current_principal = get_current_principal()
+    deploy_cmd = f'dfx deploy vault --argument "(null, opt principal \\"{current_principal}\\", opt 100, opt 10, opt true)"'
+    return run_command(deploy_cmd)
+
+
+def get_balance_amount(principal_id):
+    """Return the vault balance of a principal as an int, or None on failure."""
+    get_balance_cmd = f'dfx canister call vault get_balance "(principal \\"{principal_id}\\")" --output json'
+    balance_result = run_command_expects_response_obj(get_balance_cmd)
+    if not balance_result:
+        return None
+    amount = balance_result.get("data", {}).get("Balance", {}).get("amount", "0")
+    return int(amount.replace("_", ""))
+
+
+def test_import_snapshot_keeps_fees():
+    """Test that a vault rebuilt from an imported snapshot still debits the fees it paid."""
+    try:
+        print("Testing fees in an imported snapshot...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        source_vault_id = get_canister_id("vault")
+
+        # A deposit into the vault, then a transfer out for which the vault pays a fee
+        for principal_from, principal_to, amount, fee in (
+            (current_principal, source_vault_id, 1000, "null"),
+            (source_vault_id, current_principal, 300, "opt 10"),
+        ):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{principal_from}\\", principal \\"{principal_to}\\", {amount}, \\"transfer\\", null, {fee})" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        if get_balance_amount(source_vault_id) != 690:
+            print_error(
+                f"Expected vault balance 690, got {get_balance_amount(source_vault_id)}"
+            )
+            return False
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            transactions_path = os.path.join(tmp_dir, "transactions.cbor")
+            balances_path = os.path.join(tmp_dir, "balances.cbor")
+            if not run_command(
+                f"python tools/export_transactions.py --output {transactions_path}"
+            ) or not run_command(
+                f"python tools/export_transactions.py --balances --output {balances_path}"
+            ):
+                print_error("Failed to export the snapshot")
+                return False
+
+            if not deploy_test_mode_vault():
+                print_error("Failed to redeploy the vault")
+                return False
+            vault_id = get_canister_id("vault")
+
+            if not run_command(
+                f"python tools/import_snapshot.py --source-vault {source_vault_id} "
+                f"--transactions {transactions_path} --balances {balances_path} "
+                f"--scan-end-tx-id 0"
+            ):
+                print_error("Failed to import the snapshot")
+                return False
+
+        rebuild_result = run_command_expects_response_obj(
+            "dfx canister call vault rebuild_balances --output json"
+        )
+        if not rebuild_result:
+            print_error("Failed to start balance rebuild")
+            return False
+        status = wait_for_job(rebuild_result["data"]["Job"]["id"])
+        if status != "Completed":
+            print_error(f"Expected balance rebuild to complete, got status {status}")
+            return False
+
+        vault_balance = get_balance_amount(vault_id)
+        if vault_balance != 690 or get_balance_amount(current_principal) != 700:
+            print_error(f"Fees lost by the import: vault balance {vault_balance}")
+            return False
+
+        print_ok("✓ Imported transactions keep their fees through a rebuild")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing fees in an imported snapshot: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
+def test_rebuild_balances():
+    """Test that rebuild_balances restores balances from the stored transactions."""
+    try:
+        print("Testing balance rebuild...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        # Two deposits into the vault
+        for amount in (300, 200):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", null)" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        # Make the balance drift away from the transaction history
+        set_balance_cmd = f'dfx canister call vault test_mode_set_balance "(principal \\"{current_principal}\\", 12345)" --output json'
+        if not run_command_expects_response_obj(set_balance_cmd):
+            print_error("Failed to set balance in test mode")
+            return False
+
+        rebuild_result = run_command_expects_response_obj(
+            "dfx canister call vault rebuild_balances --output json"
+        )
+        if not rebuild_result:
+            print_error("Failed to start balance rebuild")
+            return False
+
+        status = wait_for_job(rebuild_result["data"]["Job"]["id"])
+        if status != "Completed":
+            print_error(f"Expected balance rebuild to complete, got status {status}")
+            return False
+
+        balance = get_balance_amount(current_principal)
+        if balance != 500:
+            print_error(f"Expected rebuilt balance 500, got {balance}")
+            return False
+
+        vault_balance = get_balance_amount(vault_id)
+        if vault_balance != 500:
+            print_error(f"Expected rebuilt vault balance 500, got {vault_balance}")
+            return False
+
+        print_ok("✓ Balances rebuilt from stored transactions")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing balance rebuild: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_get_balances():
+    """Test that get_balances returns the balances of several principals in input order."""
+    try:
+        print("Testing batched balance query...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        unknown_principal = "2vxsx-fae"
+
+        for principal_id, amount in ((current_principal, 700), (vault_id, 300)):
+            set_balance_cmd = f'dfx canister call vault test_mode_set_balance "(principal \\"{principal_id}\\", {amount})" --output json'
+            if not run_command_expects_response_obj(set_balance_cmd):
+                print_error("Failed to set balance")
+                return False
+
+        principals = [vault_id, unknown_principal, current_principal, vault_id]
+        principals_arg = "; ".join(
+            f'principal \\"{principal_id}\\"' for principal_id in principals
+        )
+        result = run_command_expects_response_obj(
+            f'dfx canister call vault get_balances "(vec {{ {principals_arg} }})" --output json'
+        )
+        if not result:
+            print_error("Failed to get balances")
+            return False
+
+        balances = [
+            (balance["principal_id"], int(balance["amount"].replace("_", "")))
+            for balance in result["data"]["Balances"]
+        ]
+        expected = [
+            (vault_id, 300),
+            (unknown_principal, 0),
+            (current_principal, 700),
+            (vault_id, 300),
+        ]
+        if balances != expected:
+            print_error(f"Unexpected balances: {balances}, expected {expected}")
+            return False
+
+        print_ok("✓ Balances returned in the order requested")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing batched balance query: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
+def test_top_balances():
+    """Test the amount-ordered balance index: top balances and counts above a threshold."""
+    try:
+        print("Testing top balances...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        other_principal = "2vxsx-fae"
+
+        # The last update moves a balance to another bucket of the index
+        for principal_id, amount in (
+            (current_principal, 5),
+            (vault_id, 1_000_000),
+            (other_principal, 70_000),
+            (current_principal, 2_500_000),
+        ):
+            set_balance_cmd = f'dfx canister call vault test_mode_set_balance "(principal \\"{principal_id}\\", {amount})" --output json'
+            if not run_command_expects_response_obj(set_balance_cmd):
+                print_error("Failed to set balance")
+                return False
+
+        def top(n, ascending):
+            result = run_command_expects_response_obj(
+                f"dfx canister call vault get_top_balances '({n}, opt {ascending})' --output json"
+            )
+            return [
+                (balance["principal_id"], int(balance["amount"].replace("_", "")))
+                for balance in result["data"]["Balances"]
+            ]
+
+        largest = top(2, "false")
+        if largest != [(current_principal, 2_500_000), (vault_id, 1_000_000)]:
+            print_error(f"Unexpected largest balances: {largest}")
+            return False
+
+        smallest = top(1, "true")
+        if smallest != [(other_principal, 70_000)]:
+            print_error(f"Unexpected smallest balances: {smallest}")
+            return False
+
+        count_result = run_command_expects_response_obj(
+            "dfx canister call vault count_balances_above '(70_000)' --output json"
+        )
+        count = int(count_result["data"]["Count"].replace("_", ""))
+        if count != 2:
+            print_error(f"Expected 2 balances above 70000, got {count}")
+            return False
+
+        print_ok("✓ Balances ordered by amount")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing top balances: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_get_transactions_by_time():
+    """Test that time-range queries return the transactions within the range, paginated."""
+    try:
+        print("Testing transactions by time...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        hour_ns = 3_600_000_000_000
+
+        # Deposits one, two and three hours after an arbitrary origin
+        for hours, amount in ((1, 100), (2, 200), (3, 300)):
+            timestamp = 1_700_000_000_000_000_000 + hours * hour_ns
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", opt {timestamp})" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        start_ns = 1_700_000_000_000_000_000 + 2 * hour_ns
+        end_ns = 1_700_000_000_000_000_000 + 3 * hour_ns
+
+        amounts = []
+        cursor = "null"
+        for _ in range(5):
+            query_cmd = f'dfx canister call vault get_transactions_by_time "(opt principal \\"{current_principal}\\", {start_ns}, {end_ns}, {cursor}, opt 1)" --output json'
+            result = run_command_expects_response_obj(query_cmd)
+            if not result:
+                print_error("Failed to get transactions by time")
+                return False
+
+            page = result["data"]["TransactionsPage"]
+            amounts.extend(int(tx["amount"]) for tx in page["transactions"])
+            if not page["next_cursor"]:
+                break
+            next_cursor = page["next_cursor"][0]
+            cursor = f'opt record {{ bucket = {next_cursor["bucket"].replace("_", "")}; position = {next_cursor["position"].replace("_", "")} }}'
+
+        if sorted(amounts) != [-300, -200]:
+            print_error(f"Expected the transactions of 200 and 300, got {amounts}")
+            return False
+
+        print_ok("✓ Transactions returned by time range")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing transactions by time: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
+def test_get_balance_at():
+    """Test that historical balances are computed at a tx id and at a timestamp."""
+    try:
+        print("Testing balance at a point in history...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        hour_ns = 3_600_000_000_000
+        origin_ns = 1_700_000_000_000_000_000
+
+        # Deposits with ids 0, 1 and 2, one hour apart
+        for hours, amount in ((1, 100), (2, 200), (3, 300)):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", opt {origin_ns + hours * hour_ns})" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        expectations = (
+            ("opt 0, null", 100),
+            ("opt 1, null", 300),
+            (f"null, opt {origin_ns + 2 * hour_ns + 1}", 300),
+            (f"null, opt {origin_ns + 5 * hour_ns}", 600),
+        )
+        for args, expected in expectations:
+            query_cmd = f'dfx canister call vault get_balance_at "(principal \\"{current_principal}\\", {args})" --output json'
+            result = run_command_expects_response_obj(query_cmd)
+            if not result:
+                print_error(f"Failed to get balance at ({args})")
+                return False
+
+            amount = int(result["data"]["Balance"]["amount"].replace("_", ""))
+            if amount != expected:
+                print_error(f"Expected balance {expected} at ({args}), got {amount}")
+                return False
+
+        print_ok("✓ Historical balances computed from checkpoints")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing balance at a point in history: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
+def test_export_transactions():
+    """Test that the export tool streams every transaction, in id order, across chunks."""
+    try:
+        print("Testing transaction export...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        for amount in (100, 200, 300):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", null)" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            output_path = os.path.join(tmp_dir, "transactions.cbor")
+            # A tiny chunk size forces one chunk per transaction
+            if not run_command(
+                f"python tools/export_transactions.py --output {output_path} --max-bytes 1"
+            ):
+                print_error("Failed to run the export tool")
+                return False
+
+            rows = []
+            with open(output_path, "rb") as f:
+                decoder = cbor2.CBORDecoder(f)
+                while f.peek(1):
+                    rows.append(decoder.decode())
+
+        ids = [row[1] for row in rows]
+        amounts = [row[6] for row in rows]
+        if ids != [0, 1, 2] or amounts != [100, 200, 300]:
+            print_error(f"Unexpected exported rows: {rows}")
+            return False
+
+        print_ok("✓ Transactions exported in id order")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing transaction export: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_import_snapshot():
+    """Test that a fresh vault seeded from an exported snapshot matches the source vault."""
+    try:
+        print("Testing snapshot import...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        source_vault_id = get_canister_id("vault")
+
+        for amount in (100, 200, 300):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{source_vault_id}\\", {amount}, \\"transfer\\", null)" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        user_balance = get_balance_amount(current_principal)
+        vault_balance = get_balance_amount(source_vault_id)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            transactions_path = os.path.join(tmp_dir, "transactions.cbor")
+            balances_path = os.path.join(tmp_dir, "balances.cbor")
+            if not run_command(
+                f"python tools/export_transactions.py --output {transactions_path}"
+            ) or not run_command(
+                f"python tools/export_transactions.py --balances --output {balances_path}"
+            ):
+                print_error("Failed to export the snapshot")
+                return False
+
+            # The new vault gets a new canister id, so the source vault's rows are remapped
+            if not deploy_test_mode_vault():
+                print_error("Failed to redeploy the vault")
+                return False
+            vault_id = get_canister_id("vault")
+
+            # A tiny chunk size forces one chunk per row
+            if not run_command(
+                f"python tools/import_snapshot.py --source-vault {source_vault_id} "
+                f"--transactions {transactions_path} --balances {balances_path} "
+                f"--scan-end-tx-id 0 --max-bytes 1"
+            ):
+                print_error("Failed to import the snapshot")
+                return False
+
+        if (
+            get_balance_amount(current_principal) != user_balance
+            or get_balance_amount(vault_id) != vault_balance
+        ):
+            print_error("Imported balances do not match the source vault")
+            return False
+
+        transactions_result = run_command_expects_response_obj(
+            f'dfx canister call vault get_transactions "(principal \\"{current_principal}\\")" --output json'
+        )
+        if not transactions_result:
+            print_error("Failed to get the imported transactions")
+            return False
+        transactions = transactions_result["data"]["Transactions"]
+        if sorted(tx["principal_to"] for tx in transactions) != [vault_id] * 3:
+            print_error(f"Unexpected imported transactions: {transactions}")
+            return False
+
+        print_ok("✓ Snapshot imported into a fresh vault")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing snapshot import: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def import_snapshot_chunk(kind, path):
+    """Send a whole exported file to import_snapshot_chunk as a single chunk."""
+    with open(path, "rb") as f:
+        data = f.read()
+    blob = "".join(f"\\{byte:02x}" for byte in data)
+    argument_path = f"{path}.did"
+    with open(argument_path, "w") as f:
+        f.write(f'("{kind}", blob "{blob}", "{hashlib.sha256(data).hexdigest()}")')
+    return run_command_expects_response_obj(
+        f"dfx canister call vault import_snapshot_chunk --argument-file {argument_path} --output json"
+    )
+
+
+def test_import_snapshot_abort():
+    """Test that aborting an import whose hashes do not match leaves the vault empty."""
+    try:
+        print("Testing snapshot import abort...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        source_vault_id = get_canister_id("vault")
+
+        for amount in (100, 200, 300):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{source_vault_id}\\", {amount}, \\"transfer\\", null)" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            transactions_path = os.path.join(tmp_dir, "transactions.cbor")
+            balances_path = os.path.join(tmp_dir, "balances.cbor")
+            if not run_command(
+                f"python tools/export_transactions.py --output {transactions_path}"
+            ) or not run_command(
+                f"python tools/export_transactions.py --balances --output {balances_path}"
+            ):
+                print_error("Failed to export the snapshot")
+                return False
+
+            if not deploy_test_mode_vault():
+                print_error("Failed to redeploy the vault")
+                return False
+            vault_id = get_canister_id("vault")
+
+            start_cmd = f'dfx canister call vault import_snapshot_start "(principal \\"{source_vault_id}\\")" --output json'
+            if not run_command_expects_response_obj(start_cmd):
+                print_error("Failed to start the snapshot import")
+                return False
+            if not import_snapshot_chunk(
+                "transactions", transactions_path
+            ) or not import_snapshot_chunk("balances", balances_path):
+                print_error("Failed to import the snapshot chunks")
+                return False
+
+        finish_result = run_command(
+            'dfx canister call vault import_snapshot_finish \'("wrong", "wrong", 0, 0, 0)\' --output json'
+        )
+        if not finish_result or json.loads(finish_result).get("success"):
+            print_error(f"Expected the hash mismatch to be refused: {finish_result}")
+            return False
+
+        abort_result = run_command_expects_response_obj(
+            "dfx canister call vault import_snapshot_abort --output json"
+        )
+        if not abort_result:
+            print_error("Failed to abort the snapshot import")
+            return False
+        status = wait_for_job(abort_result["data"]["Job"]["id"])
+        if status != "Completed":
+            print_error(f"Expected the abort to complete, got status {status}")
+            return False
+
+        if get_balance_amount(current_principal) or get_balance_amount(vault_id):
+            print_error("Imported balances left after the abort")
+            return False
+        transactions_result = run_command_expects_response_obj(
+            f'dfx canister call vault get_transactions "(principal \\"{current_principal}\\")" --output json'
+        )
+        if not transactions_result or transactions_result["data"]["Transactions"]:
+            print_error(
+                f"Imported transactions left after the abort: {transactions_result}"
+            )
+            return False
+
+        # Only a vault without transactions accepts a new import
+        if not run_command_expects_response_obj(start_cmd):
+            print_error("Failed to start a new import after the abort")
+            return False
+
+        print_ok("✓ Aborted snapshot import leaves the vault empty")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing snapshot import abort: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
+def test_categories():
+    """Test category rules, manual tagging, running totals and category pages."""
+    try:
+        print("Testing categories...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        other_principal = "2vxsx-fae"
+
+        for create_cmd in (
+            "dfx canister call vault create_category '(\"rewards\")' --output json",
+            f'dfx canister call vault add_category_rule "(\\"rewards\\", opt principal \\"{other_principal}\\", null, null)" --output json',
+        ):
+            if not run_command_expects_response_obj(create_cmd):
+                print_error("Failed to set up the category")
+                return False
+
+        # Only the first deposit matches the rule
+        for principal_from, amount in (
+            (other_principal, 500),
+            (current_principal, 100),
+        ):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{principal_from}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", null)" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        transactions = run_command_expects_response_obj(
+            f'dfx canister call vault get_transactions "(principal \\"{current_principal}\\")" --output json'
+        )["data"]["Transactions"]
+        tx_id = transactions[0]["id"].replace("_", "")
+        if not run_command_expects_response_obj(
+            f"dfx canister call vault tag_transaction '({tx_id}, \"rewards\")' --output json"
+        ):
+            print_error("Failed to tag transaction")
+            return False
+
+        def totals():
+            result = run_command_expects_response_obj(
+                "dfx canister call vault get_categories --output json"
+            )
+            category = result["data"]["Categories"][0]
+            return tuple(
+                int(category[field].replace("_", ""))
+                for field in ("transactions_count", "amount_in", "amount_out")
+            )
+
+        if totals() != (2, 600, 0):
+            print_error(f"Unexpected category totals: {totals()}")
+            return False
+
+        amounts = []
+        cursor = "null"
+        for _ in range(5):
+            page = run_command_expects_response_obj(
+                f"dfx canister call vault get_category_transactions '(\"rewards\", {cursor}, opt 1)' --output json"
+            )["data"]["CategoryTransactionsPage"]
+            amounts.extend(int(tx["amount"]) for tx in page["transactions"])
+            if not page["next_cursor"]:
+                break
+            cursor = f"opt {page['next_cursor'][0].replace('_', '')}"
+
+        if sorted(amounts) != [100, 500]:
+            print_error(f"Expected the deposits of 100 and 500, got {amounts}")
+            return False
+
+        if not run_command_expects_response_obj(
+            f"dfx canister call vault untag_transaction '({tx_id}, \"rewards\")' --output json"
+        ):
+            print_error("Failed to untag transaction")
+            return False
+
+        if totals() != (1, 500, 0):
+            print_error(f"Unexpected category totals after untagging: {totals()}")
+            return False
+
+        print_ok("✓ Transactions tagged by rule and by hand")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing categories: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_multi_token():
+    """Test that a registered token has its own balances, apart from the primary token's."""
+    try:
+        print("Testing multi-token support...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+
+        register_cmd = 'dfx canister call vault register_token "(\\"ckETH\\", principal \\"aaaaa-aa\\", principal \\"2vxsx-fae\\")" --output json'
+        if not run_command_expects_response_obj(register_cmd):
+            print_error("Failed to register token")
+            return False
+
+        tokens = run_command_expects_response_obj(
+            "dfx canister call vault get_tokens --output json"
+        )["data"]["Tokens"]
+        symbols = [token["symbol"] for token in tokens]
+        if symbols != ["ckBTC", "ckETH"]:
+            print_error(f"Unexpected tokens: {symbols}")
+            return False
+
+        transfer_cmd = f'dfx canister call vault transfer_token "(\\"ckETH\\", principal \\"{current_principal}\\", 250)" --output json'
+        if not run_command_expects_response_obj(transfer_cmd):
+            print_error("Failed to transfer token")
+            return False
+
+        def token_balance(token):
+            result = run_command_expects_response_obj(
+                f'dfx canister call vault get_token_balance "(\\"{token}\\", principal \\"{current_principal}\\")" --output json'
+            )
+            return int(result["data"]["Balance"]["amount"].replace("_", ""))
+
+        if token_balance("ckETH") != 250 or token_balance("ckBTC") != 0:
+            print_error(
+                f"Unexpected balances: ckETH {token_balance('ckETH')}, ckBTC {token_balance('ckBTC')}"
+            )
+            return False
+
+        print_ok("✓ Token balances kept apart")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing multi-token support: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def principal_bytes(principal_id):
+    """Decodes a textual principal into its bytes (without the CRC32 checksum)."""
+    text = principal_id.replace("-", "").upper()
+    return base64.b32decode(text + "=" * (-len(text) % 8))[4:]
+
+
+def test_deposit_account():
+    """Test that the deposit subaccount of a principal is derived from it and stable."""
+    try:
+        print("Testing deposit accounts...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        opened = run_command_expects_response_obj(
+            "dfx canister call vault open_deposit_account --output json"
+        )
+        if not opened:
+            print_error("Failed to open deposit account")
+            return False
+        account = opened["data"]["DepositAccount"]["account"]
+        subaccount = [int(byte.replace("_", "")) for byte in account["subaccount"][0]]
+
+        owner_bytes = principal_bytes(current_principal)
+        expected = list(bytes([len(owner_bytes)]) + owner_bytes) + [0] * (
+            31 - len(owner_bytes)
+        )
+        if account["owner"] != vault_id or subaccount != expected:
+            print_error(f"Unexpected deposit account: {account}")
+            return False
+
+        fetched = run_command_expects_response_obj(
+            f'dfx canister call vault get_deposit_account "(principal \\"{current_principal}\\")" --output json'
+        )
+        if fetched["data"]["DepositAccount"]["account"] != account:
+            print_error(f"Deposit account changed: {fetched}")
+            return False
+
+        print_ok("✓ Deposit subaccount derived from the owner")
+
+        anonymous = run_command(
+            "dfx canister call --identity anonymous vault open_deposit_account --output json"
+        )
+        if not anonymous or json.loads(anonymous).get("success"):
+            print_error(f"Expected the anonymous principal to be refused: {anonymous}")
+            return False
+        print_ok("✓ Anonymous principal cannot open a deposit subaccount")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing deposit accounts: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_deposit():
+    """Test that a deposit credits the caller's balance on the call itself."""
+    try:
+        print("Testing deposits...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        deposited = run_command_expects_response_obj(
+            'dfx canister call vault deposit "(250)" --output json'
+        )
+        if not deposited or not deposited.get("success"):
+            print_error(f"Deposit failed: {deposited}")
+            return False
+        if "TransactionId" not in deposited["data"]:
+            print_error(f"Deposit returned no transaction id: {deposited}")
+            return False
+
+        if get_balance_amount(current_principal) != 250:
+            print_error(
+                f"Deposit not credited: {get_balance_amount(current_principal)}"
+            )
+            return False
+        if get_balance_amount(vault_id) != 250:
+            print_error(f"Vault balance not updated: {get_balance_amount(vault_id)}")
+            return False
+        print_ok("✓ Deposit credited on the call")
+
+        rejected = run_command_expects_response_obj(
+            'dfx canister call vault deposit "(0)" --output json'
+        )
+        if rejected:
+            print_error(f"Deposit of 0 should fail: {rejected}")
+            return False
+        print_ok("✓ Deposit of 0 rejected")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing deposits: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_archive():
+    """Test that old transactions move to an archive canister and stay readable there."""
+    try:
+        print("Testing archiving...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        run_command("dfx canister delete archive --yes || true")
+        if not run_command(
+            f'dfx deploy archive --argument "(principal \\"{vault_id}\\")"'
+        ):
+            print_error("Failed to deploy archive canister")
+            return False
+        archive_id = get_canister_id("archive")
+
+        timestamp = 1_700_000_000_000_000_000
+        for amount in (100, 200, 300):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", opt {timestamp})" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        # Archive the transactions with ids 0 and 1
+        for cmd in (
+            f'dfx canister call vault add_archive "(principal \\"{archive_id}\\")" --output json',
+            'dfx canister call vault set_archive_policy "(null, opt 2)" --output json',
+        ):
+            if not run_command_expects_response_obj(cmd):
+                print_error(f"Failed to run {cmd}")
+                return False
+
+        archived_counts = []
+        for _ in range(2):
+            result = run_command_expects_response_obj(
+                "dfx canister call vault archive_transactions --output json"
+            )
+            if not result:
+                print_error("Failed to archive transactions")
+                return False
+            archived_counts.append(int(result["data"]["Count"]))
+        if archived_counts != [2, 0]:
+            print_error(
+                f"Expected 2 then 0 transactions archived, got {archived_counts}"
+            )
+            return False
+        print_ok("✓ Transactions below the policy's id archived")
+
+        transactions = run_command_expects_response_obj(
+            f'dfx canister call vault get_transactions "(principal \\"{current_principal}\\")" --output json'
+        )["data"]["Transactions"]
+        if [int(tx["amount"]) for tx in transactions] != [300]:
+            print_error(f"Expected only the newest transaction kept: {transactions}")
+            return False
+        if get_balance_amount(current_principal) != 600:
+            print_error("Archiving changed the balance")
+            return False
+
+        page = run_command_expects_response_obj(
+            f'dfx canister call vault get_transactions_by_time "(null, 0, {timestamp}, null, null)" --output json'
+        )["data"]["TransactionsPage"]
+        if [archive["archive"] for archive in page["archived"]] != [archive_id]:
+            print_error(f"Expected the archive listed for the range: {page}")
+            return False
+
+        archived = json.loads(
+            run_command(
+                "dfx canister call archive get_transactions '(null, 0, 10, 10)' --output json"
+            )
+        )
+        if [int(tx["amount"]) for tx in archived["transactions"]] != [100, 200]:
+            print_error(f"Unexpected archived transactions: {archived}")
+            return False
+        print_ok("✓ Archived transactions read from the archive")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing archiving: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def get_changes_page(seq):
+    """Return the change feed page following `seq`, or None on failure."""
+    result = run_command_expects_response_obj(
+        f'dfx canister call vault get_changes_since "({seq}, null)" --output json'
+    )
+    return result["data"]["ChangesPage"] if result else None
+
+
+def test_change_feed():
+    """Test that balance and transaction changes are listed after a sequence number."""
+    try:
+        print("Testing the change feed...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        start_seq = int(get_changes_page(0)["last_seq"].replace("_", ""))
+        set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", 100, \\"transfer\\", null)" --output json'
+        if not run_command_expects_response_obj(set_mock_cmd):
+            print_error("Failed to set mock transaction")
+            return False
+
+        page = get_changes_page(start_seq)
+        transactions = [
+            change["change"]["Transaction"]
+            for change in page["changes"]
+            if "Transaction" in change["change"]
+        ]
+        balances = {
+            change["change"]["Balance"]["principal_id"]: int(
+                change["change"]["Balance"]["amount"].replace("_", "")
+            )
+            for change in page["changes"]
+            if "Balance" in change["change"]
+        }
+        if [int(tx["amount"].replace("_", "")) for tx in transactions] != [100]:
+            print_error(f"Expected the new transaction in the feed: {page}")
+            return False
+        if balances.get(current_principal) != 100 or balances.get(vault_id) != 100:
+            print_error(f"Expected the new balances in the feed: {balances}")
+            return False
+        if get_changes_page(page["last_seq"].replace("_", ""))["changes"]:
+            print_error("Expected no change after the last sequence number")
+            return False
+        print_ok("✓ Changes listed after a sequence number")
+
+        ahead_seq = int(page["last_seq"].replace("_", "")) + 5
+        if not get_changes_page(ahead_seq)["resync_required"]:
+            print_error("Expected a resync to be required for an unknown sequence")
+            return False
+        print_ok("✓ Resync required for a sequence number not in the feed")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing the change feed: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_notifications():
+    """Test that new transactions matching a subscription's filter are queued for it."""
+    try:
+        print("Testing notification subscriptions...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        subscribe_cmd = 'dfx canister call vault subscribe "(\\"on_vault_notification\\", null, opt 1000, null)" --output json'
+        if not run_command_expects_response_obj(subscribe_cmd):
+            print_error("Failed to subscribe")
+            return False
+        print_ok("✓ Subscribed with a minimum amount")
+
+        for amount in (500, 5000):
+            set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", {amount}, \\"transfer\\", null)" --output json'
+            if not run_command_expects_response_obj(set_mock_cmd):
+                print_error("Failed to set mock transaction")
+                return False
+
+        result = run_command_expects_response_obj(
+            "dfx canister call vault get_subscriptions --output json"
+        )
+        subscriptions = result["data"]["Subscriptions"] if result else []
+        if len(subscriptions) != 1:
+            print_error(f"Expected one subscription: {subscriptions}")
+            return False
+        subscription = {
+            key: int(str(value).replace("_", ""))
+            for key, value in subscriptions[0].items()
+            if key in ("matched_count", "pending", "delivered_count")
+        }
+        # The caller is not a canister, so the batch may or may not have been sent
+        if subscription["matched_count"] != 1 or (
+            subscription["pending"] + subscription["delivered_count"] != 1
+        ):
+            print_error(f"Expected only the 5000 transfer to match: {subscriptions}")
+            return False
+        print_ok("✓ Only the matching transaction was queued")
+
+        unsubscribe_cmd = 'dfx canister call vault unsubscribe "(\\"on_vault_notification\\", null)" --output json'
+        if not run_command_expects_response_obj(unsubscribe_cmd):
+            print_error("Failed to unsubscribe")
+            return False
+        result = run_command_expects_response_obj(
+            "dfx canister call vault get_subscriptions --output json"
+        )
+        if not result or result["data"]["Subscriptions"]:
+            print_error(f"Expected no subscription after unsubscribing: {result}")
+            return False
+        print_ok("✓ Subscription removed")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing notifications: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_storage_report():
+    """Test that the storage report counts the stored entities per type and region."""
+    try:
+        print("Testing the storage report...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", 100, \\"transfer\\", null)" --output json'
+        if not run_command_expects_response_obj(set_mock_cmd):
+            print_error("Failed to set mock transaction")
+            return False
+
+        result = run_command_expects_response_obj(
+            "dfx canister call vault storage_report --output json"
+        )
+        if not result:
+            print_error("Failed to get the storage report")
+            return False
+        report = result["data"]["StorageReport"]
+
+        if int(report["stable_memory_pages"].replace("_", "")) <= 0:
+            print_error(f"Expected stable memory pages to be used: {report}")
+            return False
+        if not report["entity_counts_complete"]:
+            print_error("Expected the shared map entities to be counted")
+            return False
+
+        entities = {
+            entity["entity"]: int(entity["rows"].replace("_", ""))
+            for entity in report["entities"]
+        }
+        if entities.get("VaultTransaction", 0) < 1 or entities.get("Balance", 0) < 2:
+            print_error(
+                f"Expected the transaction and balances to be counted: {entities}"
+            )
+            return False
+        if entities.get("Canisters", 0) < 1:
+            print_error(f"Expected the canister records to be counted: {entities}")
+            return False
+        print_ok("✓ Entities counted per type")
+
+        regions = {
+            region["name"]: int(region["rows"].replace("_", ""))
+            for region in report["regions"]
+        }
+        if regions.get("VaultTransaction") != entities["VaultTransaction"]:
+            print_error(f"Expected the transactions region to match: {regions}")
+            return False
+        print_ok("✓ Regions listed with their rows")
+        return True
+
+    except Exception as e:
+        print_error(f"Error testing the storage report: {e}\n{traceback.format_exc()}")
+        return False
+
+
+def test_withdrawal_queue():
+    """Test that queued withdrawals are sent by the timer and listed with their block."""
+    try:
+        print("Testing the withdrawal queue...")
+
+        if not deploy_test_mode_vault():
+            print_error("Failed to deploy vault with test mode enabled")
+            return False
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        set_mock_cmd = f'dfx canister call vault test_mode_set_mock_transaction "(principal \\"{current_principal}\\", principal \\"{vault_id}\\", 100, \\"transfer\\", null)" --output json'
+        if not run_command_expects_response_obj(set_mock_cmd):
+            print_error("Failed to set mock transaction")
+            return False
+
+        too_much_cmd = "dfx canister call vault request_withdrawal '(1000, null, null)' --output json"
+        if run_command_expects_response_obj(too_much_cmd):
+            print_error("Expected a withdrawal above the balance to be refused")
+            return False
+        print_ok("✓ Withdrawal above the balance refused")
+
+        request_cmd = "dfx canister call vault request_withdrawal '(40, null, null)' --output json"
+        result = run_command_expects_response_obj(request_cmd)
+        if not result:
+            print_error("Failed to queue a withdrawal")
+            return False
+        withdrawal_id = result["data"]["Withdrawal"]["id"]
+        print_ok(f"✓ Withdrawal {withdrawal_id} queued")
+
+        withdrawal = None
+        for _ in range(10):
+            time.sleep(1)
+            result = run_command_expects_response_obj(
+                f"dfx canister call vault get_withdrawals '(opt principal \"{current_principal}\", null, opt 10)' --output json"
+            )
+            withdrawals = (
+                result["data"]["WithdrawalsPage"]["withdrawals"] if result else []
+            )
+            withdrawal = next(
+                (w for w in withdrawals if w["id"] == withdrawal_id), None
+            )
+            if withdrawal and withdrawal["status"] == "Completed":
+                break
+
+        if not withdrawal or withdrawal["status"] != "Completed":
+            print_error(f"Expected the withdrawal to be sent: {withdrawal}")
+            return False
+        if not withdrawal["block_id"]:
+            print_error(f"Expected the block id of the withdrawal: {withdrawal}")
+            return False
+        print_ok(f"✓ Withdrawal sent in block {withdrawal['block_id'][0]}")
+        return True
+
+    except Exception as e:
+        print_error(
+            f"Error testing the withdrawal queue: {e}\n{traceback.format_exc()}"
+        )
+        return False
+
+
 def run_all_test_mode_tests():
     """Run all test mode tests and return results."""
     tests = [
@@ -706,6 +1938,25 @@ def run_all_test_mode_tests():
         ("Balance Consistency with History", test_balance_consistency_with_history),
         ("Test Mode Utility Functions", test_test_mode_utility_functions),
         ("Reset Clears Mock Transactions", test_reset_clears_mock_transactions),
+        ("Reset Keeps Transaction Index", test_reset_keeps_transaction_index),
+        ("Rebuild Balances", test_rebuild_balances),
+        ("Batched Balances", test_get_balances),
+        ("Top Balances", test_top_balances),
+        ("Transactions by Time", test_get_transactions_by_time),
+        ("Balance at Point in History", test_get_balance_at),
+        ("Export Transactions", test_export_transactions),
+        ("Import Snapshot", test_import_snapshot),
+        ("Import Snapshot Keeps Fees", test_import_snapshot_keeps_fees),
+        ("Import Snapshot Abort", test_import_snapshot_abort),
+        ("Categories", test_categories),
+        ("Multi-Token", test_multi_token),
+        ("Deposit Account", test_deposit_account),
+        ("Deposit", test_deposit),
+        ("Archive", test_archive),
+        ("Change Feed", test_change_feed),
+        ("Notifications", test_notifications),
+        ("Storage Report", test_storage_report),
+        ("Withdrawal Queue", test_withdrawal_queue),
     ]
 
     results = {}
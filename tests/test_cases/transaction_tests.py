@@ -6,10 +6,18 @@ Tests for transaction history functionality of the vault canister.
 import json
 import os
 import sys
+import time
 import traceback
 
 from tests.utils.colors import print_error, print_ok
-from tests.utils.command import get_current_principal, run_command
+from tests.utils.command import (
+    get_canister_id,
+    get_current_principal,
+    rebuild_balances,
+    run_command,
+    run_command_expects_response_obj,
+    update_transaction_history,
+)
 
 # Add the parent directory to the Python path to make imports work
 sys.path.insert(
@@ -140,3 +148,95 @@ def test_transaction_validity():
     else:
         print_error("Some transactions have invalid data")
         return False
+
+
+def _vault_balance(principal_id):
+    result = run_command_expects_response_obj(
+        f"dfx canister call vault get_balance '(principal \"{principal_id}\")' --output json"
+    )
+    return int(result["data"]["Balance"]["amount"].replace("_", ""))
+
+
+def test_deposit_then_sync():
+    """Test that syncing a transaction stored by deposit keeps it credited and indexed once."""
+    print("\nTesting a deposit found again by the sync...")
+    try:
+        principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+        balance_before = _vault_balance(principal)
+
+        approve_result = run_command(
+            f"dfx canister call ckbtc_ledger icrc2_approve '(record {{ spender = record {{ owner = principal \"{vault_id}\"; subaccount = null }}; amount = 1010; fee = null; memo = null; from_subaccount = null; created_at_time = null; expected_allowance = null; expires_at = null }})' --output json"
+        )
+        if not approve_result or "Ok" not in json.loads(approve_result):
+            print_error(f"Approval failed: {approve_result}")
+            return False
+
+        deposited = run_command_expects_response_obj(
+            "dfx canister call vault deposit '(1000)' --output json"
+        )
+        if not deposited:
+            print_error("Deposit failed")
+            return False
+        tx_id = int(
+            deposited["data"]["TransactionId"]["transaction_id"].replace("_", "")
+        )
+
+        def stored_deposit():
+            _, _, transactions = get_transactions(principal)
+            return next(
+                (tx for tx in transactions if int(tx["id"].replace("_", "")) == tx_id),
+                None,
+            )
+
+        timestamp = int(stored_deposit()["timestamp"].replace("_", ""))
+
+        # The deposit is stored ahead of the sync cursor: a rebuild and an export must
+        # still cover it
+        if not rebuild_balances():
+            print_error("Balance rebuild failed")
+            return False
+        if _vault_balance(principal) != balance_before + 1000:
+            print_error(
+                f"Deposit lost by the rebuild: {balance_before} -> {_vault_balance(principal)}"
+            )
+            return False
+        exported = run_command_expects_response_obj(
+            f"dfx canister call vault export_transactions '(opt {tx_id}, null)' --output json"
+        )
+        if not exported or exported["data"]["ExportChunk"]["row_count"] in ("0", 0):
+            print_error(f"Deposit missing from the export: {exported}")
+            return False
+
+        # Let the indexer catch up, so the sync fetches the deposit's block
+        time.sleep(3)
+        update_transaction_history()
+        update_transaction_history()
+
+        if _vault_balance(principal) != balance_before + 1000:
+            print_error(
+                f"Expected the deposit credited once: {balance_before} -> {_vault_balance(principal)}"
+            )
+            return False
+
+        synced = stored_deposit()
+        if int(synced["timestamp"].replace("_", "")) != timestamp:
+            print_error(f"Deposit timestamp changed by the sync: {synced}")
+            return False
+
+        by_time = run_command_expects_response_obj(
+            f'dfx canister call vault get_transactions_by_time "(opt principal \\"{principal}\\", {timestamp}, {timestamp}, null, null)" --output json'
+        )
+        ids = [
+            int(tx["id"].replace("_", ""))
+            for tx in by_time["data"]["TransactionsPage"]["transactions"]
+        ]
+        if ids != [tx_id]:
+            print_error(f"Expected the deposit indexed once at its timestamp: {ids}")
+            return False
+
+        print_ok("Deposit kept its balance, timestamp and index entry after the sync")
+        return True
+    except Exception as e:
+        print_error(f"Error testing deposit then sync: {e}\n{traceback.format_exc()}")
+        return False
@@ -6,6 +6,7 @@ Tests for token transfer functionality of the vault canister.
 import json
 import os
 import sys
+import time
 import traceback
 
 # Add the parent directory to the Python path to make imports work
@@ -14,7 +15,14 @@ sys.path.insert(
 )
 
 from tests.utils.colors import GREEN, RED, RESET
-from tests.utils.command import get_canister_id, get_current_principal, run_command
+from tests.utils.command import (
+    get_canister_id,
+    get_current_principal,
+    rebuild_balances,
+    run_command,
+    run_command_expects_response_obj,
+    update_transaction_history,
+)
 
 
 def transfer_from_vault(to_principal, amount):
@@ -158,3 +166,106 @@ def test_exceed_balance_transfer():
     else:
         print(f"{RED}✗ Excess transfer unexpectedly succeeded{RESET}")
         return False
+
+
+def _vault_ledger_balance(vault_id):
+    """Returns the ledger balance of the vault's default account."""
+    result = run_command(
+        f"dfx canister call ckbtc_ledger icrc1_balance_of '(record {{ owner = principal \"{vault_id}\"; subaccount = null }})' --output json"
+    )
+    return int(str(json.loads(result)).replace("_", ""))
+
+
+def test_withdraw_subaccount_deposit():
+    """Test that funds deposited to a deposit subaccount can be withdrawn."""
+    try:
+        print("\nTesting a withdrawal of funds deposited to a deposit subaccount...")
+
+        current_principal = get_current_principal()
+        vault_id = get_canister_id("vault")
+
+        opened = run_command_expects_response_obj(
+            "dfx canister call vault open_deposit_account --output json"
+        )
+        if not opened:
+            print(f"{RED}✗ Failed to open deposit account{RESET}")
+            return False
+        account = opened["data"]["DepositAccount"]["account"]
+        subaccount = [int(byte.replace("_", "")) for byte in account["subaccount"][0]]
+
+        # Deposit more than the default account holds, so the withdrawal can only be
+        # paid once the subaccount has been swept
+        default_balance = _vault_ledger_balance(vault_id)
+        deposit_amount = default_balance + 1000
+        withdrawal_amount = default_balance + 500
+        subaccount_candid = "; ".join(str(byte) for byte in subaccount)
+        transfer_result = run_command(
+            f"dfx canister call ckbtc_ledger icrc1_transfer '(record {{ to = record {{ owner = principal \"{vault_id}\"; subaccount = opt vec {{ {subaccount_candid} }} }}; amount = {deposit_amount}; fee = null; memo = null; from_subaccount = null; created_at_time = null }})' --output json"
+        )
+        if not transfer_result or "Ok" not in json.loads(transfer_result):
+            print(f"{RED}✗ Deposit to the subaccount failed: {transfer_result}{RESET}")
+            return False
+
+        # The deposit is found once the indexer has it, and swept by the same sync
+        for _ in range(10):
+            time.sleep(2)
+            update_transaction_history()
+            if _vault_ledger_balance(vault_id) > withdrawal_amount:
+                break
+        else:
+            print(f"{RED}✗ Deposit subaccount was not swept{RESET}")
+            return False
+        print(f"{GREEN}✓ Deposit subaccount swept into the default account{RESET}")
+
+        result = run_command_expects_response_obj(
+            f"dfx canister call vault request_withdrawal '({withdrawal_amount}, null, null)' --output json"
+        )
+        if not result:
+            print(f"{RED}✗ Failed to queue the withdrawal{RESET}")
+            return False
+        withdrawal_id = result["data"]["Withdrawal"]["id"]
+
+        withdrawal = None
+        for _ in range(10):
+            time.sleep(1)
+            result = run_command_expects_response_obj(
+                f"dfx canister call vault get_withdrawals '(opt principal \"{current_principal}\", null, opt 10)' --output json"
+            )
+            withdrawals = (
+                result["data"]["WithdrawalsPage"]["withdrawals"] if result else []
+            )
+            withdrawal = next(
+                (w for w in withdrawals if w["id"] == withdrawal_id), None
+            )
+            if withdrawal and withdrawal["status"] == "Completed":
+                break
+
+        if not withdrawal or withdrawal["status"] != "Completed":
+            print(f"{RED}✗ Expected the withdrawal to be sent: {withdrawal}{RESET}")
+            return False
+
+        # The withdrawal is stored ahead of the sync cursor: a rebuild must keep it
+        balance = run_command_expects_response_obj(
+            f"dfx canister call vault get_balance '(principal \"{current_principal}\")' --output json"
+        )["data"]["Balance"]["amount"]
+        if not rebuild_balances():
+            print(f"{RED}✗ Balance rebuild failed{RESET}")
+            return False
+        rebuilt = run_command_expects_response_obj(
+            f"dfx canister call vault get_balance '(principal \"{current_principal}\")' --output json"
+        )["data"]["Balance"]["amount"]
+        if rebuilt != balance:
+            print(
+                f"{RED}✗ Withdrawal lost by the rebuild: {balance} -> {rebuilt}{RESET}"
+            )
+            return False
+
+        print(
+            f"{GREEN}✓ Withdrew {withdrawal_amount} tokens deposited to a subaccount{RESET}"
+        )
+        return True
+    except Exception as e:
+        print(
+            f"{RED}✗ Error testing the subaccount withdrawal: {e}\n{traceback.format_exc()}{RESET}"
+        )
+        return False
@@ -7,6 +7,8 @@ import json
 import os
 import subprocess
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 from tests.utils.colors import print_error, print_ok
 
@@ -232,6 +234,33 @@ def update_transaction_history(
     return True
 
 
+def wait_for_job(job_id, timeout_seconds=30):
+    """Poll job_status until the job is no longer pending or running; return its status."""
+    job_id = job_id.replace("_", "")
+    status = None
+    for _ in range(timeout_seconds):
+        status_result = run_command_expects_response_obj(
+            f"dfx canister call vault job_status '(opt {job_id})' --output json"
+        )
+        if not status_result:
+            return None
+        status = status_result["data"]["Job"]["status"]
+        if status not in ("Pending", "Running"):
+            break
+        time.sleep(1)
+    return status
+
+
+def rebuild_balances():
+    """Rebuild the vault's balances from its stored transactions; return True on success."""
+    rebuild_result = run_command_expects_response_obj(
+        "dfx canister call vault rebuild_balances --output json"
+    )
+    if not rebuild_result:
+        return False
+    return wait_for_job(rebuild_result["data"]["Job"]["id"]) == "Completed"
+
+
 def generate_transaction_commands(transactions):
     """
     Generate dfx commands for a list of transaction data.
@@ -316,30 +345,17 @@ def generate_transaction_commands(transactions):
     return commands
 
 
-def execute_transactions(
-    transaction_pairs, identities=None, start_amount=101, initial_balances=None
-):
+def _plan_transactions(transaction_pairs, principals, start_amount, initial_balances):
     """
-    Execute transactions with balance tracking.
-
-    Args:
-        transaction_pairs: Pairs of [from, to] with 'vault', identity names, or 'principal'
-        identities: Dict of identity names to principals (from create_test_identities)
-        start_amount: Starting amount (increments by 1 for each transaction)
-        initial_balances: Optional starting balances for accounts
+    Assign amounts to the transfers of a sequence and compute the expected balances.
 
     Returns:
-        (success, final_balances)
+        (steps, vault_balances): each step is a dict with its 'index', 'kind'
+        ('transfer', 'sync' or 'check'), 'sender' and 'receiver', plus the 'amount'
+        of a transfer or the 'expected' vault balance of a check
     """
     amount = start_amount
-    success = True
 
-    # Set up principals map
-    principals = {"principal": get_current_principal()}
-    if identities:
-        principals.update(identities)
-
-    # Initialize balances
     # For regular token balances (outside vault)
     token_balances = {}
     if initial_balances:
@@ -352,54 +368,23 @@ def execute_transactions(
             token_balances[user] = 0
         vault_balances[user] = 0  # Initialize vault balance to 0
 
-    # Process each transaction
-    for sender, receiver in transaction_pairs:
+    steps = []
+    for index, (sender, receiver) in enumerate(transaction_pairs):
+        step = {"index": index, "sender": sender, "receiver": receiver}
+        steps.append(step)
+
         if sender == "update_history":
-            update_transaction_history()
-            continue  # Skip the rest of the loop for update_history transactions
+            step["kind"] = "sync"
+            continue
 
         if sender == "check_balance":
             # receiver should be the name of the identity to check
-            if receiver in principals:
-                principal_id = principals[receiver]
-                expected_amount = vault_balances.get(receiver, 0)
-
-                from tests.test_cases.balance_tests import check_balance
-
-                actual_balance, balance_success = check_balance(
-                    principal_id, expected_amount
-                )
-
-                if not balance_success:
-                    print_error(f"Balance verification failed for {receiver}")
-                    success = False
-            elif receiver == "vault":
-                vault_id = get_canister_id("vault")
-                expected_amount = vault_balances.get("vault", 0)
-
-                from tests.test_cases.balance_tests import check_balance
-
-                actual_balance, balance_success = check_balance(
-                    vault_id, expected_amount
-                )
-
-                if not balance_success:
-                    print_error("Balance verification failed for vault")
-                    success = False
-            else:
-                print_error(f"Unknown identity for balance check: {receiver}")
-                success = False
+            step["kind"] = "check"
+            step["expected"] = vault_balances.get(receiver, 0)
             continue
 
-        # Get sender and receiver principals/identities
-        sender_principal = (
-            principals.get(sender, sender) if sender != "vault" else "vault"
-        )
-        receiver_principal = (
-            principals.get(receiver, receiver) if receiver != "vault" else "vault"
-        )
-
-        print(f"Transaction: {sender} -> {receiver}, amount: {amount}")
+        step["kind"] = "transfer"
+        step["amount"] = amount
 
         # Track token balances (outside the vault)
         if sender != "vault" and sender in token_balances:
@@ -415,106 +400,277 @@ def execute_transactions(
             # User is sending to vault (deposit)
             vault_balances[sender] += amount
 
-        # Execute transfer
-        sender_id = "vault" if sender == "vault" else principals.get(sender, sender)
-        receiver_id = (
-            "vault" if receiver == "vault" else principals.get(receiver, receiver)
-        )
+        amount += 1
 
-        if sender == "vault":
-            cmd = f"""dfx canister call vault transfer '(
-                principal "{receiver_id}",
-                {amount}
-            )' --output json"""
-            tx_result = run_command(cmd)
-            if not tx_result or not json.loads(tx_result).get("success", False):
-                print_error(f"Transaction failed: {sender} -> {receiver}")
-                success = False
-                continue
+    return steps, vault_balances
+
+
+def _run_transfer_step(step, principals, identities, sync_deposit):
+    """Run one transfer of a sequence and return whether it succeeded."""
+    sender, receiver, amount = step["sender"], step["receiver"], step["amount"]
+    print(f"Transaction: {sender} -> {receiver}, amount: {amount}")
+
+    receiver_id = "vault" if receiver == "vault" else principals.get(receiver, receiver)
+    identity_arg = f"--identity {sender}" if identities and sender in identities else ""
+
+    if sender == "vault":
+        cmd = f"""dfx canister call vault transfer '(
+            principal "{receiver_id}",
+            {amount}
+        )' --output json"""
+        tx_result = run_command(cmd)
+        if not tx_result or not json.loads(tx_result).get("success", False):
+            print_error(f"Transaction failed: {sender} -> {receiver}")
+            return False
+        return True
+
+    if receiver == "vault":
+        # User sending to vault - need to transfer via ledger
+        vault_id = get_canister_id("vault")
+        if not vault_id:
+            print_error("Failed to get vault canister ID")
+            return False
+
+        # Transfer tokens to the vault via ledger
+        transfer_cmd = f"""dfx {identity_arg} canister call ckbtc_ledger icrc1_transfer '(
+            record {{ 
+                to = record {{ 
+                    owner = principal "{vault_id}"; 
+                    subaccount = null 
+                }}; 
+                amount = {amount}; 
+                fee = null; 
+                memo = null; 
+                from_subaccount = null; 
+                created_at_time = null 
+            }}
+        )' --output json"""
+
+        print(f"Transferring {amount} tokens from {sender} to vault via ledger...")
+        transfer_result = run_command(transfer_cmd)
+        if not transfer_result:
+            print_error(f"Failed to transfer tokens from {sender} to vault")
+            return False
+
+        transfer_json = json.loads(transfer_result)
+        if "Err" in transfer_json:
+            print_error(f"Transfer error: {transfer_json['Err']}")
+            return False
+
+        print(f"Transfer successful: {transfer_json}")
+
+        if sync_deposit:
+            # Now tell the vault to update transaction history
+            update_transaction_history()
+        return True
+
+    # User-to-user direct transfer via ledger (out-of-vault)
+    transfer_cmd = f"""dfx {identity_arg} canister call ckbtc_ledger icrc1_transfer '(
+        record {{ 
+            to = record {{ 
+                owner = principal "{receiver_id}"; 
+                subaccount = null 
+            }}; 
+            amount = {amount}; 
+            fee = null; 
+            memo = null; 
+            from_subaccount = null; 
+            created_at_time = null 
+        }}
+    )' --output json"""
+
+    print(
+        f"Transferring {amount} tokens directly from {sender} to {receiver} via ledger..."
+    )
+    tx_result = run_command(transfer_cmd)
+
+    try:
+        tx_response = json.loads(tx_result)
+        if "Ok" in tx_response:
+            print(f"Transfer successful: {tx_response}")
+            return True
+        print_error(f"Transfer failed: {tx_response}")
+    except (json.JSONDecodeError, TypeError):
+        print_error(f"Failed to parse transfer response: {tx_result}")
+    return False
+
+
+def _run_check_step(step, principals):
+    """Check the vault balance of one identity (or of the vault) against the plan."""
+    from tests.test_cases.balance_tests import check_balance
+
+    receiver = step["receiver"]
+    if receiver in principals:
+        principal_id = principals[receiver]
+    elif receiver == "vault":
+        principal_id = get_canister_id("vault")
+    else:
+        print_error(f"Unknown identity for balance check: {receiver}")
+        return False
 
-        elif receiver == "vault":
-            # User sending to vault - need to transfer via ledger
-            identity_arg = f"--identity {sender}" if sender in identities else ""
+    actual_balance, balance_success = check_balance(principal_id, step["expected"])
+    if not balance_success:
+        print_error(f"Balance verification failed for {receiver}")
+        return False
+    return True
 
-            # Get vault canister ID
-            vault_id = get_canister_id("vault")
-            if not vault_id:
-                print_error("Failed to get vault canister ID")
-                success = False
-                continue
 
-            # Transfer tokens to the vault via ledger
-            transfer_cmd = f"""dfx {identity_arg} canister call ckbtc_ledger icrc1_transfer '(
-                record {{ 
-                    to = record {{ 
-                        owner = principal "{vault_id}"; 
-                        subaccount = null 
-                    }}; 
-                    amount = {amount}; 
-                    fee = null; 
-                    memo = null; 
-                    from_subaccount = null; 
-                    created_at_time = null 
-                }}
-            )' --output json"""
-
-            print(f"Transferring {amount} tokens from {sender} to vault via ledger...")
-            transfer_result = run_command(transfer_cmd)
-            if not transfer_result:
-                print_error(f"Failed to transfer tokens from {sender} to vault")
-                success = False
+def _run_step(step, principals, identities, sync_deposit=True):
+    """Run one step of a sequence and return (step, success, duration in seconds)."""
+    started = time.monotonic()
+    if step["kind"] == "sync":
+        ok = update_transaction_history()
+    elif step["kind"] == "check":
+        ok = _run_check_step(step, principals)
+    else:
+        ok = _run_transfer_step(step, principals, identities, sync_deposit)
+    return step, ok, time.monotonic() - started
+
+
+def _run_steps(steps, principals, identities):
+    """Run steps one after the other, without syncing after each deposit."""
+    return [_run_step(step, principals, identities, False) for step in steps]
+
+
+def _phase_kind(step):
+    # Payouts spend vault balances, so they never share a phase with the deposits
+    # funding them
+    if step["kind"] == "transfer" and step["sender"] == "vault":
+        return "payout"
+    return step["kind"]
+
+
+def _group_phases(steps):
+    """
+    Split a sequence into runs of consecutive steps of the same kind; syncs stand alone
+    and payouts from the vault are split from the other transfers.
+    """
+    phases = []
+    for step in steps:
+        kind = _phase_kind(step)
+        if phases and kind != "sync" and phases[-1][0] == kind:
+            phases[-1][1].append(step)
+        else:
+            phases.append((kind, [step]))
+    return phases
+
+
+def _execute_steps_in_parallel(steps, principals, identities, workers):
+    """
+    Run a sequence through a pool of worker threads, in phases.
+
+    Consecutive transfers run concurrently, one worker per sender, so the transfers of
+    each identity keep their order. Payouts from the vault depend on the deposits before
+    them, so they form phases of their own, run by a single worker. Consecutive balance
+    checks run concurrently. Syncs are ordering barriers: they run alone, once every
+    earlier step has finished. Deposits are not synced one by one as in sequential mode,
+    so a sync barrier is added after transfers that deposited into the vault, unless a
+    sync follows anyway; a payout therefore only runs once the deposits before it are
+    synced.
+    """
+    timings = []
+    phases = _group_phases(steps)
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for position, (kind, phase) in enumerate(phases):
+            if kind == "sync":
+                timings.append(_run_step(phase[0], principals, identities))
                 continue
 
-            transfer_json = json.loads(transfer_result)
-            if "Err" in transfer_json:
-                print_error(f"Transfer error: {transfer_json['Err']}")
-                success = False
+            if kind == "check":
+                futures = [
+                    pool.submit(_run_step, step, principals, identities)
+                    for step in phase
+                ]
+                timings.extend(future.result() for future in futures)
                 continue
 
-            print(f"Transfer successful: {transfer_json}")
+            steps_by_sender = {}
+            for step in phase:
+                steps_by_sender.setdefault(step["sender"], []).append(step)
+            futures = [
+                pool.submit(_run_steps, sender_steps, principals, identities)
+                for sender_steps in steps_by_sender.values()
+            ]
+            phase_timings = []
+            for future in futures:
+                phase_timings.extend(future.result())
+            timings.extend(sorted(phase_timings, key=lambda timing: timing[0]["index"]))
+
+            next_kind = phases[position + 1][0] if position + 1 < len(phases) else None
+            if next_kind != "sync" and any(
+                step["receiver"] == "vault" for step in phase
+            ):
+                barrier = {
+                    "index": phase[-1]["index"],
+                    "kind": "sync",
+                    "sender": "update_history",
+                    "receiver": "(after deposits)",
+                }
+                timings.append(_run_step(barrier, principals, identities))
+
+    return timings
+
+
+def _describe_step(step):
+    if step["kind"] == "sync":
+        return f"update_history {step['receiver'] or ''}".strip()
+    if step["kind"] == "check":
+        return f"check_balance {step['receiver']} == {step['expected']}"
+    return f"{step['sender']} -> {step['receiver']} ({step['amount']})"
+
+
+def _print_step_timings(timings, wall_seconds):
+    """Print how long each step took, in the order the steps finished their phase."""
+    print("\nStep timings:")
+    for step, ok, seconds in timings:
+        status = "ok  " if ok else "FAIL"
+        print(f"  {seconds:7.2f}s  {status}  #{step['index']} {_describe_step(step)}")
+    print(
+        f"  {sum(timing[2] for timing in timings):7.2f}s  total step time, "
+        f"{wall_seconds:.2f}s wall time"
+    )
 
-            # Now tell the vault to update transaction history
-            update_transaction_history()
 
-            cmd = transfer_cmd  # For logging
+def execute_transactions(
+    transaction_pairs,
+    identities=None,
+    start_amount=101,
+    initial_balances=None,
+    workers=1,
+):
+    """
+    Execute transactions with balance tracking.
 
-        else:
-            # User-to-user direct transfer via ledger (out-of-vault)
-            identity_arg = f"--identity {sender}" if sender in identities else ""
-
-            # Transfer tokens directly from one user to another
-            transfer_cmd = f"""dfx {identity_arg} canister call ckbtc_ledger icrc1_transfer '(
-                record {{ 
-                    to = record {{ 
-                        owner = principal "{receiver_id}"; 
-                        subaccount = null 
-                    }}; 
-                    amount = {amount}; 
-                    fee = null; 
-                    memo = null; 
-                    from_subaccount = null; 
-                    created_at_time = null 
-                }}
-            )' --output json"""
-
-            print(
-                f"Transferring {amount} tokens directly from {sender} to {receiver} via ledger..."
-            )
-            tx_result = run_command(transfer_cmd)
-
-            try:
-                tx_response = json.loads(tx_result)
-                if "Ok" in tx_response:
-                    print(f"Transfer successful: {tx_response}")
-                else:
-                    print_error(f"Transfer failed: {tx_response}")
-                    success = False
-            except (json.JSONDecodeError, TypeError):
-                print_error(f"Failed to parse transfer response: {tx_result}")
-                success = False
+    Args:
+        transaction_pairs: Pairs of [from, to] with 'vault', identity names, or 'principal'
+        identities: Dict of identity names to principals (from create_test_identities)
+        start_amount: Starting amount (increments by 1 for each transaction)
+        initial_balances: Optional starting balances for accounts
+        workers: Number of worker threads. Above 1, the transfers of different
+                 identities and the balance checks run concurrently, with
+                 update_transaction_history as a barrier (see _execute_steps_in_parallel)
 
-        amount += 1
+    Returns:
+        (success, final_balances)
+    """
+    # Set up principals map
+    principals = {"principal": get_current_principal()}
+    if identities:
+        principals.update(identities)
+
+    steps, vault_balances = _plan_transactions(
+        transaction_pairs, principals, start_amount, initial_balances
+    )
+
+    started = time.monotonic()
+    if workers > 1:
+        timings = _execute_steps_in_parallel(steps, principals, identities, workers)
+    else:
+        timings = [_run_step(step, principals, identities) for step in steps]
+    _print_step_timings(timings, time.monotonic() - started)
 
+    success = all(ok for _, ok, _ in timings)
     return success, vault_balances
 
 
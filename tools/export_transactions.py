@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Streams the full transaction history (or the balances) of a vault into a local file.
+
+The vault's export_transactions query returns chunks of CBOR-encoded rows in id order;
+with --balances, export_balances returns the balances in principal order.
+Chunks are appended to the output file as they arrive, so memory use does not grow with
+the size of the history. The resulting file is a CBOR sequence and can be read back one
+row at a time:
+
+    import cbor2
+
+    with open("transactions.cbor", "rb") as f:
+        decoder = cbor2.CBORDecoder(f)
+        while f.peek(1):
+            version, tx_id, timestamp, kind, principal_from, principal_to, amount, fee = decoder.decode()
+
+Balance rows are [version, principal_id, amount].
+
+Usage:
+    python tools/export_transactions.py --output transactions.cbor [--network ic] [--canister vault]
+    python tools/export_transactions.py --balances --output balances.cbor
+"""
+
+import argparse
+import re
+import subprocess
+import sys
+
+BLOB_PATTERN = re.compile(r'data = blob "((?:[^"\\]|\\.)*)"')
+NEXT_CURSOR_PATTERN = re.compile(r"next_cursor = (?:opt \(?([0-9_]+)|null)")
+ROW_COUNT_PATTERN = re.compile(r"row_count = ([0-9_]+)")
+HEX_DIGITS = "0123456789abcdefABCDEF"
+ESCAPED_CHARS = {"n": 10, "r": 13, "t": 9, "\\": 92, '"': 34, "'": 39}
+
+
+def unescape_blob(text):
+    """Converts the body of a Candid text `blob "..."` literal into bytes."""
+    data = bytearray()
+    i = 0
+    while i < len(text):
+        char = text[i]
+        escape = text[i + 1 : i + 3]  # noqa: E203
+        if char != "\\":
+            data.extend(char.encode("utf-8"))
+            i += 1
+        elif len(escape) == 2 and all(c in HEX_DIGITS for c in escape):
+            data.append(int(escape, 16))
+            i += 3
+        else:
+            data.append(ESCAPED_CHARS[escape[0]])
+            i += 2
+    return bytes(data)
+
+
+def fetch_chunk(canister, network, cursor, max_bytes, method="export_transactions"):
+    """Calls the export method and returns (chunk, row count, next cursor)."""
+    command = ["dfx", "canister", "call", "--query", canister, method]
+    if network:
+        command += ["--network", network]
+    max_bytes_arg = f"opt {max_bytes}" if max_bytes else "null"
+    command.append(f"(opt {cursor}, {max_bytes_arg})")
+
+    process = subprocess.run(command, capture_output=True, text=True)
+    if process.returncode != 0:
+        raise RuntimeError(f"{method} failed: {process.stderr.strip()}")
+
+    output = process.stdout
+    blob_match = BLOB_PATTERN.search(output)
+    if "success = true" not in output or not blob_match:
+        raise RuntimeError(f"{method} returned an error: {output.strip()}")
+
+    next_cursor_match = NEXT_CURSOR_PATTERN.search(output)
+    next_cursor = (
+        int(next_cursor_match.group(1).replace("_", ""))
+        if next_cursor_match and next_cursor_match.group(1)
+        else None
+    )
+    row_count = int(ROW_COUNT_PATTERN.search(output).group(1).replace("_", ""))
+    return unescape_blob(blob_match.group(1)), row_count, next_cursor
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--output", default="transactions.cbor", help="Output file")
+    parser.add_argument("--canister", default="vault", help="Vault canister name or id")
+    parser.add_argument("--network", default=None, help="dfx network (e.g. ic)")
+    parser.add_argument(
+        "--balances", action="store_true", help="Export the balances instead"
+    )
+    parser.add_argument("--start", type=int, default=0, help="First id or position")
+    parser.add_argument(
+        "--max-bytes", type=int, default=None, help="Maximum size of each chunk"
+    )
+    args = parser.parse_args()
+
+    method = "export_balances" if args.balances else "export_transactions"
+    row_name = "balances" if args.balances else "transactions"
+    cursor = args.start
+    total_rows = 0
+    total_bytes = 0
+
+    with open(args.output, "wb") as output:
+        while cursor is not None:
+            chunk, row_count, cursor = fetch_chunk(
+                args.canister, args.network, cursor, args.max_bytes, method
+            )
+            output.write(chunk)
+            total_rows += row_count
+            total_bytes += len(chunk)
+            print(
+                f"Exported {total_rows} {row_name} ({total_bytes} bytes), next cursor: {cursor}",
+                file=sys.stderr,
+            )
+
+    print(f"Wrote {total_rows} {row_name} to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
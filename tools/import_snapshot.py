@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""
+Seeds a new vault with the transactions and balances exported from another vault.
+
+Both files are produced by tools/export_transactions.py (the balances with --balances).
+They are split into chunks at row boundaries and sent to the vault's admin-only
+import_snapshot_chunk endpoint with their SHA-256. import_snapshot_finish then checks the
+hash chain over all chunks and resumes syncing from the exporting vault's cursors, as
+reported by its status query.
+
+The exporting vault's own principal is attributed to the new vault, so transactions to
+or from it keep their meaning.
+
+Usage:
+    python tools/import_snapshot.py --source-vault <principal> --scan-end-tx-id <id> \\
+        [--transactions transactions.cbor] [--balances balances.cbor] [--canister vault]
+"""
+
+import argparse
+import hashlib
+import os
+import subprocess
+import sys
+import tempfile
+
+import cbor2
+
+DEFAULT_MAX_BYTES = 200_000
+# Mirrors SNAPSHOT_IMPORT_MAX_ROWS in the vault
+DEFAULT_MAX_ROWS = 5000
+
+
+def read_chunks(path, max_bytes, max_rows):
+    """Splits a CBOR sequence file into chunks of whole rows."""
+    with open(path, "rb") as f:
+        decoder = cbor2.CBORDecoder(f)
+        chunk_start = 0
+        rows = 0
+        while f.peek(1):
+            row_start = f.tell()
+            decoder.decode()
+            rows += 1
+            if rows > max_rows or (
+                f.tell() - chunk_start > max_bytes and row_start > chunk_start
+            ):
+                yield _read_range(path, chunk_start, row_start)
+                chunk_start = row_start
+                rows = 1
+        if f.tell() > chunk_start:
+            yield _read_range(path, chunk_start, f.tell())
+
+
+def _read_range(path, start, end):
+    with open(path, "rb") as f:
+        f.seek(start)
+        return f.read(end - start)
+
+
+def chain_hash(previous_hash, chunk):
+    """Same hash chain as the vault's vault.export.chain_hash."""
+    chunk_hash = hashlib.sha256(chunk).hexdigest()
+    return hashlib.sha256((previous_hash + chunk_hash).encode("utf-8")).hexdigest()
+
+
+def candid_blob(data):
+    return 'blob "' + "".join(f"\\{byte:02x}" for byte in data) + '"'
+
+
+def call(canister, network, method, argument):
+    """Calls an update method, passing the Candid argument through a file."""
+    with tempfile.NamedTemporaryFile("w", suffix=".did", delete=False) as f:
+        f.write(argument)
+        argument_file = f.name
+    try:
+        command = ["dfx", "canister", "call", canister, method]
+        if network:
+            command += ["--network", network]
+        command += ["--argument-file", argument_file]
+        process = subprocess.run(command, capture_output=True, text=True)
+    finally:
+        os.remove(argument_file)
+
+    if process.returncode != 0:
+        raise RuntimeError(f"{method} failed: {process.stderr.strip()}")
+    if "success = true" not in process.stdout:
+        raise RuntimeError(f"{method} returned an error: {process.stdout.strip()}")
+    return process.stdout
+
+
+def import_file(args, path, kind):
+    """Sends a snapshot file chunk by chunk and returns its hash chain."""
+    snapshot_hash = ""
+    if not path:
+        return snapshot_hash
+
+    imported_bytes = 0
+    for chunk in read_chunks(path, args.max_bytes, args.max_rows):
+        call(
+            args.canister,
+            args.network,
+            "import_snapshot_chunk",
+            f'("{kind}", {candid_blob(chunk)}, "{hashlib.sha256(chunk).hexdigest()}")',
+        )
+        snapshot_hash = chain_hash(snapshot_hash, chunk)
+        imported_bytes += len(chunk)
+        print(f"Imported {imported_bytes} bytes of {kind}", file=sys.stderr)
+    return snapshot_hash
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--source-vault", required=True, help="Principal of the exporting vault"
+    )
+    parser.add_argument("--transactions", default=None, help="Exported transactions")
+    parser.add_argument("--balances", default=None, help="Exported balances")
+    parser.add_argument(
+        "--scan-end-tx-id", type=int, required=True, help="Source scan_end_tx_id"
+    )
+    parser.add_argument(
+        "--scan-start-tx-id", type=int, default=None, help="Source scan_start_tx_id"
+    )
+    parser.add_argument(
+        "--scan-oldest-tx-id", type=int, default=None, help="Source scan_oldest_tx_id"
+    )
+    parser.add_argument("--canister", default="vault", help="Vault canister name or id")
+    parser.add_argument("--network", default=None, help="dfx network (e.g. ic)")
+    parser.add_argument(
+        "--max-bytes", type=int, default=DEFAULT_MAX_BYTES, help="Maximum chunk size"
+    )
+    parser.add_argument(
+        "--max-rows", type=int, default=DEFAULT_MAX_ROWS, help="Maximum rows per chunk"
+    )
+    args = parser.parse_args()
+
+    scan_start_tx_id = (
+        args.scan_end_tx_id if args.scan_start_tx_id is None else args.scan_start_tx_id
+    )
+    scan_oldest_tx_id = (
+        args.scan_end_tx_id
+        if args.scan_oldest_tx_id is None
+        else args.scan_oldest_tx_id
+    )
+
+    call(
+        args.canister,
+        args.network,
+        "import_snapshot_start",
+        f'(principal "{args.source_vault}")',
+    )
+    transactions_hash = import_file(args, args.transactions, "transactions")
+    balances_hash = import_file(args, args.balances, "balances")
+    output = call(
+        args.canister,
+        args.network,
+        "import_snapshot_finish",
+        f'("{transactions_hash}", "{balances_hash}", {args.scan_end_tx_id}, '
+        f"{scan_start_tx_id}, {scan_oldest_tx_id})",
+    )
+    print(output.strip())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,17 @@
+"""
+Python client of the vault, keeping a local cache of its balances and transactions.
+
+The client talks to the vault's Candid interface over HTTP with ic-py (`pip install
+ic-py cbor2`), without dfx. See VaultClient for the caching and refresh behaviour.
+
+    from vault_client import VaultClient
+
+    client = VaultClient("<vault canister id>", "vault.db")
+    client.refresh()
+    client.balances(["<principal>", "<principal>"])
+"""
+
+from .cache import VaultCache
+from .client import VaultClient, VaultError
+
+__all__ = ["VaultCache", "VaultClient", "VaultError"]
@@ -0,0 +1,52 @@
+"""
+Refreshes the local cache of a vault, then prints balances or transactions from it.
+
+Usage (from the tools directory):
+    python -m vault_client --canister <id> [--cache vault.db] [--url http://127.0.0.1:4943] refresh
+    python -m vault_client --canister <id> balances <principal> [<principal> ...]
+    python -m vault_client --canister <id> transactions [<principal>] [--limit 20]
+"""
+
+import argparse
+import json
+
+from .client import IC_URL, VaultClient
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--canister", required=True, help="Vault canister id")
+    parser.add_argument("--cache", default="vault.db", help="Path of the cache")
+    parser.add_argument("--url", default=IC_URL, help="URL of the replica")
+    parser.add_argument(
+        "--no-refresh", action="store_true", help="Only read the cache as it is"
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("refresh", help="Only refresh the cache")
+    balances_parser = commands.add_parser("balances", help="Print balances")
+    balances_parser.add_argument("principals", nargs="+")
+    transactions_parser = commands.add_parser(
+        "transactions", help="Print transactions, newest first"
+    )
+    transactions_parser.add_argument("principal", nargs="?", default=None)
+    transactions_parser.add_argument("--limit", type=int, default=20)
+    args = parser.parse_args()
+
+    client = VaultClient(args.canister, args.cache, url=args.url)
+    try:
+        if not args.no_refresh:
+            applied = client.refresh()
+            print(
+                f"Applied {applied} changes, highest transaction id: {client.max_tx_id()}"
+            )
+
+        if args.command == "balances":
+            print(json.dumps(client.balances(args.principals), indent=2))
+        elif args.command == "transactions":
+            print(json.dumps(client.transactions(args.principal, args.limit), indent=2))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
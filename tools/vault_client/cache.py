@@ -0,0 +1,153 @@
+import sqlite3
+from contextlib import contextmanager
+from typing import Dict, Iterable, List, Optional
+
+# Maximum number of parameters bound by a single lookup (SQLite's default limit is 999)
+LOOKUP_BATCH_SIZE = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS balances (
+    principal_id TEXT PRIMARY KEY,
+    amount TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    timestamp INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    principal_from TEXT NOT NULL,
+    principal_to TEXT NOT NULL,
+    amount TEXT NOT NULL,
+    fee TEXT NOT NULL DEFAULT '0'
+);
+CREATE INDEX IF NOT EXISTS transactions_from ON transactions (principal_from, id);
+CREATE INDEX IF NOT EXISTS transactions_to ON transactions (principal_to, id);
+"""
+
+
+class VaultCache:
+    """
+    On-disk cache of a vault's balances and transactions, in a SQLite database.
+
+    Amounts are stored as text, since they do not always fit SQLite's 64-bit integers.
+    Writes are committed at the end of each `batch()` block.
+    """
+
+    def __init__(self, path: str):
+        self.connection = sqlite3.connect(path)
+        self.connection.executescript(SCHEMA)
+        columns = [
+            row[1] for row in self.connection.execute("PRAGMA table_info(transactions)")
+        ]
+        if "fee" not in columns:
+            # Caches created before fees were exported
+            self.connection.execute(
+                "ALTER TABLE transactions ADD COLUMN fee TEXT NOT NULL DEFAULT '0'"
+            )
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    @contextmanager
+    def batch(self):
+        """Groups the writes of the block into a single transaction."""
+        with self.connection:
+            yield self
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT value FROM meta WHERE key = ?", (key,)
+        ).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value))
+        )
+
+    def put_balance(self, principal_id: str, amount: int) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO balances (principal_id, amount) VALUES (?, ?)",
+            (principal_id, str(amount)),
+        )
+
+    def delete_balance(self, principal_id: str) -> None:
+        self.connection.execute(
+            "DELETE FROM balances WHERE principal_id = ?", (principal_id,)
+        )
+
+    def clear_balances(self) -> None:
+        self.connection.execute("DELETE FROM balances")
+
+    def put_transaction(self, tx: dict) -> None:
+        self.connection.execute(
+            "INSERT OR REPLACE INTO transactions "
+            "(id, timestamp, kind, principal_from, principal_to, amount, fee) "
+            "VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (
+                tx["id"],
+                tx["timestamp"],
+                tx["kind"],
+                tx["principal_from"],
+                tx["principal_to"],
+                str(tx["amount"]),
+                str(tx.get("fee", 0)),
+            ),
+        )
+
+    def delete_transaction(self, tx_id: int) -> None:
+        self.connection.execute("DELETE FROM transactions WHERE id = ?", (tx_id,))
+
+    def max_tx_id(self) -> Optional[int]:
+        return self.connection.execute("SELECT MAX(id) FROM transactions").fetchone()[0]
+
+    def balances(self, principal_ids: Iterable[str]) -> Dict[str, int]:
+        """Looks up several balances, returning only the principals that have one."""
+        principal_ids = list(dict.fromkeys(principal_ids))
+        amounts = {}
+        for start in range(0, len(principal_ids), LOOKUP_BATCH_SIZE):
+            chunk = principal_ids[start : start + LOOKUP_BATCH_SIZE]  # noqa: E203
+            placeholders = ", ".join("?" * len(chunk))
+            rows = self.connection.execute(
+                "SELECT principal_id, amount FROM balances "
+                f"WHERE principal_id IN ({placeholders})",
+                chunk,
+            )
+            amounts.update((principal_id, int(amount)) for principal_id, amount in rows)
+        return amounts
+
+    def balance(self, principal_id: str) -> Optional[int]:
+        return self.balances([principal_id]).get(principal_id)
+
+    def transactions(
+        self, principal_id: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[dict]:
+        """Lists the transactions (of a principal, if given), newest first."""
+        query = "SELECT id, timestamp, kind, principal_from, principal_to, amount, fee FROM transactions"
+        params: list = []
+        if principal_id is not None:
+            query += " WHERE principal_from = ? OR principal_to = ?"
+            params += [principal_id, principal_id]
+        query += " ORDER BY id DESC"
+        if limit is not None:
+            query += " LIMIT ?"
+            params.append(limit)
+
+        return [
+            {
+                "id": tx_id,
+                "timestamp": timestamp,
+                "kind": kind,
+                "principal_from": principal_from,
+                "principal_to": principal_to,
+                "amount": int(amount),
+                "fee": int(fee),
+            }
+            for tx_id, timestamp, kind, principal_from, principal_to, amount, fee in (
+                self.connection.execute(query, params)
+            )
+        ]
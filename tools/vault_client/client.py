@@ -0,0 +1,212 @@
+from io import BytesIO
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import cbor2
+from ic.agent import Agent
+from ic.canister import Canister
+from ic.client import Client
+from ic.identity import Identity
+
+from .cache import VaultCache
+
+IC_URL = "https://ic0.app"
+# Mirrors GET_BALANCES_MAX_PRINCIPALS in the vault
+GET_BALANCES_MAX_PRINCIPALS = 1000
+# Mirrors CHANGE_FEED_MAX_RESULTS in the vault
+CHANGE_FEED_MAX_RESULTS = 1000
+
+
+class VaultError(Exception):
+    """Raised when the vault rejects a call or answers with success = false."""
+
+
+class VaultClient:
+    """
+    Client of a vault canister, keeping its balances and transactions in a local cache.
+
+    Calls go straight to the vault's Candid interface over HTTP (with ic-py), so dfx is
+    not needed. Every call made is a query, so the anonymous identity is enough.
+
+    The cache is kept up to date by refresh(): the first call loads every balance and
+    stored transaction with the export queries, later calls only pull the change feed
+    from the last change applied. Cached lookups never call the vault.
+    """
+
+    def __init__(
+        self,
+        canister_id: str,
+        cache_path: str,
+        url: str = IC_URL,
+        identity: Optional[Identity] = None,
+        candid: Optional[str] = None,
+    ):
+        """
+        Args:
+            canister_id: Principal of the vault canister
+            cache_path: Path of the SQLite cache, created if missing
+            url: URL of the replica (e.g. http://127.0.0.1:4943 for a local one)
+            identity: Identity signing the calls (anonymous by default)
+            candid: The vault's Candid interface (fetched from the vault if not given)
+        """
+        agent = Agent(identity or Identity(anonymous=True), Client(url=url))
+        self.canister_id = canister_id
+        self.canister = Canister(agent, canister_id, candid)
+        self.cache = VaultCache(cache_path)
+
+        cached_canister_id = self.cache.get_meta("canister_id")
+        if cached_canister_id not in (None, canister_id):
+            raise ValueError(
+                f"{cache_path} caches vault {cached_canister_id}, not {canister_id}"
+            )
+
+    def close(self) -> None:
+        self.cache.close()
+
+    def _call(self, method: str, *args):
+        """Calls a vault method returning a Response and returns its data."""
+        result = getattr(self.canister, method)(*args)
+        if not isinstance(result, list):
+            raise VaultError(f"{method} was rejected: {result}")
+
+        response = result[0]
+        data = response["data"]
+        if not response["success"]:
+            raise VaultError(f"{method} failed: {data.get('Error', data)}")
+        return next(iter(data.values()))
+
+    def _export_rows(self, method: str) -> Iterator[list]:
+        """Pages through export_transactions or export_balances, yielding decoded rows."""
+        cursor = 0
+        while cursor is not None:
+            chunk = self._call(method, [cursor], [])
+            data = BytesIO(bytes(chunk["data"]))
+            decoder = cbor2.CBORDecoder(data)
+            while data.tell() < len(data.getbuffer()):
+                yield decoder.decode()
+            cursor = chunk["next_cursor"][0] if chunk["next_cursor"] else None
+
+    def reload(self) -> int:
+        """
+        Replaces the cached balances with the vault's, and stores every transaction it
+        holds. Transactions already cached are kept, so those archived by the vault since
+        they were cached remain available.
+
+        The change feed position is read before the export, so that refresh() afterwards
+        applies the changes made while exporting.
+
+        Returns:
+            Number of balances and transactions loaded
+        """
+        start_seq = self._call("get_changes_since", 0, [0])["last_seq"]
+        loaded = 0
+        with self.cache.batch():
+            self.cache.clear_balances()
+            for _, principal_id, amount in self._export_rows("export_balances"):
+                self.cache.put_balance(principal_id, amount)
+                loaded += 1
+
+            for row in self._export_rows("export_transactions"):
+                # Rows of version 1 were exported without the fee
+                _, tx_id, timestamp, kind, principal_from, principal_to, amount = row[
+                    :7
+                ]
+                self.cache.put_transaction(
+                    {
+                        "id": tx_id,
+                        "timestamp": timestamp,
+                        "kind": kind,
+                        "principal_from": principal_from,
+                        "principal_to": principal_to,
+                        "amount": amount,
+                        "fee": row[7] if len(row) > 7 else 0,
+                    }
+                )
+                loaded += 1
+
+            self.cache.set_meta("canister_id", self.canister_id)
+            self.cache.set_meta("seq", start_seq)
+        return loaded
+
+    def _apply_change(self, change: dict) -> None:
+        kind, value = next(iter(change.items()))
+        if kind == "Balance":
+            self.cache.put_balance(value["principal_id"], value["amount"])
+        elif kind == "BalanceDeleted":
+            self.cache.delete_balance(value)
+        elif kind == "Transaction":
+            self.cache.put_transaction(value)
+        elif kind == "TransactionDeleted":
+            self.cache.delete_transaction(value)
+
+    def refresh(self) -> int:
+        """
+        Brings the cache up to date with the vault.
+
+        Pulls the changes following the last one applied, a page at a time, each page
+        committed with its position in the feed. The cache is reloaded when it is empty,
+        or when the vault no longer keeps the changes it needs.
+
+        Returns:
+            Number of changes (or rows, for a reload) applied
+        """
+        applied = 0
+        if self.cache.get_meta("seq") is None:
+            applied += self.reload()
+
+        while True:
+            seq = int(self.cache.get_meta("seq"))
+            page = self._call("get_changes_since", seq, [CHANGE_FEED_MAX_RESULTS])
+            if page["resync_required"]:
+                applied += self.reload()
+                continue
+            if not page["changes"]:
+                return applied
+
+            with self.cache.batch():
+                for change in page["changes"]:
+                    self._apply_change(change["change"])
+                self.cache.set_meta("seq", page["changes"][-1]["seq"])
+            applied += len(page["changes"])
+
+    def balance(self, principal_id: str) -> int:
+        """Returns the cached balance of a principal (0 if it has none)."""
+        return self.cache.balance(principal_id) or 0
+
+    def balances(self, principal_ids: Iterable[str]) -> Dict[str, int]:
+        """Returns the cached balances of several principals (0 for those without one)."""
+        principal_ids = list(principal_ids)
+        amounts = self.cache.balances(principal_ids)
+        return {
+            principal_id: amounts.get(principal_id, 0) for principal_id in principal_ids
+        }
+
+    def fetch_balances(self, principal_ids: Iterable[str]) -> Dict[str, int]:
+        """
+        Reads the current balances of several principals from the vault, in batches of
+        GET_BALANCES_MAX_PRINCIPALS per call, and stores them in the cache.
+
+        Changes not yet pulled by refresh() are older than these balances: the cache can
+        go back to an older amount until refresh() has caught up with the feed.
+        """
+        principal_ids = list(dict.fromkeys(principal_ids))
+        amounts = {}
+        batch_size = GET_BALANCES_MAX_PRINCIPALS
+        for start in range(0, len(principal_ids), batch_size):
+            batch = principal_ids[start : start + batch_size]  # noqa: E203
+            for balance in self._call("get_balances", batch):
+                amounts[balance["principal_id"].to_str()] = balance["amount"]
+
+        with self.cache.batch():
+            for principal_id, amount in amounts.items():
+                self.cache.put_balance(principal_id, amount)
+        return amounts
+
+    def transactions(
+        self, principal_id: Optional[str] = None, limit: Optional[int] = None
+    ) -> List[dict]:
+        """Lists the cached transactions (of a principal, if given), newest first."""
+        return self.cache.transactions(principal_id, limit)
+
+    def max_tx_id(self) -> Optional[int]:
+        """Returns the highest cached transaction id."""
+        return self.cache.max_tx_id()